@@ -0,0 +1,301 @@
+"""
+Micro-benchmarks of the common.util functions that run on every request: the JWT
+placeholder and the sanitization validators, on realistic and adversarial inputs.
+
+Each case is calibrated so one repeat runs for at least --min-time seconds, warmed up for
+--warmup repeats that are thrown away, then timed for --repeat repeats with the garbage
+collector off. Times are per call.
+
+    python benchmarks/micro.py                         # table of every case
+    python benchmarks/micro.py --filter zip --json out.json
+    python benchmarks/micro.py --compare HEAD~5         # HEAD~5 against the working tree
+    python benchmarks/micro.py --compare v1.0 HEAD --threshold 0.05 --fail-on-regression
+
+Comparing checks each revision out in a temporary git worktree and benchmarks it with this
+script, in a fresh interpreter. Cases a revision doesn't have are reported as missing.
+"""
+import argparse
+import gc
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Revision name of the checked out working tree in --compare
+WORKTREE = 'WORKTREE'
+
+
+def cases():
+    """
+    Returns:
+            list: (name, function, argument) of every benchmark case, built against whatever
+                  version of common.util is importable, skipping functions it doesn't have
+    """
+    from common.util import jwt_placeholder
+    from common.util import sanitization
+
+    payload = {'first_name': 'Foo', 'last_name': 'Bar', 'username': 'fooBar', 'email': 'fooBar@pdx.edu'}
+    token = jwt_placeholder.generate_token(dict(payload))
+    if isinstance(token, bytes):
+        token = token.decode('utf-8')
+    long_payload = dict(payload, padding='x' * 10000)
+
+    inputs = {
+        'generate_token': [
+            ('typical', payload),
+            ('large payload', long_payload),
+        ],
+        'validate_token': [
+            ('valid', token),
+            ('tampered', token[:-4] + 'AAAA'),
+            ('garbage 10k', 'a' * 10000),
+        ],
+        'validate_email': [
+            ('typical', 'foo.master@hotmail.com'),
+            ('no at', 'foo.master.hotmail.com'),
+            ('long 10k', 'a' * 10000 + '@' + 'b' * 10000 + '.com'),
+            ('unicode', 'ünïcødé@exämple.рф'),
+        ],
+        'validate_phone_num_usa': [
+            ('typical', '5035552345'),
+            ('letters', '503555234a'),
+            ('long 10k', '5' * 10000),
+            ('unicode digits', '５０３５５５２３４５'),
+        ],
+        'validate_username': [
+            ('typical', 'fooBar'),
+            ('symbols', 'foo-bar!'),
+            ('long 10k', 'a' * 10000),
+            ('unicode', 'ünïcødé_ùsér'),
+        ],
+        'validate_zip_usa': [
+            ('typical', '97201'),
+            ('zip+4', '97201-1234'),
+            ('unknown', '00000'),
+            ('malformed', '9720a'),
+            ('long 10k', '9' * 10000),
+            ('unicode digits', '９７２０１'),
+        ],
+    }
+    modules = {'generate_token': jwt_placeholder, 'validate_token': jwt_placeholder}
+
+    built = []
+    for function_name, arguments in inputs.items():
+        function = getattr(modules.get(function_name, sanitization), function_name, None)
+        if function is None:
+            continue
+        for label, argument in arguments:
+            built.append(('%s[%s]' % (function_name, label), function, argument))
+
+    # A bulk load's columns, validated a column at a time and, for comparison, a value at a time
+    rows = 1000
+    columns = {
+        'email': ['contact%d@pdx.edu' % row if row % 10 else 'contact%d' % row for row in range(rows)],
+        'phone': ['503555%04d' % row for row in range(rows)],
+        'zip': ['97201' if row % 7 else '9720a' for row in range(rows)],
+        'username': ['user_%d' % row for row in range(rows)],
+    }
+    kinds = {'email': 'email', 'phone': 'phone_usa', 'zip': 'zip_usa', 'username': 'username'}
+    validate_columns = getattr(sanitization, 'validate_columns', None)
+    if validate_columns is not None:
+        built.append(('validate_columns[%d rows]' % rows, lambda kinds: validate_columns(columns, kinds), kinds))
+
+    def row_by_row(kinds):
+        for email, phone, zip_code, username in zip(columns['email'], columns['phone'], columns['zip'], columns['username']):
+            sanitization.validate_email(email)
+            sanitization.validate_phone_num_usa(phone)
+            sanitization.validate_zip_usa(zip_code)
+            sanitization.validate_username(username)
+    built.append(('row by row[%d rows]' % rows, row_by_row, kinds))
+    return built
+
+
+def call_safely(function, argument):
+    # Adversarial inputs may raise, that's part of what is measured
+    def call():
+        try:
+            function(dict(argument) if isinstance(argument, dict) else argument)
+        except BaseException:
+            pass
+    return call
+
+
+def measure(call, min_time, warmup, repeat):
+    """
+    Times a function, see the module docstring
+    Returns:
+            dict: loops per repeat, and min/median/mean/stdev/p95 seconds per call
+    """
+    # The first call may pay for imports and lazily loaded data, keep it out of the calibration
+    call()
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            call()
+        if time.perf_counter() - started >= min_time:
+            break
+        loops *= 2
+
+    timings = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for iteration in range(warmup + repeat):
+            started = time.perf_counter()
+            for _ in range(loops):
+                call()
+            if iteration >= warmup:
+                timings.append((time.perf_counter() - started) / loops)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    timings.sort()
+    return {
+        'loops': loops,
+        'min': timings[0],
+        'median': statistics.median(timings),
+        'mean': statistics.mean(timings),
+        'stdev': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        'p95': timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+    }
+
+
+def run(root, name_filter, min_time, warmup, repeat):
+    """
+    Benchmarks the code under root in this process
+    Returns:
+            dict: case name -> statistics
+    """
+    sys.path.insert(0, root)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'emp_backend.settings')
+    import django
+    django.setup()
+    # The adversarial cases would otherwise log on every call
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    results = {}
+    for name, function, argument in cases():
+        if name_filter and name_filter not in name:
+            continue
+        results[name] = measure(call_safely(function, argument), min_time, warmup, repeat)
+    return results
+
+
+def format_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return '%.2f %s' % (seconds / scale, unit)
+    return '%.0f ns' % (seconds / 1e-9)
+
+
+def print_results(results):
+    print('%-40s %12s %12s %12s %8s' % ('case', 'median', 'p95', 'stdev', 'loops'))
+    for name, stats in results.items():
+        print('%-40s %12s %12s %12s %8d' % (
+            name, format_time(stats['median']), format_time(stats['p95']), format_time(stats['stdev']), stats['loops']))
+
+
+def run_revision(revision, arguments):
+    """
+    Benchmarks a git revision (or the working tree) in a fresh interpreter
+    Returns:
+            dict: case name -> statistics
+    """
+    with tempfile.TemporaryDirectory() as scratch:
+        output = os.path.join(scratch, 'results.json')
+        root = BASE_DIR
+        if revision != WORKTREE:
+            root = os.path.join(scratch, 'tree')
+            subprocess.run(['git', '-C', BASE_DIR, 'worktree', 'add', '--detach', '--quiet', root, revision], check=True)
+        try:
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--root', root, '--json', output, '--quiet'] + arguments,
+                           check=True)
+            with open(output) as results:
+                return json.load(results)['results']
+        finally:
+            if revision != WORKTREE:
+                subprocess.run(['git', '-C', BASE_DIR, 'worktree', 'remove', '--force', root], check=True)
+
+
+def compare(base, head, base_results, head_results, threshold):
+    """
+    Prints the change of every case's median between two revisions
+    Returns:
+            list: names of the cases slower by more than threshold (a fraction)
+    """
+    print('%-40s %12s %12s %9s' % ('case', base[:12], head[:12], 'change'))
+    regressions = []
+    for name in sorted(set(base_results) | set(head_results)):
+        if name not in base_results or name not in head_results:
+            print('%-40s %12s %12s %9s' % (
+                name,
+                format_time(base_results[name]['median']) if name in base_results else 'missing',
+                format_time(head_results[name]['median']) if name in head_results else 'missing', ''))
+            continue
+        change = head_results[name]['median'] / base_results[name]['median'] - 1
+        flag = ''
+        if change > threshold:
+            flag = '  slower'
+            regressions.append(name)
+        elif change < -threshold:
+            flag = '  faster'
+        print('%-40s %12s %12s %+8.1f%%%s' % (
+            name, format_time(base_results[name]['median']), format_time(head_results[name]['median']), change * 100, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filter', help="Only run cases whose name contains this")
+    parser.add_argument('--min-time', type=float, default=0.02, help="Minimum seconds per repeat")
+    parser.add_argument('--warmup', type=int, default=3, help="Repeats run and thrown away first")
+    parser.add_argument('--repeat', type=int, default=15, help="Repeats timed")
+    parser.add_argument('--json', help="Also write the results to this file")
+    parser.add_argument('--quiet', action='store_true', help="Don't print the table")
+    parser.add_argument('--root', default=BASE_DIR, help="Tree whose common.util is benchmarked (used by --compare)")
+    parser.add_argument('--compare', nargs='+', metavar='REVISION',
+                        help="Compare two git revisions, or one revision against the working tree")
+    parser.add_argument('--threshold', type=float, default=0.10, help="Slowdown reported as a regression, as a fraction")
+    parser.add_argument('--fail-on-regression', action='store_true', help="Exit with 1 when a case regressed")
+    args = parser.parse_args()
+
+    if args.compare:
+        if len(args.compare) > 2:
+            parser.error("--compare takes one or two revisions")
+        base, head = (args.compare + [WORKTREE])[:2]
+        arguments = ['--min-time', str(args.min_time), '--warmup', str(args.warmup), '--repeat', str(args.repeat)]
+        if args.filter:
+            arguments += ['--filter', args.filter]
+        base_results = run_revision(base, arguments)
+        head_results = run_revision(head, arguments)
+        regressions = compare(base, head, base_results, head_results, args.threshold)
+        if args.json:
+            with open(args.json, 'w') as output:
+                json.dump({'base': base, 'head': head, 'base_results': base_results, 'head_results': head_results,
+                           'regressions': regressions}, output, indent=1)
+        if regressions and args.fail_on_regression:
+            sys.exit(1)
+        return
+
+    results = run(args.root, args.filter, args.min_time, args.warmup, args.repeat)
+    if not args.quiet:
+        print_results(results)
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump({
+                'python': sys.version.split()[0],
+                'settings': {'min_time': args.min_time, 'warmup': args.warmup, 'repeat': args.repeat},
+                'results': results,
+            }, output, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Measures what preloading saves a pre-fork deployment: the memory of each worker and the
+time from fork to its first response, with and without emp_backend/wsgi_preload.py.
+
+Each mode runs in a fresh interpreter that forks --workers children, the way gunicorn does:
+    lazy     - every worker imports emp_backend.wsgi after the fork (gunicorn without --preload)
+    preload  - the master imports emp_backend.wsgi_preload before the fork
+
+Memory comes from /proc/<pid>/smaps_rollup, so this only runs on Linux:
+    rss  - resident memory, counting shared pages in full
+    pss  - proportional share, shared pages divided between the processes sharing them
+    uss  - private pages, what the worker costs on top of the master
+
+Needs a migrated database with the sample data loaded (see readme.md), then:
+    python benchmarks/preload_rss.py --workers 8 --path /getRelations/
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+from wsgiref.util import setup_testing_defaults
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = ('lazy', 'preload')
+
+
+def memory():
+    """
+    Returns the calling process' rss, pss and uss in KiB
+    """
+    fields = {}
+    with open('/proc/self/smaps_rollup') as smaps:
+        for line in smaps:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return {
+        'rss': fields['Rss'],
+        'pss': fields['Pss'],
+        'uss': fields['Private_Clean'] + fields['Private_Dirty'],
+    }
+
+
+def first_request(application, path):
+    environ = {'PATH_INFO': path, 'REQUEST_METHOD': 'GET'}
+    setup_testing_defaults(environ)
+    statuses = []
+    body = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    b''.join(body)
+    if hasattr(body, 'close'):
+        body.close()
+    return statuses[0]
+
+
+def run_mode(mode, workers, path):
+    """
+    Forks the workers of one mode and prints one json line per worker
+    """
+    sys.path.insert(0, BASE_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'emp_backend.settings')
+    if mode == 'preload':
+        import emp_backend.wsgi_preload  # noqa: F401
+
+    # Workers measure their memory only once all of them served their first request, and
+    # exit only once all of them measured, so pages shared between them are counted as shared
+    barrier = multiprocessing.Barrier(workers)
+    children = []
+    for _ in range(workers):
+        read_end, write_end = os.pipe()
+        forked = time.monotonic()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_end)
+            if mode == 'preload':
+                from emp_backend.wsgi_preload import application
+            else:
+                from emp_backend.wsgi import application
+            status = first_request(application, path)
+            elapsed = (time.monotonic() - forked) * 1000
+            barrier.wait()
+            result = dict(memory(), status=status, first_request_ms=elapsed)
+            os.write(write_end, json.dumps(result).encode('utf-8'))
+            barrier.wait()
+            os._exit(0)
+        os.close(write_end)
+        children.append((pid, read_end))
+
+    for pid, read_end in children:
+        with os.fdopen(read_end) as pipe:
+            print(pipe.read())
+    for pid, read_end in children:
+        os.waitpid(pid, 0)
+
+
+def summarize(mode, results):
+    def mean(key):
+        return sum(result[key] for result in results) / len(results)
+    return "%-8s %8.0f %8.0f %8.0f %14.1f   %s" % (
+        mode, mean('rss'), mean('pss'), mean('uss'), mean('first_request_ms'),
+        ', '.join(sorted(set(result['status'] for result in results))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4, help="Workers forked per mode")
+    parser.add_argument('--path', default='/getRelations/', help="Path of the first request each worker serves")
+    parser.add_argument('--mode', choices=MODES, help="Measure one mode in this process (used internally)")
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.workers, args.path)
+        return
+
+    print("%-8s %8s %8s %8s %14s   %s" % ('mode', 'rss KiB', 'pss KiB', 'uss KiB', 'first req ms', 'status'))
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, __file__, '--mode', mode, '--workers', str(args.workers), '--path', args.path],
+            check=True, stdout=subprocess.PIPE, universal_newlines=True,
+        ).stdout
+        results = [json.loads(line) for line in output.splitlines() if line.strip()]
+        print(summarize(mode, results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Measures the startup time and per-request overhead of a settings profile's request stack,
+comparing emp_backend.settings (the full Django stack) with emp_backend.settings_api.
+
+Each profile runs in a fresh interpreter, which times django.setup() plus building the WSGI
+handler, then sends --requests requests straight to the handler (no network):
+    get        - GET of --path, a token-free endpoint
+    preflight  - a CORS preflight, answered by CorsMiddleware
+    unauth     - a POST without a token to a token-protected view, answered with a 401
+
+Needs a migrated database with the sample data loaded (see readme.md), then:
+    python benchmarks/request_stack.py --requests 2000
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from wsgiref.util import setup_testing_defaults
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROFILES = ('emp_backend.settings', 'emp_backend.settings_api')
+
+
+def request(application, method, path, **headers):
+    environ = dict(headers, PATH_INFO=path, REQUEST_METHOD=method)
+    setup_testing_defaults(environ)
+    body = application(environ, lambda status, response_headers, exc_info=None: None)
+    b''.join(body)
+    if hasattr(body, 'close'):
+        body.close()
+
+
+def run_profile(profile, requests, path):
+    """
+    Measures one profile in this process and prints the results as json
+    """
+    sys.path.insert(0, BASE_DIR)
+    os.environ['DJANGO_SETTINGS_MODULE'] = profile
+    started = time.perf_counter()
+    import django
+    from django.core.handlers.wsgi import WSGIHandler
+    django.setup(set_prefix=False)
+    application = WSGIHandler()
+    results = {'startup_ms': (time.perf_counter() - started) * 1000}
+    # django.request logs every 401, which would dominate the unauth timings
+    logging.disable(logging.WARNING)
+
+    cases = {
+        'get': ('GET', path, {}),
+        'preflight': ('OPTIONS', path, {'HTTP_ORIGIN': 'https://emp.pdx.edu', 'HTTP_ACCESS_CONTROL_REQUEST_METHOD': 'POST'}),
+        'unauth': ('POST', '/setEvacuationAssistance/', {}),
+    }
+    for name, (method, case_path, headers) in cases.items():
+        # The first request of each kind pays for lazy imports and caches, leave it out
+        request(application, method, case_path, **headers)
+        started = time.perf_counter()
+        for _ in range(requests):
+            request(application, method, case_path, **headers)
+        results[name + '_us'] = (time.perf_counter() - started) / requests * 1000000
+    print(json.dumps(results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=1000, help="Requests timed per kind")
+    parser.add_argument('--path', default='/getRelations/', help="Path of the token-free GET")
+    parser.add_argument('--profile', choices=PROFILES, help="Measure one profile in this process (used internally)")
+    args = parser.parse_args()
+
+    if args.profile:
+        run_profile(args.profile, args.requests, args.path)
+        return
+
+    columns = ('startup_ms', 'get_us', 'preflight_us', 'unauth_us')
+    print("%-26s" % 'profile' + ''.join("%14s" % column for column in columns))
+    for profile in PROFILES:
+        output = subprocess.run(
+            [sys.executable, __file__, '--profile', profile, '--requests', str(args.requests), '--path', args.path],
+            check=True, stdout=subprocess.PIPE, universal_newlines=True,
+        ).stdout
+        results = json.loads(output.splitlines()[-1])
+        print("%-26s" % profile + ''.join("%14.1f" % results[column] for column in columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Compares the validations per second of the ModelForms in emergency_app/forms.py with the compiled
+validators in emergency_app/validation.py that replaced them on the write endpoints.
+
+Every case validates the same submission both ways, as a QueryDict like request.POST (or a dict,
+like the json of replaceEmergencyContacts). updateEmergencyContact is left out by default since its
+priority check queries the database, which would dominate both timings; --with-queries adds it.
+
+Needs a migrated database with the sample data loaded (see readme.md), then:
+    python benchmarks/validation.py --seconds 1
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from urllib.parse import urlencode
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def rate(function, seconds):
+    """
+    Calls a function repeatedly for about the given time
+    Returns:
+            float: calls per second
+    """
+    function()
+    calls = 0
+    batch = 1
+    started = time.perf_counter()
+    while True:
+        for _ in range(batch):
+            function()
+        calls += batch
+        elapsed = time.perf_counter() - started
+        if elapsed >= seconds:
+            return calls / elapsed
+        batch *= 2
+
+
+def cases(with_queries):
+    """
+    Returns:
+            list: (name, form validation, compiled validation) pairs of functions
+    """
+    from django.http import QueryDict
+    from emergency_app import forms, validation
+    from emergency_app.models.identity import Identity
+
+    contact = {
+        'pidm': 0, 'priority': '1', 'first_name': 'Debby', 'last_name': 'Bar', 'relt_code': 'S',
+        'street_line1': '1825 SW Broadway', 'city': 'Portland', 'stat_code': 'OR', 'zip': '97201',
+        'ctry_code_phone': '1', 'phone_area': '503', 'phone_number': '5552345',
+    }
+    invalid_contact = dict(contact, relt_code='Z', first_name='', city='')
+    notifications = QueryDict(urlencode({
+        'external_email': 'foo@gmail.com', 'primary_phone': '5035552345', 'alternate_phone': '',
+        'sms_status_ind': 'N', 'sms_device': '5035552346',
+    }))
+    invalid_notifications = QueryDict(urlencode({'external_email': 'foo', 'primary_phone': '123', 'sms_status_ind': 'X'}))
+    evacuation = QueryDict(urlencode({'evacuation_assistance': 'Y'}))
+
+    # Both ways render the errors of invalid submissions, as the endpoints do
+    def pair(name, form_class, schema, data):
+        def with_form():
+            form = form_class(data)
+            if not form.is_valid():
+                str(form.errors)
+
+        def compiled():
+            cleaned, errors = schema.validate(data)
+            if errors:
+                validation.as_text(errors)
+
+        return name, with_form, compiled
+
+    built = [
+        pair('replace contact', forms.ReplaceEmergencyContactForm, validation.replace_emergency_contact, contact),
+        pair('replace contact (invalid)', forms.ReplaceEmergencyContactForm, validation.replace_emergency_contact, invalid_contact),
+        pair('set notifications', forms.SetEmergencyNotificationsForm, validation.set_emergency_notifications, notifications),
+        pair('set notifications (invalid)', forms.SetEmergencyNotificationsForm, validation.set_emergency_notifications, invalid_notifications),
+        pair('set evacuation assistance', forms.SetEvacuationAssistanceForm, validation.set_evacuation_assistance, evacuation),
+    ]
+    if with_queries:
+        pidm = Identity.objects.values_list('pidm', flat=True).first()
+        built.append(pair('update contact', forms.UpdateEmergencyContactForm, validation.update_emergency_contact,
+                          QueryDict(urlencode(dict(contact, pidm=pidm)))))
+    return built
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=1.0, help="Time spent on each case and way")
+    parser.add_argument('--with-queries', action='store_true', help="Also time updateEmergencyContact")
+    parser.add_argument('--json', help="Also write the results to this file")
+    args = parser.parse_args()
+
+    sys.path.insert(0, BASE_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'emp_backend.settings')
+    import django
+    django.setup()
+    # Invalid submissions are logged, which isn't what is measured here
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    results = {}
+    print('%-30s %14s %14s %9s' % ('case', 'form /s', 'compiled /s', 'speedup'))
+    for name, form, compiled in cases(args.with_queries):
+        form_rate = rate(form, args.seconds)
+        compiled_rate = rate(compiled, args.seconds)
+        results[name] = {'form_per_second': form_rate, 'compiled_per_second': compiled_rate}
+        print('%-30s %14.0f %14.0f %8.1fx' % (name, form_rate, compiled_rate, compiled_rate / form_rate))
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent=1)
+
+
+if __name__ == '__main__':
+    main()
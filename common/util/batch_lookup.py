@@ -0,0 +1,57 @@
+"""
+    Contact lookup for many people at once (e.g. everyone in a building during an incident).
+    SPREMRG and ZGBNNN are read with chunked IN queries, so thousands of pidms cost a handful
+    of queries, and results are produced chunk by chunk so they can be streamed.
+    Each chunk is scattered to the shards its people live on.
+"""
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from emergency_app.models.contact import Contact
+from emergency_app.models.emergency import Emergency
+from common.util import sharding
+
+
+def priority_order(contact):
+    """
+    Sort key for contacts: numeric priority, contacts without a valid priority last
+    """
+    priority = contact['priority']
+    return (0, int(priority)) if str(priority).isdigit() else (1, 0)
+
+
+def iter_contacts_by_pidm(pidms, chunk_size):
+    """
+    Yields every requested person's contacts and notification settings
+    Args:
+            pidms (list): pidms to look up, duplicates are only returned once
+            chunk_size (int): amount of pidms per IN query (sqlite allows 999 parameters)
+    Returns:
+            generator: dicts of the form {"pidm": 123, "contacts": [...by priority], "notifications": {...} or None}
+                in the order the pidms were requested
+    """
+    pidms = list(dict.fromkeys(pidms))
+    for start in range(0, len(pidms), chunk_size):
+        chunk = pidms[start:start + chunk_size]
+
+        contacts = {pidm: [] for pidm in chunk}
+        notifications = {}
+        for alias, shard_pidms in sharding.group_by_shard(chunk).items():
+            for contact in Contact.objects.using(alias).filter(pidm__in=shard_pidms).values():
+                contacts[contact['pidm']].append(contact)
+            for emergency in Emergency.objects.using(alias).filter(pidm__in=shard_pidms).values():
+                notifications[emergency['pidm']] = emergency
+
+        for pidm in chunk:
+            yield {
+                'pidm': pidm,
+                'contacts': sorted(contacts[pidm], key=priority_order),
+                'notifications': notifications.get(pidm),
+            }
+
+
+def iter_lookup_lines(pidms, chunk_size):
+    """
+    Yields the lookup as newline delimited json, one person per line
+    """
+    for person in iter_contacts_by_pidm(pidms, chunk_size):
+        yield json.dumps(person, cls=DjangoJSONEncoder) + '\n'
@@ -0,0 +1,183 @@
+"""
+    Append-only change feed for SPREMRG and ZGBNNN.
+    Every mutation records an entry in the same transaction as the write, so
+    downstream consumers (Banner, the alert vendor) can sync incrementally
+    instead of diffing full tables.
+    Entries are written on the person's shard, in the transaction of their rows. The feed
+    consumers read is the default database's CHANGE_LOG: the other shards' entries are an
+    outbox that relay() moves there before each read, in the order each shard wrote them.
+"""
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from common.util import sharding
+from emergency_app.models.change_log import ChangeLog, ChangeLogCursor
+
+# Operation codes stored in CHANGE_LOG_OPERATION
+INSERT = 'I'
+UPDATE = 'U'
+DELETE = 'D'
+
+# Fields that are bookkeeping rather than data, never reported as changed
+# (the models' derived lookup_key_fields are skipped as well)
+ignored_fields = ('activity_date', 'version')
+
+
+def snapshot(instance):
+    """
+    Captures the current field values of a model instance
+    Args:
+            instance (Model): The Contact or Emergency row to capture
+    Returns:
+            dict: attname -> value for every tracked field
+    """
+    derived_fields = getattr(instance, 'lookup_key_fields', ())
+    return {
+        field.attname: getattr(instance, field.attname)
+        for field in instance._meta.concrete_fields
+        if field.name not in ignored_fields and field.name not in derived_fields
+    }
+
+
+def diff(before, after):
+    """
+    Computes the fields that differ between two snapshots
+    Args:
+            before (dict): snapshot taken before the write (or None for an insert)
+            after (dict): snapshot taken after the write
+    Returns:
+            dict: field -> new value, only for the fields that changed
+    """
+    if before is None:
+        return dict(after)
+    return {field: value for field, value in after.items() if before.get(field) != value}
+
+
+def record(instance_or_model, pidm, operation, changed_fields, row_key=None):
+    """
+    Appends an entry to the change log - call inside the transaction that performs the write
+    Args:
+            instance_or_model (Model or Model class): what was written, used for the table name and row key
+            pidm (int): The person the row belongs to
+            operation (str): INSERT, UPDATE or DELETE
+            changed_fields (dict): field -> new value
+            row_key (optional): primary key of the row, defaults to the instance's pk
+    Returns:
+            ChangeLog: the new entry, or None when nothing changed
+    """
+    change = entry(instance_or_model, pidm, operation, changed_fields, row_key)
+    if change is not None:
+        change.save(using=sharding.shard_for(pidm))
+    return change
+
+
+def entry(instance_or_model, pidm, operation, changed_fields, row_key=None):
+    """
+    Builds an unsaved change log entry, for writers that save many at once with bulk_create
+    on the people's shard
+    Args:
+            same as record()
+    Returns:
+            ChangeLog: the unsaved entry, or None when nothing changed
+    """
+    if operation == UPDATE and not changed_fields:
+        return None
+    if row_key is None and not isinstance(instance_or_model, type):
+        row_key = instance_or_model.pk
+    return ChangeLog(
+        pidm=pidm,
+        table_name=instance_or_model._meta.db_table,
+        row_key=None if row_key is None else str(row_key),
+        operation=operation,
+        changed_fields=json.dumps(changed_fields, cls=DjangoJSONEncoder),
+    )
+
+
+def relay(alias, batch_size=1000):
+    """
+    Moves the entries written on a shard to the default database's change log, where they get
+    the next sequence numbers. A copy keeps the entry's shard and sequence in origin, so entries
+    copied by a relay that stopped before deleting them, or by a concurrent one, aren't copied twice.
+    Args:
+            alias (str): the shard, not the default database
+            batch_size (int): entries moved per transaction
+    Returns:
+            int: amount of entries copied
+    """
+    copied = 0
+    while True:
+        entries = list(ChangeLog.objects.using(alias).order_by('sequence')[:batch_size])
+        if not entries:
+            return copied
+        origins = ['%s:%d' % (alias, shard_entry.sequence) for shard_entry in entries]
+        relayed = set(ChangeLog.objects.using('default').filter(origin__in=origins).values_list('origin', flat=True))
+        copies = [
+            ChangeLog(origin=origin, pidm=shard_entry.pidm, table_name=shard_entry.table_name, row_key=shard_entry.row_key,
+                      operation=shard_entry.operation, changed_fields=shard_entry.changed_fields,
+                      activity_date=shard_entry.activity_date)
+            for origin, shard_entry in zip(origins, entries) if origin not in relayed
+        ]
+        try:
+            with transaction.atomic(using='default'):
+                ChangeLog.objects.using('default').bulk_create(copies)
+        except IntegrityError:
+            # A concurrent relay copied them first, the next pass finds them relayed
+            continue
+        ChangeLog.objects.using(alias).filter(sequence__in=[shard_entry.sequence for shard_entry in entries]).delete()
+        copied += len(copies)
+
+
+def changes_since(sequence, limit):
+    """
+    Reads the change log after a cursor, once the other shards' entries are relayed
+    Args:
+            sequence (int): The last sequence number the caller has seen (0 for everything)
+            limit (int): Maximum amount of entries to return
+    Returns:
+            list: change dicts in sequence order
+    """
+    for alias in sharding.shard_aliases()[1:]:
+        relay(alias)
+    entries = ChangeLog.objects.filter(sequence__gt=sequence).order_by('sequence')[:limit]
+    return [serialize(entry) for entry in entries]
+
+
+def serialize(entry):
+    """
+    Converts a ChangeLog row into its json form
+    Args:
+            entry (ChangeLog): The row to convert
+    Returns:
+            dict: the change as served by the API
+    """
+    return {
+        'sequence': entry.sequence,
+        'pidm': entry.pidm,
+        'table': entry.table_name,
+        'row_key': entry.row_key,
+        'operation': entry.operation,
+        'changed_fields': json.loads(entry.changed_fields),
+        'activity_date': entry.activity_date,
+    }
+
+
+def get_cursor(consumer):
+    """
+    Returns the last sequence number a consumer has processed (0 if it never ran)
+    """
+    cursor, created = ChangeLogCursor.objects.get_or_create(consumer=consumer)
+    return cursor.sequence
+
+
+def advance_cursor(consumer, sequence):
+    """
+    Stores the last sequence number a consumer has processed
+    """
+    ChangeLogCursor.objects.update_or_create(consumer=consumer, defaults={'sequence': sequence})
+
+
+def all_cursors():
+    """
+    Returns every consumer's cursor, used to decide which entries are safe to purge
+    """
+    return dict(ChangeLogCursor.objects.values_list('consumer', 'sequence'))
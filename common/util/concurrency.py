@@ -0,0 +1,88 @@
+"""
+    Optimistic concurrency for SPREMRG and ZGBNNN rows, so two tabs or devices editing the same
+    contacts don't silently overwrite each other.
+    Every write increments the row's version. A writer remembers the version it read, or the one the
+    client was shown, and writes with UPDATE ... WHERE version = <that version>. When another request
+    changed the row in between nothing is written, and the endpoint answers Conflict(409) with the
+    current row. No lock is held while the request is validated.
+"""
+from django.db.models import F, Q
+from django.utils import timezone
+
+
+class Conflict(Exception):
+    """
+    Raised inside a transaction to roll it back when a row was changed by another request
+    """
+
+
+def expected_version(data, stored):
+    """
+    The version a write must find, the client's when it sends one
+    Args:
+            data (dict): the submitted values, may hold 'version'
+            stored (Model): the row as it was read
+    Returns:
+            int: the submitted version, or the stored row's. None when the submitted one isn't a number.
+    """
+    submitted = data.get('version')
+    if submitted in (None, ''):
+        return stored.version
+    try:
+        return int(submitted)
+    except (TypeError, ValueError):
+        return None
+
+
+def save_if_current(instance, version):
+    """
+    Writes every field of a changed row and increments its version, only if the row is still at version.
+    Like save(), fills in the auto_now dates and the lookup keys.
+    Args:
+            instance (Model): the Contact or Emergency row, with the new values
+            version (int): the version the row must still have
+    Returns:
+            bool: True if written, False if the row was changed or deleted by another request
+    """
+    if hasattr(instance, 'update_lookup_keys'):
+        instance.update_lookup_keys()
+    instance.version = version + 1
+    values = {
+        field.attname: field.pre_save(instance, False)
+        for field in instance._meta.concrete_fields
+        if not field.primary_key
+    }
+    rows = type(instance)._default_manager.using(instance._state.db)
+    return rows.filter(pk=instance.pk, version=version).update(**values) == 1
+
+
+def delete_if_current(instance, version):
+    """
+    Deletes a row, only if it is still at version
+    Returns:
+            bool: True if deleted, False if the row was changed or deleted by another request
+    """
+    rows = type(instance)._default_manager.using(instance._state.db)
+    deleted, per_model = rows.filter(pk=instance.pk, version=version).delete()
+    return deleted > 0
+
+
+def claim_versions(model, versions, using):
+    """
+    Increments the version of many rows in one UPDATE, only if every one of them is still at the
+    version given, for writers that then change them with bulk_update or delete them
+    Args:
+            model (Model class): Contact or Emergency
+            versions (dict): primary key -> the version the row must still have
+            using (str): the shard the rows are on
+    Raises:
+            Conflict: if any of the rows was changed or deleted, call inside the transaction to roll back
+    """
+    if not versions:
+        return
+    current = Q()
+    for pk, version in versions.items():
+        current |= Q(pk=pk, version=version)
+    # update() skips auto_now, the rows are being written so stamp their activity date for the export
+    if model._default_manager.using(using).filter(current).update(version=F('version') + 1, activity_date=timezone.now()) != len(versions):
+        raise Conflict()
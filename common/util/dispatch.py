@@ -0,0 +1,293 @@
+"""
+    Alert dispatch: compiles who to notify from ZGBNNN and fans the message out
+    through pluggable transports, each with its own thread pool, concurrency limit
+    and retries, and reports what was delivered.
+    Transports are configured in settings.EMP_DISPATCH_TRANSPORTS, StubTransport
+    stands in for the real SMTP server and SMS gateway when testing locally.
+"""
+import heapq
+import json
+import logging
+import smtplib
+import threading
+import time
+import urllib.request
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.utils.module_loading import import_string
+from common.util import sanitization
+from common.util import sharding
+from emergency_app.models.emergency import Emergency
+
+logger = logging.getLogger(__name__)
+
+# Channels
+EMAIL = 'email'
+SMS = 'sms'
+
+# One address to notify. pidm is the first person found using the address.
+Target = namedtuple('Target', ['channel', 'address', 'pidm'])
+
+# What to send, subject is only used by email
+Message = namedtuple('Message', ['subject', 'body'])
+
+
+class TransportError(Exception):
+    """
+    Raised by a transport when a message could not be delivered
+    """
+
+
+class Transport:
+    """
+    Sends one message to one address on a channel. Subclasses implement send(), which is
+    called from several threads at once (up to concurrency) and raises TransportError on failure.
+    """
+    channel = None
+
+    def __init__(self, channel=None, concurrency=10, **options):
+        self.channel = channel or self.channel
+        self.concurrency = concurrency
+
+    def send(self, address, message):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SMTPTransport(Transport):
+    """
+    Sends email through Django's email backend, keeping one open connection per thread
+    """
+    channel = EMAIL
+
+    def __init__(self, channel=None, concurrency=10, from_email=None, **options):
+        super(SMTPTransport, self).__init__(channel, concurrency)
+        self.from_email = from_email
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+
+    def connection(self):
+        if not hasattr(self.local, 'connection'):
+            connection = get_connection()
+            connection.open()
+            self.local.connection = connection
+            with self.lock:
+                self.connections.append(connection)
+        return self.local.connection
+
+    def discard(self):
+        """
+        Closes this thread's connection after an error, the backend would otherwise keep reusing it
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            return
+        del self.local.connection
+        with self.lock:
+            self.connections.remove(connection)
+        try:
+            connection.close()
+        except (smtplib.SMTPException, OSError):
+            pass
+
+    def send(self, address, message):
+        try:
+            email = EmailMessage(message.subject, message.body, self.from_email, [address], connection=self.connection())
+            email.send()
+        except (smtplib.SMTPException, OSError) as e:
+            self.discard()
+            raise TransportError(str(e))
+
+    def close(self):
+        for connection in self.connections:
+            connection.close()
+
+
+class SMSGatewayTransport(Transport):
+    """
+    Sends text messages by POSTing {"to": "+15035552345", "body": "..."} to an HTTP gateway
+    """
+    channel = SMS
+
+    def __init__(self, channel=None, concurrency=10, url=None, token=None, timeout=10, **options):
+        super(SMSGatewayTransport, self).__init__(channel, concurrency)
+        self.url = url
+        self.token = token
+        self.timeout = timeout
+
+    def send(self, address, message):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps({'to': '+' + address, 'body': message.body}).encode('utf-8'),
+            headers={'Content-Type': 'application/json', 'Authorization': 'Bearer %s' % self.token},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                if response.status >= 300:
+                    raise TransportError("gateway returned %d" % response.status)
+        except OSError as e:
+            raise TransportError(str(e))
+
+
+class StubTransport(Transport):
+    """
+    Records messages instead of sending them, for local testing
+    Args:
+            channel (str): EMAIL or SMS
+            fail (dict): address -> amount of attempts that should fail before it succeeds (-1 for always)
+            latency (float): seconds each send takes
+    """
+
+    def __init__(self, channel=EMAIL, concurrency=10, fail=None, latency=0, **options):
+        super(StubTransport, self).__init__(channel, concurrency)
+        self.fail = dict(fail or {})
+        self.latency = latency
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def send(self, address, message):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            if self.fail.get(address):
+                self.fail[address] -= 1
+                raise TransportError("stub failure for %s" % address)
+            self.sent.append((address, message))
+
+
+def load_transports(channels=None):
+    """
+    Builds the transports configured in settings.EMP_DISPATCH_TRANSPORTS
+    Args:
+            channels (list): only build these channels, defaults to every configured channel
+    Returns:
+            dict: channel -> Transport
+    """
+    transports = {}
+    for channel, config in settings.EMP_DISPATCH_TRANSPORTS.items():
+        if channels is not None and channel not in channels:
+            continue
+        backend = import_string(config['BACKEND'])
+        transports[channel] = backend(channel=channel, concurrency=config.get('CONCURRENCY', 10), **config.get('OPTIONS', {}))
+    return transports
+
+
+def compile_targets(pidms=None, chunk_size=2000):
+    """
+    Compiles the deduplicated list of addresses to notify from ZGBNNN.
+    Everyone's external and campus email is notified, and their sms device unless they opted out
+    of text messages (sms_status_ind 'Y'). Addresses shared by several people are only notified once.
+    Args:
+            pidms (list): only notify these people, defaults to everyone
+            chunk_size (int): rows fetched from the database at a time
+    Returns:
+            list: Target tuples, emails first
+    """
+    shards = []
+    for alias in sharding.shard_aliases():
+        rows = Emergency.objects.using(alias).order_by('pidm')
+        if pidms is not None:
+            rows = rows.filter(pidm__in=pidms)
+        rows = rows.values_list('pidm', 'external_email', 'campus_email', 'sms_status_ind', 'sms_device')
+        shards.append(rows.iterator(chunk_size=chunk_size))
+
+    emails, texts = {}, {}
+    # In pidm order across the shards, so a shared address always goes to the same person
+    for pidm, external_email, campus_email, sms_status_ind, sms_device in heapq.merge(*shards):
+        for email in (campus_email, external_email):
+            key = sanitization.normalize_email(email)
+            if key and sanitization.validate_email(key):
+                emails.setdefault(key, Target(EMAIL, key, pidm))
+        if sms_status_ind != 'Y':
+            key = sanitization.normalize_phone(sms_device)
+            if key:
+                texts.setdefault(key, Target(SMS, key, pidm))
+    return list(emails.values()) + list(texts.values())
+
+
+class DeliveryReport:
+    """
+    Thread safe accounting of one dispatch, per channel
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.channels = {}
+        self.failures = []
+        self.elapsed = 0
+
+    def count(self, channel, outcome, amount=1):
+        with self.lock:
+            counts = self.channels.setdefault(channel, {'targets': 0, 'sent': 0, 'failed': 0, 'retries': 0, 'skipped': 0})
+            counts[outcome] += amount
+
+    def fail(self, target, error):
+        with self.lock:
+            self.failures.append({'channel': target.channel, 'address': target.address, 'pidm': target.pidm, 'error': error})
+
+    def as_dict(self):
+        return {'channels': self.channels, 'failures': self.failures, 'elapsed': round(self.elapsed, 3)}
+
+
+def dispatch(message, targets, transports, max_attempts=None, backoff=None):
+    """
+    Sends a message to every target, every channel's transport running in parallel on its own
+    thread pool sized to the transport's concurrency. Failed sends are retried with exponential backoff.
+    Args:
+            message (Message): what to send
+            targets (list): Target tuples, e.g. from compile_targets()
+            transports (dict): channel -> Transport, targets on other channels are skipped
+            max_attempts (int): attempts per address, defaults to settings.EMP_DISPATCH_MAX_ATTEMPTS
+            backoff (float): seconds before the first retry, doubled on each retry,
+                defaults to settings.EMP_DISPATCH_BACKOFF_SECONDS
+    Returns:
+            DeliveryReport: counts per channel and every address that could not be reached
+    """
+    max_attempts = max_attempts or settings.EMP_DISPATCH_MAX_ATTEMPTS
+    backoff = settings.EMP_DISPATCH_BACKOFF_SECONDS if backoff is None else backoff
+    report = DeliveryReport()
+    started = time.monotonic()
+
+    def deliver(transport, target):
+        for attempt in range(1, max_attempts + 1):
+            try:
+                transport.send(target.address, message)
+                report.count(target.channel, 'sent')
+                return
+            except TransportError as e:
+                error = str(e)
+            except Exception as e:
+                # A bug in the transport rather than a delivery failure, retrying won't help
+                logger.error("Transport %s crashed sending to %s", target.channel, target.address, exc_info=True)
+                error = '%s: %s' % (type(e).__name__, e)
+                break
+            if attempt < max_attempts:
+                report.count(target.channel, 'retries')
+                time.sleep(backoff * (2 ** (attempt - 1)))
+        report.count(target.channel, 'failed')
+        report.fail(target, error)
+
+    executors = {
+        channel: ThreadPoolExecutor(max_workers=transport.concurrency, thread_name_prefix='emp-dispatch-' + channel)
+        for channel, transport in transports.items()
+    }
+    try:
+        for target in targets:
+            report.count(target.channel, 'targets')
+            if target.channel not in transports:
+                report.count(target.channel, 'skipped')
+                continue
+            executors[target.channel].submit(deliver, transports[target.channel], target)
+    finally:
+        for executor in executors.values():
+            executor.shutdown(wait=True)
+        for transport in transports.values():
+            transport.close()
+
+    report.elapsed = time.monotonic() - started
+    return report
@@ -0,0 +1,179 @@
+"""
+    Maintains EMERGENCY_PROFILE, one row per person holding their contacts, notification settings
+    and evacuation assistance status already serialized the way the read endpoints return them.
+    Reads outnumber writes by far, so the joins of SPREMRG with the reference tables and the JSON
+    encoding are paid once per write instead of once per read: every write path rebuilds the
+    person's profile in the transaction that wrote their rows, and a read is one primary key lookup
+    whose text is returned as is. A missing profile (people written outside the application before
+    the next rebuild) is built on first read. Profiles live on the person's shard, next to their rows.
+    They hold the descriptions of the contacts' codes too, so saving a reference row rebuilds the
+    profiles of the people whose contacts use it (see EmergencyAppConfig.ready).
+"""
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from common.util import batch_lookup
+from common.util import sharding
+from emergency_app.models.contact import Contact
+from emergency_app.models.emergency import Emergency
+from emergency_app.models.emergency_profile import EmergencyProfile
+
+# What a contact's codes stand for, joined from the reference tables
+contact_references = {
+    'relation_description': F('relation__description'),
+    'state_name': F('state__value'),
+    'nation_name': F('nation__value'),
+}
+
+# ZGBNNN columns of getEmergencyNotifications and of getEvacuationAssistance
+notification_columns = ['external_email', 'campus_email', 'primary_phone', 'alternate_phone', 'sms_status_ind',
+                        'sms_device', 'version']
+evacuation_columns = ['evacuation_assistance', 'version']
+
+# Serialized fragment of a person without contacts or without a ZGBNNN row, answered with No Content
+EMPTY = '[]'
+
+
+def contact_columns(contact_model=Contact):
+    """
+    Returns every SPREMRG column of a contact, the ones the contact endpoints return
+    """
+    return [field.attname for field in contact_model._meta.concrete_fields]
+
+
+def encode(value):
+    """
+    Serializes a fragment exactly like JsonResponse would
+    """
+    return json.dumps(value, cls=DjangoJSONEncoder)
+
+
+def profile_rows(pidms, contact_model, emergency_model, profile_model, using):
+    """
+    Builds unsaved profile rows, reading SPREMRG and ZGBNNN once for all the people
+    Args:
+            pidms (list): people on one shard
+            the models to use, historical versions inside a migration
+            using (str): the shard
+    Returns:
+            list: unsaved profile rows, one per pidm
+    """
+    contacts = {pidm: [] for pidm in pidms}
+    rows = contact_model.objects.using(using).filter(pidm__in=pidms)
+    for contact in rows.values(*contact_columns(contact_model), **contact_references):
+        contacts[contact['pidm']].append(contact)
+    emergencies = {emergency['pidm']: emergency for emergency in
+                   emergency_model.objects.using(using).filter(pidm__in=pidms).values('pidm', 'evacuation_assistance', *notification_columns)}
+
+    profiles = []
+    for pidm in pidms:
+        emergency = emergencies.get(pidm)
+        profiles.append(profile_model(
+            pidm=pidm,
+            contacts=encode(sorted(contacts[pidm], key=batch_lookup.priority_order)),
+            notifications=encode([{column: emergency[column] for column in notification_columns}] if emergency else []),
+            evacuation_assistance=encode([{column: emergency[column] for column in evacuation_columns}] if emergency else []),
+        ))
+    return profiles
+
+
+def sync(pidm):
+    """
+    Rebuilds one person's profile from their rows - call in the transaction that wrote them
+    Args:
+            pidm (int): the person whose SPREMRG or ZGBNNN rows were written
+    """
+    alias = sharding.shard_for(pidm)
+    profile_rows([pidm], Contact, Emergency, EmergencyProfile, alias)[0].save(using=alias)
+
+
+def sync_many(pidms, using):
+    """
+    Rebuilds several people's profiles, for bulk writers
+    Args:
+            pidms (list): people on one shard whose rows were written
+            using (str): the shard
+    """
+    pidms = sorted(set(pidms))
+    EmergencyProfile.objects.using(using).filter(pidm__in=pidms).delete()
+    EmergencyProfile.objects.using(using).bulk_create(profile_rows(pidms, Contact, Emergency, EmergencyProfile, using))
+
+
+def reference_saved(sender, instance, using, **kwargs):
+    """
+    post_save receiver of the reference tables: rebuilds, on the database the row was saved to, the
+    profiles of the people with a contact using its code, which hold its old description.
+    Not while loaddata saves a fixture (raw), run rebuild_emergency_profiles once it is loaded.
+    """
+    if kwargs.get('raw'):
+        return
+    uses = Q()
+    for field in Contact._meta.concrete_fields:
+        if field.related_model is sender:
+            uses |= Q(**{field.attname: instance.pk})
+    pidms = list(Contact.objects.using(using).filter(uses).values_list('pidm', flat=True).distinct())
+    if pidms:
+        with transaction.atomic(using=using):
+            sync_many(pidms, using)
+
+
+def get(pidm):
+    """
+    Returns a person's profile, building it if they have none yet
+    Args:
+            pidm (int): the person
+    Returns:
+            EmergencyProfile: with the serialized contacts, notifications and evacuation_assistance
+    """
+    alias = sharding.shard_for(pidm)
+    try:
+        return EmergencyProfile.objects.using(alias).get(pk=pidm)
+    except EmergencyProfile.DoesNotExist:
+        pass
+    profile = profile_rows([pidm], Contact, Emergency, EmergencyProfile, alias)[0]
+    try:
+        # Only an insert, a write rebuilding the profile since it was read has the newer one
+        with transaction.atomic(using=alias):
+            profile.save(using=alias, force_insert=True)
+    except IntegrityError:
+        pass
+    return profile
+
+
+def document(profile):
+    """
+    Joins a profile's fragments into the one document of getEmergencyProfile, without decoding them
+    Args:
+            profile (EmergencyProfile): the person's profile
+    Returns:
+            str: {"contacts": [...], "notifications": [...], "evacuation_assistance": [...]}
+    """
+    return '{"contacts": %s, "notifications": %s, "evacuation_assistance": %s}' % (
+        profile.contacts, profile.notifications, profile.evacuation_assistance)
+
+
+def rebuild(contact_model=Contact, emergency_model=Emergency, profile_model=EmergencyProfile, batch_size=1000, shards=None):
+    """
+    Rebuilds every profile from SPREMRG and ZGBNNN, for the initial load and for repairing drift
+    Args:
+            the models to use, historical versions inside a migration
+            batch_size (int): people read and written per batch
+            shards (list): database aliases to rebuild, defaults to every shard
+    Returns:
+            int: amount of profiles written
+    """
+    total = 0
+    for alias in shards or sharding.shard_aliases():
+        pidms = set(contact_model.objects.using(alias).values_list('pidm', flat=True).distinct())
+        pidms.update(emergency_model.objects.using(alias).values_list('pidm', flat=True))
+        pidms = sorted(pidms)
+        # One transaction per shard, so readers never see a half rebuilt shard
+        with transaction.atomic(using=alias):
+            profile_model.objects.using(alias).all().delete()
+            for start in range(0, len(pidms), batch_size):
+                batch = pidms[start:start + batch_size]
+                profile_model.objects.using(alias).bulk_create(
+                    profile_rows(batch, contact_model, emergency_model, profile_model, alias))
+                total += len(batch)
+    return total
@@ -0,0 +1,129 @@
+"""
+    Maintains EVACUATION_ROSTER, the denormalized list of everyone with
+    evacuation_assistance 'Y' and how to reach them, so building safety staff
+    can read it in one query during an incident instead of scanning ZGBNNN.
+    Each write only touches the roster row of the person being written, so
+    concurrent writes during a drill never contend on a shared row.
+    Roster rows live on the person's shard, written in the transaction of their ZGBNNN row,
+    and the roster endpoint merges every shard's rows.
+"""
+import heapq
+from operator import itemgetter
+from django.db import transaction
+from common.util import sharding
+from emergency_app.models.emergency import Emergency
+from emergency_app.models.identity import Identity
+from emergency_app.models.evacuation_roster import EvacuationRoster
+
+# ZGBNNN fields copied onto the roster
+emergency_fields = ['campus_email', 'external_email', 'primary_phone', 'alternate_phone', 'sms_device']
+
+# ZGBIDMP fields copied onto the roster
+identity_fields = ['username', 'first_name', 'last_name']
+
+
+def roster_rows(emergencies, identities, roster_model):
+    """
+    Builds unsaved roster rows for the people needing assistance
+    Args:
+            emergencies (iterable): Emergency rows
+            identities (dict): pidm -> Identity row
+            roster_model (Model class): EvacuationRoster, or its historical version inside a migration
+    Returns:
+            list: unsaved roster rows
+    """
+    rows = []
+    for emergency in emergencies:
+        if emergency.evacuation_assistance != 'Y':
+            continue
+        row = roster_model(pidm=emergency.pidm)
+        for field in emergency_fields:
+            setattr(row, field, getattr(emergency, field))
+        identity = identities.get(emergency.pidm)
+        for field in identity_fields:
+            setattr(row, field, getattr(identity, field) if identity else None)
+        rows.append(row)
+    return rows
+
+
+def sync(emergency, identity=None):
+    """
+    Brings one person's roster row in line with their ZGBNNN row - call in the transaction that wrote it
+    Args:
+            emergency (Emergency): the row just written
+            identity (Identity): the person's ZGBIDMP row, looked up when not given
+    """
+    alias = sharding.shard_for(emergency.pidm)
+    if emergency.evacuation_assistance != 'Y':
+        EvacuationRoster.objects.using(alias).filter(pidm=emergency.pidm).delete()
+        return
+    if identity is None:
+        identity = Identity.objects.filter(pidm=emergency.pidm).first()
+    row = roster_rows([emergency], {emergency.pidm: identity}, EvacuationRoster)[0]
+    row.save(using=alias)
+
+
+def sync_many(pidms, using):
+    """
+    Brings several people's roster rows in line with ZGBNNN, for bulk writers
+    Args:
+            pidms (list): people on one shard whose ZGBNNN rows were written
+            using (str): the shard
+    """
+    emergencies = list(Emergency.objects.using(using).filter(pidm__in=pidms))
+    identities = Identity.objects.in_bulk([emergency.pidm for emergency in emergencies])
+    EvacuationRoster.objects.using(using).filter(pidm__in=pidms).delete()
+    EvacuationRoster.objects.using(using).bulk_create(roster_rows(emergencies, identities, EvacuationRoster))
+
+
+def all_rows():
+    """
+    Reads the whole roster, merging the shards' rows
+    Returns:
+            list: roster rows as dicts, by pidm
+    """
+    shards = [EvacuationRoster.objects.using(alias).order_by('pidm').values() for alias in sharding.shard_aliases()]
+    return list(heapq.merge(*shards, key=itemgetter('pidm')))
+
+
+def rebuild(emergency_model=Emergency, identity_model=Identity, roster_model=EvacuationRoster, batch_size=1000, shards=None):
+    """
+    Rebuilds the whole roster from ZGBNNN and ZGBIDMP, for the initial load and for repairing drift
+    Args:
+            the models to use, historical versions inside a migration
+            batch_size (int): rows read and written per batch
+            shards (list): database aliases to rebuild, defaults to every shard
+    Returns:
+            int: amount of people on the roster
+    """
+    total = 0
+    for alias in shards or sharding.shard_aliases():
+        # One transaction per shard, so readers never see a half built shard
+        with transaction.atomic(using=alias):
+            roster_model.objects.using(alias).all().delete()
+            needing_assistance = emergency_model.objects.using(alias).filter(evacuation_assistance='Y').order_by('pidm')
+            last_pidm = None
+            while True:
+                batch = needing_assistance if last_pidm is None else needing_assistance.filter(pidm__gt=last_pidm)
+                batch = list(batch[:batch_size])
+                if not batch:
+                    break
+                identities = identity_model.objects.in_bulk([emergency.pidm for emergency in batch])
+                roster_model.objects.using(alias).bulk_create(roster_rows(batch, identities, roster_model))
+                total += len(batch)
+                last_pidm = batch[-1].pidm
+    return total
+
+
+def counts(rows):
+    """
+    Summarizes roster rows for the roster endpoint
+    Returns:
+            dict: people on the roster, and how many can be reached by text, phone and email
+    """
+    return {
+        'total': len(rows),
+        'sms': sum(1 for row in rows if row['sms_device']),
+        'phone': sum(1 for row in rows if row['primary_phone'] or row['alternate_phone']),
+        'email': sum(1 for row in rows if row['campus_email'] or row['external_email']),
+    }
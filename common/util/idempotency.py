@@ -0,0 +1,212 @@
+"""
+    Idempotency-Key support for the write endpoints, so a client retrying a request it never got
+    the answer to (flaky mobile networks) doesn't create the contact twice.
+    The first request with a key claims it, runs normally, and its response is kept in IDEMPOTENCY_KEY,
+    per person, for settings.EMP_IDEMPOTENCY_TTL seconds. Retries with the same key get that response
+    back without validating or writing anything, whichever worker they reach, in one query. The claim
+    is an insert against the unique (key, pidm), so of two concurrent requests with a key only one runs.
+    Expired keys are purged by the workers claiming keys, every settings.EMP_IDEMPOTENCY_PURGE_INTERVAL
+    seconds.
+    The key lives on the default database and the view writes on the person's shard, so claiming the
+    key, the write and keeping the response are separate transactions. A worker dying after the claim
+    leaves the key claimed without a write: retries get a 409 until settings.EMP_IDEMPOTENCY_LOCK_SECONDS
+    pass and the key counts as abandoned. One dying after the write but before keeping the response
+    leaves the write done, and a retry after that runs it again.
+"""
+import hashlib
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+from functools import wraps
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from common.util import jwt_placeholder as j
+from emergency_app.models.identity import Identity
+from emergency_app.models.idempotency_key import IdempotencyKey
+
+header = 'HTTP_IDEMPOTENCY_KEY'
+max_key_length = 255
+
+http_conflict_response = 409
+http_unprocessable_entity_response = 422
+
+# Outcomes of claim()
+CLAIMED = 'claimed'          # first request with the key, run it
+REPLAY = 'replay'            # answered before, replay the stored response
+IN_PROGRESS = 'in progress'  # the first request is still running
+MISMATCH = 'mismatch'        # the key was used for a different request
+
+# What is kept of a response to replay it
+StoredResponse = namedtuple('StoredResponse', ['status', 'content', 'content_type'])
+
+# time.monotonic() of this process's next purge of the expired keys
+_next_purge = 0.0
+_purge_lock = threading.Lock()
+
+
+def outcome(entry, fingerprint, now):
+    """
+    What a request gets from its key's row
+    Returns:
+            tuple: (REPLAY, IN_PROGRESS or MISMATCH, the StoredResponse to replay or None), or None
+            when there is no row or it is expired or abandoned, and the key can be claimed
+    """
+    if entry is None or entry.expires <= now:
+        return None
+    if entry.response_status is None and \
+            entry.activity_date <= now - timedelta(seconds=settings.EMP_IDEMPOTENCY_LOCK_SECONDS):
+        return None
+    if entry.fingerprint != fingerprint:
+        return MISMATCH, None
+    if entry.response_status is None:
+        return IN_PROGRESS, None
+    return REPLAY, StoredResponse(entry.response_status, bytes(entry.response_content), entry.response_content_type)
+
+
+def check(key, username, fingerprint):
+    """
+    Answers a retry with one query, reading the key's row of the person logged in as username
+    Returns:
+            tuple: like claim(), or None when the key has to be claimed
+    """
+    pidms = Identity.objects.filter(username=username).values('pidm')
+    return outcome(IdempotencyKey.objects.filter(key=key, pidm__in=pidms).first(), fingerprint, timezone.now())
+
+
+def claim(key, pidm, fingerprint):
+    """
+    Looks a key up, claiming it for this request if it is new, expired, or abandoned by a first
+    request that didn't complete within settings.EMP_IDEMPOTENCY_LOCK_SECONDS (its worker died)
+    Args:
+            key (str): the Idempotency-Key header
+            pidm (int): the person sending it
+            fingerprint (str): digest of the request, to recognise a key reused for another request
+    Returns:
+            tuple: (CLAIMED, REPLAY, IN_PROGRESS or MISMATCH, the StoredResponse to replay or None)
+    """
+    for attempt in range(2):
+        now = timezone.now()
+        entry = IdempotencyKey.objects.filter(key=key, pidm=pidm).first()
+        answer = outcome(entry, fingerprint, now)
+        if answer is not None:
+            return answer
+        if entry is not None:
+            # Conditional on the row read, so only one of the requests finding it stale replaces it
+            IdempotencyKey.objects.filter(pk=entry.pk, activity_date=entry.activity_date).delete()
+        purge_expired()
+        try:
+            with transaction.atomic():
+                IdempotencyKey.objects.create(key=key, pidm=pidm, fingerprint=fingerprint,
+                                              expires=now + timedelta(seconds=settings.EMP_IDEMPOTENCY_TTL))
+            return CLAIMED, None
+        except IntegrityError:
+            # Claimed by a concurrent request in between, read its row
+            continue
+    return IN_PROGRESS, None
+
+
+def complete(key, pidm, fingerprint, response):
+    """
+    Keeps the response of a claimed key for its retries
+    """
+    IdempotencyKey.objects.filter(key=key, pidm=pidm, fingerprint=fingerprint).update(
+        response_status=response.status, response_content=response.content,
+        response_content_type=response.content_type, activity_date=timezone.now())
+
+
+def release(key, pidm):
+    """
+    Forgets a claimed key whose request failed, so a retry runs it again
+    """
+    IdempotencyKey.objects.filter(key=key, pidm=pidm).delete()
+
+
+def purge_expired():
+    """
+    Deletes the expired keys, at most once per settings.EMP_IDEMPOTENCY_PURGE_INTERVAL in this process
+    Returns:
+            int: amount of keys deleted
+    """
+    global _next_purge
+    with _purge_lock:
+        if time.monotonic() < _next_purge:
+            return 0
+        _next_purge = time.monotonic() + settings.EMP_IDEMPOTENCY_PURGE_INTERVAL
+    deleted, per_model = IdempotencyKey.objects.filter(expires__lte=timezone.now()).delete()
+    return deleted
+
+
+def reset():
+    """
+    Makes the next claim purge the expired keys
+    """
+    global _next_purge
+    with _purge_lock:
+        _next_purge = 0.0
+
+
+def fingerprint(request):
+    digest = hashlib.sha256()
+    for part in (request.method, request.path):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def idempotent(view):
+    """
+    Decorates a write view to replay its response to retries carrying the same Idempotency-Key header.
+    Keys are per person (the JWT's user), requests without a key or a valid JWT run as usual.
+    Server errors aren't kept, so their retries run again.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        idempotency_key = request.META.get(header)
+        if not idempotency_key:
+            return view(request, *args, **kwargs)
+        if len(idempotency_key) > max_key_length:
+            return HttpResponse("Idempotency-Key must be at most %d characters" % max_key_length,
+                                status=http_unprocessable_entity_response)
+        jwt = request.META.get('HTTP_AUTHORIZATION')
+        try:
+            j.validate_token(jwt)
+        except Exception:
+            # The view answers with the Unauthorized error
+            return view(request, *args, **kwargs)
+
+        username = j.grab_token_payload(jwt)['username']
+        request_fingerprint = fingerprint(request)
+        answer = check(idempotency_key, username, request_fingerprint)
+        if answer is None:
+            pidm = Identity.objects.filter(username=username).values_list('pidm', flat=True).first()
+            if pidm is None:
+                return view(request, *args, **kwargs)
+            answer = claim(idempotency_key, pidm, request_fingerprint)
+        state, stored = answer
+        if state == REPLAY:
+            response = HttpResponse(stored.content, status=stored.status, content_type=stored.content_type)
+            response['Idempotent-Replayed'] = 'true'
+            return response
+        if state == IN_PROGRESS:
+            return HttpResponse("A request with this Idempotency-Key is still in progress", status=http_conflict_response)
+        if state == MISMATCH:
+            return HttpResponse("Idempotency-Key was already used for a different request",
+                                status=http_unprocessable_entity_response)
+
+        try:
+            response = view(request, *args, **kwargs)
+        except Exception:
+            release(idempotency_key, pidm)
+            raise
+        if response.status_code >= 500 or response.streaming:
+            release(idempotency_key, pidm)
+        else:
+            complete(idempotency_key, pidm, request_fingerprint,
+                     StoredResponse(response.status_code, response.content, response['Content-Type']))
+        return response
+
+    return wrapper
@@ -3,9 +3,13 @@
 	Generates and validates JWTs
 """
 import sys
+import logging
 import jwt
+import calendar
+import uuid
 # datetime and timedelta for expiration
 from datetime import datetime, timedelta
+from common.util import revocation
 
 # The base for our secret - TODO: temporary, replace with better base later (perhaps store it in the database, and allow it to be updated)
 # Once set up, this should be used to salt the user password to generate our 
@@ -16,6 +20,8 @@ hash_algorithm = 'HS256'
 # Currently 15 minutes
 token_expiration_time = 60 * 15
 
+logger = logging.getLogger(__name__)
+
 def generate_token(json):
 	"""
 	Generates a JWT based on the given payload
@@ -26,7 +32,12 @@ def generate_token(json):
 		String: The encoded JWT as a string
 	"""
 	
-	json['exp'] = datetime.utcnow() + timedelta(seconds=token_expiration_time)
+	now = datetime.utcnow()
+	json['exp'] = now + timedelta(seconds=token_expiration_time)
+	# When the user logged in, refreshed tokens keep it to bound the session (see refresh_token)
+	json['orig_iat'] = calendar.timegm(now.utctimetuple())
+	# Token id, kept by refreshed tokens so revoking it ends the whole session (see common/util/revocation.py)
+	json['jti'] = uuid.uuid4().hex
 	
 	try:
 		token = jwt.encode(json, base_secret, algorithm=hash_algorithm)
@@ -44,9 +55,11 @@ def validate_token(token):
 		token (str): The JWT to be validated
 	Returns:
 		Bool: True if the JWT hashes successfully, False if it has been tampered with
+	Raises:
+		InvalidTokenError if the JWT was revoked
 	"""
 	try:
-		jwt.decode(token, base_secret, algorithms=hash_algorithm)
+		payload = jwt.decode(token, base_secret, algorithms=hash_algorithm)
 	except(jwt.exceptions.InvalidSignatureError):
 		# print("Invalid signature in jwt_placeholder.validate_token()!")
 		raise
@@ -56,11 +69,39 @@ def validate_token(token):
 	except(jwt.exceptions.ExpiredSignatureError):
 		# print("Expired token!")
 		raise
-	except Exception as e:
-		print(e)
+	except Exception:
+		logger.warning("Unexpected error validating a JWT", exc_info=True)
 		raise
+	if revocation.is_revoked(payload.get('jti')):
+		raise jwt.exceptions.InvalidTokenError("Token has been revoked")
 	return True
 
+def refresh_token(token, max_session_lifetime):
+	"""
+	Issues a new JWT with a renewed expiration in place of a still valid one, from the claims
+	already in it, so active users don't have to log in (and query the database) every 15 minutes
+	Args:
+		token (str): The JWT to be refreshed
+		max_session_lifetime (int): seconds after logging in the user has to log in again
+	Returns:
+		String: The encoded JWT, expiring at the latest max_session_lifetime seconds after logging in
+	Raises:
+		The exceptions of validate_token, and ExpiredSignatureError when the session is over
+	"""
+	payload = jwt.decode(token, base_secret, algorithms=hash_algorithm)
+	if revocation.is_revoked(payload.get('jti')):
+		raise jwt.exceptions.InvalidTokenError("Token has been revoked")
+	now = datetime.utcnow()
+	orig_iat = payload.get('orig_iat')
+	# Tokens without a login time can't be refreshed, their users log in once more
+	if not isinstance(orig_iat, int):
+		raise jwt.exceptions.InvalidTokenError("Token has no login time")
+	session_end = datetime.utcfromtimestamp(orig_iat) + timedelta(seconds=max_session_lifetime)
+	if session_end <= now:
+		raise jwt.exceptions.ExpiredSignatureError("Session has expired")
+	payload['exp'] = min(now + timedelta(seconds=token_expiration_time), session_end)
+	return jwt.encode(payload, base_secret, algorithm=hash_algorithm)
+
 def grab_token_payload(token):
 	"""
 	Decodes the payload of the JWT - Only call after a token has been validated
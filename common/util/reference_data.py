@@ -0,0 +1,77 @@
+"""
+    Process-wide cache of the read-only reference tables (STVRELT, NATION, STATE).
+    They only change through fixtures and the admin, so every worker keeps them in
+    memory instead of querying them on each request. Saves and deletes in this
+    process clear the cache at once (see EmergencyAppConfig.ready), other processes
+    pick changes up after settings.EMP_REFERENCE_DATA_TTL seconds.
+"""
+import threading
+import time
+from django.conf import settings
+from emergency_app.models.relation import Relation
+from emergency_app.models.nation import Nation
+from emergency_app.models.state import State
+
+# Cached tables, by name
+RELATIONS = 'relations'
+NATIONS = 'nations'
+STATES = 'states'
+
+reference_models = {
+    RELATIONS: Relation,
+    NATIONS: Nation,
+    STATES: State,
+}
+
+# name -> (loaded at, rows, primary keys)
+_cache = {}
+_lock = threading.Lock()
+
+
+def _entry(name):
+    entry = _cache.get(name)
+    if entry is None or time.monotonic() - entry[0] > settings.EMP_REFERENCE_DATA_TTL:
+        with _lock:
+            model = reference_models[name]
+            rows = list(model.objects.values())
+            pk_name = model._meta.pk.name
+            entry = (time.monotonic(), rows, frozenset(row[pk_name] for row in rows))
+            _cache[name] = entry
+    return entry
+
+
+def values(name):
+    """
+    Returns every row of a reference table
+    Args:
+            name (String): RELATIONS, NATIONS or STATES
+    Returns:
+            list: dicts of the row values, shared between callers so don't modify them
+    """
+    return _entry(name)[1]
+
+
+def codes(name):
+    """
+    Returns the primary keys of a reference table, for validating codes without a query
+    Args:
+            name (String): RELATIONS, NATIONS or STATES
+    Returns:
+            frozenset: the codes
+    """
+    return _entry(name)[2]
+
+
+def load():
+    """
+    Loads every reference table, e.g. before forking workers so they share the pages
+    """
+    for name in reference_models:
+        _entry(name)
+
+
+def clear(**kwargs):
+    """
+    Empties the cache, connected to the save and delete signals of the reference models
+    """
+    _cache.clear()
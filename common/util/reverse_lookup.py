@@ -0,0 +1,188 @@
+"""
+    Reverse lookup of people by phone number or email address, for bounce and STOP processing.
+    Uses the normalized, indexed *_key columns of ZGBNNN and SPREMRG instead of scanning
+    the free-text address columns. Addresses aren't keyed by pidm, so every shard is searched.
+"""
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from common.util import sanitization
+from common.util import change_log
+from common.util import evacuation_roster
+from common.util import emergency_profile
+from common.util import sharding
+from emergency_app.models.change_log import ChangeLog
+from emergency_app.models.contact import Contact
+from emergency_app.models.emergency import Emergency
+
+# Address kinds
+PHONE = 'phone'
+EMAIL = 'email'
+
+# Provider report kinds: an email that bounced, or a STOP reply to a text message
+BOUNCE = 'bounce'
+STOP = 'stop'
+
+# ZGBNNN lookup key -> the address column it is derived from
+emergency_phone_keys = {
+    'primary_phone_key': 'primary_phone',
+    'alternate_phone_key': 'alternate_phone',
+    'sms_device_key': 'sms_device',
+}
+
+
+def normalize_address(address):
+    """
+    Normalizes an address reported by a provider
+    Args:
+            address (String): An email address, or a phone number (ideally E.164, e.g. +15035552345)
+    Returns:
+            tuple: (EMAIL or PHONE, normalized key), the key is None if the address is empty
+    """
+    if '@' in (address or ''):
+        return EMAIL, sanitization.normalize_email(address)
+    return PHONE, sanitization.normalize_phone(address)
+
+
+def find(phone_keys, email_keys, chunk_size=500):
+    """
+    Finds every ZGBNNN and SPREMRG row using any of the given addresses
+    Args:
+            phone_keys (iterable): normalized phone numbers
+            email_keys (iterable): normalized email addresses
+            chunk_size (int): amount of keys per IN query (sqlite allows 999 parameters)
+    Returns:
+            dict: key -> list of {"table", "pidm", "row_key", "field"} matches
+    """
+    matches = {}
+    phone_keys = list(set(phone_keys))
+    email_keys = list(set(email_keys))
+
+    def add(key, table, pidm, row_key, field):
+        matches.setdefault(key, []).append({'table': table, 'pidm': pidm, 'row_key': row_key, 'field': field})
+
+    for alias in sharding.shard_aliases():
+        emergencies, contacts = Emergency.objects.using(alias), Contact.objects.using(alias)
+        for start in range(0, len(phone_keys), chunk_size):
+            chunk = phone_keys[start:start + chunk_size]
+            for key_field, field in emergency_phone_keys.items():
+                for pidm, key in emergencies.filter(**{key_field + '__in': chunk}).values_list('pidm', key_field):
+                    add(key, Emergency._meta.db_table, pidm, pidm, field)
+            for surrogate_id, pidm, key in contacts.filter(phone_key__in=chunk).values_list('surrogate_id', 'pidm', 'phone_key'):
+                add(key, Contact._meta.db_table, pidm, surrogate_id, 'phone_number')
+
+        for start in range(0, len(email_keys), chunk_size):
+            chunk = email_keys[start:start + chunk_size]
+            for pidm, key in emergencies.filter(external_email_key__in=chunk).values_list('pidm', 'external_email_key'):
+                add(key, Emergency._meta.db_table, pidm, pidm, 'external_email')
+
+    return matches
+
+
+def lookup(address):
+    """
+    Finds every row using one address
+    Returns:
+            list: {"table", "pidm", "row_key", "field"} matches
+    """
+    kind, key = normalize_address(address)
+    if key is None:
+        return []
+    if kind == EMAIL:
+        return find([], [key]).get(key, [])
+    return find([key], []).get(key, [])
+
+
+def apply_reports(reports, chunk_size=500, dry_run=False):
+    """
+    Applies provider reports: a STOP opts the number out of text messages (sms_status_ind 'Y'),
+    a bounce removes the external email. Each chunk is written in one transaction per shard with its change log entries.
+    Args:
+            reports (iterable): (address, BOUNCE or STOP) pairs
+            chunk_size (int): amount of addresses per IN query and per transaction
+            dry_run (bool): only count what would change
+    Returns:
+            dict: counts of "reports", "unknown" addresses, "opted_out" and "emails_removed" people
+    """
+    summary = {'reports': 0, 'unknown': 0, 'opted_out': 0, 'emails_removed': 0}
+    stops, bounces = set(), set()
+    for address, kind in reports:
+        summary['reports'] += 1
+        key = normalize_address(address)[1]
+        if key is None:
+            summary['unknown'] += 1
+        elif kind == STOP:
+            stops.add(key)
+        else:
+            bounces.add(key)
+
+    stops, bounces = sorted(stops), sorted(bounces)
+    for start in range(0, max(len(stops), len(bounces)), chunk_size):
+        stop_chunk = stops[start:start + chunk_size]
+        bounce_chunk = bounces[start:start + chunk_size]
+        stop_keys, bounce_keys = set(stop_chunk), set(bounce_chunk)
+        for alias in sharding.shard_aliases():
+            emergencies = Emergency.objects.using(alias)
+            with transaction.atomic(using=alias):
+                # One instance per person, someone with both a STOP and a bounce gets both changes in one UPDATE
+                reported = list(emergencies.filter(
+                    Q(sms_device_key__in=stop_chunk) & ~Q(sms_status_ind='Y') | Q(external_email_key__in=bounce_chunk)))
+                now = timezone.now()
+                changes = []
+                for emergency in reported:
+                    changed = {}
+                    if emergency.sms_device_key in stop_keys and emergency.sms_status_ind != 'Y':
+                        # Opting out empties the device number, as set_emergency_notifications does
+                        emergency.sms_status_ind, emergency.sms_device = 'Y', None
+                        changed.update(sms_status_ind='Y', sms_device=None)
+                        summary['opted_out'] += 1
+                    if emergency.external_email_key in bounce_keys:
+                        emergency.external_email = None
+                        changed['external_email'] = None
+                        summary['emails_removed'] += 1
+                    emergency.activity_date = now
+                    # Bumped in the UPDATE, so a user editing the same row gets a conflict
+                    emergency.version = F('version') + 1
+                    emergency.update_lookup_keys()
+                    changes.append(change_log.entry(emergency, emergency.pidm, change_log.UPDATE, changed))
+                if dry_run or not reported:
+                    continue
+
+                emergencies.bulk_update(reported, ['sms_status_ind', 'sms_device', 'external_email', 'activity_date', 'version']
+                                        + Emergency.lookup_key_fields)
+                ChangeLog.objects.using(alias).bulk_create(changes)
+                # Opting out and bounces change contact details shown on the evacuation roster and profiles
+                written = [emergency.pidm for emergency in reported]
+                evacuation_roster.sync_many(written, alias)
+                emergency_profile.sync_many(written, alias)
+
+    return summary
+
+
+def backfill(model, compute_keys, key_fields, batch_size=1000, using='default'):
+    """
+    Recomputes the lookup keys of every row, in primary key order batches
+    Args:
+            model (Model class): Contact or Emergency, or their historical version inside a migration
+            compute_keys (function): sets the key fields on one row
+            key_fields (list): the fields compute_keys sets
+            batch_size (int): rows read and written per batch
+            using (str): the shard whose rows are updated
+    Returns:
+            int: amount of rows updated
+    """
+    pk_name = model._meta.pk.name
+    updated = 0
+    last_pk = None
+    while True:
+        rows = model.objects.using(using).order_by(pk_name)
+        if last_pk is not None:
+            rows = rows.filter(**{pk_name + '__gt': last_pk})
+        rows = list(rows[:batch_size])
+        if not rows:
+            return updated
+        for row in rows:
+            compute_keys(row)
+        model.objects.using(using).bulk_update(rows, key_fields)
+        updated += len(rows)
+        last_pk = rows[-1].pk
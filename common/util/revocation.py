@@ -0,0 +1,182 @@
+"""
+    Revocation of JWTs before they expire (logging out).
+    Revoked token ids (the jti claim) are stored in REVOKED_TOKEN, and every process mirrors them
+    in a Bloom filter: checking a token that isn't revoked, nearly every request, reads a few bits
+    of memory instead of querying the database. Only the rare token the filter reports as possibly
+    revoked is looked up. Processes read the revocations made since the last one they have seen every
+    settings.EMP_REVOCATION_REFRESH_INTERVAL seconds, and rebuild the filter from the unexpired ones every
+    settings.EMP_REVOCATION_RELOAD_INTERVAL seconds, which also picks up revocations committed out of order.
+"""
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.utils import timezone
+from emergency_app.models.revoked_token import RevokedToken
+
+
+class BloomFilter:
+    """
+    Set of strings that answers "not in it" for certain, and "in it" with a false positive rate
+    Args:
+            capacity (int): strings it holds before exceeding the false positive rate
+            error_rate (float): rate of false positives at capacity
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        # Optimal sizes for the capacity and error rate, about 1.8MB for a million strings at 0.1%
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _hashes(self, value):
+        # Two halves of one digest, combined into hash_count positions (Kirsch-Mitzenmacher)
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+    def add(self, value):
+        first, second = self._hashes(value)
+        for number in range(self.hash_count):
+            position = (first + number * second) % self.size
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        first, second = self._hashes(value)
+        bits, size = self.bits, self.size
+        # Most lookups are misses, which stop at the first unset bit
+        for number in range(self.hash_count):
+            position = (first + number * second) % size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class RevocationList:
+    """
+    One process' mirror of REVOKED_TOKEN
+    Args:
+            capacity (int): revocations the filter holds at its error rate, it is rebuilt when exceeded
+            error_rate (float): rate of valid tokens that are looked up in the database
+            refresh_interval (float): seconds between reads of the new revocations
+            reload_interval (float): seconds between rebuilds of the whole filter
+    """
+
+    def __init__(self, capacity, error_rate, refresh_interval, reload_interval):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh_interval = refresh_interval
+        self.reload_interval = reload_interval
+        self.lock = threading.Lock()
+        self.filter = None
+        self.last_sequence = 0
+        self.refreshed = self.reloaded = 0
+
+    def reload(self):
+        """
+        Rebuilds the filter from every revocation of a token that may still be valid
+        """
+        rows = RevokedToken.objects.filter(expires__gt=timezone.now()).values_list('sequence', 'jti')
+        bloom = BloomFilter(self.capacity, self.error_rate)
+        last_sequence = 0
+        for sequence, jti in rows.iterator():
+            bloom.add(jti)
+            last_sequence = max(last_sequence, sequence)
+        self.filter, self.last_sequence = bloom, last_sequence
+        self.refreshed = self.reloaded = time.monotonic()
+
+    def stale(self):
+        """
+        Returns True when the list wasn't loaded yet or refresh_interval passed since its last refresh
+        """
+        return self.filter is None or time.monotonic() - self.refreshed > self.refresh_interval
+
+    def refresh(self, if_stale=False):
+        """
+        Adds the revocations made since the last refresh, rebuilding the filter when it is due or full
+        Args:
+                if_stale (bool): only refresh if the list is still stale once the lock is taken
+        """
+        with self.lock:
+            if if_stale and not self.stale():
+                # Another thread waiting on the lock refreshed it first
+                return
+            if self.filter is None or time.monotonic() - self.reloaded > self.reload_interval:
+                self.reload()
+                return
+            rows = RevokedToken.objects.filter(sequence__gt=self.last_sequence).values_list('sequence', 'jti')
+            for sequence, jti in rows:
+                self.filter.add(jti)
+                self.last_sequence = max(self.last_sequence, sequence)
+            if self.filter.count > self.capacity:
+                # More revocations than planned for, keep the error rate with a larger filter
+                self.capacity *= 2
+                self.reload()
+            self.refreshed = time.monotonic()
+
+    def is_revoked(self, jti):
+        """
+        Checks a token id, querying the database only when the filter says it may be revoked
+        Args:
+                jti (str): the token's jti claim
+        Returns:
+                bool: True if the token was revoked
+        """
+        if self.stale():
+            self.refresh(if_stale=True)
+        if jti not in self.filter:
+            return False
+        return RevokedToken.objects.filter(jti=jti).exists()
+
+
+_list = None
+_list_lock = threading.Lock()
+
+
+def get_list():
+    """
+    Returns the process-wide revocation list, created from the settings on first use
+    """
+    global _list
+    with _list_lock:
+        if _list is None:
+            _list = RevocationList(settings.EMP_REVOCATION_CAPACITY, settings.EMP_REVOCATION_ERROR_RATE,
+                                   settings.EMP_REVOCATION_REFRESH_INTERVAL, settings.EMP_REVOCATION_RELOAD_INTERVAL)
+        return _list
+
+
+def reset():
+    """
+    Drops the revocation list, the next check reloads it
+    """
+    global _list
+    with _list_lock:
+        _list = None
+
+
+def is_revoked(jti):
+    """
+    Checks a token id against the revocation list, tokens without one can't be revoked
+    """
+    if jti is None:
+        return False
+    return get_list().is_revoked(jti)
+
+
+def revoke(jti, expires):
+    """
+    Revokes every token with an id, including the ones refreshed from it. This process sees it at once,
+    the others within settings.EMP_REVOCATION_REFRESH_INTERVAL seconds.
+    Args:
+            jti (str): the token's jti claim
+            expires (int): timestamp after which none of the tokens is valid, when the revocation is purged
+    """
+    RevokedToken.objects.filter(expires__lte=timezone.now()).delete()
+    RevokedToken.objects.get_or_create(jti=jti, defaults={
+        'expires': datetime.fromtimestamp(expires, dt_timezone.utc),
+    })
+    get_list().refresh()
@@ -1,9 +1,9 @@
+import operator
 import re
+from itertools import compress
 # from https://github.com/seanpianka/Zipcodes
 import zipcodes
-from emergency_app.models.relation import Relation
-from emergency_app.models.nation import Nation
-from emergency_app.models.state import State
+from common.util import reference_data
 
 def validate_email(email):
     """
@@ -58,6 +58,8 @@ def validate_phone_num_usa(phone_num):
     return True
 
 
+zip_format = re.compile('[0-9]{5}(-[0-9]{4})?\\Z')
+
 def validate_zip_usa(zip):
     """
     Validates a zip code in USA
@@ -66,9 +68,13 @@ def validate_zip_usa(zip):
     Returns:
             boolean: True if valid, False otherwise.
     """
-    return bool(zip and zipcodes.is_real(zip))
+    # zipcodes raises on malformed codes and panics on non-ASCII ones, only hand it well formed codes
+    if not zip or not zip_format.match(zip):
+        return False
+    return zipcodes.is_real(zip)
 
-# implementing foreign key for relation, state and nation tables would eliminate the need to validate all
+# SPREMRG has foreign keys to the relation, state and nation tables, these checks turn an unknown code
+# into a validation error instead of an IntegrityError, from the cached codes without a query
 def validate_relation(relt_code):
     """
     Validates a relation code
@@ -77,12 +83,7 @@ def validate_relation(relt_code):
     Returns:
             boolean: True if valid, False otherwise.
     """
-    try:
-        Relation.objects.get(code=relt_code)
-    except Relation.DoesNotExist:
-        return False
-
-    return True
+    return relt_code in reference_data.codes(reference_data.RELATIONS)
 
 
 def validate_state_usa(stat_code):
@@ -93,12 +94,7 @@ def validate_state_usa(stat_code):
     Returns:
             boolean: True if valid, False otherwise.
     """
-    try:
-        State.objects.get(id=stat_code)
-    except State.DoesNotExist:
-        return False
-
-    return True
+    return stat_code in reference_data.codes(reference_data.STATES)
 
 def validate_nation_code(natn_code):
     """
@@ -108,12 +104,7 @@ def validate_nation_code(natn_code):
     Returns:
             boolean: True if valid, False otherwise.
     """
-    try:
-        Nation.objects.get(id=natn_code)
-    except Nation.DoesNotExist:
-        return False
-
-    return True
+    return natn_code in reference_data.codes(reference_data.NATIONS)
 
 def validate_country_phone_code(ctry_code_phone):
     """
@@ -123,12 +114,7 @@ def validate_country_phone_code(ctry_code_phone):
     Returns:
             boolean: True if valid, False otherwise.
     """
-    try:
-        Nation.objects.get(phone_code=ctry_code_phone)
-    except Nation.DoesNotExist:
-        return False
-
-    return True
+    return any(nation['phone_code'] == ctry_code_phone for nation in reference_data.values(reference_data.NATIONS))
 
 def validate_username(username):
     """
@@ -158,3 +144,152 @@ def validate_checkbox(checkbox):
         return True
     else:
         return False
+
+
+# Anything that isn't an ascii digit, stripped when normalizing phone numbers
+non_digits = re.compile('[^0-9]')
+
+def normalize_phone(phone_num, ctry_code_phone=None):
+    """
+    Normalizes a phone number to its E.164 digits (without the leading '+'), for indexed reverse lookups.
+    Numbers starting with '+' are already E.164, other numbers without a country code are taken to be USA numbers.
+    Args:
+            phone_num (String): The phone number in any format, e.g. "503-555-2345"
+            ctry_code_phone (String): The country phone code, e.g. "+1" or "01", None for USA
+    Returns:
+            String: The digits, e.g. "15035552345", or None if there are no digits.
+    """
+    digits = non_digits.sub('', phone_num or '')
+    if not digits:
+        return None
+    if phone_num.lstrip().startswith('+'):
+        return digits
+    country = non_digits.sub('', ctry_code_phone or '').lstrip('0') or '1'
+    if country == '1' and len(digits) == 11 and digits[0] == '1':
+        return digits
+    return country + digits
+
+
+def normalize_email(email):
+    """
+    Normalizes an email address for indexed reverse lookups
+    Args:
+            email (String): The email address
+    Returns:
+            String: The trimmed, lowercased address, or None if empty.
+    """
+    email = (email or '').strip().lower()
+    return email or None
+
+
+
+# Batch validation of bulk loads: each column is checked in one pass with precompiled patterns and set
+# lookups, giving exactly the result of calling the validator above on every value.
+# Non-ASCII values don't fit the patterns and are handed to the single-value validator.
+email_pattern = re.compile('[^@]*@[^@]*\\.[^@]*')
+phone_usa_pattern = re.compile('[2-9][0-9]{7}(?!11)[0-9]{2}')
+username_pattern = re.compile('[A-Za-z0-9_]{2,30}')
+
+# Every real ZIP code, built by the first batch that checks ZIP codes
+_zip_index = None
+
+
+def zip_index():
+    global _zip_index
+    if _zip_index is None:
+        _zip_index = frozenset(row['zip_code'] for row in zipcodes.list_all())
+    return _zip_index
+
+
+def _check_pattern(pattern, validator):
+    def check(values):
+        return [bool(pattern.fullmatch(value)) or (not value.isascii() and validator(value)) for value in values]
+    return check
+
+
+def _check_codes(name):
+    def check(values):
+        codes = reference_data.codes(name)
+        return [value in codes for value in values]
+    return check
+
+
+def _check_zips(values):
+    index = zip_index()
+    return [bool(zip_format.match(value)) and value[:5] in index for value in values]
+
+
+def _check_checkboxes(values):
+    return [value == 'Y' or value == 'N' for value in values]
+
+
+# Kind of column -> (check of a whole column, single-value validator it matches, error message)
+batch_validators = {
+    'email': (_check_pattern(email_pattern, validate_email), validate_email, "Invalid email"),
+    'phone_usa': (_check_pattern(phone_usa_pattern, validate_phone_num_usa), validate_phone_num_usa, "Invalid phone number"),
+    'zip_usa': (_check_zips, validate_zip_usa, "Invalid zip code"),
+    'relation': (_check_codes(reference_data.RELATIONS), validate_relation, "Invalid relation code"),
+    'state_usa': (_check_codes(reference_data.STATES), validate_state_usa, "Invalid state code"),
+    'nation_code': (_check_codes(reference_data.NATIONS), validate_nation_code, "Invalid nation code"),
+    'username': (_check_pattern(username_pattern, validate_username), validate_username, "Invalid username"),
+    'checkbox': (_check_checkboxes, validate_checkbox, "Invalid checkbox value"),
+}
+
+
+class BatchResult:
+    """
+    Outcome of validate_columns(). bitmaps[row] has bit i set when columns[i] is invalid in that row.
+    """
+
+    def __init__(self, columns, bitmaps, messages):
+        self.columns = columns
+        self.bitmaps = bitmaps
+        self.messages = messages
+
+    def invalid_rows(self):
+        return [row for row, bitmap in enumerate(self.bitmaps) if bitmap]
+
+    def errors(self, row):
+        """
+        Returns:
+                dict: column -> error message, for the invalid columns of one row
+        """
+        bitmap = self.bitmaps[row]
+        return {column: self.messages[i] for i, column in enumerate(self.columns) if bitmap >> i & 1}
+
+    def as_dict(self):
+        """
+        Returns:
+                dict: row -> errors(row), for every invalid row
+        """
+        return {row: self.errors(row) for row in self.invalid_rows()}
+
+
+def validate_columns(columns, kinds, optional=()):
+    """
+    Validates a batch of rows given as columns, one column at a time
+    Args:
+            columns (dict): column name -> list of values (strings, None counts as ''), all the same length
+            kinds (dict): column name -> kind of validation, a key of batch_validators
+            optional (collection): columns whose empty values ('' and None) are valid
+    Returns:
+            BatchResult: per row bitmap of the invalid columns, and their messages
+    Raises:
+            ValueError: if the columns aren't all the same length
+    """
+    names = list(kinds)
+    lengths = {len(columns[name]) for name in names}
+    if len(lengths) > 1:
+        raise ValueError("Columns have different lengths: %s" % sorted(lengths))
+    bitmaps = [0] * (lengths.pop() if lengths else 0)
+
+    for i, name in enumerate(names):
+        check = batch_validators[kinds[name]][0]
+        values = ['' if value is None else value for value in columns[name]]
+        bit = 1 << i
+        skip_empty = name in optional
+        # Only the invalid rows are visited, usually a small share of the batch
+        for row in compress(range(len(values)), map(operator.not_, check(values))):
+            if not (skip_empty and values[row] == ''):
+                bitmaps[row] |= bit
+    return BatchResult(names, bitmaps, [batch_validators[kinds[name]][2] for name in names])
@@ -0,0 +1,319 @@
+"""
+    Hash sharding of the per-person tables (SPREMRG, ZGBNNN and their EMERGENCY_PROFILE and
+    EVACUATION_ROSTER rows) by pidm. settings.EMP_SHARDS is the shard map, the database aliases in
+    order, and each pidm's rows live on the shard a consistent hash of the pidm picks, so growing the
+    map only moves the people that land on the new shards (see the rebalance_shards command). A write
+    is one transaction on the person's shard, change log entry and durable tasks included: each shard
+    keeps its entries until change_log.relay() moves them to the default database's feed, and its own
+    TASK_QUEUE, which run_task_worker polls. Everything else (ZGBIDMP, which finds a username's pidm,
+    revocations) stays on the default database, which is also the first shard. The reference tables
+    are copied to every shard for the foreign keys.
+
+    Per-person queries name their shard, Contact.objects.using(shard_for(pidm)), and code that spans
+    people (exports, batch lookups, bounce processing, dispatch) scatters over shard_aliases() or
+    group_by_shard(). ShardRouter only places instances by their own pidm (save(), related lookups):
+    a query on a sharded table that names no database raises UnknownShard instead of silently reading
+    the default database. With a single shard, everything goes to the default database as before.
+
+    Surrogate ids (SPREMRG_SURROGATE_ID) must stay unique across the shards, they identify rows in the
+    change log, the export and for the Banner sync, and a move keeps them. With several shards new rows are
+    numbered from one sequence on the default database (SURROGATE_SEQUENCE) instead of each shard's own.
+"""
+import hashlib
+from django.apps import apps
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max
+
+# Models whose rows are placed by pidm, and the ones copied to every shard
+sharded_models = frozenset(['emergency_app.contact', 'emergency_app.emergency', 'emergency_app.emergencyprofile',
+                            'emergency_app.evacuationroster'])
+replicated_models = frozenset(['emergency_app.relation', 'emergency_app.nation', 'emergency_app.state'])
+
+# Sharded models built from the others, a move replaces the copy a read may have built on the target
+derived_models = frozenset(['emergency_app.emergencyprofile', 'emergency_app.evacuationroster'])
+
+# Sharded models with a surrogate id, numbered from the shared sequence when there are several shards
+sequenced_models = frozenset(['emergency_app.contact'])
+
+# Models every shard has its own table of, not placed by the router (the change log's outbox, the task queue)
+shard_local_models = frozenset(['emergency_app.changelog', 'emergency_app.task'])
+
+
+class UnknownShard(Exception):
+    """
+    Raised for a query on a sharded table that doesn't say which shard it is for
+    """
+
+
+class SurrogateIdCollision(Exception):
+    """
+    Raised by move() when people's surrogate ids are used by someone else's rows on the target shard
+    """
+
+    def __init__(self, pidms, source, target):
+        self.pidms = pidms
+        super(SurrogateIdCollision, self).__init__(
+            "Surrogate ids of pidms %s on %s are used by other people's rows on %s"
+            % (', '.join(str(pidm) for pidm in pidms), source, target))
+
+
+def shard_aliases():
+    """
+    Returns the shard map, the database aliases of the shards in order
+    """
+    return settings.EMP_SHARDS
+
+
+def jump_hash(key, buckets):
+    """
+    Jump consistent hash (Lamping and Veach): maps a 64 bit key to one of buckets, and growing
+    buckets from n to n + 1 only moves 1/(n + 1) of the keys, all to the new bucket
+    """
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return bucket
+
+
+def shard_for(pidm):
+    """
+    Returns the database alias of the shard a person's rows live on
+    Args:
+            pidm (int): the person
+    Returns:
+            str: an alias of settings.EMP_SHARDS
+    """
+    aliases = shard_aliases()
+    if len(aliases) == 1:
+        return aliases[0]
+    # Sequential pidms are spread by a stable digest, Python's hash() changes between processes
+    key = int.from_bytes(hashlib.blake2b(str(int(pidm)).encode('ascii'), digest_size=8).digest(), 'little')
+    return aliases[jump_hash(key, len(aliases))]
+
+
+def group_by_shard(pidms):
+    """
+    Splits pidms by the shard their rows live on, for scatter-gather queries
+    Args:
+            pidms (iterable): people to look up
+    Returns:
+            dict: alias -> list of pidms, in the order given, only shards with people on them
+    """
+    groups = {}
+    for pidm in pidms:
+        groups.setdefault(shard_for(pidm), []).append(pidm)
+    return groups
+
+
+def highest_surrogate_id(model):
+    """
+    Returns the highest surrogate id of a sharded model on any shard, 0 if it has no rows
+    """
+    highest = 0
+    for alias in shard_aliases():
+        highest = max(highest, model.objects.using(alias).aggregate(highest=Max('pk'))['highest'] or 0)
+    return highest
+
+
+def allocate_surrogate_ids(model, count):
+    """
+    Draws surrogate ids for new rows from the sequence on the default database that every shard shares.
+    The sequence starts above the highest id on any shard the first time it is used.
+    Args:
+            model (Model class): Contact
+            count (int): amount of ids
+    Returns:
+            range: the ids, unused on every shard
+    """
+    sequences = apps.get_model('emergency_app', 'SurrogateSequence').objects.using('default')
+    name = model._meta.db_table
+    with transaction.atomic(using='default'):
+        # The UPDATE locks the row until the transaction ends, so concurrent writers draw disjoint ranges
+        if not sequences.filter(name=name).update(last_value=F('last_value') + count):
+            try:
+                with transaction.atomic(using='default'):
+                    sequences.create(name=name, last_value=highest_surrogate_id(model) + count)
+            except IntegrityError:
+                # Another writer started the sequence first
+                sequences.filter(name=name).update(last_value=F('last_value') + count)
+        last_value = sequences.values_list('last_value', flat=True).get(name=name)
+    return range(last_value - count + 1, last_value + 1)
+
+
+def assign_surrogate_ids(rows):
+    """
+    Numbers new rows (no primary key yet) from the shared sequence when there are several shards.
+    With a single shard the column's own sequence numbers them on insert, as before.
+    Args:
+            rows (list): unsaved Contact instances
+    Returns:
+            bool: True if the rows were given ids, save them with force_insert
+    """
+    rows = [row for row in rows if row.pk is None]
+    if len(shard_aliases()) == 1 or not rows:
+        return False
+    for row, pk in zip(rows, allocate_surrogate_ids(type(rows[0]), len(rows))):
+        row.pk = pk
+    return True
+
+
+def advance_surrogate_sequences():
+    """
+    Moves the shared sequences past the highest surrogate id on any shard, after rows were loaded without
+    drawing from them (fixtures, Banner)
+    Returns:
+            dict: sequence name -> its last value
+    """
+    sequences = apps.get_model('emergency_app', 'SurrogateSequence').objects.using('default')
+    advanced = {}
+    for label in sorted(sequenced_models):
+        model = apps.get_model(label)
+        name = model._meta.db_table
+        with transaction.atomic(using='default'):
+            highest = highest_surrogate_id(model)
+            sequence, created = sequences.select_for_update().get_or_create(name=name, defaults={'last_value': highest})
+            if sequence.last_value < highest:
+                sequence.last_value = highest
+                sequence.save(using='default')
+        advanced[name] = sequence.last_value
+    return advanced
+
+
+def copy_reference_tables(alias):
+    """
+    Brings a shard's copy of the reference tables in line with the default database's.
+    Codes no longer on default are kept, contacts on the shard may still reference them.
+    Args:
+            alias (str): the shard
+    Returns:
+            int: amount of rows written
+    """
+    written = 0
+    for label in sorted(replicated_models):
+        model = apps.get_model(label)
+        rows = list(model.objects.using('default').all())
+        existing = set(model.objects.using(alias).values_list('pk', flat=True))
+        fields = [field.name for field in model._meta.concrete_fields if not field.primary_key]
+        with transaction.atomic(using=alias):
+            model.objects.using(alias).bulk_create([row for row in rows if row.pk not in existing])
+            model.objects.using(alias).bulk_update([row for row in rows if row.pk in existing], fields)
+        written += len(rows)
+    return written
+
+
+def replicate(sender, instance, using, **kwargs):
+    """
+    post_save receiver of the reference tables: copies a row saved on the default database to the other
+    shards, saving it there too so their receivers run (e.g. rebuilding the profiles using it).
+    Not while loaddata saves a fixture (raw), rebalance_shards copies the tables once it is loaded.
+    """
+    if kwargs.get('raw') or using != 'default':
+        return
+    values = {field.attname: getattr(instance, field.attname) for field in sender._meta.concrete_fields if not field.primary_key}
+    for alias in shard_aliases()[1:]:
+        sender.objects.using(alias).update_or_create(pk=instance.pk, defaults=values)
+
+
+def misplaced_pidms():
+    """
+    Finds the people whose rows aren't on the shard the shard map places them on, e.g. after adding shards
+    Returns:
+            dict: (current shard, shard they belong on) -> sorted list of pidms
+    """
+    moves = {}
+    for alias in shard_aliases():
+        pidms = set()
+        for label in sorted(sharded_models):
+            pidms.update(apps.get_model(label).objects.using(alias).values_list('pidm', flat=True).distinct())
+        for pidm in pidms:
+            target = shard_for(pidm)
+            if target != alias:
+                moves.setdefault((alias, target), []).append(pidm)
+    return {shards: sorted(pidms) for shards, pidms in moves.items()}
+
+
+def colliding_pidms(pidms, source, target):
+    """
+    Finds the people whose surrogate ids are used by someone else's rows on the target shard, move() refuses
+    to move them. Rows the target already has with the same id and pidm are copies an interrupted move left.
+    Args:
+            pidms (list): the people
+            source (str), target (str): the shards
+    Returns:
+            list: sorted pidms
+    """
+    colliding = set()
+    for label in sorted(sequenced_models):
+        model = apps.get_model(label)
+        owners = dict(model.objects.using(source).filter(pidm__in=pidms).values_list('pk', 'pidm'))
+        for pk, pidm in model.objects.using(target).filter(pk__in=list(owners)).values_list('pk', 'pidm'):
+            if pidm != owners[pk]:
+                colliding.add(owners[pk])
+    return sorted(colliding)
+
+
+def move(pidms, source, target):
+    """
+    Moves people's SPREMRG, ZGBNNN and profile rows from one shard to another, keeping their primary keys.
+    The rows are committed on the target before they are deleted from the source, so a failure in between
+    leaves them on both shards. misplaced_pidms() still lists the people, and moving them again removes the
+    source's copies.
+    Args:
+            pidms (list): the people
+            source (str), target (str): the shards
+    Raises:
+            SurrogateIdCollision: if one of their surrogate ids is used on the target, nothing is moved
+    """
+    colliding = colliding_pidms(pidms, source, target)
+    if colliding:
+        raise SurrogateIdCollision(colliding, source, target)
+    models = [apps.get_model(label) for label in sorted(sharded_models)]
+    rows = {model: list(model.objects.using(source).filter(pidm__in=pidms)) for model in models}
+    with transaction.atomic(using=target):
+        for model, model_rows in rows.items():
+            if model._meta.label_lower in derived_models:
+                model.objects.using(target).filter(pidm__in=pidms).delete()
+                copied = set()
+            else:
+                # Left on the target by an interrupted move, or written there since, the target's copy is current
+                copied = set(model.objects.using(target).filter(pk__in=[row.pk for row in model_rows]).values_list('pk', flat=True))
+            model.objects.using(target).bulk_create([row for row in model_rows if row.pk not in copied])
+    with transaction.atomic(using=source):
+        for model, model_rows in rows.items():
+            model.objects.using(source).filter(pk__in=[row.pk for row in model_rows]).delete()
+
+
+class ShardRouter:
+    """
+    Database router placing SPREMRG, ZGBNNN and profile rows on the shard of their pidm
+    """
+
+    def _shard(self, model, hints):
+        if model._meta.label_lower not in sharded_models or len(shard_aliases()) == 1:
+            return None
+        instance = hints.get('instance')
+        if isinstance(instance, model) and instance.pidm is not None:
+            return shard_for(instance.pidm)
+        raise UnknownShard("%s is sharded by pidm, query it with .using(sharding.shard_for(pidm))" % model._meta.label)
+
+    def db_for_read(self, model, **hints):
+        return self._shard(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._shard(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Contacts reference the copies of the reference tables on their own shard
+        labels = {obj1._meta.label_lower, obj2._meta.label_lower}
+        if labels & sharded_models and labels <= sharded_models | replicated_models:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == 'default' or db not in shard_aliases():
+            return None
+        # The other shards only hold the per-person, change log, task queue and reference tables, data migrations run on default
+        return app_label == 'emergency_app' and '%s.%s' % (app_label, model_name) in sharded_models | shard_local_models | replicated_models
@@ -0,0 +1,238 @@
+"""
+    Structured, non-blocking logging.
+    Records are written as one json object per line, carrying the request id and the pidm of
+    the request they were logged from (see RequestContextMiddleware). The request thread only
+    puts the record on a bounded queue, a background thread formats and writes it, and when the
+    queue is full records are dropped rather than making the request wait. Floods of the same
+    message (e.g. a broken client repeating an invalid submission) are sampled and rate limited
+    per message type. Configured through settings.LOGGING.
+"""
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import weakref
+from logging.handlers import QueueHandler, QueueListener
+
+# Context of the request being handled by this thread, stamped on every record
+context = {
+    'request_id': contextvars.ContextVar('request_id', default=None),
+    'pidm': contextvars.ContextVar('pidm', default=None),
+}
+
+# Attributes every LogRecord has, anything else was passed in extra= and is written as a field
+standard_attributes = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def bind(**values):
+    """
+    Sets context carried by every record logged for the rest of this request
+    Args:
+            request_id (str), pidm (int)
+    Returns:
+            dict: name -> token, give it to reset() to restore the context as it was before
+    """
+    return {name: context[name].set(value) for name, value in values.items()}
+
+
+def reset(tokens):
+    """
+    Restores the context bind() changed, and whatever was bound after it, e.g. when a request ends
+    Args:
+            tokens (dict): what bind() returned
+    """
+    for name, token in tokens.items():
+        try:
+            context[name].reset(token)
+        except ValueError:
+            # Bound in another context, e.g. a server closing a streamed response from another thread
+            context[name].set(None)
+
+
+def message_type(record):
+    # The unformatted message, so "Invalid zip %s" is one type whatever the zip
+    return (record.name, str(record.msg))
+
+
+class ContextFilter(logging.Filter):
+    """
+    Stamps records with the request id and pidm. Runs in the logging thread, where the context is.
+    """
+
+    def filter(self, record):
+        for name, value in context.items():
+            setattr(record, name, value.get())
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps only a fraction of the records of some message types
+    Args:
+            rates (dict): message -> fraction of its records kept, between 0 and 1
+            default (float): fraction kept of every other message
+    """
+
+    def __init__(self, rates=None, default=1.0):
+        super(SamplingFilter, self).__init__()
+        self.rates = rates or {}
+        self.default = default
+
+    def filter(self, record):
+        rate = self.rates.get(str(record.msg), self.default)
+        if rate >= 1:
+            return True
+        record.sample_rate = rate
+        return random.random() < rate
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket per message type: each type may log burst records at once and rate records per
+    second after that. The next record let through reports how many were suppressed in between.
+    """
+
+    def __init__(self, rate=10, burst=20):
+        super(RateLimitFilter, self).__init__()
+        self.rate = rate
+        self.burst = burst
+        self.lock = threading.Lock()
+        # message type -> [tokens, last refill, suppressed]
+        self.buckets = {}
+
+    def filter(self, record):
+        now = time.monotonic()
+        key = message_type(record)
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            if bucket[2]:
+                record.suppressed = bucket[2]
+                bucket[2] = 0
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as one line of json: time, level, logger, message, request_id, pidm,
+    and every field passed in extra=
+    """
+
+    def format(self, record):
+        document = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in standard_attributes:
+                document[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            document['exception'] = record.exc_text
+        return json.dumps(document, default=str)
+
+
+class _Listener(QueueListener):
+
+    def enqueue_sentinel(self):
+        # Wait for room on a full queue, the listener is still draining it
+        self.queue.put(self._sentinel)
+
+
+class BackgroundHandler(QueueHandler):
+    """
+    Puts records on a bounded queue that a background QueueListener writes to a stream,
+    so logging never waits on the stream. Records that don't fit on the queue are dropped,
+    and the next record written reports how many. A forked process (e.g. a worker of the
+    preloading server) gets a listener of its own, threads don't survive the fork.
+    Args:
+            stream: where the listener writes, defaults to sys.stderr
+            queue_size (int): records waiting to be written before new ones are dropped
+    """
+
+    def __init__(self, stream=None, queue_size=10000):
+        super(BackgroundHandler, self).__init__(queue.Queue(queue_size))
+        self.target = logging.StreamHandler(stream or sys.stderr)
+        self.listener = _Listener(self.queue, self.target)
+        self.dropped = 0
+        self.listener.start()
+        self.running = True
+        _handlers.add(self)
+
+    def _after_fork(self):
+        # The parent's listener writes what was queued before the fork, and its queue's lock
+        # may have been held by that thread, so the child starts with a new queue and listener
+        self.queue = queue.Queue(self.queue.maxsize)
+        self.listener = _Listener(self.queue, self.target)
+        self.dropped = 0
+        if self.running:
+            self.listener.start()
+
+    def setFormatter(self, fmt):
+        # Formatting happens on the listener thread, not the logging one
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Only capture what can't wait: the args and exception may change after this returns
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        # Handler.handle() holds the handler's lock, so dropped isn't updated concurrently
+        if self.dropped:
+            record.dropped = self.dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        self.dropped = 0
+
+    def flush(self):
+        """
+        Waits for every record queued so far to be written
+        """
+        if self.running:
+            self.listener.stop()
+            self.listener.start()
+        self.target.flush()
+
+    def close(self):
+        # logging.shutdown() flushes and closes every handler at exit
+        if self.running:
+            self.listener.stop()
+            self.running = False
+        self.target.close()
+        super(BackgroundHandler, self).close()
+
+
+# Every open BackgroundHandler, to restart their listeners in forked processes
+_handlers = weakref.WeakSet()
+
+
+def _restart_listeners():
+    for handler in list(_handlers):
+        handler._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_listeners)
@@ -0,0 +1,242 @@
+"""
+    Background execution of post-commit side effects (vendor sync, confirmation emails, cache warmups).
+    Two ways to run a task, both only once the surrounding transaction commits:
+        enqueue()         - a bounded in-process thread pool, for cheap best-effort work
+        enqueue_durable() - a row in TASK_QUEUE, picked up by `manage.py run_task_worker`,
+                            for work that must survive a restart. Failures are retried with backoff,
+                            and a task whose worker died while running it is claimed again once its
+                            lease (settings.EMP_TASKS_LEASE_SECONDS) expires.
+    No external broker is needed, the durable queue lives in the application database. Writes commit
+    on the person's shard, so pass the shard as using: the task waits for that transaction, and a
+    durable task is written in it, to that shard's TASK_QUEUE, which the worker polls like the others.
+"""
+import importlib
+import json
+import logging
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from emergency_app.models.task import Task
+
+logger = logging.getLogger(__name__)
+
+# Task name -> function, filled in by the @task decorator
+registry = {}
+
+
+def task(func):
+    """
+    Registers a function as a task so it can be enqueued and resolved by name
+    Args:
+            func (function): module level function, its arguments must be json serializable
+    Returns:
+            function: func, unchanged
+    """
+    registry[task_name(func)] = func
+    return func
+
+
+def task_name(func):
+    return func.__module__ + '.' + func.__name__
+
+
+def resolve(name):
+    """
+    Finds a registered task by name, importing its module if this process hasn't yet
+    Raises:
+            LookupError: if the name isn't a registered task
+    """
+    if name not in registry:
+        module_name = name.rpartition('.')[0]
+        try:
+            importlib.import_module(module_name)
+        except ImportError:
+            pass
+    if name not in registry:
+        raise LookupError("%s is not a registered task" % name)
+    return registry[name]
+
+
+class InProcessRunner:
+    """
+    Runs tasks on a bounded thread pool. When max_queue tasks are already waiting,
+    new tasks spill over to the durable queue instead of growing memory without limit.
+    """
+
+    def __init__(self, max_workers, max_queue):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='emp-task')
+        self.slots = threading.BoundedSemaphore(max_queue)
+
+    def submit(self, name, args, kwargs):
+        if not self.slots.acquire(blocking=False):
+            logger.warning("In-process task queue is full, sending %s to the durable queue", name)
+            _insert(name, args, kwargs)
+            return
+        self.executor.submit(self._run, name, args, kwargs)
+
+    def _run(self, name, args, kwargs):
+        try:
+            run_in_process(name, args, kwargs)
+        finally:
+            self.slots.release()
+            # Connections are per thread, don't leave this worker thread's open
+            connections.close_all()
+
+
+def run_in_process(name, args, kwargs):
+    """
+    Runs a task right away, handing a failure to the durable queue, whose worker retries it with backoff
+    """
+    try:
+        resolve(name)(*args, **kwargs)
+    except Exception:
+        logger.exception("Task %s failed in-process, retrying from the durable queue", name)
+        _insert(name, args, kwargs, attempts=1, last_error=traceback.format_exc())
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_runner():
+    """
+    Returns the process-wide in-process runner, created on first use
+    """
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = InProcessRunner(settings.EMP_TASKS_MAX_WORKERS, settings.EMP_TASKS_MAX_QUEUE)
+        return _runner
+
+
+def enqueue(func, *args, using='default', **kwargs):
+    """
+    Runs a task on the in-process thread pool once the current transaction of the database using
+    commits (immediately when there is no transaction). Nothing runs if the transaction rolls back.
+    Args:
+            func (function): a function decorated with @task
+            *args, **kwargs: json serializable arguments for func
+            using (str): the database whose transaction the task waits for, e.g. the person's shard
+    """
+    name = task_name(func)
+    if settings.EMP_TASKS_ALWAYS_EAGER:
+        transaction.on_commit(lambda: run_in_process(name, args, kwargs), using=using)
+    else:
+        transaction.on_commit(lambda: get_runner().submit(name, args, kwargs), using=using)
+
+
+def enqueue_durable(func, *args, using='default', **kwargs):
+    """
+    Adds a task to the durable queue. The row is written in the current transaction of the
+    database using, so the worker only ever sees tasks whose transaction committed.
+    Args:
+            func (function): a function decorated with @task
+            *args, **kwargs: json serializable arguments for func
+            using (str): the database whose transaction writes the task, e.g. the person's shard
+    Returns:
+            Task: the queued row
+    """
+    return _insert(task_name(func), args, kwargs, using=using)
+
+
+def _insert(name, args, kwargs, attempts=0, last_error=None, using='default'):
+    return Task.objects.using(using).create(
+        name=name,
+        arguments=json.dumps([list(args), kwargs], cls=DjangoJSONEncoder),
+        attempts=attempts,
+        last_error=last_error,
+        run_after=timezone.now(),
+    )
+
+
+def backoff(attempts):
+    """
+    Delay before the next attempt: exponential on the attempt count, capped at settings.EMP_TASKS_MAX_BACKOFF_SECONDS
+    """
+    seconds = settings.EMP_TASKS_BACKOFF_SECONDS * (2 ** (attempts - 1))
+    return timedelta(seconds=min(seconds, settings.EMP_TASKS_MAX_BACKOFF_SECONDS))
+
+
+def claim_due(limit, max_attempts, using='default'):
+    """
+    Claims up to limit due tasks of one database's queue for this worker. The claim is a conditional
+    update on the status, so two workers polling the same queue never run the same task.
+    Running tasks not finished within settings.EMP_TASKS_LEASE_SECONDS are taken to belong to a
+    worker that died, and are claimed again, counting the lost run as a failed attempt, or marked
+    failed when that was their last attempt. The claim's activity_date is the lease.
+    Args:
+            limit (int): most tasks to claim
+            max_attempts (int): attempts before a task is marked failed
+            using (str): the database, one of sharding.shard_aliases()
+    Returns:
+            list: the claimed Task rows
+    """
+    now = timezone.now()
+    queue = Task.objects.using(using)
+    pending = Q(status=Task.PENDING, run_after__lte=now)
+    expired = Q(status=Task.RUNNING, activity_date__lt=now - timedelta(seconds=settings.EMP_TASKS_LEASE_SECONDS))
+    due = queue.filter(pending | expired).order_by('run_after', 'id')
+    claimed = []
+    lost = "Lease expired, the worker running the task died or took too long"
+    for task_id, status, attempts in due.values_list('id', 'status', 'attempts')[:limit]:
+        if status == Task.PENDING:
+            won = queue.filter(pending, id=task_id).update(status=Task.RUNNING, activity_date=now)
+        elif attempts + 1 >= max_attempts:
+            # A task that keeps killing its worker isn't run again
+            if queue.filter(expired, id=task_id, attempts=attempts).update(
+                    status=Task.FAILED, activity_date=now, attempts=attempts + 1, last_error=lost):
+                logger.error("Task %d lease expired on its last attempt, failed for good after %d attempts",
+                             task_id, attempts + 1)
+            won = False
+        else:
+            won = queue.filter(expired, id=task_id).update(
+                activity_date=now, attempts=F('attempts') + 1, last_error=lost)
+            if won:
+                logger.warning("Task %d lease expired, running it again", task_id)
+        if won:
+            claimed.append(task_id)
+    return list(queue.filter(id__in=claimed).order_by('run_after', 'id'))
+
+
+def run_durable(queued, max_attempts):
+    """
+    Runs one claimed task, then marks it done, reschedules it with backoff, or gives up after max_attempts
+    Args:
+            queued (Task): a claimed row
+            max_attempts (int): attempts before the task is marked failed
+    Returns:
+            bool: True if the task succeeded
+    """
+    try:
+        args, kwargs = json.loads(queued.arguments)
+        resolve(queued.name)(*args, **kwargs)
+    except Exception:
+        attempts = queued.attempts + 1
+        if attempts >= max_attempts:
+            logger.error("Task %s (%d) failed for good after %d attempts", queued.name, queued.id, attempts)
+            _finish(queued, status=Task.FAILED, attempts=attempts, last_error=traceback.format_exc())
+        else:
+            _finish(queued, status=Task.PENDING, attempts=attempts, last_error=traceback.format_exc(),
+                    run_after=timezone.now() + backoff(attempts))
+        return False
+
+    _finish(queued, status=Task.DONE, attempts=queued.attempts + 1)
+    return True
+
+
+def _finish(queued, **fields):
+    """
+    Records the outcome of a run, only while this worker still holds the lease: once it expired, the
+    task was claimed again (with a new activity_date) and the new claimer's state is kept
+    """
+    held = Task.objects.using(queued._state.db).filter(id=queued.id, status=Task.RUNNING,
+                                                       activity_date=queued.activity_date)
+    if not held.update(activity_date=timezone.now(), **fields):
+        logger.warning("Task %s (%d) lease expired while it ran, leaving it to the worker that claimed it again",
+                       queued.name, queued.id)
@@ -0,0 +1 @@
+default_app_config = 'emergency_app.apps.EmergencyAppConfig'
@@ -0,0 +1,306 @@
+"""
+    Admission control, so a surge (everyone opening the app when an alert goes out) degrades into
+    fast 503s instead of every request timing out.
+    Each endpoint belongs to a class (settings.EMP_ADMISSION_ENDPOINTS), configured in
+    settings.EMP_ADMISSION_CLASSES with:
+        limit       - requests of the class in flight in this process
+        queue       - requests waiting for a slot, further ones are shed right away
+        timeout     - seconds a request may wait for a slot before it is shed
+        retry_after - seconds shed clients are told to wait (Retry-After header)
+    The process as a whole runs at most settings.EMP_ADMISSION_MAX_IN_FLIGHT requests. The classes are
+    listed in priority order: when the process is full, freed slots go to the waiting requests of the
+    first class, so writes and reads get through while reference data, which clients cache, is shed first.
+    A request that already waited longer than settings.EMP_ADMISSION_MAX_UPSTREAM_WAIT in the load
+    balancer's queue (X-Request-Start header) is shed before doing any work, its client has likely given up.
+    Counters are kept per class and returned by getAdmissionCounters/.
+    The limits are per process and only matter when the process runs requests concurrently: the
+    workers must be threaded (e.g. gunicorn --threads) with more threads than MAX_IN_FLIGHT, the extra
+    ones being where requests wait for a slot or are shed. A sync worker runs one request at a time,
+    so nothing ever queues or is shed here, which is logged once.
+"""
+import logging
+import threading
+import time
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.deprecation import MiddlewareMixin
+
+logger = logging.getLogger(__name__)
+
+http_service_unavailable_response = 503
+
+# Set by the load balancer, e.g. nginx's "t=${msec}": when it received the request
+upstream_header = 'HTTP_X_REQUEST_START'
+
+
+class EndpointClass:
+    """
+    Limits and counters of one class of endpoints, guarded by the controller's lock
+    """
+
+    def __init__(self, name, priority, lock, limit, queue, timeout, retry_after):
+        self.name = name
+        self.priority = priority
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.condition = threading.Condition(lock)
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+        self.timed_out = 0
+        self.stale = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def as_dict(self):
+        return {
+            'limit': self.limit,
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'admitted': self.admitted,
+            'queued': self.queued,
+            'shed': self.shed,
+            'timed_out': self.timed_out,
+            'stale': self.stale,
+            'wait_seconds': round(self.wait_seconds, 6),
+            'max_wait_seconds': round(self.max_wait_seconds, 6),
+        }
+
+
+class AdmissionController:
+    """
+    Counts the requests in flight per class and in the whole process, and decides which may run
+    Args:
+            classes (dict): class name -> limit, queue, timeout and retry_after, in priority order
+            max_in_flight (int): requests in flight in the whole process
+    """
+
+    def __init__(self, classes, max_in_flight):
+        self.lock = threading.Lock()
+        self.classes = {
+            name: EndpointClass(name, priority, self.lock, **config)
+            for priority, (name, config) in enumerate(classes.items())
+        }
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+
+    def _has_slot(self, endpoint_class):
+        return endpoint_class.in_flight < endpoint_class.limit and self.in_flight < self.max_in_flight
+
+    def _yields_to(self, endpoint_class, ahead):
+        # Whether waiting requests of a class before endpoint_class (ahead=True: or of the same class)
+        # could take the slot
+        for other in self.classes.values():
+            if other.priority > endpoint_class.priority or (other is endpoint_class and not ahead):
+                break
+            if other.waiting and self._has_slot(other):
+                return True
+        return False
+
+    def _wake(self):
+        # Hands a free slot to the first class, in priority order, with a request waiting for it
+        for endpoint_class in self.classes.values():
+            if endpoint_class.waiting and self._has_slot(endpoint_class):
+                endpoint_class.condition.notify()
+                return
+
+    def _start(self, endpoint_class, waited):
+        endpoint_class.in_flight += 1
+        endpoint_class.admitted += 1
+        endpoint_class.wait_seconds += waited
+        endpoint_class.max_wait_seconds = max(endpoint_class.max_wait_seconds, waited)
+        self.in_flight += 1
+
+    def admit(self, name):
+        """
+        Takes a slot for a request of a class, waiting up to the class's timeout for one
+        Args:
+                name (str): the endpoint class
+        Returns:
+                bool: True if the request may run and must call release(), False if it is shed
+        """
+        endpoint_class = self.classes[name]
+        with self.lock:
+            if self._has_slot(endpoint_class) and not self._yields_to(endpoint_class, ahead=True):
+                self._start(endpoint_class, 0.0)
+                return True
+            if endpoint_class.waiting >= endpoint_class.queue or endpoint_class.timeout <= 0:
+                endpoint_class.shed += 1
+                return False
+
+            endpoint_class.waiting += 1
+            endpoint_class.queued += 1
+            started = time.monotonic()
+            deadline = started + endpoint_class.timeout
+            try:
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        endpoint_class.shed += 1
+                        endpoint_class.timed_out += 1
+                        return False
+                    endpoint_class.condition.wait(remaining)
+                    if self._has_slot(endpoint_class) and not self._yields_to(endpoint_class, ahead=False):
+                        self._start(endpoint_class, time.monotonic() - started)
+                        return True
+            finally:
+                endpoint_class.waiting -= 1
+                # A slot this request was woken for but didn't take goes to the next in line
+                self._wake()
+
+    def release(self, name):
+        """
+        Frees the slot taken by admit()
+        """
+        endpoint_class = self.classes[name]
+        with self.lock:
+            endpoint_class.in_flight -= 1
+            self.in_flight -= 1
+            self._wake()
+
+    def count_stale(self, name):
+        with self.lock:
+            self.classes[name].shed += 1
+            self.classes[name].stale += 1
+
+    def counters(self):
+        """
+        Returns:
+                dict: requests in flight in the process, and the counters of every class
+        """
+        with self.lock:
+            return {
+                'max_in_flight': self.max_in_flight,
+                'in_flight': self.in_flight,
+                'classes': {name: endpoint_class.as_dict() for name, endpoint_class in self.classes.items()},
+            }
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_controller():
+    """
+    Returns the process-wide controller, created from the settings on first use
+    """
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = AdmissionController(settings.EMP_ADMISSION_CLASSES, settings.EMP_ADMISSION_MAX_IN_FLIGHT)
+        return _controller
+
+
+def reset():
+    """
+    Drops the controller and its counters, the next request builds a new one from the settings
+    """
+    global _controller
+    with _controller_lock:
+        _controller = None
+
+
+_warned_single_threaded = False
+
+
+def check_threaded(request):
+    """
+    Warns, once per process, when the server runs one request at a time, e.g. gunicorn's sync workers
+    """
+    global _warned_single_threaded
+    if _warned_single_threaded or request.META.get('wsgi.multithread', True):
+        return
+    _warned_single_threaded = True
+    logger.warning("The server isn't threaded, admission control never queues or sheds requests: "
+                   "run the workers with threads (e.g. gunicorn --threads), more than EMP_ADMISSION_MAX_IN_FLIGHT")
+
+
+def endpoint_class(request):
+    """
+    Returns:
+            str: the class of the endpoint requested, None for endpoints that are always admitted
+    """
+    return settings.EMP_ADMISSION_ENDPOINTS.get(request.path_info.strip('/').split('/', 1)[0])
+
+
+def upstream_wait(request):
+    """
+    Seconds the request spent between the load balancer and this process, from X-Request-Start
+    in seconds, milliseconds or microseconds since the epoch, optionally prefixed with 't='
+    Returns:
+            float: the wait, None without a readable header
+    """
+    value = request.META.get(upstream_header, '')
+    try:
+        started = float(value[2:] if value.startswith('t=') else value)
+    except ValueError:
+        return None
+    while started > 1e11:
+        started /= 1000
+    return max(time.time() - started, 0.0)
+
+
+class ReleasingContent:
+    """
+    Streaming content that frees the request's slot once the response is closed, so the rows
+    a streaming endpoint reads while it is sent count as in flight
+    """
+
+    def __init__(self, content, release):
+        self.content = content
+        self.release = release
+
+    def __iter__(self):
+        return iter(self.content)
+
+    def close(self):
+        if hasattr(self.content, 'close'):
+            self.content.close()
+        if self.release is not None:
+            self.release()
+            self.release = None
+
+
+class AdmissionControlMiddleware(MiddlewareMixin):
+    """
+    Sheds the requests the controller doesn't admit with a 503 and a Retry-After header.
+    Comes right after the CORS and request context middleware, so shed requests cost next to nothing
+    but still carry the CORS headers browsers need to read the 503.
+    """
+
+    def process_request(self, request):
+        name = endpoint_class(request)
+        if name is None or not settings.EMP_ADMISSION_ENABLED:
+            return None
+        check_threaded(request)
+        controller = get_controller()
+
+        waited = upstream_wait(request)
+        if waited is not None and waited > settings.EMP_ADMISSION_MAX_UPSTREAM_WAIT:
+            controller.count_stale(name)
+            return self.shed(controller, name)
+        if not controller.admit(name):
+            return self.shed(controller, name)
+        request.admission = (controller, name)
+        return None
+
+    def shed(self, controller, name):
+        response = HttpResponse("Server busy, retry later", status=http_service_unavailable_response)
+        response['Retry-After'] = str(controller.classes[name].retry_after)
+        return response
+
+    def process_response(self, request, response):
+        admission = getattr(request, 'admission', None)
+        if admission is None:
+            return response
+        del request.admission
+        controller, name = admission
+        if response.streaming:
+            response.streaming_content = ReleasingContent(response.streaming_content, lambda: controller.release(name))
+        else:
+            controller.release(name)
+        return response
@@ -1,5 +1,20 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
 
 
 class EmergencyAppConfig(AppConfig):
     name = 'emergency_app'
+
+    def ready(self):
+        from common.util import emergency_profile, reference_data, sharding
+        for model in reference_data.reference_models.values():
+            post_save.connect(reference_data.clear, sender=model, dispatch_uid='reference_data_save_' + model.__name__)
+            post_delete.connect(reference_data.clear, sender=model, dispatch_uid='reference_data_delete_' + model.__name__)
+            # Profiles hold the descriptions, and each shard a copy of the reference tables
+            post_save.connect(emergency_profile.reference_saved, sender=model, dispatch_uid='emergency_profile_' + model.__name__)
+            post_save.connect(sharding.replicate, sender=model, dispatch_uid='sharding_replicate_' + model.__name__)
+
+        if settings.EMP_PRELOAD:
+            from emergency_app import preload
+            preload.preload_modules()
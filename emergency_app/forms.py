@@ -1,5 +1,6 @@
 # Taken from this video:
 # https://www.youtube.com/watch?v=wVnQkKf-gHo
+import logging
 from django import forms
 # from emergency_app.models.identity import Identity
 from emergency_app.models.contact import Contact
@@ -7,6 +8,10 @@ from emergency_app.models.emergency import Emergency
 from emergency_app.models.nation import Nation
 # from emergency_app.models.state import State
 from common.util import sanitization
+from common.util import sharding
+
+# Validation failures are logged at INFO, the client gets the details in the response
+logger = logging.getLogger(__name__)
 
 # When required field=false, clean() would normalize empty value of CharField into empty string
 # However, null value was needed to follow the sample data provided. Therefore, this function is declared.
@@ -56,27 +61,7 @@ class UpdateEmergencyContactForm(forms.ModelForm):
     # clean() for validating fields that depend on each other, this function apparently runs after clean_<field_name>() got executed
     def clean(self):
         self.cleaned_data = super(UpdateEmergencyContactForm, self).clean()
-        # checking whether given surrogate id is actually in database.
-        surrogate_id = self.cleaned_data.get("surrogate_id")
-        pidm = self.cleaned_data.get("pidm")
-        if surrogate_id:
-            try:
-                Contact.objects.get(surrogate_id=surrogate_id, pidm=pidm)
-            except Contact.DoesNotExist:
-                print("Invalid Surrogate ID. ")
-                raise forms.ValidationError("Invalid Surrogate ID")
-
-        # checking whether given priority is actually in the correct range (1 to (n+1)) for new entry
-        # and range (1 to n) for old entry (the one with surrogate id given correctly)
-        priority = self.cleaned_data.get("priority")
-        entries = Contact.objects.filter(pidm=pidm)
-        if not priority:
-            print("Missing priority number. ")
-            raise forms.ValidationError("Missing priority number")
-        if (not surrogate_id and not(1 <= int(priority) <= (len(entries) + 1)) or
-            (surrogate_id and not(1 <= int(priority) <= len(entries)))):
-            print("Invalid priority number. ")
-            raise forms.ValidationError("Invalid priority number")
+        self.validate_surrogate_id_and_priority()
 
         # empty string handler for the rest fields
         # this seems ugly, it's probably better to use clean_<field_name>() for each of these fields.
@@ -95,15 +80,14 @@ class UpdateEmergencyContactForm(forms.ModelForm):
         zip = self.cleaned_data.get("zip")
         natn_code = self.cleaned_data.get("natn_code")
         if (street_line1 or city or stat_code or zip or natn_code):
-            print("Invalid address, need street_line1, city, and either stat_code + zip or natn_code be filled correctly.")
             if not street_line1:
-                print("Invalid street line1. ")
+                logger.info("Invalid street line1", extra={'field': 'street_line1'})
                 raise forms.ValidationError('street_line1', "Address field is required")
             if not city:
-                print("Invalid city. ")
+                logger.info("Invalid city", extra={'field': 'city'})
                 raise forms.ValidationError('city', "City field is required")
             if not natn_code and not(stat_code and zip):
-                print("Invalid natn_code or stat_code + zip. ")
+                logger.info("Invalid natn_code or stat_code + zip", extra={'field': 'natn_code'})
                 raise forms.ValidationError("Nation field, or State + Zip fields is/are required")
 
         # commenting validations related to USA option part since it needs more revisions
@@ -112,14 +96,14 @@ class UpdateEmergencyContactForm(forms.ModelForm):
         # need revisions since it's complicated on implementation
         if natn_code == Nation.objects.get(value="USA").id: # alternatively, == "LUS":
             if not(stat_code is None or stat_code != "00")):
-                print("Invalid stat_code")
+                logger.info("Invalid stat_code", extra={'field': 'stat_code'})
                 raise forms.ValidationError("Invalid state code")
             if not(zip is None or sanitization.validate_zip_usa(zip)):
-                print("Invalid zip")
+                logger.info("Invalid zip", extra={'field': 'zip'})
                 raise forms.ValidationError("Invalid zip code")
             # this if statement is weird, but OIT website behaves like this
             if stat_code and not zip:
-                print("Invalid natn_code or stat_code + zip. ")
+                logger.info("Invalid natn_code or stat_code + zip", extra={'field': 'natn_code'})
                 raise forms.ValidationError("Nation field, or State + Zip fields is/are required")
             # Below phone number validation is not completely true, people live in USA may have phone number from foreign country
             # may add if ctry_code_phone == Nation.objects.get(value="USA").phone_code but Canada adds more complication
@@ -128,19 +112,53 @@ class UpdateEmergencyContactForm(forms.ModelForm):
             if ((phone_area or phone_number) and
                 not(len(phone_area) == 3 and len(phone_number) == 7 and
                     sanitization.validate_phone_num_usa(phone_area + phone_number))):
-                print("Invalid phone area + number. ")
+                logger.info("Invalid phone area + number", extra={'field': 'phone_number'})
                 raise forms.ValidationError("Invalid phone area and number")
         """
 
         return self.cleaned_data
         # Possible TODOs: check validity of address, city and state based on zipcode
 
+    # The code fields are named after the codes, not the foreign keys (relation, state, nation),
+    # so ModelForm doesn't write them to the instance by itself
+    def _post_clean(self):
+        super(UpdateEmergencyContactForm, self)._post_clean()
+        for field in ("relt_code", "stat_code", "natn_code"):
+            if field in self.cleaned_data:
+                setattr(self.instance, field, self.cleaned_data[field])
+
+    # checks the surrogate id and priority against the user's other contacts in the database
+    def validate_surrogate_id_and_priority(self):
+        # checking whether given surrogate id is actually in database.
+        surrogate_id = self.cleaned_data.get("surrogate_id")
+        pidm = self.cleaned_data.get("pidm")
+        # the user's contacts are on their shard, nobody has contacts without a pidm
+        contacts = Contact.objects.using('default' if pidm is None else sharding.shard_for(pidm))
+        if surrogate_id:
+            try:
+                contacts.get(surrogate_id=surrogate_id, pidm=pidm)
+            except Contact.DoesNotExist:
+                logger.info("Invalid Surrogate ID", extra={'field': 'surrogate_id'})
+                raise forms.ValidationError("Invalid Surrogate ID")
+
+        # checking whether given priority is actually in the correct range (1 to (n+1)) for new entry
+        # and range (1 to n) for old entry (the one with surrogate id given correctly)
+        priority = self.cleaned_data.get("priority")
+        entries = contacts.filter(pidm=pidm)
+        if not priority:
+            logger.info("Missing priority number", extra={'field': 'priority'})
+            raise forms.ValidationError("Missing priority number")
+        if (not surrogate_id and not(1 <= int(priority) <= (len(entries) + 1)) or
+            (surrogate_id and not(1 <= int(priority) <= len(entries)))):
+            logger.info("Invalid priority number", extra={'field': 'priority'})
+            raise forms.ValidationError("Invalid priority number")
+
     # clean_<field_name>() function is reponsible to validate one specific field.
     def clean_relt_code(self, *args, **kwargs):
         relt_code = self.cleaned_data.get("relt_code")
         relt_code = empty_string_handler(relt_code)
         if not(relt_code is None or sanitization.validate_relation(relt_code)):
-            print("Invalid relation code. ")
+            logger.info("Invalid relation code", extra={'field': 'relt_code'})
             raise forms.ValidationError("Invalid relation code")
 
         return relt_code
@@ -150,7 +168,7 @@ class UpdateEmergencyContactForm(forms.ModelForm):
         stat_code = self.cleaned_data.get("stat_code")
         stat_code = empty_string_handler(stat_code)
         if not(stat_code is None or sanitization.validate_state_usa(stat_code)):
-            print("Invalid stat_code. ")
+            logger.info("Invalid stat_code", extra={'field': 'stat_code'})
             raise forms.ValidationError("Invalid state code")
 
         return stat_code
@@ -159,7 +177,7 @@ class UpdateEmergencyContactForm(forms.ModelForm):
         natn_code = self.cleaned_data.get("natn_code")
         natn_code = empty_string_handler(natn_code)
         if not(natn_code is None or sanitization.validate_nation_code(natn_code)):
-            print("Invalid natn_code. ")
+            logger.info("Invalid natn_code", extra={'field': 'natn_code'})
             raise forms.ValidationError("Invalid nation code")
 
         return natn_code
@@ -168,12 +186,20 @@ class UpdateEmergencyContactForm(forms.ModelForm):
         ctry_code_phone_code = self.cleaned_data.get("ctry_code_phone_code")
         ctry_code_phone_code = empty_string_handler(ctry_code_phone_code)
         if not(ctry_code_phone_code is None or sanitization.validate_country_phone_code(ctry_code_phone_code)):
-            print("Invalid ctry_code_phone_code. ")
+            logger.info("Invalid ctry_code_phone_code", extra={'field': 'ctry_code_phone_code'})
             raise forms.ValidationError("Invalid country phone code")
 
         return ctry_code_phone_code
 
 
+# Form for validating one entry of the user's complete, ordered contact list (replaceEmergencyContacts)
+# The list as a whole decides the surrogate ids and priorities, so they are checked together in the view
+# instead of against the database one contact at a time.
+class ReplaceEmergencyContactForm(UpdateEmergencyContactForm):
+    def validate_surrogate_id_and_priority(self):
+        pass
+
+
 # Form for validating the request update of user's evacuation assistance
 class SetEvacuationAssistanceForm(forms.ModelForm):
     evacuation_assistance = forms.CharField(max_length=4)
@@ -189,7 +215,7 @@ class SetEvacuationAssistanceForm(forms.ModelForm):
         # since evacuation assistance form must submit some values, evacuation_assistance should not be None
         # hence, skipping empty_string_handler function
         if not(sanitization.validate_checkbox(evacuation_assistance)):
-            print("Invalid checkbox evacuation_assistance. ")
+            logger.info("Invalid checkbox evacuation_assistance", extra={'field': 'evacuation_assistance'})
             raise forms.ValidationError("Invalid checkbox value")
 
         return evacuation_assistance
@@ -212,7 +238,7 @@ class SetEmergencyNotificationsForm(forms.ModelForm):
         external_email = self.cleaned_data.get("external_email")
         external_email = empty_string_handler(external_email)
         if not(external_email is None or sanitization.validate_email(external_email)):
-            print("Invalid external email. ")
+            logger.info("Invalid external email", extra={'field': 'external_email'})
             raise forms.ValidationError("Invalid email")
 
         return external_email
@@ -221,7 +247,7 @@ class SetEmergencyNotificationsForm(forms.ModelForm):
         primary_phone = self.cleaned_data.get("primary_phone")
         primary_phone = empty_string_handler(primary_phone)
         if not(primary_phone is None or sanitization.validate_phone_num_usa(primary_phone)):
-            print("Invalid primary phone number. ")
+            logger.info("Invalid primary phone number", extra={'field': 'primary_phone'})
             raise forms.ValidationError("Invalid phone number")
 
         return primary_phone
@@ -230,7 +256,7 @@ class SetEmergencyNotificationsForm(forms.ModelForm):
         alternate_phone = self.cleaned_data.get("alternate_phone")
         alternate_phone = empty_string_handler(alternate_phone)
         if not(alternate_phone is None or sanitization.validate_phone_num_usa(alternate_phone)):
-            print("Invalid alternate phone. ")
+            logger.info("Invalid alternate phone", extra={'field': 'alternate_phone'})
             raise forms.ValidationError("Invalid phone number")
 
         return alternate_phone
@@ -240,7 +266,7 @@ class SetEmergencyNotificationsForm(forms.ModelForm):
         sms_status_ind = empty_string_handler(sms_status_ind)
         # since sms_status_ind must be submitted with a value, it should not be none
         if not(sanitization.validate_checkbox(sms_status_ind)):
-            print("Invalid checkbox sms_status_ind. ")
+            logger.info("Invalid checkbox sms_status_ind", extra={'field': 'sms_status_ind'})
             raise forms.ValidationError("Invalid checkbox value")
 
         return sms_status_ind
@@ -254,7 +280,7 @@ class SetEmergencyNotificationsForm(forms.ModelForm):
         sms_device = self.cleaned_data.get("sms_device")
         sms_device = empty_string_handler(sms_device)
         if not(sms_device is None or sanitization.validate_phone_num_usa(sms_device)):
-            print("Invalid sms_device phone number. ")
+            logger.info("Invalid sms_device phone number", extra={'field': 'sms_device'})
             raise forms.ValidationError("Invalid phone number")
 
         return sms_device
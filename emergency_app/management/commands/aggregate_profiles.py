@@ -0,0 +1,48 @@
+import io
+import os
+import pstats
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from emergency_app import profiling
+
+
+class Command(BaseCommand):
+    help = ("Aggregates the captured request profiles per endpoint: the slowest functions of the "
+            "cProfile captures, and one combined collapsed stack file of the sampled captures")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=settings.EMP_PROFILE_DIR, help="Where the profiles were written")
+        parser.add_argument('--endpoint', help="Only this endpoint, e.g. updateEmergencyContact")
+        parser.add_argument('--top', type=int, default=20, help="Functions listed per endpoint")
+        parser.add_argument('--sort', default='cumulative', help="pstats sort key, e.g. cumulative or tottime")
+        parser.add_argument('--output', help="Directory for the combined <endpoint>.collapsed files, "
+                                             "ready for flamegraph.pl or speedscope")
+
+    def handle(self, *args, **options):
+        profiles = profiling.captured(options['dir'], options['endpoint'])
+        if not profiles:
+            self.stderr.write("No profiles in %s" % options['dir'])
+            return
+
+        for endpoint, modes in sorted(profiles.items()):
+            captures = [capture for mode_captures in modes.values() for capture in mode_captures]
+            milliseconds = sorted(ms for path, ms in captures)
+            self.stdout.write("== %s: %d profiles, median %d ms, max %d ms" % (
+                endpoint, len(captures), milliseconds[len(milliseconds) // 2], milliseconds[-1]))
+
+            if profiling.CPROFILE in modes:
+                report = io.StringIO()
+                stats = pstats.Stats(*[path for path, ms in modes[profiling.CPROFILE]], stream=report)
+                stats.strip_dirs().sort_stats(options['sort']).print_stats(options['top'])
+                self.stdout.write(report.getvalue())
+
+            if profiling.SAMPLE in modes:
+                stacks = profiling.combine_collapsed([path for path, ms in modes[profiling.SAMPLE]])
+                self.stdout.write("%d samples in %d distinct stacks" % (sum(stacks.values()), len(stacks)))
+                if options['output']:
+                    os.makedirs(options['output'], exist_ok=True)
+                    path = os.path.join(options['output'], endpoint + '.collapsed')
+                    with open(path, 'w') as combined:
+                        for stack, count in stacks.most_common():
+                            combined.write('%s %d\n' % (stack, count))
+                    self.stdout.write("Wrote %s" % path)
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from common.util import reverse_lookup
+from common.util import sharding
+from emergency_app.models.contact import Contact
+from emergency_app.models.emergency import Emergency
+
+
+class Command(BaseCommand):
+    help = "Recomputes the normalized phone/email lookup keys of every SPREMRG and ZGBNNN row in bulk"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Rows read and written per batch")
+
+    def handle(self, *args, **options):
+        for model in (Contact, Emergency):
+            updated = sum(reverse_lookup.backfill(model, model.update_lookup_keys, model.lookup_key_fields,
+                                                  options['batch_size'], alias)
+                          for alias in sharding.shard_aliases())
+            self.stderr.write("Updated the lookup keys of %d %s rows" % (updated, model._meta.db_table))
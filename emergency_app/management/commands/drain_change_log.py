@@ -0,0 +1,51 @@
+import json
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from common.util import change_log
+from emergency_app.models.change_log import ChangeLog
+
+
+class Command(BaseCommand):
+    help = ("Drains the SPREMRG/ZGBNNN change log for a consumer in batches, "
+            "writing one json change per line and advancing the consumer's cursor")
+
+    def add_arguments(self, parser):
+        parser.add_argument('consumer', help="Name of the downstream consumer, e.g. banner or alert_vendor")
+        parser.add_argument('--batch-size', type=int, default=settings.EMP_CHANGE_LOG_PAGE_SIZE,
+                            help="Amount of changes read per batch")
+        parser.add_argument('--output', help="File to append the changes to, defaults to stdout")
+        parser.add_argument('--purge', action='store_true',
+                            help="Delete drained entries that every consumer has already processed")
+
+    def handle(self, *args, **options):
+        consumer = options['consumer']
+        batch_size = options['batch_size']
+        output = open(options['output'], 'a') if options['output'] else self.stdout
+
+        cursor = change_log.get_cursor(consumer)
+        drained = 0
+        try:
+            while True:
+                changes = change_log.changes_since(cursor, batch_size)
+                if not changes:
+                    break
+                for change in changes:
+                    output.write(json.dumps(change, cls=DjangoJSONEncoder) + '\n')
+                output.flush()
+                # Only advance once the batch has been written, so a crash re-delivers rather than loses changes
+                cursor = changes[-1]['sequence']
+                change_log.advance_cursor(consumer, cursor)
+                drained += len(changes)
+        finally:
+            if output is not self.stdout:
+                output.close()
+
+        if options['purge']:
+            with transaction.atomic():
+                purge_before = min(change_log.all_cursors().values())
+                purged, _ = ChangeLog.objects.filter(sequence__lte=purge_before).delete()
+            self.stderr.write("Purged %d change log entries" % purged)
+
+        self.stderr.write("Drained %d changes for %s, cursor at %d" % (drained, consumer, cursor))
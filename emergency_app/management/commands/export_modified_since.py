@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from common.util import export
+
+
+class Command(BaseCommand):
+    help = ("Exports every SPREMRG/ZGBNNN row modified after a timestamp as newline delimited json, "
+            "reading the tables in keyset-paginated chunks")
+
+    def add_arguments(self, parser):
+        parser.add_argument('since', help="ISO 8601 timestamp, e.g. 2019-08-01T13:32:00")
+        parser.add_argument('--tables', default=','.join(export.exportable_models),
+                            help="Comma separated Banner tables to export")
+        parser.add_argument('--chunk-size', type=int, default=settings.EMP_EXPORT_CHUNK_SIZE,
+                            help="Amount of rows read per query")
+        parser.add_argument('--output', help="File to write the export to, defaults to stdout")
+
+    def handle(self, *args, **options):
+        since = export.parse_since(options['since'])
+        if since is None:
+            raise CommandError("since must be an ISO 8601 timestamp")
+        tables = options['tables'].split(',')
+        for table in tables:
+            if table not in export.exportable_models:
+                raise CommandError("tables must be any of " + ', '.join(export.exportable_models))
+
+        output = open(options['output'], 'w') if options['output'] else self.stdout
+        exported = 0
+        try:
+            for line in export.iter_export_lines(tables, since, options['chunk_size']):
+                output.write(line)
+                exported += 1
+        finally:
+            if output is not self.stdout:
+                output.close()
+
+        self.stderr.write("Exported %d rows modified since %s" % (exported, since.isoformat()))
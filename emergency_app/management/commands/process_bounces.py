@@ -0,0 +1,39 @@
+import csv
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from common.util import reverse_lookup
+
+
+class Command(BaseCommand):
+    help = ("Applies a provider's bounce/STOP report: STOP replies opt the number out of text messages, "
+            "bounced emails are removed. One report per line: 'address' or 'address,kind' (kind is bounce or stop)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('report', help="Report file, '-' for stdin")
+        parser.add_argument('--kind', choices=[reverse_lookup.BOUNCE, reverse_lookup.STOP],
+                            help="Kind of every line without its own kind column")
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help="Addresses per lookup query and per transaction")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only count what would change")
+
+    def handle(self, *args, **options):
+        if options['report'] == '-':
+            reports = list(self.parse(options.get('stdin', sys.stdin), options['kind']))
+        else:
+            with open(options['report'], newline='') as report:
+                reports = list(self.parse(report, options['kind']))
+
+        summary = reverse_lookup.apply_reports(reports, options['chunk_size'], options['dry_run'])
+        self.stderr.write("%(reports)d reports, %(unknown)d unusable addresses, "
+                          "%(opted_out)d people opted out of texts, %(emails_removed)d emails removed" % summary)
+
+    def parse(self, report, default_kind):
+        for line_number, row in enumerate(csv.reader(report), start=1):
+            if not row or not row[0].strip():
+                continue
+            kind = row[1].strip().lower() if len(row) > 1 and row[1].strip() else default_kind
+            if kind not in (reverse_lookup.BOUNCE, reverse_lookup.STOP):
+                raise CommandError("Line %d: kind must be bounce or stop (or pass --kind)" % line_number)
+            yield row[0].strip(), kind
+
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from common.util import sharding
+
+
+class Command(BaseCommand):
+    help = ("Places SPREMRG and ZGBNNN rows on the shards settings.EMP_SHARDS assigns them, after shards were "
+            "appended to it, and copies the reference tables to every shard. Run it after migrating the new shards "
+            "and after loading fixtures, which always go to the default database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help="People moved per transaction")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only count the people that would move")
+
+    def handle(self, *args, **options):
+        if not options['dry_run']:
+            for alias in sharding.shard_aliases()[1:]:
+                written = sharding.copy_reference_tables(alias)
+                self.stderr.write("Copied %d reference rows to %s" % (written, alias))
+            # Fixtures and Banner loads don't draw from the shared sequence, new rows must be numbered above them
+            for name, last_value in sorted(sharding.advance_surrogate_sequences().items()):
+                self.stderr.write("%s surrogate ids continue after %d" % (name, last_value))
+
+        chunk_size = options['chunk_size']
+        moves = sorted(sharding.misplaced_pidms().items())
+        # Check every move first, a person whose rows can't move would be stranded where shard_for() doesn't look
+        colliding = []
+        for (source, target), pidms in moves:
+            self.stderr.write("%d people to move from %s to %s" % (len(pidms), source, target))
+            for start in range(0, len(pidms), chunk_size):
+                taken = sharding.colliding_pidms(pidms[start:start + chunk_size], source, target)
+                colliding.extend("%d (%s to %s)" % (pidm, source, target) for pidm in taken)
+        if colliding:
+            raise CommandError("Surrogate ids of these people are used by other people's rows on their shard, "
+                               "nothing was moved: %s" % ', '.join(colliding))
+        if options['dry_run']:
+            return
+
+        moved = 0
+        for (source, target), pidms in moves:
+            for start in range(0, len(pidms), chunk_size):
+                chunk = pidms[start:start + chunk_size]
+                try:
+                    sharding.move(chunk, source, target)
+                except sharding.SurrogateIdCollision as e:
+                    raise CommandError("%s, %d people were moved before it" % (e, moved))
+                moved += len(chunk)
+        self.stderr.write("Moved %d people" % moved)
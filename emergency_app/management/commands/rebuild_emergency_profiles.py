@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from common.util import emergency_profile
+
+
+class Command(BaseCommand):
+    help = ("Rebuilds EMERGENCY_PROFILE from SPREMRG and ZGBNNN on every shard, "
+            "e.g. after they were loaded or changed outside the application")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="People read and written per batch")
+
+    def handle(self, *args, **options):
+        total = emergency_profile.rebuild(batch_size=options['batch_size'])
+        self.stderr.write("%d profiles rebuilt" % total)
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from common.util import evacuation_roster
+
+
+class Command(BaseCommand):
+    help = "Rebuilds EVACUATION_ROSTER from ZGBNNN and ZGBIDMP, e.g. after ZGBNNN was loaded outside the application"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Rows read and written per batch")
+
+    def handle(self, *args, **options):
+        total = evacuation_roster.rebuild(batch_size=options['batch_size'])
+        self.stderr.write("%d people need evacuation assistance" % total)
@@ -0,0 +1,38 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from common.util import sharding
+from common.util import tasks
+
+
+class Command(BaseCommand):
+    help = ("Runs tasks from the durable TASK_QUEUE, retrying failures with exponential backoff. "
+            "Polls the queue of every shard, several workers can poll the same queues.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once no task is due instead of polling forever")
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help="Amount of tasks claimed per poll")
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help="Seconds to sleep when no task is due")
+        parser.add_argument('--max-attempts', type=int, default=settings.EMP_TASKS_MAX_ATTEMPTS,
+                            help="Attempts before a task is marked failed")
+
+    def handle(self, *args, **options):
+        succeeded = failed = 0
+        while True:
+            claimed = []
+            for alias in sharding.shard_aliases():
+                claimed.extend(tasks.claim_due(options['batch_size'], options['max_attempts'], using=alias))
+            for queued in claimed:
+                if tasks.run_durable(queued, options['max_attempts']):
+                    succeeded += 1
+                else:
+                    failed += 1
+            if not claimed:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+
+        self.stderr.write("Ran %d tasks, %d attempts failed" % (succeeded + failed, failed))
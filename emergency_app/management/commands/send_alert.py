@@ -0,0 +1,36 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from common.util import dispatch
+
+
+class Command(BaseCommand):
+    help = ("Sends an alert to everyone in ZGBNNN (or the given pidms) through the configured transports, "
+            "and prints the delivery report as json")
+
+    def add_arguments(self, parser):
+        parser.add_argument('body', help="Message text, sent as the email body and the text message")
+        parser.add_argument('--subject', default="PSU Alert", help="Email subject")
+        parser.add_argument('--pidm', type=int, action='append', dest='pidms',
+                            help="Only notify this person, can be repeated")
+        parser.add_argument('--channel', action='append', dest='channels',
+                            choices=[dispatch.EMAIL, dispatch.SMS],
+                            help="Only send on this channel, can be repeated")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only compile and count the targets")
+
+    def handle(self, *args, **options):
+        targets = dispatch.compile_targets(options['pidms'])
+        if options['channels']:
+            targets = [target for target in targets if target.channel in options['channels']]
+        if options['dry_run']:
+            counts = {}
+            for target in targets:
+                counts[target.channel] = counts.get(target.channel, 0) + 1
+            self.stdout.write(json.dumps({'targets': counts}))
+            return
+
+        transports = dispatch.load_transports(options['channels'])
+        if not transports:
+            raise CommandError("No transport is configured in EMP_DISPATCH_TRANSPORTS")
+        report = dispatch.dispatch(dispatch.Message(options['subject'], options['body']), targets, transports)
+        self.stdout.write(json.dumps(report.as_dict()))
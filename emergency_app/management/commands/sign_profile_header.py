@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from emergency_app import profiling
+
+
+class Command(BaseCommand):
+    help = "Prints a signed X-EMP-Profile header value, which profiles the request it is sent with"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=sorted(profiling.extensions), default=profiling.CPROFILE,
+                            help="cprofile writes pstats, sample writes collapsed stacks")
+
+    def handle(self, *args, **options):
+        self.stdout.write(profiling.sign(options['mode']))
@@ -0,0 +1,54 @@
+import uuid
+from django.conf import settings
+from django.utils.deprecation import MiddlewareMixin
+from common.util import structured_logging
+
+
+class RequestContextMiddleware(MiddlewareMixin):
+    """
+    Gives every request an id, taken from the X-Request-ID header when the load balancer sets one,
+    which is stamped on everything logged while handling it and returned in the X-Request-ID header.
+    The context is reset when the response is done, streamed ones once they are closed, so what the
+    thread logs between requests (e.g. background tasks) isn't stamped with the last request's id.
+    """
+
+    def process_request(self, request):
+        request.request_id = request.META.get('HTTP_X_REQUEST_ID') or uuid.uuid4().hex
+        request.logging_context = structured_logging.bind(request_id=request.request_id, pidm=None)
+
+    def process_response(self, request, response):
+        if hasattr(request, 'request_id'):
+            response['X-Request-ID'] = request.request_id
+        tokens = getattr(request, 'logging_context', None)
+        if tokens is None:
+            return response
+        if not response.streaming:
+            structured_logging.reset(tokens)
+            return response
+        # The content is generated, and may log, after this returns
+        close = response.close
+
+        def close_and_reset():
+            try:
+                close()
+            finally:
+                # close() may be called more than once, a token can only be reset once
+                if request.logging_context is not None:
+                    structured_logging.reset(request.logging_context)
+                    request.logging_context = None
+        response.close = close_and_reset
+        return response
+
+
+class TokenAuthenticatedCsrfMiddleware(MiddlewareMixin):
+    """
+    Scoped CSRF policy: views in settings.EMP_TOKEN_AUTHENTICATED_VIEW_MODULES skip the CSRF check.
+    They authenticate with the JWT in the Authorization header, which a browser never attaches
+    to a cross-site request on its own, so there is no ambient credential to forge a request with.
+    Every other view (e.g. the admin, when installed) keeps the check. Must come before CsrfViewMiddleware.
+    """
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if view_func.__module__ in settings.EMP_TOKEN_AUTHENTICATED_VIEW_MODULES:
+            request._dont_enforce_csrf_checks = True
+        return None
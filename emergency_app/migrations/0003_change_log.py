@@ -0,0 +1,44 @@
+# Generated by Django 2.2.1 on 2026-10-19 12:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emergency_app', '0002_nation_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('sequence', models.AutoField(db_column='CHANGE_LOG_SEQUENCE', primary_key=True, serialize=False)),
+                ('pidm', models.IntegerField(db_column='CHANGE_LOG_PIDM', db_index=True)),
+                ('table_name', models.CharField(db_column='CHANGE_LOG_TABLE', max_length=30)),
+                ('row_key', models.CharField(db_column='CHANGE_LOG_ROW_KEY', max_length=30, null=True)),
+                ('operation', models.CharField(db_column='CHANGE_LOG_OPERATION', max_length=1)),
+                ('changed_fields', models.TextField(db_column='CHANGE_LOG_CHANGED_FIELDS')),
+                ('activity_date', models.DateTimeField(auto_now_add=True, db_column='CHANGE_LOG_ACTIVITY_DATE')),
+            ],
+            options={
+                'db_table': 'CHANGE_LOG',
+            },
+        ),
+        migrations.CreateModel(
+            name='ChangeLogCursor',
+            fields=[
+                ('consumer', models.CharField(db_column='CHANGE_LOG_CURSOR_CONSUMER', max_length=60, primary_key=True, serialize=False)),
+                ('sequence', models.IntegerField(db_column='CHANGE_LOG_CURSOR_SEQUENCE', default=0)),
+                ('activity_date', models.DateTimeField(auto_now=True, db_column='CHANGE_LOG_CURSOR_ACTIVITY_DATE')),
+            ],
+            options={
+                'db_table': 'CHANGE_LOG_CURSOR',
+            },
+        ),
+        migrations.AlterField(
+            model_name='contact',
+            name='surrogate_id',
+            field=models.AutoField(db_column='SPREMRG_SURROGATE_ID', primary_key=True, serialize=False),
+        ),
+    ]
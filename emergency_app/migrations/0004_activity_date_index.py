@@ -0,0 +1,21 @@
+# Generated by Django 2.2.1 on 2026-10-19 12:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emergency_app', '0003_change_log'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contact',
+            index=models.Index(fields=['activity_date', 'surrogate_id'], name='SPREMRG_ACTIVITY_DATE_IDX'),
+        ),
+        migrations.AddIndex(
+            model_name='emergency',
+            index=models.Index(fields=['activity_date', 'pidm'], name='ZGBNNN_ACTIVITY_DATE_IDX'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.1 on 2026-10-19 12:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emergency_app', '0004_activity_date_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Task',
+            fields=[
+                ('id', models.AutoField(db_column='TASK_ID', primary_key=True, serialize=False)),
+                ('name', models.CharField(db_column='TASK_NAME', max_length=200)),
+                ('arguments', models.TextField(db_column='TASK_ARGUMENTS')),
+                ('status', models.CharField(db_column='TASK_STATUS', default='P', max_length=1)),
+                ('attempts', models.IntegerField(db_column='TASK_ATTEMPTS', default=0)),
+                ('run_after', models.DateTimeField(db_column='TASK_RUN_AFTER')),
+                ('last_error', models.TextField(db_column='TASK_LAST_ERROR', null=True)),
+                ('activity_date', models.DateTimeField(auto_now=True, db_column='TASK_ACTIVITY_DATE')),
+            ],
+            options={
+                'db_table': 'TASK_QUEUE',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['status', 'run_after'], name='TASK_QUEUE_DUE_IDX'),
+        ),
+    ]
@@ -0,0 +1,97 @@
+# Generated by Django 2.2.1 on 2026-10-19 12:47
+
+from django.db import migrations, models
+import re
+
+non_digits = re.compile('[^0-9]')
+
+
+# Frozen copies of sanitization.normalize_phone and normalize_email as they were when the keys were added
+def normalize_phone(phone_num, ctry_code_phone=None):
+    digits = non_digits.sub('', phone_num or '')
+    if not digits:
+        return None
+    if phone_num.lstrip().startswith('+'):
+        return digits
+    country = non_digits.sub('', ctry_code_phone or '').lstrip('0') or '1'
+    if country == '1' and len(digits) == 11 and digits[0] == '1':
+        return digits
+    return country + digits
+
+
+def normalize_email(email):
+    email = (email or '').strip().lower()
+    return email or None
+
+
+def backfill(model, compute_keys, key_fields, using, batch_size=1000):
+    # Primary key order batches, like reverse_lookup.backfill
+    last_pk = None
+    while True:
+        rows = model.objects.using(using).order_by('pk')
+        if last_pk is not None:
+            rows = rows.filter(pk__gt=last_pk)
+        rows = list(rows[:batch_size])
+        if not rows:
+            return
+        for row in rows:
+            compute_keys(row)
+        model.objects.using(using).bulk_update(rows, key_fields)
+        last_pk = rows[-1].pk
+
+
+def backfill_lookup_keys(apps, schema_editor):
+    # Historical models don't have update_lookup_keys(), so compute the keys here
+    Contact = apps.get_model('emergency_app', 'Contact')
+    Emergency = apps.get_model('emergency_app', 'Emergency')
+    using = schema_editor.connection.alias
+
+    def contact_keys(contact):
+        phone = (contact.phone_area or '') + (contact.phone_number or '')
+        contact.phone_key = normalize_phone(phone, contact.ctry_code_phone)
+
+    def emergency_keys(emergency):
+        emergency.primary_phone_key = normalize_phone(emergency.primary_phone)
+        emergency.alternate_phone_key = normalize_phone(emergency.alternate_phone)
+        emergency.sms_device_key = normalize_phone(emergency.sms_device)
+        emergency.external_email_key = normalize_email(emergency.external_email)
+
+    backfill(Contact, contact_keys, ['phone_key'], using)
+    backfill(Emergency, emergency_keys,
+             ['primary_phone_key', 'alternate_phone_key', 'sms_device_key', 'external_email_key'], using)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emergency_app', '0005_task_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contact',
+            name='phone_key',
+            field=models.CharField(db_column='SPREMRG_PHONE_KEY', db_index=True, max_length=72, null=True),
+        ),
+        migrations.AddField(
+            model_name='emergency',
+            name='alternate_phone_key',
+            field=models.CharField(db_column='ZGBNNN_BUSINESS_PHONE_KEY', db_index=True, max_length=72, null=True),
+        ),
+        migrations.AddField(
+            model_name='emergency',
+            name='external_email_key',
+            field=models.CharField(db_column='ZGBNNN_EMAIL_ADDRESS_KEY', db_index=True, max_length=512, null=True),
+        ),
+        migrations.AddField(
+            model_name='emergency',
+            name='primary_phone_key',
+            field=models.CharField(db_column='ZGBNNN_MOBILE_PHONE_KEY', db_index=True, max_length=72, null=True),
+        ),
+        migrations.AddField(
+            model_name='emergency',
+            name='sms_device_key',
+            field=models.CharField(db_column='ZGBNNN_SMS_DEVICE_1_KEY', db_index=True, max_length=72, null=True),
+        ),
+        migrations.RunPython(backfill_lookup_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 2.2.1 on 2026-10-19 12:49
+
+from django.db import migrations, models
+
+# Frozen copies of evacuation_roster's fields and rebuild as they were when the roster was added
+emergency_fields = ['campus_email', 'external_email', 'primary_phone', 'alternate_phone', 'sms_device']
+identity_fields = ['username', 'first_name', 'last_name']
+
+
+def build_roster(apps, schema_editor, batch_size=1000):
+    Emergency = apps.get_model('emergency_app', 'Emergency')
+    Identity = apps.get_model('emergency_app', 'Identity')
+    EvacuationRoster = apps.get_model('emergency_app', 'EvacuationRoster')
+    using = schema_editor.connection.alias
+    needing_assistance = Emergency.objects.using(using).filter(evacuation_assistance='Y').order_by('pidm')
+    last_pidm = None
+    while True:
+        batch = needing_assistance if last_pidm is None else needing_assistance.filter(pidm__gt=last_pidm)
+        batch = list(batch[:batch_size])
+        if not batch:
+            return
+        # ZGBIDMP is only on the default database
+        identities = Identity.objects.using('default').in_bulk([emergency.pidm for emergency in batch])
+        rows = []
+        for emergency in batch:
+            row = EvacuationRoster(pidm=emergency.pidm)
+            for field in emergency_fields:
+                setattr(row, field, getattr(emergency, field))
+            identity = identities.get(emergency.pidm)
+            for field in identity_fields:
+                setattr(row, field, getattr(identity, field) if identity else None)
+            rows.append(row)
+        EvacuationRoster.objects.using(using).bulk_create(rows)
+        last_pidm = batch[-1].pidm
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emergency_app', '0006_lookup_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EvacuationRoster',
+            fields=[
+                ('pidm', models.IntegerField(db_column='EVAC_ROSTER_PIDM', primary_key=True, serialize=False)),
+                ('username', models.CharField(db_column='EVAC_ROSTER_USERNAME', max_length=120, null=True)),
+                ('first_name', models.CharField(db_column='EVAC_ROSTER_FIRST_NAME', max_length=240, null=True)),
+                ('last_name', models.CharField(db_column='EVAC_ROSTER_LAST_NAME', max_length=240, null=True)),
+                ('campus_email', models.CharField(db_column='EVAC_ROSTER_CAMPUS_EMAIL', max_length=512, null=True)),
+                ('external_email', models.CharField(db_column='EVAC_ROSTER_EXTERNAL_EMAIL', max_length=512, null=True)),
+                ('primary_phone', models.CharField(db_column='EVAC_ROSTER_PRIMARY_PHONE', max_length=72, null=True)),
+                ('alternate_phone', models.CharField(db_column='EVAC_ROSTER_ALTERNATE_PHONE', max_length=72, null=True)),
+                ('sms_device', models.CharField(db_column='EVAC_ROSTER_SMS_DEVICE', max_length=72, null=True)),
+                ('activity_date', models.DateTimeField(auto_now=True, db_column='EVAC_ROSTER_ACTIVITY_DATE')),
+            ],
+            options={
+                'db_table': 'EVACUATION_ROSTER',
+            },
+        ),
+        migrations.RunPython(build_roster, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 2.2.1 on 2026-10-19 13:16
+
+from django.db import migrations
+from django.db.models import Count
+import django.db.models.deletion
+import emergency_app.models.fields
+
+# Placeholders the old forms could store instead of NULL
+blank_codes = ('', 'null', 'N/A')
+
+
+def check_codes(apps, schema_editor):
+    """
+    Every code must exist in its reference table before the constraints are added.
+    Each column is checked with one grouped query instead of row by row, placeholders are
+    set to NULL and any other unknown code stops the migration with the codes listed.
+    """
+    using = schema_editor.connection.alias
+    Contact = apps.get_model('emergency_app', 'Contact')
+    references = [
+        ('relt_code', apps.get_model('emergency_app', 'Relation'), 'code'),
+        ('stat_code', apps.get_model('emergency_app', 'State'), 'id'),
+        ('natn_code', apps.get_model('emergency_app', 'Nation'), 'id'),
+    ]
+    unknown = []
+    for column, model, key in references:
+        Contact.objects.using(using).filter(**{column + '__in': blank_codes}).update(**{column: None})
+        orphans = (
+            Contact.objects.using(using).exclude(**{column + '__isnull': True})
+            .exclude(**{column + '__in': model.objects.using(using).values(key)})
+            .values_list(column).annotate(rows=Count('pk')).order_by(column)
+        )
+        unknown.extend("%s %r (%d rows)" % (column, code, rows) for code, rows in orphans)
+    if unknown:
+        raise ValueError(
+            "SPREMRG has codes missing from the reference tables, load relation.yaml, nation.yaml "
+            "and state.yaml or fix the rows before migrating: " + ", ".join(unknown)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emergency_app', '0007_evacuation_roster'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_codes, migrations.RunPython.noop),
+        # Same columns, the fields are renamed so relt_code etc. can stay the names of the codes.
+        # The code columns keep Banner's widths, wider than the reference tables' keys for states and nations
+        migrations.RenameField(
+            model_name='contact',
+            old_name='relt_code',
+            new_name='relation',
+        ),
+        migrations.RenameField(
+            model_name='contact',
+            old_name='stat_code',
+            new_name='state',
+        ),
+        migrations.RenameField(
+            model_name='contact',
+            old_name='natn_code',
+            new_name='nation',
+        ),
+        migrations.AlterField(
+            model_name='contact',
+            name='relation',
+            field=emergency_app.models.fields.CodeForeignKey(attname='relt_code', db_column='SPREMRG_RELT_CODE', null=True, on_delete=django.db.models.deletion.PROTECT, to='emergency_app.Relation'),
+        ),
+        migrations.AlterField(
+            model_name='contact',
+            name='state',
+            field=emergency_app.models.fields.CodeForeignKey(attname='stat_code', db_column='SPREMRG_STAT_CODE', max_length=12, null=True, on_delete=django.db.models.deletion.PROTECT, to='emergency_app.State'),
+        ),
+        migrations.AlterField(
+            model_name='contact',
+            name='nation',
+            field=emergency_app.models.fields.CodeForeignKey(attname='natn_code', db_column='SPREMRG_NATN_CODE', max_length=20, null=True, on_delete=django.db.models.deletion.PROTECT, to='emergency_app.Nation'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.1 on 2026-10-19 13:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emergency_app', '0008_contact_foreign_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contact',
+            name='version',
+            field=models.IntegerField(db_column='SPREMRG_VERSION', default=1),
+        ),
+        migrations.AddField(
+            model_name='emergency',
+            name='version',
+            field=models.IntegerField(db_column='ZGBNNN_VERSION', default=1),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.1 on 2026-10-19 13:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emergency_app', '0009_row_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevokedToken',
+            fields=[
+                ('sequence', models.AutoField(db_column='REVOKED_TOKEN_SEQUENCE', primary_key=True, serialize=False)),
+                ('jti', models.CharField(db_column='REVOKED_TOKEN_JTI', max_length=64, unique=True)),
+                ('expires', models.DateTimeField(db_column='REVOKED_TOKEN_EXPIRES', db_index=True)),
+                ('activity_date', models.DateTimeField(auto_now_add=True, db_column='REVOKED_TOKEN_ACTIVITY_DATE')),
+            ],
+            options={
+                'db_table': 'REVOKED_TOKEN',
+            },
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 2.2.1 on 2026-10-19 13:42
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import migrations, models
+from django.db.models import F
+import json
+
+# Frozen copies of emergency_profile's fragments and rebuild as they were when the profiles were added
+notification_columns = ['external_email', 'campus_email', 'primary_phone', 'alternate_phone', 'sms_status_ind',
+                        'sms_device', 'version']
+evacuation_columns = ['evacuation_assistance', 'version']
+
+
+def encode(value):
+    return json.dumps(value, cls=DjangoJSONEncoder)
+
+
+def priority_order(contact):
+    priority = contact['priority']
+    return (0, int(priority)) if str(priority).isdigit() else (1, 0)
+
+
+def profile_rows(pidms, Contact, Emergency, EmergencyProfile, using):
+    contacts = {pidm: [] for pidm in pidms}
+    columns = [field.attname for field in Contact._meta.concrete_fields]
+    rows = Contact.objects.using(using).filter(pidm__in=pidms).values(
+        *columns, relation_description=F('relation__description'), state_name=F('state__value'),
+        nation_name=F('nation__value'))
+    for contact in rows:
+        contacts[contact['pidm']].append(contact)
+    emergencies = {emergency['pidm']: emergency for emergency in
+                   Emergency.objects.using(using).filter(pidm__in=pidms).values('pidm', 'evacuation_assistance', *notification_columns)}
+    profiles = []
+    for pidm in pidms:
+        emergency = emergencies.get(pidm)
+        profiles.append(EmergencyProfile(
+            pidm=pidm,
+            contacts=encode(sorted(contacts[pidm], key=priority_order)),
+            notifications=encode([{column: emergency[column] for column in notification_columns}] if emergency else []),
+            evacuation_assistance=encode([{column: emergency[column] for column in evacuation_columns}] if emergency else []),
+        ))
+    return profiles
+
+
+def build_profiles(apps, schema_editor, batch_size=1000):
+    Contact = apps.get_model('emergency_app', 'Contact')
+    Emergency = apps.get_model('emergency_app', 'Emergency')
+    EmergencyProfile = apps.get_model('emergency_app', 'EmergencyProfile')
+    using = schema_editor.connection.alias
+    pidms = set(Contact.objects.using(using).values_list('pidm', flat=True).distinct())
+    pidms.update(Emergency.objects.using(using).values_list('pidm', flat=True))
+    pidms = sorted(pidms)
+    for start in range(0, len(pidms), batch_size):
+        batch = pidms[start:start + batch_size]
+        EmergencyProfile.objects.using(using).bulk_create(profile_rows(batch, Contact, Emergency, EmergencyProfile, using))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emergency_app', '0010_revoked_tokens'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmergencyProfile',
+            fields=[
+                ('pidm', models.IntegerField(db_column='EMRG_PROFILE_PIDM', primary_key=True, serialize=False)),
+                ('contacts', models.TextField(db_column='EMRG_PROFILE_CONTACTS')),
+                ('notifications', models.TextField(db_column='EMRG_PROFILE_NOTIFICATIONS')),
+                ('evacuation_assistance', models.TextField(db_column='EMRG_PROFILE_EVAC_ASSIST')),
+                ('activity_date', models.DateTimeField(auto_now=True, db_column='EMRG_PROFILE_ACTIVITY_DATE')),
+            ],
+            options={
+                'db_table': 'EMERGENCY_PROFILE',
+            },
+        ),
+        migrations.RunPython(build_profiles, migrations.RunPython.noop),
+    ]
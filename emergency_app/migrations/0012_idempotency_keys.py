@@ -0,0 +1,31 @@
+# Generated by Django 2.2.1 on 2026-10-19 14:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emergency_app', '0011_emergency_profiles'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.AutoField(db_column='IDEMPOTENCY_KEY_ID', primary_key=True, serialize=False)),
+                ('key', models.CharField(db_column='IDEMPOTENCY_KEY_VALUE', max_length=255)),
+                ('pidm', models.IntegerField(db_column='IDEMPOTENCY_KEY_PIDM')),
+                ('fingerprint', models.CharField(db_column='IDEMPOTENCY_KEY_FINGERPRINT', max_length=64)),
+                ('response_status', models.IntegerField(db_column='IDEMPOTENCY_KEY_STATUS', null=True)),
+                ('response_content', models.BinaryField(db_column='IDEMPOTENCY_KEY_CONTENT', null=True)),
+                ('response_content_type', models.CharField(db_column='IDEMPOTENCY_KEY_CONTENT_TYPE', max_length=120, null=True)),
+                ('expires', models.DateTimeField(db_column='IDEMPOTENCY_KEY_EXPIRES', db_index=True)),
+                ('activity_date', models.DateTimeField(auto_now=True, db_column='IDEMPOTENCY_KEY_ACTIVITY_DATE')),
+            ],
+            options={
+                'db_table': 'IDEMPOTENCY_KEY',
+                'unique_together': {('key', 'pidm')},
+            },
+        ),
+    ]
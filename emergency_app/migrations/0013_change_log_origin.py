@@ -0,0 +1,24 @@
+# Generated by Django 2.2.1 on 2026-10-19 14:10
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emergency_app', '0012_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='changelog',
+            name='origin',
+            field=models.CharField(db_column='CHANGE_LOG_ORIGIN', max_length=80, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='changelog',
+            name='activity_date',
+            field=models.DateTimeField(db_column='CHANGE_LOG_ACTIVITY_DATE', default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.1 on 2026-10-19 15:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('emergency_app', '0013_change_log_origin'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SurrogateSequence',
+            fields=[
+                ('name', models.CharField(db_column='SURROGATE_SEQUENCE_NAME', max_length=30, primary_key=True, serialize=False)),
+                ('last_value', models.BigIntegerField(db_column='SURROGATE_SEQUENCE_LAST_VALUE')),
+            ],
+            options={
+                'db_table': 'SURROGATE_SEQUENCE',
+            },
+        ),
+    ]
@@ -4,3 +4,10 @@ from .identity import Identity
 from .relation import Relation
 from .nation import Nation
 from .state import State
+from .change_log import ChangeLog, ChangeLogCursor
+from .task import Task
+from .evacuation_roster import EvacuationRoster
+from .revoked_token import RevokedToken
+from .emergency_profile import EmergencyProfile
+from .idempotency_key import IdempotencyKey
+from .surrogate_sequence import SurrogateSequence
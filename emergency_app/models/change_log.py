@@ -0,0 +1,45 @@
+from django.db import models
+from django.utils import timezone
+
+
+class ChangeLog(models.Model):
+    # Monotonic sequence number, consumers use it as their cursor
+    # (AutoField is AUTOINCREMENT on sqlite, so numbers are never reused)
+    sequence = models.AutoField(db_column='CHANGE_LOG_SEQUENCE', primary_key=True)
+
+    # Person whose data changed
+    pidm = models.IntegerField(db_column='CHANGE_LOG_PIDM', db_index=True)
+
+    # Table that was changed (SPREMRG, ZGBNNN) and the primary key of the changed row
+    table_name = models.CharField(db_column='CHANGE_LOG_TABLE', max_length=30)
+    row_key = models.CharField(db_column='CHANGE_LOG_ROW_KEY', max_length=30, null=True)
+
+    # 'I'nsert, 'U'pdate or 'D'elete
+    operation = models.CharField(db_column='CHANGE_LOG_OPERATION', max_length=1)
+
+    # JSON object of the changed fields and their new values
+    changed_fields = models.TextField(db_column='CHANGE_LOG_CHANGED_FIELDS')
+
+    # Date the change was recorded, kept when a shard's entry is relayed to the default database
+    activity_date = models.DateTimeField(db_column='CHANGE_LOG_ACTIVITY_DATE', default=timezone.now)
+
+    # Shard and sequence an entry relayed from another shard was written with (e.g. "shard_1:42"),
+    # so it's never relayed twice. Null for entries written on the default database.
+    origin = models.CharField(db_column='CHANGE_LOG_ORIGIN', max_length=80, null=True, unique=True)
+
+    class Meta:
+        db_table = 'CHANGE_LOG'
+
+
+class ChangeLogCursor(models.Model):
+    # Name of the downstream consumer (e.g. banner, alert_vendor)
+    consumer = models.CharField(db_column='CHANGE_LOG_CURSOR_CONSUMER', max_length=60, primary_key=True)
+
+    # Last sequence number the consumer has processed
+    sequence = models.IntegerField(db_column='CHANGE_LOG_CURSOR_SEQUENCE', default=0)
+
+    # Date of last update
+    activity_date = models.DateTimeField(db_column='CHANGE_LOG_CURSOR_ACTIVITY_DATE', auto_now=True)
+
+    class Meta:
+        db_table = 'CHANGE_LOG_CURSOR'
@@ -1,9 +1,16 @@
 from django.db import models
+from common.util import sanitization
+from common.util import sharding
+from .fields import CodeForeignKey
+from .nation import Nation
+from .relation import Relation
+from .state import State
+
 
-# should we put foreign keys on this model?
 class Contact(models.Model):
-    # Primary key
-    surrogate_id = models.IntegerField(db_column='SPREMRG_SURROGATE_ID', primary_key=True)
+    # Primary key, sequence generated like the Banner column so new contacts know their id after saving.
+    # With several shards it's drawn from the sequence they share (common/util/sharding.py)
+    surrogate_id = models.AutoField(db_column='SPREMRG_SURROGATE_ID', primary_key=True)
 
     # Personal identifier
     pidm = models.IntegerField(db_column='SPREMRG_PIDM')
@@ -11,8 +18,8 @@ class Contact(models.Model):
     # Contact priority
     priority = models.CharField(db_column='SPREMRG_PRIORITY', max_length=4)
 
-    # Contact's relation to this person
-    relt_code = models.CharField(db_column='SPREMRG_RELT_CODE', max_length=4, null=True)
+    # Contact's relation to this person, the code is contact.relt_code
+    relation = CodeForeignKey(Relation, 'relt_code', db_column='SPREMRG_RELT_CODE', null=True)
 
     # Contact name
     last_name = models.CharField(db_column='SPREMRG_LAST_NAME', max_length=240)
@@ -24,8 +31,8 @@ class Contact(models.Model):
     street_line2 = models.CharField(db_column='SPREMRG_STREET_LINE2', max_length=300, null=True)
     street_line3 = models.CharField(db_column='SPREMRG_STREET_LINE3', max_length=300, null=True)
     city = models.CharField(db_column='SPREMRG_CITY', max_length=200, null=True)
-    stat_code = models.CharField(db_column='SPREMRG_STAT_CODE', max_length=12, null=True)
-    natn_code = models.CharField(db_column='SPREMRG_NATN_CODE', max_length=20, null=True)
+    state = CodeForeignKey(State, 'stat_code', db_column='SPREMRG_STAT_CODE', max_length=12, null=True)
+    nation = CodeForeignKey(Nation, 'natn_code', db_column='SPREMRG_NATN_CODE', max_length=20, null=True)
     zip = models.CharField(db_column='SPREMRG_ZIP', max_length=120, null=True)
 
     # Contact phone number
@@ -37,5 +44,28 @@ class Contact(models.Model):
     # Date of last update
     activity_date = models.DateTimeField(db_column='SPREMRG_ACTIVITY_DATE', auto_now=True)
 
+    # Incremented by every write, writers check it to not overwrite changes they haven't seen (common/util/concurrency.py)
+    version = models.IntegerField(db_column='SPREMRG_VERSION', default=1)
+
+    # Normalized phone number (E.164 digits) for bounce and opt-out lookups, kept in sync by save()
+    phone_key = models.CharField(db_column='SPREMRG_PHONE_KEY', max_length=72, null=True, db_index=True)
+
+    # Fields derived by update_lookup_keys(), include them when writing with bulk_update
+    lookup_key_fields = ['phone_key']
+
     class Meta:
         db_table = 'SPREMRG'
+        indexes = [
+            # Keyset index for the incremental "modified since" export
+            models.Index(fields=['activity_date', 'surrogate_id'], name='SPREMRG_ACTIVITY_DATE_IDX'),
+        ]
+
+    def update_lookup_keys(self):
+        phone = (self.phone_area or '') + (self.phone_number or '')
+        self.phone_key = sanitization.normalize_phone(phone, self.ctry_code_phone)
+
+    def save(self, *args, **kwargs):
+        self.update_lookup_keys()
+        if sharding.assign_surrogate_ids([self]):
+            kwargs['force_insert'] = True
+        super(Contact, self).save(*args, **kwargs)
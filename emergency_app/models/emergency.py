@@ -1,4 +1,5 @@
 from django.db import models
+from common.util import sanitization
 
 
 class Emergency(models.Model):
@@ -23,5 +24,31 @@ class Emergency(models.Model):
     # Date of last update
     activity_date = models.DateTimeField(db_column='ZGBNNN_ACTIVITY_DATE', auto_now=True, null=True)
 
+    # Incremented by every write, writers check it to not overwrite changes they haven't seen (common/util/concurrency.py)
+    version = models.IntegerField(db_column='ZGBNNN_VERSION', default=1)
+
+    # Normalized addresses (E.164 digits, lowercased email) for bounce and opt-out lookups, kept in sync by save()
+    primary_phone_key = models.CharField(db_column='ZGBNNN_MOBILE_PHONE_KEY', max_length=72, null=True, db_index=True)
+    alternate_phone_key = models.CharField(db_column='ZGBNNN_BUSINESS_PHONE_KEY', max_length=72, null=True, db_index=True)
+    sms_device_key = models.CharField(db_column='ZGBNNN_SMS_DEVICE_1_KEY', max_length=72, null=True, db_index=True)
+    external_email_key = models.CharField(db_column='ZGBNNN_EMAIL_ADDRESS_KEY', max_length=512, null=True, db_index=True)
+
+    # Fields derived by update_lookup_keys(), include them when writing with bulk_update
+    lookup_key_fields = ['primary_phone_key', 'alternate_phone_key', 'sms_device_key', 'external_email_key']
+
     class Meta:
         db_table = 'ZGBNNN'
+        indexes = [
+            # Keyset index for the incremental "modified since" export
+            models.Index(fields=['activity_date', 'pidm'], name='ZGBNNN_ACTIVITY_DATE_IDX'),
+        ]
+
+    def update_lookup_keys(self):
+        self.primary_phone_key = sanitization.normalize_phone(self.primary_phone)
+        self.alternate_phone_key = sanitization.normalize_phone(self.alternate_phone)
+        self.sms_device_key = sanitization.normalize_phone(self.sms_device)
+        self.external_email_key = sanitization.normalize_email(self.external_email)
+
+    def save(self, *args, **kwargs):
+        self.update_lookup_keys()
+        super(Emergency, self).save(*args, **kwargs)
@@ -0,0 +1,21 @@
+from django.db import models
+
+
+# Denormalized, pre-serialized copy of what the read endpoints return for one person.
+# Rebuilt by every write to their SPREMRG and ZGBNNN rows, see common/util/emergency_profile.py
+class EmergencyProfile(models.Model):
+    # Unique person identifier
+    pidm = models.IntegerField(db_column='EMRG_PROFILE_PIDM', primary_key=True)
+
+    # JSON list of the person's contacts by priority, as getEmergencyContacts returns them
+    contacts = models.TextField(db_column='EMRG_PROFILE_CONTACTS')
+
+    # JSON lists of the ZGBNNN columns getEmergencyNotifications and getEvacuationAssistance return, empty without a row
+    notifications = models.TextField(db_column='EMRG_PROFILE_NOTIFICATIONS')
+    evacuation_assistance = models.TextField(db_column='EMRG_PROFILE_EVAC_ASSIST')
+
+    # Date of last rebuild
+    activity_date = models.DateTimeField(db_column='EMRG_PROFILE_ACTIVITY_DATE', auto_now=True)
+
+    class Meta:
+        db_table = 'EMERGENCY_PROFILE'
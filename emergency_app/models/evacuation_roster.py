@@ -0,0 +1,26 @@
+from django.db import models
+
+
+# Denormalized list of everyone who needs evacuation assistance, with their contact details.
+# Kept up to date by the writes to ZGBNNN, see common/util/evacuation_roster.py
+class EvacuationRoster(models.Model):
+    # Unique person identifier
+    pidm = models.IntegerField(db_column='EVAC_ROSTER_PIDM', primary_key=True)
+
+    # Name and username, from ZGBIDMP
+    username = models.CharField(db_column='EVAC_ROSTER_USERNAME', max_length=120, null=True)
+    first_name = models.CharField(db_column='EVAC_ROSTER_FIRST_NAME', max_length=240, null=True)
+    last_name = models.CharField(db_column='EVAC_ROSTER_LAST_NAME', max_length=240, null=True)
+
+    # How to reach them, from ZGBNNN
+    campus_email = models.CharField(db_column='EVAC_ROSTER_CAMPUS_EMAIL', max_length=512, null=True)
+    external_email = models.CharField(db_column='EVAC_ROSTER_EXTERNAL_EMAIL', max_length=512, null=True)
+    primary_phone = models.CharField(db_column='EVAC_ROSTER_PRIMARY_PHONE', max_length=72, null=True)
+    alternate_phone = models.CharField(db_column='EVAC_ROSTER_ALTERNATE_PHONE', max_length=72, null=True)
+    sms_device = models.CharField(db_column='EVAC_ROSTER_SMS_DEVICE', max_length=72, null=True)
+
+    # Date of last update
+    activity_date = models.DateTimeField(db_column='EVAC_ROSTER_ACTIVITY_DATE', auto_now=True)
+
+    class Meta:
+        db_table = 'EVACUATION_ROSTER'
@@ -0,0 +1,32 @@
+from django.db import models
+
+
+class CodeForeignKey(models.ForeignKey):
+    """
+    Foreign key to a reference table whose raw value keeps the name of the Banner code column
+    (e.g. relt_code) instead of Django's <name>_id, so contact.relt_code is still the code that
+    the endpoints, exports and change log use, and contact.relation is the referenced row
+    Args:
+            to (Model class): the reference table
+            attname (str): name of the code attribute
+            max_length (int): width of the code column when Banner's is wider than the referenced key,
+                defaults to the key's
+    """
+
+    def __init__(self, to, attname, **kwargs):
+        self.code_attname = attname
+        kwargs.setdefault('on_delete', models.PROTECT)
+        super(CodeForeignKey, self).__init__(to, **kwargs)
+
+    def get_attname(self):
+        return self.code_attname
+
+    def db_type(self, connection):
+        if self.max_length is None:
+            return super(CodeForeignKey, self).db_type(connection)
+        return models.CharField(max_length=self.max_length).db_type(connection)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(CodeForeignKey, self).deconstruct()
+        kwargs['attname'] = self.code_attname
+        return name, path, args, kwargs
@@ -0,0 +1,27 @@
+from django.db import models
+
+
+class IdempotencyKey(models.Model):
+    id = models.AutoField(db_column='IDEMPOTENCY_KEY_ID', primary_key=True)
+
+    # Idempotency-Key header of the request, unique per person
+    key = models.CharField(db_column='IDEMPOTENCY_KEY_VALUE', max_length=255)
+    pidm = models.IntegerField(db_column='IDEMPOTENCY_KEY_PIDM')
+
+    # Digest of the request, to recognise a key reused for another request
+    fingerprint = models.CharField(db_column='IDEMPOTENCY_KEY_FINGERPRINT', max_length=64)
+
+    # Response replayed to retries, null while the first request is running
+    response_status = models.IntegerField(db_column='IDEMPOTENCY_KEY_STATUS', null=True)
+    response_content = models.BinaryField(db_column='IDEMPOTENCY_KEY_CONTENT', null=True)
+    response_content_type = models.CharField(db_column='IDEMPOTENCY_KEY_CONTENT_TYPE', max_length=120, null=True)
+
+    # When retries stop being replayed, the row is purged after that
+    expires = models.DateTimeField(db_column='IDEMPOTENCY_KEY_EXPIRES', db_index=True)
+
+    # Date of last update, when the first request claimed the key or completed
+    activity_date = models.DateTimeField(db_column='IDEMPOTENCY_KEY_ACTIVITY_DATE', auto_now=True)
+
+    class Meta:
+        db_table = 'IDEMPOTENCY_KEY'
+        unique_together = [('key', 'pidm')]
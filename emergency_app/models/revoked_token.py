@@ -0,0 +1,18 @@
+from django.db import models
+
+
+class RevokedToken(models.Model):
+    # Monotonic sequence number, processes read the revocations after the last one they have seen
+    sequence = models.AutoField(db_column='REVOKED_TOKEN_SEQUENCE', primary_key=True)
+
+    # jti claim of the revoked JWT, shared by the tokens refreshed from it
+    jti = models.CharField(db_column='REVOKED_TOKEN_JTI', max_length=64, unique=True)
+
+    # When the last token with this jti expires, the row is purged after that
+    expires = models.DateTimeField(db_column='REVOKED_TOKEN_EXPIRES', db_index=True)
+
+    # Date the token was revoked
+    activity_date = models.DateTimeField(db_column='REVOKED_TOKEN_ACTIVITY_DATE', auto_now_add=True)
+
+    class Meta:
+        db_table = 'REVOKED_TOKEN'
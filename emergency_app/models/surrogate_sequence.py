@@ -0,0 +1,12 @@
+from django.db import models
+
+
+class SurrogateSequence(models.Model):
+    # Table whose surrogate ids the sequence hands out, e.g. SPREMRG
+    name = models.CharField(db_column='SURROGATE_SEQUENCE_NAME', max_length=30, primary_key=True)
+
+    # Highest id handed out, shared by every shard so a row keeps a unique id wherever it lives
+    last_value = models.BigIntegerField(db_column='SURROGATE_SEQUENCE_LAST_VALUE')
+
+    class Meta:
+        db_table = 'SURROGATE_SEQUENCE'
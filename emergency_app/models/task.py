@@ -0,0 +1,34 @@
+from django.db import models
+
+
+class Task(models.Model):
+    # Task states
+    PENDING = 'P'
+    RUNNING = 'R'
+    DONE = 'D'
+    FAILED = 'F'
+
+    # Queue position
+    id = models.AutoField(db_column='TASK_ID', primary_key=True)
+
+    # Registered task name (module.function) and its json encoded [args, kwargs]
+    name = models.CharField(db_column='TASK_NAME', max_length=200)
+    arguments = models.TextField(db_column='TASK_ARGUMENTS')
+
+    # Current state, attempts so far and when it may run next
+    status = models.CharField(db_column='TASK_STATUS', max_length=1, default=PENDING)
+    attempts = models.IntegerField(db_column='TASK_ATTEMPTS', default=0)
+    run_after = models.DateTimeField(db_column='TASK_RUN_AFTER')
+
+    # Error of the last failed attempt
+    last_error = models.TextField(db_column='TASK_LAST_ERROR', null=True)
+
+    # Date of last update
+    activity_date = models.DateTimeField(db_column='TASK_ACTIVITY_DATE', auto_now=True)
+
+    class Meta:
+        db_table = 'TASK_QUEUE'
+        indexes = [
+            # The worker polls for due pending tasks
+            models.Index(fields=['status', 'run_after'], name='TASK_QUEUE_DUE_IDX'),
+        ]
@@ -0,0 +1,67 @@
+"""
+    Preloading of shared read-only data, for pre-fork WSGI servers (gunicorn --preload,
+    uWSGI without lazy-apps). Everything loaded here before the fork is shared
+    copy-on-write by the workers instead of being loaded again by each of them.
+    See emp_backend/wsgi_preload.py and benchmarks/preload_rss.py.
+"""
+import gc
+import time
+from collections import OrderedDict
+import zipcodes
+from django.db import connections
+from django.urls import get_resolver
+from common.util import reference_data
+from common.util import sanitization
+
+
+def preload_modules():
+    """
+    Imports and builds everything that doesn't need the database: the url conf with the views
+    and validators it imports, the zipcodes dataset and the regexes the validators compile on first use
+    Returns:
+            OrderedDict: step name -> seconds taken
+    """
+    timings = OrderedDict()
+
+    started = time.monotonic()
+    get_resolver().url_patterns
+    timings['urls'] = time.monotonic() - started
+
+    started = time.monotonic()
+    zipcodes.is_real('97201')
+    timings['zipcodes'] = time.monotonic() - started
+
+    started = time.monotonic()
+    # fills the re module's cache of compiled patterns
+    sanitization.validate_email('preload@pdx.edu')
+    sanitization.validate_username('preload')
+    sanitization.normalize_phone('5035552345')
+    timings['validators'] = time.monotonic() - started
+
+    return timings
+
+
+def preload(freeze=False):
+    """
+    Loads all shared read-only data: preload_modules() and the reference tables.
+    The database connections opened here are closed, workers must never share them.
+    Args:
+            freeze (bool): move everything allocated so far to the permanent gc generation, so
+                the workers' garbage collections don't touch (and copy) the shared pages
+    Returns:
+            OrderedDict: step name -> seconds taken
+    """
+    timings = preload_modules()
+
+    started = time.monotonic()
+    reference_data.load()
+    timings['reference_data'] = time.monotonic() - started
+    connections.close_all()
+
+    if freeze:
+        started = time.monotonic()
+        gc.collect()
+        gc.freeze()
+        timings['gc_freeze'] = time.monotonic() - started
+
+    return timings
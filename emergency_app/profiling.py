@@ -0,0 +1,220 @@
+"""
+    Opt-in profiling of single requests in production.
+    A request is profiled when it carries a valid X-EMP-Profile header (signed with the
+    SECRET_KEY, see `manage.py sign_profile_header`) or is picked by
+    settings.EMP_PROFILE_SAMPLE_RATE. The view is run under one of two profilers:
+        cprofile - deterministic, written as a pstats file (.prof)
+        sample   - a thread sampling the view's stack, written as flamegraph-ready
+                   collapsed stacks (.collapsed), with much lower overhead
+    Files go to settings.EMP_PROFILE_DIR, named after the endpoint, and the oldest are deleted
+    once the directory exceeds settings.EMP_PROFILE_MAX_BYTES.
+    `manage.py aggregate_profiles` combines them per endpoint.
+"""
+import cProfile
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from django.conf import settings
+from django.core import signing
+from django.utils.deprecation import MiddlewareMixin
+
+logger = logging.getLogger(__name__)
+
+# Profilers
+CPROFILE = 'cprofile'
+SAMPLE = 'sample'
+
+# File extension per profiler
+extensions = {CPROFILE: '.prof', SAMPLE: '.collapsed'}
+
+header = 'HTTP_X_EMP_PROFILE'
+signing_salt = 'emergency_app.profiling'
+
+# Separates the endpoint from the rest of a profile's file name
+name_separator = '__'
+
+
+def sign(mode):
+    """
+    Returns:
+            str: X-EMP-Profile header value requesting a profile, valid for settings.EMP_PROFILE_HEADER_MAX_AGE seconds
+    """
+    return signing.TimestampSigner(salt=signing_salt).sign(mode)
+
+
+def requested_mode(request):
+    """
+    Returns:
+            str: the profiler to run for this request, or None to not profile it
+    """
+    value = request.META.get(header)
+    if value:
+        try:
+            mode = signing.TimestampSigner(salt=signing_salt).unsign(value, max_age=settings.EMP_PROFILE_HEADER_MAX_AGE)
+        except signing.BadSignature:
+            return None
+        return mode if mode in extensions else None
+    if settings.EMP_PROFILE_SAMPLE_RATE and random.random() < settings.EMP_PROFILE_SAMPLE_RATE:
+        return settings.EMP_PROFILE_MODE
+    return None
+
+
+def endpoint_name(request):
+    # updateEmergencyContact/<int:surrogate_id>/ -> updateEmergencyContact_int_surrogate_id
+    route = request.resolver_match.route if request.resolver_match else request.path
+    return re.sub('[^0-9A-Za-z]+', '_', route).strip('_') or 'root'
+
+
+class StackSampler:
+    """
+    Samples one thread's stack every interval seconds from a background thread,
+    counting each distinct stack as collapsed 'outer;...;inner' frames
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='emp-profile-sampler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s:%s:%d' % (code.co_filename.rsplit(os.sep, 1)[-1], code.co_name, frame.f_lineno))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return ''.join('%s %d\n' % (stack, count) for stack, count in self.stacks.most_common())
+
+
+def rotate(directory, max_bytes):
+    """
+    Deletes the oldest profiles until the directory holds at most max_bytes
+    """
+    files = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.endswith(tuple(extensions.values())):
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for mtime, size, path in files)
+    for mtime, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+class ProfilingMiddleware(MiddlewareMixin):
+    """
+    Runs the view under a profiler when requested, see the module docstring.
+    Must come last, it calls the view itself.
+    """
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        mode = requested_mode(request)
+        if mode is None:
+            return None
+
+        if mode == CPROFILE:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            profiler = StackSampler(threading.get_ident(), settings.EMP_PROFILE_SAMPLE_INTERVAL)
+            profiler.start()
+        started = time.monotonic()
+        try:
+            response = view_func(request, *view_args, **view_kwargs)
+        finally:
+            if mode == CPROFILE:
+                profiler.disable()
+            else:
+                profiler.stop()
+            try:
+                name = self.save(request, mode, profiler, time.monotonic() - started)
+            except Exception:
+                # Losing the profile mustn't cost the user their response
+                logger.warning("Couldn't save the %s profile of %s", mode, request.path, exc_info=True)
+                name = None
+        if name:
+            response['X-EMP-Profile-File'] = name
+        return response
+
+    def save(self, request, mode, profiler, elapsed):
+        directory = settings.EMP_PROFILE_DIR
+        os.makedirs(directory, exist_ok=True)
+        # The request id comes from the client's X-Request-ID, keep it out of the path (no separators, dots or '__')
+        request_id = re.sub('[^0-9A-Za-z-]+', '', getattr(request, 'request_id', None) or '')[:64]
+        name = name_separator.join((
+            endpoint_name(request),
+            time.strftime('%Y%m%dT%H%M%S'),
+            '%dms' % (elapsed * 1000),
+            request_id or uuid.uuid4().hex,
+        )) + extensions[mode]
+        path = os.path.join(directory, name)
+        if mode == CPROFILE:
+            profiler.dump_stats(path)
+        else:
+            with open(path, 'w') as collapsed:
+                collapsed.write(profiler.collapsed())
+        rotate(directory, settings.EMP_PROFILE_MAX_BYTES)
+        return name
+
+
+def captured(directory, endpoint=None):
+    """
+    Groups the profiles in a directory by endpoint and profiler
+    Args:
+            directory (str): where the profiles were written
+            endpoint (str): only this endpoint, as named in the file names
+    Returns:
+            dict: endpoint -> profiler -> list of (path, milliseconds the view took), oldest first
+    """
+    profiles = {}
+    for name in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+        for mode, extension in extensions.items():
+            parts = name[:-len(extension)].split(name_separator)
+            if not name.endswith(extension) or len(parts) != 4:
+                continue
+            if endpoint and parts[0] != endpoint:
+                continue
+            milliseconds = int(parts[2].rstrip('ms'))
+            profiles.setdefault(parts[0], {}).setdefault(mode, []).append((os.path.join(directory, name), milliseconds))
+    return profiles
+
+
+def combine_collapsed(paths):
+    """
+    Sums collapsed stack files, e.g. for one flamegraph of an endpoint
+    Returns:
+            Counter: stack -> samples
+    """
+    stacks = Counter()
+    for path in paths:
+        with open(path) as collapsed:
+            for line in collapsed:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if stack:
+                    stacks[stack] += int(count)
+    return stacks
@@ -0,0 +1,161 @@
+from django.test import TestCase, Client, override_settings
+from emergency_app import admission
+from emergency_app.models.identity import Identity
+from emergency_app.test_views import populate_static_tables
+
+import json
+import threading
+import time
+
+auth_url = '/login/'
+get_relationship_url = '/getRelations/'
+export_url = '/exportModifiedSince/'
+admission_counters_url = '/getAdmissionCounters/'
+
+success_code = 200
+service_unavailable_code = 503
+
+classes = {
+	'write': {'limit': 1, 'queue': 2, 'timeout': 5, 'retry_after': 2},
+	'read': {'limit': 1, 'queue': 2, 'timeout': 5, 'retry_after': 2},
+	'reference': {'limit': 1, 'queue': 0, 'timeout': 0, 'retry_after': 30},
+}
+
+
+class AdmissionControllerTests(TestCase):
+	"""
+	Testing the limits, queues and priorities of the admission controller
+	"""
+
+	def wait_for(self, controller, name, waiting):
+		deadline = time.monotonic() + 5
+		while controller.counters()['classes'][name]['waiting'] != waiting:
+			self.assertLess(time.monotonic(), deadline, "%s never had %d waiting" % (name, waiting))
+			time.sleep(0.001)
+
+	def test_limits(self):
+		controller = admission.AdmissionController(classes, max_in_flight=10)
+		self.assertTrue(controller.admit('reference'))
+		""" Reference data doesn't queue, over its limit it is shed right away """
+		self.assertFalse(controller.admit('reference'))
+		controller.release('reference')
+		self.assertTrue(controller.admit('reference'))
+
+		counters = controller.counters()
+		self.assertEqual(counters['in_flight'], 1)
+		self.assertEqual(counters['classes']['reference']['admitted'], 2)
+		self.assertEqual(counters['classes']['reference']['shed'], 1)
+
+	def test_queue_and_timeout(self):
+		controller = admission.AdmissionController(dict(classes, read=dict(classes['read'], timeout=0.01)), max_in_flight=10)
+		self.assertTrue(controller.admit('read'))
+		self.assertFalse(controller.admit('read'))
+		counters = controller.counters()['classes']['read']
+		self.assertEqual((counters['queued'], counters['timed_out'], counters['waiting']), (1, 1, 0))
+
+		""" A request waiting for a slot gets it once one is released """
+		admitted = []
+		waiter = threading.Thread(target=lambda: admitted.append(controller.admit('write')))
+		self.assertTrue(controller.admit('write'))
+		waiter.start()
+		self.wait_for(controller, 'write', 1)
+		controller.release('write')
+		waiter.join()
+		self.assertEqual(admitted, [True])
+		self.assertGreater(controller.counters()['classes']['write']['max_wait_seconds'], 0)
+
+	def test_priority(self):
+		"""
+		When the process is full, a freed slot goes to the waiting write before the waiting read
+		"""
+		controller = admission.AdmissionController(classes, max_in_flight=1)
+		self.assertTrue(controller.admit('reference'))
+		order = []
+
+		def request(name):
+			controller.admit(name)
+			order.append(name)
+			controller.release(name)
+
+		reader = threading.Thread(target=request, args=('read',))
+		writer = threading.Thread(target=request, args=('write',))
+		reader.start()
+		self.wait_for(controller, 'read', 1)
+		writer.start()
+		self.wait_for(controller, 'write', 1)
+		controller.release('reference')
+		reader.join()
+		writer.join()
+		self.assertEqual(order, ['write', 'read'])
+		self.assertEqual(controller.counters()['in_flight'], 0)
+
+
+@override_settings(EMP_ADMINISTRATORS=['admin1'], EMP_ADMISSION_CLASSES=classes,
+				EMP_ADMISSION_ENDPOINTS={'getRelations': 'reference', 'exportModifiedSince': 'read'})
+class AdmissionControlMiddlewareTests(TestCase):
+	"""
+	Testing that the middleware sheds what the controller doesn't admit and exposes its counters
+	"""
+	databases = '__all__'
+
+	def setUp(self):
+		admission.reset()
+		populate_static_tables()
+		Identity.objects.create(pidm=1, username='admin1', first_name='Ad', last_name='Min', email='admin1@pdx.edu')
+
+	def tearDown(self):
+		admission.reset()
+
+	def test_shedding(self):
+		c = Client()
+		self.assertEqual(c.get(get_relationship_url).status_code, success_code)
+
+		""" Over the limit, shed with a Retry-After and the CORS headers browsers need to read it """
+		admission.get_controller().admit('reference')
+		response = c.get(get_relationship_url, HTTP_ORIGIN='https://emp.pdx.edu')
+		self.assertEqual(response.status_code, service_unavailable_code)
+		self.assertEqual(response['Retry-After'], '30')
+		self.assertEqual(response['Access-Control-Allow-Origin'], '*')
+		admission.get_controller().release('reference')
+
+		""" Requests that waited too long in the load balancer's queue are shed """
+		response = c.get(get_relationship_url, HTTP_X_REQUEST_START='t=%d' % ((time.time() - 60) * 1000))
+		self.assertEqual(response.status_code, service_unavailable_code)
+		response = c.get(get_relationship_url, HTTP_X_REQUEST_START='t=%.3f' % time.time())
+		self.assertEqual(response.status_code, success_code)
+
+		""" Endpoints without a class are always admitted """
+		with self.settings(EMP_ADMISSION_ENDPOINTS={}):
+			admission.get_controller().admit('reference')
+			self.assertEqual(c.get(get_relationship_url).status_code, success_code)
+
+		with self.settings(EMP_ADMISSION_ENABLED=False):
+			self.assertEqual(c.get(get_relationship_url).status_code, success_code)
+
+	def test_single_threaded_server(self):
+		"""
+		A server running one request at a time is warned about once
+		"""
+		admission._warned_single_threaded = False
+		with self.assertLogs('emergency_app.admission', 'WARNING') as logs:
+			Client().get(get_relationship_url)
+			Client().get(get_relationship_url)
+		self.assertEqual(len(logs.records), 1)
+
+	def test_counters(self):
+		c = Client()
+		jwt = c.post(auth_url, {'username': 'admin1'}).content.decode('utf-8')
+
+		""" Streaming responses hold their slot until they are sent """
+		response = c.get(export_url, {'since': '2019-05-01T12:00:00+00:00'}, HTTP_AUTHORIZATION=jwt)
+		self.assertTrue(response.streaming)
+		self.assertEqual(admission.get_controller().counters()['classes']['read']['in_flight'], 1)
+		b''.join(response.streaming_content)
+		response.close()
+
+		response = c.get(admission_counters_url, HTTP_AUTHORIZATION=jwt)
+		self.assertEqual(response.status_code, success_code)
+		counters = json.loads(response.content)
+		self.assertEqual(counters['in_flight'], 0)
+		self.assertEqual(counters['classes']['read']['admitted'], 1)
+		self.assertEqual(counters['classes']['read']['in_flight'], 0)
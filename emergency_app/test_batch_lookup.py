@@ -0,0 +1,59 @@
+from django.test import TestCase, Client, override_settings
+from emergency_app.models.identity import Identity
+from emergency_app.models.contact import Contact
+from emergency_app.models.emergency import Emergency
+from common.util import sharding
+
+import json
+
+auth_url = '/login/'
+batch_lookup_url = '/getEmergencyContactsBatch/'
+
+success_code = 200
+forbidden_code = 403
+unprocessable_entity = 422
+
+@override_settings(EMP_ADMINISTRATORS=['admin1'], EMP_BATCH_LOOKUP_MAX_PIDMS=4, EMP_BATCH_LOOKUP_CHUNK_SIZE=2)
+class BatchLookupTests(TestCase):
+	"""
+	Testing the administrative multi-pidm contact lookup
+	"""
+	databases = '__all__'
+
+	def setUp(self):
+		Identity.objects.create(pidm=1, username='admin1', first_name='Ad', last_name='Min', email='admin1@pdx.edu')
+		Identity.objects.create(pidm=123, username='fooBar', first_name='Foo', last_name='Bar', email='fooBar@pdx.edu')
+		Contact.objects.using(sharding.shard_for(123)).create(surrogate_id=1, pidm=123, priority='2', first_name='Second', last_name='Bar')
+		Contact.objects.using(sharding.shard_for(123)).create(surrogate_id=2, pidm=123, priority='1', first_name='First', last_name='Bar')
+		Contact.objects.using(sharding.shard_for(456)).create(surrogate_id=3, pidm=456, priority='1', first_name='Only', last_name='Zero')
+		Emergency.objects.using(sharding.shard_for(123)).create(pidm=123, external_email='foo@gmail.com')
+
+		c = Client()
+		self.admin_jwt = c.post(auth_url, {'username': 'admin1'}).content.decode('utf-8')
+		self.user_jwt = c.post(auth_url, {'username': 'fooBar'}).content.decode('utf-8')
+
+	def lookup(self, body, jwt):
+		return Client().post(batch_lookup_url, json.dumps(body), content_type='application/json', HTTP_AUTHORIZATION=jwt)
+
+	def test_batch_lookup(self):
+		"""
+		Results are grouped by pidm in the requested order, with contacts ordered by priority
+		"""
+		response = self.lookup({'pidms': [456, 789, 123, 456]}, self.admin_jwt)
+		self.assertEqual(response.status_code, success_code)
+		people = [json.loads(line) for line in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+
+		self.assertEqual([person['pidm'] for person in people], [456, 789, 123])
+		self.assertEqual([contact['first_name'] for contact in people[2]['contacts']], ['First', 'Second'])
+		self.assertEqual(people[2]['notifications']['external_email'], 'foo@gmail.com')
+		""" People without data are still listed """
+		self.assertEqual(people[1], {'pidm': 789, 'contacts': [], 'notifications': None})
+
+	def test_batch_lookup_rejections(self):
+		"""
+		Only administrators, only lists of pidms, and only up to the configured amount
+		"""
+		self.assertEqual(self.lookup({'pidms': [123]}, self.user_jwt).status_code, forbidden_code)
+		self.assertEqual(self.lookup({'pidms': '123'}, self.admin_jwt).status_code, unprocessable_entity)
+		self.assertEqual(self.lookup([123], self.admin_jwt).status_code, unprocessable_entity)
+		self.assertEqual(self.lookup({'pidms': [1, 2, 3, 4, 5]}, self.admin_jwt).status_code, unprocessable_entity)
@@ -0,0 +1,123 @@
+from django.test import TestCase, Client, override_settings
+from django.core.management import call_command
+from emergency_app.models.identity import Identity
+from emergency_app.models.contact import Contact
+from emergency_app.models.emergency import Emergency
+from emergency_app.models.change_log import ChangeLog
+from emergency_app.test_views import populate_static_tables
+from common.util import sharding
+
+import io
+import json
+
+auth_url = '/login/'
+set_contacts_url = '/updateEmergencyContact/'
+set_emergency_notifications_url = '/setEmergencyNotifications/'
+get_changes_url = '/getChanges/'
+
+success_code = 200
+forbidden_code = 403
+
+@override_settings(EMP_ADMINISTRATORS=['admin1'])
+class ChangeLogTests(TestCase):
+	"""
+	Testing that contact and notification writes are recorded in the change log
+	"""
+	databases = '__all__'
+
+	def setUp(self):
+		populate_static_tables()
+		Identity.objects.create(pidm=123, username='fooBar', first_name='Foo', last_name='Bar', email='fooBar@pdx.edu')
+		Identity.objects.create(pidm=1, username='admin1', first_name='Ad', last_name='Min', email='admin1@pdx.edu')
+		Contact.objects.using(sharding.shard_for(123)).create(surrogate_id=1, pidm=123, priority='1', first_name="Debby", last_name='Bar')
+		# A contact of another user, which must not be touched by fooBar's writes
+		Contact.objects.using(sharding.shard_for(987)).create(surrogate_id=2, pidm=987, priority='1', first_name="Billy", last_name='Kid')
+
+		c = Client()
+		self.user_jwt = c.post(auth_url, {'username': 'fooBar'}).content.decode('utf-8')
+		self.admin_jwt = c.post(auth_url, {'username': 'admin1'}).content.decode('utf-8')
+
+	def test_contact_writes_are_recorded(self):
+		"""
+		Creating a contact at the front of the list records the insert and the demotion of the existing contact
+		Deleting it records the delete and the promotion
+		"""
+		c = Client()
+		response = c.post(set_contacts_url, {'priority': '1', 'first_name': 'New', 'last_name': 'Contact'},
+			HTTP_AUTHORIZATION=self.user_jwt)
+		self.assertEqual(response.status_code, success_code)
+		new_contact = Contact.objects.using(sharding.shard_for(123)).get(first_name='New')
+
+		changes = list(ChangeLog.objects.using(sharding.shard_for(123)).order_by('sequence'))
+		""" The demotion is recorded before the insert, both for our user only """
+		self.assertEqual([(change.operation, change.row_key) for change in changes],
+			[('U', '1'), ('I', str(new_contact.surrogate_id))])
+		self.assertEqual(json.loads(changes[0].changed_fields), {'priority': '2'})
+		self.assertTrue(all(change.pidm == 123 for change in changes))
+		self.assertEqual(Contact.objects.using(sharding.shard_for(987)).get(surrogate_id=2).priority, '1')
+
+		response = c.delete(set_contacts_url + str(new_contact.surrogate_id) + '/', HTTP_AUTHORIZATION=self.user_jwt)
+		self.assertEqual(response.status_code, success_code)
+		changes = list(ChangeLog.objects.using(sharding.shard_for(123)).order_by('sequence'))[2:]
+		self.assertEqual([(change.operation, change.row_key) for change in changes],
+			[('U', '1'), ('D', str(new_contact.surrogate_id))])
+
+	def test_notification_writes_only_record_changed_fields(self):
+		"""
+		Updating the notifications only reports the fields that changed
+		"""
+		Emergency.objects.using(sharding.shard_for(123)).create(pidm=123, external_email='old@gmail.com', sms_status_ind='Y')
+		c = Client()
+		response = c.post(set_emergency_notifications_url,
+			{'external_email': 'new@gmail.com', 'sms_status_ind': 'Y'},
+			HTTP_AUTHORIZATION=self.user_jwt)
+		self.assertEqual(response.status_code, success_code)
+
+		change = ChangeLog.objects.using(sharding.shard_for(123)).get()
+		self.assertEqual((change.table_name, change.operation, change.row_key), ('ZGBNNN', 'U', '123'))
+		self.assertEqual(json.loads(change.changed_fields), {'external_email': 'new@gmail.com'})
+
+	def test_get_changes(self):
+		"""
+		getChanges pages through the log with a cursor and is only available to administrators
+		"""
+		c = Client()
+		for first_name in ('One', 'Two'):
+			c.post(set_contacts_url, {'priority': '1', 'first_name': first_name, 'last_name': 'Bar'},
+				HTTP_AUTHORIZATION=self.user_jwt)
+
+		""" Regular users are forbidden """
+		response = c.get(get_changes_url, HTTP_AUTHORIZATION=self.user_jwt)
+		self.assertEqual(response.status_code, forbidden_code)
+
+		response = c.get(get_changes_url, {'limit': 3}, HTTP_AUTHORIZATION=self.admin_jwt)
+		self.assertEqual(response.status_code, success_code)
+		first_page = json.loads(response.content)
+		self.assertEqual(len(first_page['changes']), 3)
+
+		response = c.get(get_changes_url, {'since': first_page['next']}, HTTP_AUTHORIZATION=self.admin_jwt)
+		second_page = json.loads(response.content)
+		""" Two creations, each demoting every existing contact: 1 + 1 + 2 + 1 entries """
+		self.assertEqual(len(second_page['changes']), 2)
+		sequences = [change['sequence'] for change in first_page['changes'] + second_page['changes']]
+		self.assertEqual(sequences, sorted(sequences))
+
+	def test_drain_change_log(self):
+		"""
+		The drain command writes every change once and advances the consumer's cursor
+		"""
+		c = Client()
+		c.post(set_contacts_url, {'priority': '2', 'first_name': 'Second', 'last_name': 'Bar'},
+			HTTP_AUTHORIZATION=self.user_jwt)
+
+		out = io.StringIO()
+		call_command('drain_change_log', 'banner', batch_size=1, stdout=out, stderr=io.StringIO())
+		lines = out.getvalue().splitlines()
+		self.assertEqual(len(lines), 1)
+		self.assertEqual(json.loads(lines[0])['operation'], 'I')
+
+		""" Nothing new to drain on the second run, and purging removes the drained entry """
+		out = io.StringIO()
+		call_command('drain_change_log', 'banner', purge=True, stdout=out, stderr=io.StringIO())
+		self.assertEqual(out.getvalue(), '')
+		self.assertEqual(ChangeLog.objects.count(), 0)
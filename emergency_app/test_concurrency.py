@@ -0,0 +1,179 @@
+from django.test import TestCase, Client
+from emergency_app.models.identity import Identity
+from emergency_app.models.contact import Contact
+from emergency_app.models.emergency import Emergency
+from emergency_app.models.change_log import ChangeLog
+from emergency_app.test_views import populate_static_tables
+from common.util import concurrency
+from common.util import reference_data
+from common.util import sharding
+
+import json
+
+auth_url = '/login/'
+update_contact_url = '/updateEmergencyContact/'
+replace_contacts_url = '/replaceEmergencyContacts/'
+get_emergency_notifications_url = '/getEmergencyNotifications/'
+set_emergency_notifications_url = '/setEmergencyNotifications/'
+set_evacuation_assistance_url = '/setEvacuationAssistance/'
+
+success_code = 200
+conflict_code = 409
+unprocessable_code = 422
+
+
+def contact_fields(contact, **changes):
+	fields = {'surrogate_id': contact.surrogate_id, 'priority': contact.priority, 'first_name': contact.first_name,
+			'last_name': contact.last_name, 'relt_code': 'S', 'ctry_code_phone': '1', 'phone_area': '503',
+			'phone_number': '5552345'}
+	fields.update(changes)
+	return fields
+
+
+class ConcurrencyTests(TestCase):
+	"""
+	Testing the conditional writes of common/util/concurrency.py
+	"""
+	databases = '__all__'
+
+	def setUp(self):
+		self.shard = sharding.shard_for(123)
+		self.contact = Contact.objects.using(self.shard).create(surrogate_id=1, pidm=123, priority='1', first_name='First', last_name='Bar')
+
+	def test_save_if_current(self):
+		self.contact.first_name = 'Changed'
+		self.assertTrue(concurrency.save_if_current(self.contact, 1))
+		self.assertEqual(self.contact.version, 2)
+		self.assertEqual(Contact.objects.using(self.shard).values_list('first_name', 'version').get(), ('Changed', 2))
+
+		""" A writer that read version 1 doesn't overwrite version 2 """
+		self.contact.first_name = 'Stale'
+		self.assertFalse(concurrency.save_if_current(self.contact, 1))
+		self.assertEqual(Contact.objects.using(self.shard).values_list('first_name', 'version').get(), ('Changed', 2))
+
+	def test_delete_if_current(self):
+		self.assertFalse(concurrency.delete_if_current(self.contact, 2))
+		self.assertTrue(concurrency.delete_if_current(self.contact, 1))
+		self.assertFalse(Contact.objects.using(self.shard).exists())
+
+	def test_claim_versions(self):
+		Contact.objects.using(self.shard).create(surrogate_id=2, pidm=123, priority='2', first_name='Second', last_name='Bar')
+		concurrency.claim_versions(Contact, {1: 1, 2: 1}, self.shard)
+		self.assertEqual(list(Contact.objects.using(self.shard).order_by('pk').values_list('version', flat=True)), [2, 2])
+
+		""" One stale row fails the claim, which rolls back with the transaction """
+		with self.assertRaises(concurrency.Conflict):
+			concurrency.claim_versions(Contact, {1: 2, 2: 1}, self.shard)
+
+	def test_expected_version(self):
+		self.assertEqual(concurrency.expected_version({}, self.contact), 1)
+		self.assertEqual(concurrency.expected_version({'version': ''}, self.contact), 1)
+		self.assertEqual(concurrency.expected_version({'version': '4'}, self.contact), 4)
+		self.assertIsNone(concurrency.expected_version({'version': 'latest'}, self.contact))
+
+
+class ConflictingWriteTests(TestCase):
+	"""
+	Testing that writes based on a stale version answer Conflict with the current row instead of overwriting it
+	"""
+	databases = '__all__'
+
+	def setUp(self):
+		reference_data.clear()
+		populate_static_tables()
+		Identity.objects.create(pidm=123, username='fooBar', first_name='Foo', last_name='Bar', email='fooBar@pdx.edu')
+		self.shard = sharding.shard_for(123)
+		self.first = Contact.objects.using(self.shard).create(surrogate_id=1, pidm=123, priority='1', first_name='First', last_name='Bar')
+		self.second = Contact.objects.using(self.shard).create(surrogate_id=2, pidm=123, priority='2', first_name='Second', last_name='Bar')
+		self.jwt = Client().post(auth_url, {'username': 'fooBar'}).content.decode('utf-8')
+
+	def post(self, url, data):
+		return Client().post(url, data, HTTP_AUTHORIZATION=self.jwt)
+
+	def test_update_contact(self):
+		response = self.post(update_contact_url, contact_fields(self.first, first_name='Tab', version='1'))
+		self.assertEqual(response.status_code, success_code)
+		self.assertEqual(Contact.objects.using(self.shard).get(surrogate_id=1).version, 2)
+
+		""" The other tab still shows version 1 """
+		response = self.post(update_contact_url, contact_fields(self.first, first_name='Other tab', version='1'))
+		self.assertEqual(response.status_code, conflict_code)
+		current = json.loads(response.content)['current']
+		self.assertEqual((current['first_name'], current['version'], current['relation_description']),
+						('Tab', 2, 'Spouse/Significant Other'))
+		self.assertEqual(Contact.objects.using(self.shard).get(surrogate_id=1).first_name, 'Tab')
+		self.assertEqual(ChangeLog.objects.using(self.shard).count(), 1)
+
+		response = self.post(update_contact_url, contact_fields(self.first, version='newest'))
+		self.assertEqual(response.status_code, unprocessable_code)
+
+	def test_update_contact_priority(self):
+		""" Moving a contact bumps the version of the contacts it moves past """
+		response = self.post(update_contact_url, contact_fields(self.second, priority='1', version='1'))
+		self.assertEqual(response.status_code, success_code)
+		self.assertEqual(list(Contact.objects.using(self.shard).order_by('surrogate_id').values_list('priority', 'version')),
+						[('2', 2), ('1', 2)])
+
+		response = self.post(update_contact_url, contact_fields(self.first, first_name='Stale', priority='1', version='1'))
+		self.assertEqual(response.status_code, conflict_code)
+		self.assertEqual(list(Contact.objects.using(self.shard).order_by('surrogate_id').values_list('priority', 'version')),
+						[('2', 2), ('1', 2)])
+
+	def test_delete_contact(self):
+		Contact.objects.using(self.shard).filter(surrogate_id=1).update(first_name='Edited', version=2)
+		response = Client().delete(update_contact_url + '1/?version=1', HTTP_AUTHORIZATION=self.jwt)
+		self.assertEqual(response.status_code, conflict_code)
+		self.assertEqual(json.loads(response.content)['current']['first_name'], 'Edited')
+		self.assertEqual(Contact.objects.using(self.shard).count(), 2)
+
+		response = Client().delete(update_contact_url + '1/?version=2', HTTP_AUTHORIZATION=self.jwt)
+		self.assertEqual(response.status_code, success_code)
+		self.assertEqual(list(Contact.objects.using(self.shard).values_list('priority', 'version')), [('1', 2)])
+
+		""" Deleted by another request """
+		response = self.post(update_contact_url, contact_fields(self.first, version='2'))
+		self.assertEqual(response.status_code, unprocessable_code)
+
+	def test_replace_contacts(self):
+		Contact.objects.using(self.shard).filter(surrogate_id=2).update(first_name='Edited', version=2)
+		contacts = [contact_fields(self.first, first_name='Replaced', version=1),
+					contact_fields(self.second, first_name='Stale', version=1)]
+		response = Client().post(replace_contacts_url, json.dumps(contacts), content_type='application/json',
+								HTTP_AUTHORIZATION=self.jwt)
+		self.assertEqual(response.status_code, conflict_code)
+		current = json.loads(response.content)['current']
+		self.assertEqual([contact['first_name'] for contact in current], ['First', 'Edited'])
+		""" Nothing is written, not even the contact that was current """
+		self.assertEqual(Contact.objects.using(self.shard).get(surrogate_id=1).version, 1)
+		self.assertFalse(ChangeLog.objects.using(self.shard).exists())
+
+		contacts[1].update(version=2)
+		response = Client().post(replace_contacts_url, json.dumps(contacts), content_type='application/json',
+								HTTP_AUTHORIZATION=self.jwt)
+		self.assertEqual(response.status_code, success_code)
+		self.assertEqual(list(Contact.objects.using(self.shard).order_by('surrogate_id').values_list('first_name', 'version')),
+						[('Replaced', 2), ('Stale', 3)])
+
+		contacts[0].update(version='one')
+		response = Client().post(replace_contacts_url, json.dumps(contacts), content_type='application/json',
+								HTTP_AUTHORIZATION=self.jwt)
+		self.assertEqual(response.status_code, unprocessable_code)
+
+	def test_emergency_info(self):
+		self.assertEqual(self.post(set_evacuation_assistance_url, {'evacuation_assistance': 'Y'}).status_code, success_code)
+		response = Client().get(get_emergency_notifications_url, HTTP_AUTHORIZATION=self.jwt)
+		self.assertEqual(json.loads(response.content)[0]['version'], 1)
+
+		notifications = {'external_email': 'foo@gmail.com', 'primary_phone': '5031234567', 'sms_status_ind': 'Y'}
+		response = self.post(set_emergency_notifications_url, dict(notifications, version='1'))
+		self.assertEqual(response.status_code, success_code)
+		self.assertEqual(Emergency.objects.using(self.shard).get(pidm=123).version, 2)
+
+		response = self.post(set_evacuation_assistance_url, {'evacuation_assistance': 'N', 'version': '1'})
+		self.assertEqual(response.status_code, conflict_code)
+		current = json.loads(response.content)['current']
+		self.assertEqual((current['external_email'], current['evacuation_assistance'], current['version']),
+						('foo@gmail.com', 'Y', 2))
+
+		response = self.post(set_emergency_notifications_url, dict(notifications, version='x'))
+		self.assertEqual(response.status_code, unprocessable_code)
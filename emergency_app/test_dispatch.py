@@ -0,0 +1,166 @@
+from django.test import TestCase, override_settings
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from emergency_app.models.emergency import Emergency
+from common.util import dispatch
+from common.util import sharding
+
+import io
+import json
+import smtplib
+import threading
+
+stub_transports = {
+	'email': {'BACKEND': 'common.util.dispatch.StubTransport', 'CONCURRENCY': 4},
+	'sms': {'BACKEND': 'common.util.dispatch.StubTransport', 'CONCURRENCY': 2},
+}
+
+class ConcurrencyTrackingTransport(dispatch.StubTransport):
+	"""
+	Stub transport that remembers the most sends it saw running at once
+	"""
+	def __init__(self, *args, **kwargs):
+		super(ConcurrencyTrackingTransport, self).__init__(*args, **kwargs)
+		self.running = 0
+		self.most_running = 0
+		self.counter_lock = threading.Lock()
+
+	def send(self, address, message):
+		with self.counter_lock:
+			self.running += 1
+			self.most_running = max(self.most_running, self.running)
+		try:
+			super(ConcurrencyTrackingTransport, self).send(address, message)
+		finally:
+			with self.counter_lock:
+				self.running -= 1
+
+class FlakySMTPBackend(BaseEmailBackend):
+	"""
+	Email backend that, like Django's SMTP backend, keeps its connection until it is closed.
+	Opening the first connection fails, and the second one is broken.
+	"""
+	events = []
+
+	def __init__(self, **kwargs):
+		super(FlakySMTPBackend, self).__init__(**kwargs)
+		self.connection = None
+
+	def open(self):
+		if self.connection is not None:
+			return False
+		self.events.append('open')
+		opened = self.events.count('open')
+		if opened == 1:
+			raise ConnectionRefusedError("connection refused")
+		self.connection = 'broken' if opened == 2 else 'open'
+		return True
+
+	def close(self):
+		self.events.append('close')
+		self.connection = None
+
+	def send_messages(self, messages):
+		if self.connection == 'broken':
+			raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+		self.events.append('sent')
+		return len(messages)
+
+
+@override_settings(EMP_DISPATCH_TRANSPORTS=stub_transports, EMP_DISPATCH_BACKOFF_SECONDS=0)
+class DispatchTests(TestCase):
+	"""
+	Testing target compilation and the concurrent dispatch of alerts
+	"""
+	databases = '__all__'
+
+	def setUp(self):
+		Emergency.objects.using(sharding.shard_for(1)).create(pidm=1, campus_email='one@pdx.edu', external_email='One@gmail.com',
+			sms_status_ind='N', sms_device='5035550001')
+		# Shares an email and a phone with pidm 1, and opted out of texts
+		Emergency.objects.using(sharding.shard_for(2)).create(pidm=2, campus_email='two@pdx.edu', external_email='one@gmail.com',
+			sms_status_ind='Y', sms_device='5035550002')
+		# Shares pidm 1's phone, opted in
+		Emergency.objects.using(sharding.shard_for(3)).create(pidm=3, campus_email='three@pdx.edu', sms_status_ind='N', sms_device='503-555-0001')
+		# No usable address
+		Emergency.objects.using(sharding.shard_for(4)).create(pidm=4, external_email='not an email')
+		self.message = dispatch.Message("Test alert", "This is a test of PSU Alert")
+
+	def test_compile_targets(self):
+		"""
+		Emails and opted-in phones, each address only once
+		"""
+		targets = dispatch.compile_targets()
+		self.assertEqual(sorted((target.channel, target.address) for target in targets), [
+			('email', 'one@gmail.com'), ('email', 'one@pdx.edu'), ('email', 'three@pdx.edu'), ('email', 'two@pdx.edu'),
+			('sms', '15035550001'),
+		])
+
+		""" Limiting to some people """
+		targets = dispatch.compile_targets(pidms=[2])
+		self.assertEqual(sorted(target.address for target in targets), ['one@gmail.com', 'two@pdx.edu'])
+
+	def test_dispatch_retries_and_accounting(self):
+		"""
+		Transient failures are retried, permanent ones reported
+		"""
+		email = dispatch.StubTransport(dispatch.EMAIL, fail={'one@pdx.edu': 1, 'two@pdx.edu': -1})
+		sms = dispatch.StubTransport(dispatch.SMS)
+		report = dispatch.dispatch(self.message, dispatch.compile_targets(), {'email': email, 'sms': sms}, max_attempts=3)
+
+		self.assertEqual(report.channels['email'], {'targets': 4, 'sent': 3, 'failed': 1, 'retries': 3, 'skipped': 0})
+		self.assertEqual(report.channels['sms'], {'targets': 1, 'sent': 1, 'failed': 0, 'retries': 0, 'skipped': 0})
+		self.assertEqual([failure['address'] for failure in report.failures], ['two@pdx.edu'])
+		self.assertEqual(sorted(address for address, message in email.sent), ['one@gmail.com', 'one@pdx.edu', 'three@pdx.edu'])
+
+		""" Channels without a transport are skipped """
+		report = dispatch.dispatch(self.message, dispatch.compile_targets(), {'email': dispatch.StubTransport()})
+		self.assertEqual(report.channels['sms']['skipped'], 1)
+
+	def test_transport_crash(self):
+		"""
+		Unexpected errors from a transport are reported as failed deliveries and logged
+		"""
+		class CrashingTransport(dispatch.StubTransport):
+			def send(self, address, message):
+				raise ValueError("bad address %s" % address)
+
+		targets = [dispatch.Target(dispatch.SMS, '15035550001', 1)]
+		with self.assertLogs('common.util.dispatch', 'ERROR') as logs:
+			report = dispatch.dispatch(self.message, targets, {'sms': CrashingTransport(dispatch.SMS)}, max_attempts=3)
+		self.assertEqual(report.channels['sms'], {'targets': 1, 'sent': 0, 'failed': 1, 'retries': 0, 'skipped': 0})
+		self.assertEqual(report.failures[0]['error'], 'ValueError: bad address 15035550001')
+		self.assertIsNotNone(logs.records[0].exc_info)
+
+	@override_settings(EMAIL_BACKEND='emergency_app.test_dispatch.FlakySMTPBackend')
+	def test_smtp_reconnects(self):
+		"""
+		A failed open is retried, and a broken connection is closed so the retry opens a new one
+		"""
+		del FlakySMTPBackend.events[:]
+		email = dispatch.SMTPTransport(from_email='alerts@pdx.edu')
+		targets = [dispatch.Target(dispatch.EMAIL, 'one@pdx.edu', 1)]
+		report = dispatch.dispatch(self.message, targets, {'email': email}, max_attempts=3)
+		self.assertEqual(report.channels['email'], {'targets': 1, 'sent': 1, 'failed': 0, 'retries': 2, 'skipped': 0})
+		self.assertEqual(FlakySMTPBackend.events, ['open', 'open', 'close', 'open', 'sent', 'close'])
+
+	def test_concurrency_limit(self):
+		"""
+		A transport never runs more sends at once than its concurrency
+		"""
+		targets = [dispatch.Target(dispatch.SMS, str(5035550000 + number), number) for number in range(20)]
+		sms = ConcurrencyTrackingTransport(dispatch.SMS, concurrency=3, latency=0.01)
+		report = dispatch.dispatch(self.message, targets, {'sms': sms})
+		self.assertEqual(report.channels['sms']['sent'], 20)
+		self.assertLessEqual(sms.most_running, 3)
+		self.assertGreater(sms.most_running, 1)
+
+	def test_send_alert_command(self):
+		out = io.StringIO()
+		call_command('send_alert', "Test", channels=['sms'], stdout=out)
+		report = json.loads(out.getvalue())
+		self.assertEqual(report['channels'], {'sms': {'targets': 1, 'sent': 1, 'failed': 0, 'retries': 0, 'skipped': 0}})
+
+		out = io.StringIO()
+		call_command('send_alert', "Test", dry_run=True, stdout=out)
+		self.assertEqual(json.loads(out.getvalue()), {'targets': {'email': 4, 'sms': 1}})
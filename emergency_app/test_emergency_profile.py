@@ -0,0 +1,144 @@
+from django.core.management import call_command
+from django.test import TestCase, Client
+from emergency_app.models.identity import Identity
+from emergency_app.models.contact import Contact
+from emergency_app.models.emergency import Emergency
+from emergency_app.models.emergency_profile import EmergencyProfile
+from emergency_app.models.relation import Relation
+from emergency_app.test_views import populate_static_tables
+from common.util import emergency_profile
+from common.util import reverse_lookup
+from common.util import sharding
+
+import io
+import json
+
+auth_url = '/login/'
+get_contacts_url = '/getEmergencyContacts/'
+update_contact_url = '/updateEmergencyContact/'
+replace_contacts_url = '/replaceEmergencyContacts/'
+get_emergency_notifications_url = '/getEmergencyNotifications/'
+set_emergency_notifications_url = '/setEmergencyNotifications/'
+get_evacuation_assistance_url = '/getEvacuationAssistance/'
+set_evacuation_assistance_url = '/setEvacuationAssistance/'
+get_profile_url = '/getEmergencyProfile/'
+
+success_code = 200
+no_content_code = 204
+
+
+class EmergencyProfileTests(TestCase):
+	"""
+	Testing that the pre-serialized profile follows every write and is what the read endpoints return
+	"""
+	databases = '__all__'
+
+	def setUp(self):
+		populate_static_tables()
+		Identity.objects.create(pidm=123, username='fooBar', first_name='Foo', last_name='Bar', email='fooBar@pdx.edu')
+		self.jwt = Client().post(auth_url, {'username': 'fooBar'}).content.decode('utf-8')
+
+	def post(self, url, data=None):
+		return Client().post(url, data or {}, HTTP_AUTHORIZATION=self.jwt)
+
+	def read(self):
+		""" Everything the read endpoints return, from the profile """
+		return {url: self.post(url) for url in (get_contacts_url, get_emergency_notifications_url, get_evacuation_assistance_url)}
+
+	def assert_profile_current(self):
+		""" The profile matches one built from the tables now """
+		stored = EmergencyProfile.objects.using(sharding.shard_for(123)).get(pidm=123)
+		built = emergency_profile.profile_rows([123], Contact, Emergency, EmergencyProfile, sharding.shard_for(123))[0]
+		self.assertEqual((stored.contacts, stored.notifications, stored.evacuation_assistance),
+						(built.contacts, built.notifications, built.evacuation_assistance))
+
+	def test_profile_follows_writes(self):
+		contact = {'priority': '1', 'first_name': 'Debby', 'last_name': 'Bar', 'relt_code': 'S',
+				'ctry_code_phone': '1', 'phone_area': '503', 'phone_number': '5552345'}
+		self.post(update_contact_url, contact)
+		self.post(update_contact_url, dict(contact, first_name='Jim'))
+		self.assert_profile_current()
+		contacts = json.loads(self.post(get_contacts_url).content)
+		""" By priority, with what the codes stand for """
+		self.assertEqual([(row['first_name'], row['priority']) for row in contacts], [('Jim', '1'), ('Debby', '2')])
+		self.assertEqual(contacts[0]['relation_description'], 'Spouse/Significant Other')
+
+		self.post(update_contact_url, dict(contact, surrogate_id=contacts[1]['surrogate_id'], priority='1', last_name='Baz'))
+		self.assert_profile_current()
+		Client().delete(update_contact_url + '%d/' % contacts[0]['surrogate_id'], HTTP_AUTHORIZATION=self.jwt)
+		self.assert_profile_current()
+		self.post(set_emergency_notifications_url, {'external_email': 'foo@gmail.com', 'primary_phone': '5035552345',
+													'sms_status_ind': 'N', 'sms_device': '5035552345'})
+		self.assert_profile_current()
+		self.post(set_evacuation_assistance_url, {'evacuation_assistance': 'Y'})
+		self.assert_profile_current()
+
+		response = Client().post(replace_contacts_url, json.dumps([dict(contact, first_name='Replaced')]),
+								content_type='application/json', HTTP_AUTHORIZATION=self.jwt)
+		self.assertEqual(response.status_code, success_code)
+		self.assert_profile_current()
+
+		""" Bounce processing rebuilds the profiles of the people it changed """
+		reverse_lookup.apply_reports([('+15035552345', reverse_lookup.STOP)])
+		self.assert_profile_current()
+		self.assertIsNone(json.loads(self.post(get_emergency_notifications_url).content)[0]['sms_device'])
+
+	def test_reads(self):
+		shard = sharding.shard_for(123)
+		Contact.objects.using(shard).create(surrogate_id=1, pidm=123, priority='1', first_name='Debby', last_name='Bar', relt_code='S')
+		Emergency.objects.using(shard).create(pidm=123, external_email='foo@gmail.com', evacuation_assistance='Y')
+
+		""" People written outside the application get their profile on first read """
+		first = self.read()
+		self.assertTrue(EmergencyProfile.objects.using(shard).filter(pidm=123).exists())
+		per_database = 2 if shard == 'default' else 1
+		with self.assertNumQueries(per_database), self.assertNumQueries(per_database, using=shard):
+			""" The user's pidm on the default database, then the profile by primary key on their shard """
+			second = self.post(get_contacts_url)
+		self.assertEqual(second.content, first[get_contacts_url].content)
+		self.assertEqual(second['Content-Type'], 'application/json')
+		self.assertEqual(json.loads(first[get_emergency_notifications_url].content)[0]['external_email'], 'foo@gmail.com')
+		self.assertEqual(json.loads(first[get_evacuation_assistance_url].content),
+						[{'evacuation_assistance': 'Y', 'version': 1}])
+
+		document = json.loads(self.post(get_profile_url).content)
+		self.assertEqual(document, {
+			'contacts': json.loads(first[get_contacts_url].content),
+			'notifications': json.loads(first[get_emergency_notifications_url].content),
+			'evacuation_assistance': json.loads(first[get_evacuation_assistance_url].content),
+		})
+
+	def test_reference_change(self):
+		""" Profiles hold the descriptions of the codes, renaming one rebuilds the profiles using it """
+		Contact.objects.using(sharding.shard_for(123)).create(surrogate_id=1, pidm=123, priority='1', first_name='Debby', last_name='Bar', relt_code='S')
+		self.assertEqual(json.loads(self.post(get_contacts_url).content)[0]['relation_description'], 'Spouse/Significant Other')
+		relation = Relation.objects.get(code='S')
+		relation.description = 'Partner'
+		relation.save()
+		self.assertEqual(json.loads(self.post(get_contacts_url).content)[0]['relation_description'], 'Partner')
+		self.assert_profile_current()
+
+		""" Not while a fixture is loaded, its other rows may not be saved yet """
+		relation.description = 'Spouse'
+		relation.save_base(raw=True)
+		self.assertEqual(json.loads(self.post(get_contacts_url).content)[0]['relation_description'], 'Partner')
+
+	def test_no_content(self):
+		for response in self.read().values():
+			self.assertEqual(response.status_code, no_content_code)
+		self.assertEqual(json.loads(self.post(get_profile_url).content),
+						{'contacts': [], 'notifications': [], 'evacuation_assistance': []})
+
+	def test_rebuild(self):
+		self.post(set_evacuation_assistance_url, {'evacuation_assistance': 'Y'})
+		""" Changed outside the application, the profile drifts until it is rebuilt """
+		Emergency.objects.using(sharding.shard_for(123)).filter(pidm=123).update(evacuation_assistance='N')
+		Contact.objects.using(sharding.shard_for(456)).create(surrogate_id=1, pidm=456, priority='1', first_name='Debby', last_name='Baz')
+		EmergencyProfile.objects.using(sharding.shard_for(789)).create(pidm=789, contacts='[{}]', notifications='[]', evacuation_assistance='[]')
+		self.assertEqual(json.loads(self.post(get_evacuation_assistance_url).content)[0]['evacuation_assistance'], 'Y')
+
+		call_command('rebuild_emergency_profiles', batch_size=1, stderr=io.StringIO())
+		self.assert_profile_current()
+		self.assertEqual(json.loads(self.post(get_evacuation_assistance_url).content)[0]['evacuation_assistance'], 'N')
+		self.assertEqual(sorted(pidm for alias in sharding.shard_aliases()
+								for pidm in EmergencyProfile.objects.using(alias).values_list('pidm', flat=True)), [123, 456])
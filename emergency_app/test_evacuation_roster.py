@@ -0,0 +1,73 @@
+from django.test import TestCase, Client, override_settings
+from django.core.management import call_command
+from emergency_app.models.identity import Identity
+from emergency_app.models.emergency import Emergency
+from emergency_app.models.evacuation_roster import EvacuationRoster
+from common.util import reverse_lookup
+from common.util import sharding
+
+import io
+
+auth_url = '/login/'
+roster_url = '/getEvacuationRoster/'
+set_evacuation_assistance_url = '/setEvacuationAssistance/'
+set_emergency_notifications_url = '/setEmergencyNotifications/'
+
+success_code = 200
+forbidden_code = 403
+
+@override_settings(EMP_ADMINISTRATORS=['admin1'])
+class EvacuationRosterTests(TestCase):
+	"""
+	Testing that the evacuation roster follows the writes to ZGBNNN
+	"""
+	databases = '__all__'
+
+	def setUp(self):
+		Identity.objects.create(pidm=1, username='admin1', first_name='Ad', last_name='Min', email='admin1@pdx.edu')
+		Identity.objects.create(pidm=123, username='fooBar', first_name='Foo', last_name='Bar', email='fooBar@pdx.edu')
+
+		c = Client()
+		self.admin_jwt = c.post(auth_url, {'username': 'admin1'}).content.decode('utf-8')
+		self.user_jwt = c.post(auth_url, {'username': 'fooBar'}).content.decode('utf-8')
+
+	def test_roster_follows_writes(self):
+		c = Client()
+		c.post(set_evacuation_assistance_url, {'evacuation_assistance': 'Y'}, HTTP_AUTHORIZATION=self.user_jwt)
+		row = EvacuationRoster.objects.using(sharding.shard_for(123)).get(pidm=123)
+		self.assertEqual((row.username, row.last_name, row.campus_email), ('fooBar', 'Bar', 'fooBar@pdx.edu'))
+
+		""" Contact details changed later are carried over to the roster """
+		c.post(set_emergency_notifications_url, {'external_email': 'foo@gmail.com', 'primary_phone': '5035552345',
+			'sms_status_ind': 'N', 'sms_device': '5035552345'}, HTTP_AUTHORIZATION=self.user_jwt)
+		row.refresh_from_db()
+		self.assertEqual((row.external_email, row.sms_device), ('foo@gmail.com', '5035552345'))
+
+		""" A STOP reply from the SMS provider clears the device on the roster too """
+		reverse_lookup.apply_reports([('+15035552345', reverse_lookup.STOP)])
+		row.refresh_from_db()
+		self.assertIsNone(row.sms_device)
+
+		""" No longer needing assistance takes the person off the roster """
+		c.post(set_evacuation_assistance_url, {'evacuation_assistance': 'N'}, HTTP_AUTHORIZATION=self.user_jwt)
+		self.assertFalse(EvacuationRoster.objects.using(sharding.shard_for(123)).exists())
+
+	def test_roster_endpoint(self):
+		Emergency.objects.using(sharding.shard_for(123)).create(pidm=123, evacuation_assistance='Y', campus_email='fooBar@pdx.edu', sms_device='5035552345')
+		Emergency.objects.using(sharding.shard_for(456)).create(pidm=456, evacuation_assistance='Y', primary_phone='5031234567')
+		Emergency.objects.using(sharding.shard_for(789)).create(pidm=789, evacuation_assistance='N', campus_email='nope@pdx.edu')
+		call_command('rebuild_evacuation_roster', stderr=io.StringIO())
+
+		c = Client()
+		response = c.get(roster_url, HTTP_AUTHORIZATION=self.user_jwt)
+		self.assertEqual(response.status_code, forbidden_code)
+
+		with self.assertNumQueries(1):
+			""" The whole roster is one read on each shard """
+			response = c.get(roster_url, HTTP_AUTHORIZATION=self.admin_jwt)
+		self.assertEqual(response.status_code, success_code)
+		body = response.json()
+		self.assertEqual(body['counts'], {'total': 2, 'sms': 1, 'phone': 1, 'email': 1})
+		self.assertEqual([row['pidm'] for row in body['roster']], [123, 456])
+		self.assertEqual(body['roster'][0]['first_name'], 'Foo')
+		self.assertIsNone(body['roster'][1]['username'])
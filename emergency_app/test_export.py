@@ -0,0 +1,90 @@
+from django.test import TestCase, Client, override_settings
+from django.core.management import call_command
+from django.utils import timezone
+from emergency_app.models.identity import Identity
+from emergency_app.models.contact import Contact
+from emergency_app.models.emergency import Emergency
+from common.util import export
+from common.util import sharding
+
+from datetime import timedelta
+import io
+import json
+
+auth_url = '/login/'
+export_url = '/exportModifiedSince/'
+
+success_code = 200
+forbidden_code = 403
+unprocessable_entity = 422
+
+@override_settings(EMP_ADMINISTRATORS=['admin1'], EMP_EXPORT_CHUNK_SIZE=2)
+class ModifiedSinceExportTests(TestCase):
+	"""
+	Testing the incremental "modified since" export
+	"""
+	databases = '__all__'
+
+	def setUp(self):
+		Identity.objects.create(pidm=1, username='admin1', first_name='Ad', last_name='Min', email='admin1@pdx.edu')
+		Identity.objects.create(pidm=123, username='fooBar', first_name='Foo', last_name='Bar', email='fooBar@pdx.edu')
+		self.now = timezone.now()
+		self.since = self.now - timedelta(hours=1)
+
+		# Three recent contacts sharing one timestamp (ties must be paged by surrogate_id) and one old contact
+		for surrogate_id in (1, 2, 3, 4):
+			Contact.objects.using(sharding.shard_for(123)).create(surrogate_id=surrogate_id, pidm=123, priority=str(surrogate_id), first_name='C', last_name='Bar')
+		# auto_now always stamps the current time, so backdate the rows with a queryset update
+		Contact.objects.using(sharding.shard_for(123)).filter(surrogate_id__in=(1, 2, 3)).update(activity_date=self.now)
+		Contact.objects.using(sharding.shard_for(123)).filter(surrogate_id=4).update(activity_date=self.now - timedelta(days=1))
+		Emergency.objects.using(sharding.shard_for(123)).create(pidm=123, external_email='foo@gmail.com')
+
+		c = Client()
+		self.admin_jwt = c.post(auth_url, {'username': 'admin1'}).content.decode('utf-8')
+		self.user_jwt = c.post(auth_url, {'username': 'fooBar'}).content.decode('utf-8')
+
+	def test_iter_modified_since(self):
+		"""
+		Every recent row is returned exactly once across chunks, in keyset order
+		"""
+		rows = list(export.iter_modified_since(Contact, self.since, 2))
+		self.assertEqual([row['surrogate_id'] for row in rows], [1, 2, 3])
+
+	def test_export_endpoint(self):
+		"""
+		The endpoint streams one json row per line, and only for administrators
+		"""
+		c = Client()
+		response = c.get(export_url, {'since': self.since.isoformat()}, HTTP_AUTHORIZATION=self.user_jwt)
+		self.assertEqual(response.status_code, forbidden_code)
+
+		response = c.get(export_url, {'since': self.since.isoformat()}, HTTP_AUTHORIZATION=self.admin_jwt)
+		self.assertEqual(response.status_code, success_code)
+		lines = [json.loads(line) for line in b''.join(response.streaming_content).decode('utf-8').splitlines()]
+		self.assertEqual([line['table'] for line in lines], ['SPREMRG'] * 3 + ['ZGBNNN'])
+
+		response = c.get(export_url, {'since': self.since.isoformat(), 'tables': 'ZGBNNN'}, HTTP_AUTHORIZATION=self.admin_jwt)
+		lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+		self.assertEqual(len(lines), 1)
+
+		""" Malformed timestamps and unknown tables are rejected """
+		response = c.get(export_url, {'since': 'yesterday'}, HTTP_AUTHORIZATION=self.admin_jwt)
+		self.assertEqual(response.status_code, unprocessable_entity)
+		response = c.get(export_url, {'since': self.since.isoformat(), 'tables': 'ZGBIDMP'}, HTTP_AUTHORIZATION=self.admin_jwt)
+		self.assertEqual(response.status_code, unprocessable_entity)
+
+	def test_shifted_priorities_exported(self):
+		"""
+		Contacts moved up the list when another is deleted are exported with their new priority
+		"""
+		Client().delete('/updateEmergencyContact/3/', HTTP_AUTHORIZATION=self.user_jwt)
+		rows = list(export.iter_modified_since(Contact, self.since, 2))
+		self.assertEqual([(row['surrogate_id'], row['priority']) for row in rows], [(1, '1'), (2, '2'), (4, '3')])
+
+	def test_export_command(self):
+		"""
+		The management command writes the same export
+		"""
+		out = io.StringIO()
+		call_command('export_modified_since', self.since.isoformat(), stdout=out, stderr=io.StringIO())
+		self.assertEqual(len(out.getvalue().splitlines()), 4)
@@ -0,0 +1,133 @@
+from django.test import TestCase, Client
+from django.utils import timezone
+from emergency_app.models.identity import Identity
+from emergency_app.models.contact import Contact
+from emergency_app.models.change_log import ChangeLog
+from emergency_app.models.idempotency_key import IdempotencyKey
+from emergency_app.test_views import populate_static_tables
+from common.util import idempotency
+from common.util import reference_data
+from common.util import sharding
+
+from datetime import timedelta
+
+auth_url = '/login/'
+update_contact_url = '/updateEmergencyContact/'
+set_evacuation_assistance_url = '/setEvacuationAssistance/'
+
+success_code = 200
+conflict_code = 409
+unprocessable_code = 422
+
+contact = {'priority': '1', 'first_name': 'Debby', 'last_name': 'Bar', 'relt_code': 'S',
+		'ctry_code_phone': '1', 'phone_area': '503', 'phone_number': '5552345'}
+
+
+class IdempotencyKeyTests(TestCase):
+	"""
+	Testing the claims, replays and expiry of the idempotency keys
+	"""
+
+	def setUp(self):
+		idempotency.reset()
+
+	def test_claim_and_replay(self):
+		self.assertEqual(idempotency.claim('retry-1', 123, 'a'), (idempotency.CLAIMED, None))
+		self.assertEqual(idempotency.claim('retry-1', 123, 'a'), (idempotency.IN_PROGRESS, None))
+
+		response = idempotency.StoredResponse(200, b'Created successfully.', 'text/html; charset=utf-8')
+		idempotency.complete('retry-1', 123, 'a', response)
+		self.assertEqual(idempotency.claim('retry-1', 123, 'a'), (idempotency.REPLAY, response))
+		self.assertEqual(idempotency.claim('retry-1', 123, 'b'), (idempotency.MISMATCH, None))
+
+		""" The same key of another person is another request """
+		self.assertEqual(idempotency.claim('retry-1', 987, 'a'), (idempotency.CLAIMED, None))
+
+		""" A released key runs again """
+		idempotency.release('retry-1', 123)
+		self.assertEqual(idempotency.claim('retry-1', 123, 'a'), (idempotency.CLAIMED, None))
+
+	def test_expiry(self):
+		idempotency.claim('expired', 123, 'a')
+		idempotency.complete('expired', 123, 'a', idempotency.StoredResponse(200, b'', 'text/html'))
+		IdempotencyKey.objects.filter(key='expired').update(expires=timezone.now())
+		self.assertEqual(idempotency.claim('expired', 123, 'a'), (idempotency.CLAIMED, None))
+
+		""" A first request that never completed (its worker died) stops blocking retries """
+		idempotency.claim('abandoned', 123, 'a')
+		with self.settings(EMP_IDEMPOTENCY_LOCK_SECONDS=60):
+			IdempotencyKey.objects.filter(key='abandoned').update(activity_date=timezone.now() - timedelta(seconds=61))
+			self.assertEqual(idempotency.claim('abandoned', 123, 'a'), (idempotency.CLAIMED, None))
+
+		""" Expired keys are purged """
+		IdempotencyKey.objects.create(key='old', pidm=123, fingerprint='a', expires=timezone.now())
+		idempotency.reset()
+		idempotency.claim('new', 123, 'a')
+		self.assertEqual(sorted(IdempotencyKey.objects.values_list('key', flat=True)), ['abandoned', 'expired', 'new'])
+
+
+class IdempotentEndpointTests(TestCase):
+	"""
+	Testing that retried writes with an Idempotency-Key are replayed without touching the database
+	"""
+	databases = '__all__'
+
+	def setUp(self):
+		idempotency.reset()
+		reference_data.clear()
+		populate_static_tables()
+		Identity.objects.create(pidm=123, username='fooBar', first_name='Foo', last_name='Bar', email='fooBar@pdx.edu')
+		Identity.objects.create(pidm=987, username='JJohn', first_name='Jimmy', last_name='Johnson', email='JimmyJ@pdx.edu')
+		c = Client()
+		self.jwt = c.post(auth_url, {'username': 'fooBar'}).content.decode('utf-8')
+		self.other_jwt = c.post(auth_url, {'username': 'JJohn'}).content.decode('utf-8')
+
+	def tearDown(self):
+		idempotency.reset()
+
+	def test_retried_create(self):
+		c = Client()
+		response = c.post(update_contact_url, contact, HTTP_AUTHORIZATION=self.jwt, HTTP_IDEMPOTENCY_KEY='create-1')
+		self.assertEqual(response.status_code, success_code)
+
+		""" The retry gets the same answer, and nothing is validated or written again """
+		with self.assertNumQueries(1):
+			""" The stored response, found with the user's pidm in the same query """
+			retried = c.post(update_contact_url, contact, HTTP_AUTHORIZATION=self.jwt, HTTP_IDEMPOTENCY_KEY='create-1')
+		self.assertEqual((retried.status_code, retried.content), (response.status_code, response.content))
+		self.assertEqual(retried['Idempotent-Replayed'], 'true')
+		self.assertEqual(Contact.objects.using(sharding.shard_for(123)).filter(pidm=123).count(), 1)
+		self.assertEqual(ChangeLog.objects.using(sharding.shard_for(123)).count(), 1)
+
+		""" A new key is a new request """
+		c.post(update_contact_url, contact, HTTP_AUTHORIZATION=self.jwt, HTTP_IDEMPOTENCY_KEY='create-2')
+		self.assertEqual(Contact.objects.using(sharding.shard_for(123)).filter(pidm=123).count(), 2)
+
+		""" Reusing a key for another request is an error """
+		response = c.post(update_contact_url, dict(contact, first_name='Jim'), HTTP_AUTHORIZATION=self.jwt,
+						HTTP_IDEMPOTENCY_KEY='create-1')
+		self.assertEqual(response.status_code, unprocessable_code)
+
+		""" Keys are per user """
+		response = c.post(update_contact_url, contact, HTTP_AUTHORIZATION=self.other_jwt, HTTP_IDEMPOTENCY_KEY='create-1')
+		self.assertFalse(response.has_header('Idempotent-Replayed'))
+		self.assertEqual(Contact.objects.using(sharding.shard_for(987)).filter(pidm=987).count(), 1)
+
+	def test_without_key(self):
+		c = Client()
+		for value in ('Y', 'N'):
+			c.post(set_evacuation_assistance_url, {'evacuation_assistance': value}, HTTP_AUTHORIZATION=self.jwt)
+		self.assertEqual(ChangeLog.objects.using(sharding.shard_for(123)).count(), 2)
+
+		response = c.post(set_evacuation_assistance_url, {'evacuation_assistance': 'Y'}, HTTP_AUTHORIZATION=self.jwt,
+						HTTP_IDEMPOTENCY_KEY='x' * 256)
+		self.assertEqual(response.status_code, unprocessable_code)
+
+	def test_in_progress(self):
+		request = Client().post(set_evacuation_assistance_url, {'evacuation_assistance': 'Y'},
+								HTTP_AUTHORIZATION=self.jwt, HTTP_IDEMPOTENCY_KEY='busy').wsgi_request
+		idempotency.release('busy', 123)
+		idempotency.claim('busy', 123, idempotency.fingerprint(request))
+		response = Client().post(set_evacuation_assistance_url, {'evacuation_assistance': 'Y'},
+								HTTP_AUTHORIZATION=self.jwt, HTTP_IDEMPOTENCY_KEY='busy')
+		self.assertEqual(response.status_code, conflict_code)
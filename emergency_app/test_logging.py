@@ -0,0 +1,123 @@
+from django.http import StreamingHttpResponse
+from django.test import TestCase, Client, RequestFactory
+from emergency_app.middleware import RequestContextMiddleware
+from common.util import structured_logging
+
+import io
+import json
+import logging
+import os
+import tempfile
+import time
+import unittest
+
+get_relationship_url = '/getRelations/'
+
+
+class StructuredLoggingTests(TestCase):
+	"""
+	Testing the json records, the flood controls and the background handler
+	"""
+
+	def setUp(self):
+		self.stream = io.StringIO()
+		self.handler = structured_logging.BackgroundHandler(self.stream)
+		self.handler.setFormatter(structured_logging.JsonFormatter())
+		self.handler.addFilter(structured_logging.ContextFilter())
+		self.logger = logging.getLogger('emergency_app.test_logging')
+		self.logger.propagate = False
+		self.logger.setLevel(logging.INFO)
+		self.logger.addHandler(self.handler)
+
+	def tearDown(self):
+		self.logger.removeHandler(self.handler)
+		self.handler.close()
+		structured_logging.bind(request_id=None, pidm=None)
+
+	def records(self):
+		self.handler.flush()
+		return [json.loads(line) for line in self.stream.getvalue().splitlines()]
+
+	def test_json_records(self):
+		structured_logging.bind(request_id='abc', pidm=123)
+		self.logger.info("Invalid zip %s", '0000', extra={'field': 'zip'})
+		record = self.records()[0]
+		self.assertEqual(record['message'], "Invalid zip 0000")
+		self.assertEqual((record['level'], record['request_id'], record['pidm'], record['field']), ('INFO', 'abc', 123, 'zip'))
+
+	def test_rate_limit_and_sampling(self):
+		self.handler.addFilter(structured_logging.SamplingFilter({"Sampled out": 0}))
+		self.handler.addFilter(structured_logging.RateLimitFilter(rate=0, burst=2))
+		for _ in range(5):
+			self.logger.info("Invalid priority number")
+			self.logger.info("Sampled out")
+		self.logger.info("Invalid city")
+		self.assertEqual([record['message'] for record in self.records()],
+			["Invalid priority number", "Invalid priority number", "Invalid city"])
+
+	def test_full_queue_drops(self):
+		"""
+		A full queue drops records instead of blocking, and the next record written says how many
+		"""
+		self.handler.close()
+		self.handler = structured_logging.BackgroundHandler(self.stream, queue_size=1)
+		self.handler.setFormatter(structured_logging.JsonFormatter())
+		self.handler.listener.stop()
+		for message in ('kept', 'dropped', 'dropped'):
+			self.handler.handle(logging.makeLogRecord({'msg': message}))
+		self.handler.listener.start()
+		self.handler.handle(logging.makeLogRecord({'msg': 'after'}))
+		records = self.records()
+		self.assertEqual([record['message'] for record in records], ['kept', 'after'])
+		self.assertEqual(records[1]['dropped'], 2)
+
+	@unittest.skipUnless(hasattr(os, 'fork'), "needs fork()")
+	def test_forked_process(self):
+		"""
+		A process forked after the handler started (a preloaded server's worker) still writes its records
+		"""
+		with tempfile.TemporaryFile('w+') as output:
+			handler = structured_logging.BackgroundHandler(output)
+			handler.setFormatter(structured_logging.JsonFormatter())
+			self.logger.addHandler(handler)
+			try:
+				pid = os.fork()
+				if pid == 0:
+					try:
+						self.logger.info("From the worker")
+						# Not flush(), which would start a listener itself: wait for the record to be written
+						deadline = time.monotonic() + 5
+						while handler.queue.unfinished_tasks and time.monotonic() < deadline:
+							time.sleep(0.01)
+						handler.target.flush()
+					finally:
+						os._exit(0)
+				os.waitpid(pid, 0)
+				self.logger.info("From the master")
+				handler.flush()
+			finally:
+				self.logger.removeHandler(handler)
+				handler.close()
+			output.seek(0)
+			messages = [json.loads(line)['message'] for line in output.read().splitlines()]
+		self.assertEqual(sorted(messages), ["From the master", "From the worker"])
+
+	def test_request_id(self):
+		response = Client().get(get_relationship_url, HTTP_X_REQUEST_ID='lb-42')
+		self.assertEqual(response['X-Request-ID'], 'lb-42')
+		self.assertEqual(len(Client().get(get_relationship_url)['X-Request-ID']), 32)
+
+	def test_context_reset_after_request(self):
+		""" Records logged by the thread after a request aren't stamped with its id """
+		Client().get(get_relationship_url, HTTP_X_REQUEST_ID='lb-43')
+		self.logger.info("Between requests")
+		self.assertEqual([(record['request_id'], record['pidm']) for record in self.records()], [(None, None)])
+
+		""" A streamed response keeps it until it is closed """
+		request = RequestFactory().get(get_relationship_url, HTTP_X_REQUEST_ID='lb-44')
+		middleware = RequestContextMiddleware(lambda request: StreamingHttpResponse(iter(['a'])))
+		response = middleware(request)
+		self.logger.info("Streaming")
+		response.close()
+		self.logger.info("Closed")
+		self.assertEqual([record['request_id'] for record in self.records()[1:]], ['lb-44', None])
@@ -0,0 +1,51 @@
+from django.apps import apps
+from django.test import TestCase, Client, override_settings
+from unittest import skipUnless
+from emergency_app.models.identity import Identity
+from emp_backend import settings as settings_default
+from emp_backend import settings_api
+
+auth_url = '/login/'
+get_relationship_url = '/getRelations/'
+set_evacuation_assistance_url = '/setEvacuationAssistance/'
+
+success_code = 200
+forbidden_code = 403
+
+
+class RequestStackTests(TestCase):
+	"""
+	Testing the CSRF policy and the CORS middleware ordering, in both settings profiles
+	"""
+	databases = '__all__'
+
+	def setUp(self):
+		Identity.objects.create(pidm=123, username='fooBar', first_name='Foo', last_name='Bar', email='fooBar@pdx.edu')
+
+	def assert_api_works(self):
+		c = Client(enforce_csrf_checks=True)
+		jwt = c.post(auth_url, {'username': 'fooBar'}).content.decode('utf-8')
+		response = c.post(set_evacuation_assistance_url, {'evacuation_assistance': 'Y'}, HTTP_AUTHORIZATION=jwt)
+		self.assertEqual(response.status_code, success_code)
+
+		""" Preflights are answered by CorsMiddleware, before CommonMiddleware redirects the missing slash """
+		response = c.options(get_relationship_url.rstrip('/'), HTTP_ORIGIN='https://emp.pdx.edu',
+			HTTP_ACCESS_CONTROL_REQUEST_METHOD='POST')
+		self.assertEqual(response.status_code, success_code)
+		self.assertEqual(response['Access-Control-Allow-Origin'], '*')
+
+	@skipUnless(apps.is_installed('django.contrib.sessions'), "the default stack needs the apps the API profile drops")
+	@override_settings(MIDDLEWARE=settings_default.MIDDLEWARE)
+	def test_default_profile(self):
+		"""
+		Token-authenticated views skip the CSRF check, other views keep it
+		"""
+		self.assert_api_works()
+
+		with self.settings(EMP_TOKEN_AUTHENTICATED_VIEW_MODULES=[]):
+			response = Client(enforce_csrf_checks=True).post(auth_url, {'username': 'fooBar'})
+			self.assertEqual(response.status_code, forbidden_code)
+
+	@override_settings(MIDDLEWARE=settings_api.MIDDLEWARE, TEMPLATES=settings_api.TEMPLATES)
+	def test_api_profile(self):
+		self.assert_api_works()
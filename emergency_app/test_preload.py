@@ -0,0 +1,34 @@
+from django.test import TestCase
+from emergency_app.models.relation import Relation
+from emergency_app import preload
+from common.util import reference_data
+from common.util import sanitization
+
+
+class PreloadTests(TestCase):
+	"""
+	Testing the reference data cache and the pre-fork preload built on it
+	"""
+	databases = '__all__'
+
+	def setUp(self):
+		Relation.objects.create(code='F', description='Friend')
+
+	def test_reference_data_cache(self):
+		reference_data.load()
+		with self.assertNumQueries(0):
+			self.assertTrue(sanitization.validate_relation('F'))
+			self.assertFalse(sanitization.validate_relation('Z'))
+			self.assertEqual(reference_data.values(reference_data.RELATIONS), [{'code': 'F', 'description': 'Friend'}])
+
+		""" Saves and deletes clear the cache """
+		Relation.objects.create(code='Z', description='Zookeeper')
+		self.assertTrue(sanitization.validate_relation('Z'))
+		Relation.objects.filter(code='F').delete()
+		self.assertFalse(sanitization.validate_relation('F'))
+
+	def test_preload(self):
+		timings = preload.preload()
+		self.assertEqual(list(timings), ['urls', 'zipcodes', 'validators', 'reference_data'])
+		with self.assertNumQueries(0):
+			self.assertTrue(sanitization.validate_relation('F'))
@@ -0,0 +1,75 @@
+from django.test import TestCase, Client, override_settings
+from django.core.management import call_command
+from emergency_app import profiling
+from emergency_app.test_views import populate_static_tables
+
+import io
+import os
+import shutil
+import tempfile
+
+get_relationship_url = '/getRelations/'
+
+
+class ProfilingTests(TestCase):
+	"""
+	Testing the opt-in profiling middleware and the aggregation of its profiles
+	"""
+	databases = '__all__'
+
+	def setUp(self):
+		populate_static_tables()
+		self.directory = tempfile.mkdtemp()
+		self.settings_override = override_settings(EMP_PROFILE_DIR=self.directory, EMP_PROFILE_SAMPLE_INTERVAL=0.0001)
+		self.settings_override.enable()
+
+	def tearDown(self):
+		self.settings_override.disable()
+		shutil.rmtree(self.directory)
+
+	def test_signed_header(self):
+		c = Client()
+		response = c.get(get_relationship_url, HTTP_X_EMP_PROFILE=profiling.sign(profiling.CPROFILE))
+		self.assertTrue(response['X-EMP-Profile-File'].startswith('getRelations__'))
+		self.assertTrue(response['X-EMP-Profile-File'].endswith('.prof'))
+
+		response = c.get(get_relationship_url, HTTP_X_EMP_PROFILE=profiling.sign(profiling.SAMPLE))
+		self.assertTrue(response['X-EMP-Profile-File'].endswith('.collapsed'))
+		self.assertEqual(len(os.listdir(self.directory)), 2)
+
+		""" Unsigned or tampered headers are ignored """
+		response = c.get(get_relationship_url, HTTP_X_EMP_PROFILE=profiling.CPROFILE)
+		self.assertFalse(response.has_header('X-EMP-Profile-File'))
+		self.assertEqual(len(os.listdir(self.directory)), 2)
+
+	def test_request_id_in_file_name(self):
+		c = Client()
+		response = c.get(get_relationship_url, HTTP_X_EMP_PROFILE=profiling.sign(profiling.CPROFILE),
+						HTTP_X_REQUEST_ID='../../etc/a__b')
+		self.assertEqual(response.status_code, 200)
+		self.assertTrue(response['X-EMP-Profile-File'].endswith('__etcab.prof'))
+		self.assertEqual(os.listdir(self.directory), [response['X-EMP-Profile-File']])
+
+		""" A profile that can't be written is dropped, the response still goes out """
+		with self.settings(EMP_PROFILE_DIR=os.path.join(self.directory, response['X-EMP-Profile-File'])):
+			with self.assertLogs('emergency_app.profiling', 'WARNING'):
+				response = c.get(get_relationship_url, HTTP_X_EMP_PROFILE=profiling.sign(profiling.SAMPLE))
+		self.assertEqual(response.status_code, 200)
+		self.assertFalse(response.has_header('X-EMP-Profile-File'))
+
+	def test_sample_rate_and_rotation(self):
+		with self.settings(EMP_PROFILE_SAMPLE_RATE=1, EMP_PROFILE_MODE=profiling.CPROFILE, EMP_PROFILE_MAX_BYTES=1):
+			Client().get(get_relationship_url)
+		""" The only profile is over the cap, so it was rotated out right away """
+		self.assertEqual(os.listdir(self.directory), [])
+
+	def test_aggregate_profiles(self):
+		c = Client()
+		for mode in (profiling.CPROFILE, profiling.CPROFILE, profiling.SAMPLE):
+			c.get(get_relationship_url, HTTP_X_EMP_PROFILE=profiling.sign(mode))
+		output = tempfile.mkdtemp(dir=self.directory)
+		out = io.StringIO()
+		call_command('aggregate_profiles', output=output, stdout=out, stderr=io.StringIO())
+		self.assertIn("== getRelations: 3 profiles", out.getvalue())
+		self.assertIn("get_relations", out.getvalue())
+		self.assertEqual(os.listdir(output), ['getRelations.collapsed'])
@@ -0,0 +1,214 @@
+from django.test import TestCase, Client, override_settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver
+from django.utils import timezone
+from emergency_app.models.identity import Identity
+from emergency_app.models.contact import Contact
+from emergency_app.models.emergency import Emergency
+from emergency_app.test_views import populate_static_tables
+from emergency_app import warmup
+from common.util import reference_data
+from common.util import revocation
+from common.util import emergency_profile
+
+from datetime import timedelta
+import json
+import os
+import re
+
+# Checked-in record of the SQL each endpoint runs, per scenario.
+# After an intended change, rewrite it with: EMP_UPDATE_QUERY_SNAPSHOTS=1 python manage.py test emergency_app.test_queries --settings=emp_backend.settings_test
+snapshot_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'query_snapshots.json')
+update_snapshots = os.environ.get('EMP_UPDATE_QUERY_SNAPSHOTS') == '1'
+
+contact_counts = (0, 1, 5)
+
+
+def normalize(sql):
+	"""
+	Reduces a statement to its shape: literals become ?, IN lists (...) and savepoint names "sp"
+	"""
+	sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+	sql = re.sub(r'"s\d+_x\d+"', '"sp"', sql)
+	sql = re.sub(r'(?<![\w"])-?\d+(?:\.\d+)?(?![\w"])', '?', sql)
+	sql = re.sub(r'IN \(\?(?:, \?)*\)', 'IN (...)', sql)
+	return sql
+
+
+def load_snapshots():
+	if not os.path.exists(snapshot_path):
+		return {}
+	with open(snapshot_path) as snapshots:
+		return json.load(snapshots)
+
+
+# The snapshots record the queries of a single shard, the default database
+@override_settings(EMP_ADMINISTRATORS=['admin1'], EMP_SHARDS=['default'])
+class QuerySnapshotTests(TestCase):
+	maxDiff = None
+	"""
+	Testing the number and shape of the SQL statements of every endpoint against query_snapshots.json,
+	so an added query (e.g. an N+1) or a changed access path fails a test instead of passing silently
+	"""
+	databases = '__all__'
+
+	@classmethod
+	def setUpClass(cls):
+		super(QuerySnapshotTests, cls).setUpClass()
+		cls.snapshots = load_snapshots()
+		cls.recorded = {}
+
+	@classmethod
+	def tearDownClass(cls):
+		if update_snapshots and cls.recorded:
+			snapshots = load_snapshots()
+			snapshots.update(cls.recorded)
+			with open(snapshot_path, 'w') as output:
+				json.dump(snapshots, output, indent=1, sort_keys=True)
+				output.write('\n')
+		super(QuerySnapshotTests, cls).tearDownClass()
+
+	def setUp(self):
+		populate_static_tables()
+		Identity.objects.create(pidm=1, username='admin1', first_name='Ad', last_name='Min', email='admin1@pdx.edu')
+		Identity.objects.create(pidm=123, username='fooBar', first_name='Foo', last_name='Bar', email='fooBar@pdx.edu')
+		c = Client()
+		self.jwt = c.post('/login/', {'username': 'fooBar'}).content.decode('utf-8')
+		self.admin_jwt = c.post('/login/', {'username': 'admin1'}).content.decode('utf-8')
+
+	def set_contacts(self, count):
+		Contact.objects.filter(pidm=123).delete()
+		for position in range(1, count + 1):
+			Contact.objects.create(surrogate_id=position, pidm=123, priority=str(position), first_name='Contact%d' % position,
+				last_name='Bar', relt_code='F', phone_area='503', phone_number='5552345')
+		# Written like the endpoints do, so reads find the profile
+		emergency_profile.sync(123)
+
+	def set_emergency(self, exists):
+		Emergency.objects.filter(pidm=123).delete()
+		if exists:
+			Emergency.objects.create(pidm=123, campus_email='fooBar@pdx.edu', external_email='foo@gmail.com',
+				primary_phone='5035552345', sms_status_ind='N', sms_device='5035552345', evacuation_assistance='Y')
+		emergency_profile.sync(123)
+
+	def contact_body(self, **fields):
+		body = {'priority': '1', 'relt_code': 'S', 'first_name': 'George', 'last_name': 'Bauuer',
+			'street_line1': '345 SW Georgia Ln', 'city': 'Portland', 'stat_code': 'OR', 'natn_code': 'LUS',
+			'zip': '97230', 'ctry_code_phone': '01', 'phone_area': '503', 'phone_number': '2572522'}
+		body.update(fields)
+		return body
+
+	def assert_queries(self, route, scenario, method, path, jwt=None, **kwargs):
+		"""
+		Runs one request and compares the SQL it ran to the snapshot of "<route> <scenario>"
+		"""
+		name = '%s %s' % (route, scenario)
+		# Start from an empty reference data cache, so runs don't depend on test order
+		reference_data.clear()
+		# and from a fresh revocation list, as every request after the first of a worker finds it
+		revocation.reset()
+		revocation.get_list().refresh()
+		if jwt:
+			kwargs['HTTP_AUTHORIZATION'] = jwt
+		with CaptureQueriesContext(connection) as queries:
+			response = getattr(Client(), method)(path, **kwargs)
+			if response.streaming:
+				b''.join(response.streaming_content)
+		recorded = {
+			'status': response.status_code,
+			'count': len(queries),
+			'queries': [normalize(query['sql']) for query in queries.captured_queries],
+		}
+		self.recorded[name] = recorded
+		if update_snapshots:
+			return
+		self.assertIn(name, self.snapshots, "No snapshot for %s, record it with EMP_UPDATE_QUERY_SNAPSHOTS=1" % name)
+		self.assertEqual(recorded, self.snapshots[name], "SQL of %s changed" % name)
+
+	def test_every_endpoint_has_snapshots(self):
+		if update_snapshots:
+			self.skipTest("snapshots are being recorded")
+		routes = {str(pattern.pattern) for pattern in get_resolver().url_patterns}
+		covered = {name.split(' ', 1)[0] for name in self.snapshots}
+		self.assertEqual(routes - covered, set(), "Endpoints without a query snapshot")
+
+	def test_login(self):
+		self.assert_queries('login/', 'known user', 'post', '/login/', data={'username': 'fooBar'})
+		self.assert_queries('login/', 'unknown user', 'post', '/login/', data={'username': 'nobody'})
+
+	def test_refresh_token(self):
+		self.assert_queries('refreshToken/', 'valid token', 'post', '/refreshToken/', self.jwt)
+
+	def test_revoke_token(self):
+		self.assert_queries('revokeToken/', 'valid token', 'post', '/revokeToken/', self.jwt)
+		self.assert_queries('revokeToken/', 'revoked token', 'post', '/revokeToken/', self.jwt)
+
+	def test_contact_reads(self):
+		for count in contact_counts:
+			self.set_contacts(count)
+			scenario = '%d contacts' % count
+			self.assert_queries('getEmergencyContacts/', scenario, 'post', '/getEmergencyContacts/', self.jwt)
+			self.assert_queries('getEmergencyContactsBatch/', scenario, 'post', '/getEmergencyContactsBatch/', self.admin_jwt,
+				data=json.dumps({'pidms': [123, 456]}), content_type='application/json')
+			self.assert_queries('exportModifiedSince/', scenario, 'get', '/exportModifiedSince/', self.admin_jwt,
+				data={'since': (timezone.now() - timedelta(hours=1)).isoformat()})
+
+	def test_update_emergency_contact(self):
+		for count in contact_counts:
+			self.set_contacts(count)
+			self.assert_queries('updateEmergencyContact/', 'new, %d contacts' % count, 'post', '/updateEmergencyContact/', self.jwt,
+				data=self.contact_body(priority=str(count + 1)))
+		for count in contact_counts[1:]:
+			self.set_contacts(count)
+			self.assert_queries('updateEmergencyContact/', 'existing last to first, %d contacts' % count, 'post',
+				'/updateEmergencyContact/', self.jwt, data=self.contact_body(surrogate_id=count, priority='1'))
+			self.set_contacts(count)
+			self.assert_queries('updateEmergencyContact/<int:surrogate_id>/', 'delete first, %d contacts' % count, 'delete',
+				'/updateEmergencyContact/1/', self.jwt)
+
+	def test_replace_emergency_contacts(self):
+		for count in contact_counts:
+			self.set_contacts(count)
+			# Keeps every contact but renames the first, and adds one
+			contacts = [dict(self.contact_body(), surrogate_id=position, first_name='Contact%d' % position, relt_code='F',
+				street_line1=None, city=None, stat_code=None, natn_code=None, zip=None, ctry_code_phone=None, phone_number='5552345')
+				for position in range(1, count + 1)]
+			if contacts:
+				contacts[0]['first_name'] = 'Renamed'
+			contacts.append(self.contact_body())
+			self.assert_queries('replaceEmergencyContacts/', '%d contacts' % count, 'post', '/replaceEmergencyContacts/', self.jwt,
+				data=json.dumps(contacts), content_type='application/json')
+
+	def test_emergency_endpoints(self):
+		notifications = {'external_email': 'foo@gmail.com', 'primary_phone': '5035552345', 'sms_status_ind': 'N', 'sms_device': '5035552345'}
+		for exists in (False, True):
+			scenario = 'existing' if exists else 'new'
+			self.set_emergency(exists)
+			self.assert_queries('getEmergencyNotifications/', scenario, 'post', '/getEmergencyNotifications/', self.jwt)
+			self.assert_queries('getEvacuationAssistance/', scenario, 'post', '/getEvacuationAssistance/', self.jwt)
+			self.assert_queries('getEmergencyProfile/', scenario, 'post', '/getEmergencyProfile/', self.jwt)
+			self.assert_queries('setEmergencyNotifications/', scenario, 'post', '/setEmergencyNotifications/', self.jwt,
+				data=notifications)
+			self.set_emergency(exists)
+			self.assert_queries('setEvacuationAssistance/', scenario, 'post', '/setEvacuationAssistance/', self.jwt,
+				data={'evacuation_assistance': 'Y'})
+			self.assert_queries('lookupAddress/', scenario, 'get', '/lookupAddress/', self.admin_jwt, data={'address': '+15035552345'})
+			self.assert_queries('getEvacuationRoster/', scenario, 'get', '/getEvacuationRoster/', self.admin_jwt)
+			self.assert_queries('getChanges/', scenario, 'get', '/getChanges/', self.admin_jwt, data={'since': 0})
+
+	def test_reference_endpoints(self):
+		self.assert_queries('getRelations/', 'cold', 'get', '/getRelations/')
+		self.assert_queries('getNationCodes/', 'cold', 'get', '/getNationCodes/')
+		self.assert_queries('getStateCodes/', 'cold', 'get', '/getStateCodes/')
+
+	def test_admission_counters(self):
+		self.assert_queries('getAdmissionCounters/', 'admin', 'get', '/getAdmissionCounters/', self.admin_jwt)
+
+	def test_readiness(self):
+		# Report a finished warm-up rather than starting one on a background thread
+		warmup._state.update(pid=os.getpid(), status=warmup.READY, steps=[])
+		try:
+			self.assert_queries('readiness/', 'warm', 'get', '/readiness/')
+		finally:
+			warmup._state.update(pid=None, status=warmup.NOT_STARTED, steps=[])
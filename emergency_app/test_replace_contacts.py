@@ -0,0 +1,131 @@
+from django.test import TestCase, Client, override_settings
+from emergency_app.models.identity import Identity
+from emergency_app.models.contact import Contact
+from emergency_app.models.change_log import ChangeLog
+from emergency_app.test_views import populate_static_tables
+from emergency_app import validation
+from common.util import sharding
+
+import json
+from unittest import mock
+
+auth_url = '/login/'
+replace_contacts_url = '/replaceEmergencyContacts/'
+
+success_code = 200
+unauthorized_code = 401
+conflict_code = 409
+unprocessable_entity = 422
+
+class ReplaceEmergencyContactsTests(TestCase):
+	"""
+	Testing the bulk replacement of a user's ordered contact list
+	"""
+	databases = '__all__'
+
+	def setUp(self):
+		populate_static_tables()
+		Identity.objects.create(pidm=123, username='fooBar', first_name='Foo', last_name='Bar', email='fooBar@pdx.edu')
+		Contact.objects.using(sharding.shard_for(123)).create(surrogate_id=1, pidm=123, priority='1', first_name='Debby', last_name='Bar', relt_code='S')
+		Contact.objects.using(sharding.shard_for(123)).create(surrogate_id=2, pidm=123, priority='2', first_name='Jim', last_name='Bar', relt_code='F')
+		Contact.objects.using(sharding.shard_for(123)).create(surrogate_id=3, pidm=123, priority='3', first_name='Ann', last_name='Bar')
+		# Another user's contact, which fooBar can neither reference nor delete
+		Contact.objects.using(sharding.shard_for(987)).create(surrogate_id=4, pidm=987, priority='1', first_name='Billy', last_name='Kid')
+
+		self.jwt = Client().post(auth_url, {'username': 'fooBar'}).content.decode('utf-8')
+
+	def replace(self, contacts, jwt=None):
+		return Client().post(replace_contacts_url, json.dumps(contacts), content_type='application/json',
+			HTTP_AUTHORIZATION=jwt or self.jwt)
+
+	def test_replace_applies_minimal_diff(self):
+		"""
+		Reordering, editing, adding and removing contacts in one request
+		"""
+		response = self.replace([
+			{'surrogate_id': 2, 'first_name': 'Jim', 'last_name': 'Bar', 'relt_code': 'F'},
+			{'surrogate_id': 1, 'first_name': 'Debby', 'last_name': 'Barr', 'relt_code': 'S'},
+			{'first_name': 'New', 'last_name': 'Contact', 'relt_code': 'G'},
+		])
+		self.assertEqual(response.status_code, success_code)
+		self.assertEqual(json.loads(response.content), {'created': 1, 'updated': 2, 'deleted': 1, 'unchanged': 0})
+
+		contacts = Contact.objects.using(sharding.shard_for(123)).filter(pidm=123).order_by('priority')
+		self.assertEqual([(contact.first_name, contact.priority) for contact in contacts],
+			[('Jim', '1'), ('Debby', '2'), ('New', '3')])
+		self.assertEqual(Contact.objects.using(sharding.shard_for(123)).get(surrogate_id=1).last_name, 'Barr')
+		""" The other user's contact is untouched """
+		self.assertTrue(Contact.objects.using(sharding.shard_for(987)).filter(surrogate_id=4).exists())
+
+		""" Every write is in the change log, with only the changed fields """
+		changes = {(change.operation, change.row_key): json.loads(change.changed_fields) for change in ChangeLog.objects.using(sharding.shard_for(123)).all()}
+		self.assertEqual(changes[('U', '2')], {'priority': '1'})
+		self.assertEqual(changes[('U', '1')], {'priority': '2', 'last_name': 'Barr'})
+		self.assertEqual(changes[('D', '3')], {})
+		new_contact = Contact.objects.using(sharding.shard_for(123)).get(first_name='New')
+		self.assertEqual(changes[('I', str(new_contact.surrogate_id))]['relt_code'], 'G')
+		self.assertEqual(ChangeLog.objects.using(sharding.shard_for(123)).filter(operation='I').count(), 1)
+
+		""" Sending the same list again changes nothing """
+		response = self.replace([
+			{'surrogate_id': 2, 'first_name': 'Jim', 'last_name': 'Bar', 'relt_code': 'F'},
+			{'surrogate_id': 1, 'first_name': 'Debby', 'last_name': 'Barr', 'relt_code': 'S'},
+			{'surrogate_id': new_contact.surrogate_id, 'first_name': 'New', 'last_name': 'Contact', 'relt_code': 'G'},
+		])
+		self.assertEqual(json.loads(response.content), {'created': 0, 'updated': 0, 'deleted': 0, 'unchanged': 3})
+		self.assertEqual(ChangeLog.objects.using(sharding.shard_for(123)).count(), len(changes))
+
+	def test_replace_rejects_invalid_lists(self):
+		"""
+		Any invalid entry rejects the whole list, and nothing is written
+		"""
+		response = self.replace([
+			{'surrogate_id': 1, 'first_name': 'Debby', 'last_name': 'Bar'},
+			{'first_name': 'Bad', 'last_name': 'Relation', 'relt_code': 'Z'},
+			{'surrogate_id': 4, 'first_name': 'Billy', 'last_name': 'Kid'},
+			{'surrogate_id': 1, 'first_name': 'Debby', 'last_name': 'Twice'},
+		])
+		self.assertEqual(response.status_code, unprocessable_entity)
+		errors = json.loads(response.content)
+		self.assertEqual(sorted(errors), ['1', '2', '3'])
+		self.assertEqual(errors['1'], {'relt_code': ["Invalid relation code"]})
+		self.assertEqual(Contact.objects.using(sharding.shard_for(123)).filter(pidm=123).count(), 3)
+		self.assertEqual(ChangeLog.objects.using(sharding.shard_for(123)).count(), 0)
+
+		response = self.replace({'not': 'a list'})
+		self.assertEqual(response.status_code, unprocessable_entity)
+
+		response = self.replace([], jwt="No Token Here!")
+		self.assertEqual(response.status_code, unauthorized_code)
+
+		with self.settings(EMP_REPLACE_CONTACTS_MAX_CONTACTS=2):
+			response = self.replace([{'first_name': 'Contact', 'last_name': str(n)} for n in range(3)])
+		self.assertEqual(response.status_code, unprocessable_entity)
+		self.assertEqual(response.content.decode('utf-8'), "At most 2 contacts per request")
+
+	def test_replace_conflicts_with_added_contact(self):
+		"""
+		A contact another request adds while the list is validated isn't silently kept, the whole list is refused
+		"""
+		validate = validation.replace_emergency_contact.validate
+		def add_contact_then_validate(*args):
+			if not Contact.objects.using(sharding.shard_for(123)).filter(first_name='Sneaky').exists():
+				Contact.objects.using(sharding.shard_for(123)).create(pidm=123, priority='4', first_name='Sneaky', last_name='Bar')
+			return validate(*args)
+
+		with mock.patch.object(validation.replace_emergency_contact, 'validate', side_effect=add_contact_then_validate):
+			response = self.replace([
+				{'surrogate_id': 1, 'first_name': 'Debby', 'last_name': 'Bar', 'relt_code': 'S'},
+				{'first_name': 'New', 'last_name': 'Contact', 'relt_code': 'G'},
+			])
+		self.assertEqual(response.status_code, conflict_code)
+		current = json.loads(response.content)['current']
+		self.assertEqual([contact['first_name'] for contact in current], ['Debby', 'Jim', 'Ann', 'Sneaky'])
+		self.assertFalse(ChangeLog.objects.using(sharding.shard_for(123)).exists())
+
+
+@override_settings(EMP_SHARDS=['default'])
+class SingleShardReplaceEmergencyContactsTests(ReplaceEmergencyContactsTests):
+	"""
+	The same tests with one shard, where the database numbers the new contacts
+	"""
@@ -0,0 +1,117 @@
+from django.test import TestCase, Client, override_settings
+from django.core.management import call_command
+from emergency_app.models.identity import Identity
+from emergency_app.models.contact import Contact
+from emergency_app.models.emergency import Emergency
+from emergency_app.models.change_log import ChangeLog
+from common.util import reverse_lookup
+from common.util import sharding
+
+import io
+import json
+import os
+import tempfile
+
+auth_url = '/login/'
+lookup_address_url = '/lookupAddress/'
+set_emergency_notifications_url = '/setEmergencyNotifications/'
+
+success_code = 200
+forbidden_code = 403
+
+@override_settings(EMP_ADMINISTRATORS=['admin1'])
+class ReverseLookupTests(TestCase):
+	"""
+	Testing the normalized address keys and the bounce/STOP processing built on them
+	"""
+	databases = '__all__'
+
+	def setUp(self):
+		Identity.objects.create(pidm=1, username='admin1', first_name='Ad', last_name='Min', email='admin1@pdx.edu')
+		Identity.objects.create(pidm=123, username='fooBar', first_name='Foo', last_name='Bar', email='fooBar@pdx.edu')
+		Emergency.objects.using(sharding.shard_for(123)).create(pidm=123, external_email='Foo.Master@Hotmail.com', primary_phone='5031234567',
+			sms_status_ind='N', sms_device='5030102929')
+		Emergency.objects.using(sharding.shard_for(456)).create(pidm=456, alternate_phone='5030102929', sms_status_ind='N', sms_device='9719876543')
+		Contact.objects.using(sharding.shard_for(789)).create(surrogate_id=1, pidm=789, priority='1', first_name='Debby', last_name='Bar',
+			phone_area='503', phone_number='0102929')
+
+		c = Client()
+		self.admin_jwt = c.post(auth_url, {'username': 'admin1'}).content.decode('utf-8')
+		self.user_jwt = c.post(auth_url, {'username': 'fooBar'}).content.decode('utf-8')
+
+	def test_keys_maintained_on_write(self):
+		"""
+		The keys are set when rows are saved, including through the set_* views
+		"""
+		self.assertEqual(Emergency.objects.using(sharding.shard_for(123)).get(pidm=123).external_email_key, 'foo.master@hotmail.com')
+		self.assertEqual(Contact.objects.using(sharding.shard_for(789)).get(surrogate_id=1).phone_key, '15030102929')
+
+		Client().post(set_emergency_notifications_url, {'external_email': 'New@gmail.com', 'sms_status_ind': 'Y'},
+			HTTP_AUTHORIZATION=self.user_jwt)
+		emergency = Emergency.objects.using(sharding.shard_for(123)).get(pidm=123)
+		self.assertEqual((emergency.external_email_key, emergency.sms_device_key), ('new@gmail.com', None))
+
+	def test_lookup(self):
+		"""
+		One address finds every row and column using it
+		"""
+		matches = reverse_lookup.lookup('+1 (503) 010-2929')
+		self.assertEqual(sorted((match['table'], match['pidm'], match['field']) for match in matches), [
+			('SPREMRG', 789, 'phone_number'),
+			('ZGBNNN', 123, 'sms_device'),
+			('ZGBNNN', 456, 'alternate_phone'),
+		])
+
+		response = Client().get(lookup_address_url, {'address': 'FOO.master@hotmail.com'}, HTTP_AUTHORIZATION=self.admin_jwt)
+		self.assertEqual(response.status_code, success_code)
+		self.assertEqual(json.loads(response.content), [{'table': 'ZGBNNN', 'pidm': 123, 'row_key': 123, 'field': 'external_email'}])
+
+		response = Client().get(lookup_address_url, {'address': '5030102929'}, HTTP_AUTHORIZATION=self.user_jwt)
+		self.assertEqual(response.status_code, forbidden_code)
+
+	def test_process_bounces(self):
+		"""
+		STOP replies opt numbers out of texts and bounces remove emails, both recorded in the change log
+		"""
+		report = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False)
+		report.write("+15030102929,stop\nfoo.master@hotmail.com,bounce\n+15550000000,stop\nnot-an-address,bounce\n")
+		report.close()
+		self.addCleanup(os.remove, report.name)
+
+		""" A dry run changes nothing """
+		call_command('process_bounces', report.name, dry_run=True, stderr=io.StringIO())
+		self.assertEqual(Emergency.objects.using(sharding.shard_for(123)).get(pidm=123).sms_status_ind, 'N')
+
+		err = io.StringIO()
+		call_command('process_bounces', report.name, chunk_size=1, stderr=err)
+		self.assertIn("1 people opted out of texts, 1 emails removed", err.getvalue())
+
+		emergency = Emergency.objects.using(sharding.shard_for(123)).get(pidm=123)
+		self.assertEqual((emergency.sms_status_ind, emergency.sms_device, emergency.external_email), ('Y', None, None))
+		""" Only the sms device is opted out, the same number as someone's alternate phone is untouched """
+		self.assertEqual(Emergency.objects.using(sharding.shard_for(456)).get(pidm=456).sms_status_ind, 'N')
+		self.assertEqual(ChangeLog.objects.using(sharding.shard_for(123)).filter(pidm=123).count(), 1)
+
+	def test_stop_and_bounce_for_one_person(self):
+		"""
+		A STOP and a bounce for the same person are applied together, neither write undoes the other's keys
+		"""
+		summary = reverse_lookup.apply_reports([('+15030102929', reverse_lookup.STOP), ('foo.master@hotmail.com', reverse_lookup.BOUNCE)])
+		self.assertEqual((summary['opted_out'], summary['emails_removed']), (1, 1))
+
+		emergency = Emergency.objects.using(sharding.shard_for(123)).get(pidm=123)
+		self.assertEqual((emergency.sms_status_ind, emergency.sms_device, emergency.sms_device_key), ('Y', None, None))
+		self.assertEqual((emergency.external_email, emergency.external_email_key), (None, None))
+		self.assertEqual(emergency.version, 2)
+		change = ChangeLog.objects.using(sharding.shard_for(123)).get(pidm=123)
+		self.assertEqual(json.loads(change.changed_fields), {'sms_status_ind': 'Y', 'sms_device': None, 'external_email': None})
+		""" The number no longer finds them """
+		self.assertEqual([match['pidm'] for match in reverse_lookup.lookup('5030102929') if match['table'] == 'ZGBNNN'], [456])
+
+	def test_backfill(self):
+		"""
+		The backfill command repairs keys of rows written without save()
+		"""
+		Emergency.objects.using(sharding.shard_for(456)).filter(pidm=456).update(sms_device='971-555-0000')
+		call_command('backfill_lookup_keys', batch_size=1, stderr=io.StringIO())
+		self.assertEqual(Emergency.objects.using(sharding.shard_for(456)).get(pidm=456).sms_device_key, '19715550000')
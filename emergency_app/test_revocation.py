@@ -0,0 +1,120 @@
+from django.test import TestCase, Client
+from emergency_app.models.identity import Identity
+from emergency_app.models.revoked_token import RevokedToken
+from common.util import jwt_placeholder
+from common.util import revocation
+
+import time
+
+auth_url = '/login/'
+refresh_url = '/refreshToken/'
+revoke_url = '/revokeToken/'
+get_contacts_url = '/getEmergencyContacts/'
+
+success_code = 200
+no_content_code = 204
+unauthorized_code = 401
+
+
+class BloomFilterTests(TestCase):
+	"""
+	Testing the sizes and answers of the Bloom filter
+	"""
+
+	def test_membership(self):
+		bloom = revocation.BloomFilter(capacity=1000, error_rate=0.01)
+		added = ['token%d' % number for number in range(1000)]
+		for value in added:
+			bloom.add(value)
+		""" Never a false negative """
+		self.assertTrue(all(value in bloom for value in added))
+		""" False positives stay around the error rate at capacity """
+		false_positives = sum('other%d' % number in bloom for number in range(10000))
+		self.assertLess(false_positives, 300)
+
+	def test_size(self):
+		bloom = revocation.BloomFilter(capacity=1000000, error_rate=0.001)
+		self.assertLess(len(bloom.bits), 2 * 1024 * 1024)
+		self.assertEqual(bloom.hash_count, 10)
+
+
+class RevocationListTests(TestCase):
+	"""
+	Testing that processes pick up revocations and only query the database for possible positives
+	"""
+
+	def setUp(self):
+		revocation.reset()
+
+	def tearDown(self):
+		revocation.reset()
+
+	def test_refresh(self):
+		other_process = revocation.RevocationList(1000, 0.001, refresh_interval=60, reload_interval=600)
+		self.assertFalse(other_process.is_revoked('a'))
+
+		revocation.revoke('a', int(time.time()) + 60)
+		self.assertTrue(revocation.is_revoked('a'))
+		with self.assertNumQueries(0):
+			self.assertFalse(revocation.is_revoked('b'))
+
+		""" Other processes see the revocation at their next refresh """
+		self.assertFalse(other_process.is_revoked('a'))
+		other_process.refreshed -= 61
+		self.assertTrue(other_process.is_revoked('a'))
+
+		""" Threads that waited on the lock while another refreshed the stale list don't refresh it again """
+		with self.assertNumQueries(0):
+			other_process.refresh(if_stale=True)
+
+	def test_reload(self):
+		revocation.revoke('a', int(time.time()) + 60)
+		revocation.revoke('b', int(time.time()) - 60)
+		revoked = revocation.RevocationList(1, 0.001, refresh_interval=60, reload_interval=600)
+		""" Expired revocations are left out of the filter """
+		self.assertTrue(revoked.is_revoked('a'))
+		self.assertNotIn('b', revoked.filter)
+
+		""" A full filter is rebuilt larger """
+		RevokedToken.objects.create(jti='c', expires=RevokedToken.objects.get(jti='a').expires)
+		revoked.refresh()
+		self.assertEqual(revoked.capacity, 2)
+		self.assertTrue(revoked.is_revoked('c'))
+
+		""" Revoking purges the expired revocations """
+		revocation.revoke('d', int(time.time()) + 60)
+		self.assertFalse(RevokedToken.objects.filter(jti='b').exists())
+
+
+class RevokeTokenTests(TestCase):
+	"""
+	Testing that revoked tokens, and the ones refreshed from them, are refused
+	"""
+	databases = '__all__'
+
+	def setUp(self):
+		revocation.reset()
+		Identity.objects.create(pidm=123, username='fooBar', first_name='Foo', last_name='Bar', email='fooBar@pdx.edu')
+
+	def tearDown(self):
+		revocation.reset()
+
+	def test_revoke(self):
+		c = Client()
+		token = c.post(auth_url, {'username': 'fooBar'}).content.decode('utf-8')
+		refreshed = c.post(refresh_url, HTTP_AUTHORIZATION=token).content.decode('utf-8')
+		other_session = c.post(auth_url, {'username': 'fooBar'}).content.decode('utf-8')
+		self.assertEqual(c.post(get_contacts_url, HTTP_AUTHORIZATION=refreshed).status_code, no_content_code)
+
+		self.assertEqual(c.post(revoke_url, HTTP_AUTHORIZATION=token).status_code, success_code)
+		revoked = RevokedToken.objects.get()
+		payload = jwt_placeholder.grab_token_payload(token)
+		self.assertEqual(revoked.jti, payload['jti'])
+		self.assertEqual(revoked.expires.timestamp(), payload['orig_iat'] + 12 * 60 * 60)
+
+		""" The whole session is revoked """
+		for revoked_token in (token, refreshed):
+			self.assertEqual(c.post(get_contacts_url, HTTP_AUTHORIZATION=revoked_token).status_code, unauthorized_code)
+			self.assertEqual(c.post(refresh_url, HTTP_AUTHORIZATION=revoked_token).status_code, unauthorized_code)
+			self.assertEqual(c.post(revoke_url, HTTP_AUTHORIZATION=revoked_token).status_code, unauthorized_code)
+		self.assertEqual(c.post(get_contacts_url, HTTP_AUTHORIZATION=other_session).status_code, no_content_code)
@@ -0,0 +1,299 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, transaction
+from django.test import TestCase, Client, override_settings
+from emergency_app.models.identity import Identity
+from emergency_app.models.contact import Contact
+from emergency_app.models.emergency import Emergency
+from emergency_app.models.emergency_profile import EmergencyProfile
+from emergency_app.models.relation import Relation
+from emergency_app.models.change_log import ChangeLog
+from emergency_app.models.evacuation_roster import EvacuationRoster
+from emergency_app.models.task import Task
+from emergency_app.test_tasks import calls, record_call
+from emergency_app.test_views import populate_static_tables
+from common.util import batch_lookup
+from common.util import change_log
+from common.util import evacuation_roster
+from common.util import export
+from common.util import sharding
+from common.util import structured_logging
+from common.util import tasks
+
+import io
+import unittest
+from unittest import mock
+from datetime import timedelta
+from django.utils import timezone
+
+auth_url = '/login/'
+update_contact_url = '/updateEmergencyContact/'
+set_evacuation_assistance_url = '/setEvacuationAssistance/'
+
+success_code = 200
+
+shards = ['default', 'shard_1', 'shard_2']
+
+
+class ShardMapTests(TestCase):
+	"""
+	Testing the placement of pidms and the routing decisions, without shard databases
+	"""
+
+	def tearDown(self):
+		structured_logging.bind(pidm=None)
+
+	def test_jump_hash(self):
+		keys = range(0, 10 ** 15, 10 ** 10)
+		placed = [sharding.jump_hash(key, 3) for key in keys]
+		self.assertEqual(set(placed), {0, 1, 2})
+		self.assertGreater(min(placed.count(bucket) for bucket in range(3)), len(placed) / 4)
+
+		""" A fourth bucket only takes keys, it never moves them between the first three """
+		for key, bucket in zip(keys, placed):
+			self.assertIn(sharding.jump_hash(key, 4), (bucket, 3))
+
+	@override_settings(EMP_SHARDS=shards)
+	def test_shard_for(self):
+		placed = sharding.group_by_shard(range(1000))
+		self.assertEqual(set(placed), set(shards))
+		self.assertEqual(sharding.shard_for(123), sharding.shard_for('123'))
+
+		with self.settings(EMP_SHARDS=['default']):
+			self.assertEqual(sharding.group_by_shard(range(1000)), {'default': list(range(1000))})
+
+	@override_settings(EMP_SHARDS=shards)
+	def test_router(self):
+		router = sharding.ShardRouter()
+		self.assertEqual(router.db_for_read(Contact, instance=Contact(pidm=123)), sharding.shard_for(123))
+		self.assertEqual(router.db_for_write(Emergency, instance=Emergency(pidm=456)), sharding.shard_for(456))
+		self.assertIsNone(router.db_for_read(Identity))
+
+		""" A query that doesn't name its shard is refused rather than sent to the default database """
+		structured_logging.bind(pidm=456)
+		with self.assertRaises(sharding.UnknownShard):
+			router.db_for_read(Contact)
+		with self.assertRaises(sharding.UnknownShard):
+			Contact.objects.filter(pidm=456).count()
+
+		self.assertTrue(router.allow_relation(Contact(pidm=123), Relation(code='S')))
+		self.assertIsNone(router.allow_migrate('default', 'emergency_app', 'identity'))
+		self.assertTrue(router.allow_migrate('shard_1', 'emergency_app', 'contact'))
+		self.assertTrue(router.allow_migrate('shard_1', 'emergency_app', 'relation'))
+		self.assertFalse(router.allow_migrate('shard_1', 'emergency_app', 'identity'))
+		""" Data migrations run on the default database only """
+		self.assertFalse(router.allow_migrate('shard_1', 'emergency_app'))
+
+		with self.settings(EMP_SHARDS=['default']):
+			self.assertIsNone(router.db_for_read(Contact, instance=Contact(pidm=123)))
+
+
+@unittest.skipUnless(len(settings.EMP_SHARDS) > 1, "needs several shard databases, run the tests with --settings=emp_backend.settings_test")
+class ShardedStorageTests(TestCase):
+	"""
+	Testing that rows land on their pidm's shard and that cross-shard reads gather every shard
+	"""
+	databases = '__all__'
+
+	def setUp(self):
+		populate_static_tables()
+		for alias in sharding.shard_aliases()[1:]:
+			sharding.copy_reference_tables(alias)
+		placed = sharding.group_by_shard(range(1, 200))
+		# One person on the default database and one on another shard
+		self.pidms = [placed['default'][0], placed[sharding.shard_aliases()[1]][0]]
+		for pidm in self.pidms:
+			Identity.objects.create(pidm=pidm, username='user%d' % pidm, first_name='Foo', last_name='Bar',
+									email='user%d@pdx.edu' % pidm)
+
+	def tearDown(self):
+		structured_logging.bind(pidm=None)
+
+	def write(self, pidm):
+		c = Client()
+		jwt = c.post(auth_url, {'username': 'user%d' % pidm}).content.decode('utf-8')
+		response = c.post(update_contact_url, {'priority': '1', 'first_name': 'Debby', 'last_name': 'Bar', 'relt_code': 'S',
+											'ctry_code_phone': '1', 'phone_area': '503', 'phone_number': '5552345'},
+						HTTP_AUTHORIZATION=jwt)
+		self.assertEqual(response.status_code, success_code)
+		response = c.post(set_evacuation_assistance_url, {'evacuation_assistance': 'Y'}, HTTP_AUTHORIZATION=jwt)
+		self.assertEqual(response.status_code, success_code)
+
+	def test_placement(self):
+		for pidm in self.pidms:
+			self.write(pidm)
+		for pidm in self.pidms:
+			for alias in sharding.shard_aliases():
+				expected = 1 if alias == sharding.shard_for(pidm) else 0
+				self.assertEqual(Contact.objects.using(alias).filter(pidm=pidm).count(), expected)
+				self.assertEqual(Emergency.objects.using(alias).filter(pidm=pidm).count(), expected)
+				self.assertEqual(EmergencyProfile.objects.using(alias).filter(pidm=pidm).count(), expected)
+
+		""" Scatter-gather reads see everyone """
+		people = list(batch_lookup.iter_contacts_by_pidm(self.pidms, chunk_size=10))
+		self.assertEqual([len(person['contacts']) for person in people], [1, 1])
+		rows = list(export.iter_modified_since(Contact, timezone.now() - timedelta(hours=1), chunk_size=1))
+		self.assertEqual(sorted(row['pidm'] for row in rows), sorted(self.pidms))
+		self.assertEqual(rows, sorted(rows, key=lambda row: (row['activity_date'], row['surrogate_id'])))
+
+	def test_change_log_and_roster(self):
+		""" The change log entries and roster rows are written on the person's shard, with their rows """
+		for pidm in self.pidms:
+			self.write(pidm)
+		sharded = self.pidms[1]
+		alias = sharding.shard_for(sharded)
+		self.assertEqual(ChangeLog.objects.using(alias).filter(pidm=sharded).count(), 2)
+		self.assertFalse(ChangeLog.objects.using('default').filter(pidm=sharded).exists())
+		for pidm in self.pidms:
+			self.assertTrue(EvacuationRoster.objects.using(sharding.shard_for(pidm)).filter(pidm=pidm).exists())
+		self.assertEqual([row['pidm'] for row in evacuation_roster.all_rows()], sorted(self.pidms))
+
+		""" Reading the feed relays the shard's entries first, in the order they were written """
+		first = ChangeLog.objects.using(alias).order_by('sequence').first()
+		changes = change_log.changes_since(0, 100)
+		self.assertEqual(sorted(change['pidm'] for change in changes), sorted(self.pidms * 2))
+		self.assertEqual([change['table'] for change in changes if change['pidm'] == sharded], ['SPREMRG', 'ZGBNNN'])
+		self.assertFalse(ChangeLog.objects.using(alias).exists())
+
+		self.assertTrue(ChangeLog.objects.using('default').filter(origin='%s:%d' % (alias, first.sequence)).exists())
+
+		""" An entry a stopped relay already copied isn't copied again """
+		self.write(sharded)
+		pending = list(ChangeLog.objects.using(alias).order_by('sequence'))
+		copied = pending[0]
+		ChangeLog.objects.using('default').create(origin='%s:%d' % (alias, copied.sequence), pidm=copied.pidm,
+												table_name=copied.table_name, operation=copied.operation,
+												changed_fields=copied.changed_fields)
+		self.assertEqual(change_log.relay(alias), len(pending) - 1)
+		self.assertFalse(ChangeLog.objects.using(alias).exists())
+		self.assertEqual(ChangeLog.objects.using('default').filter(pidm=sharded).count(), 2 + len(pending))
+
+	def test_rebalance(self):
+		""" Everyone is written to the default database while it is the only shard """
+		with self.settings(EMP_SHARDS=['default']):
+			for pidm in self.pidms:
+				self.write(pidm)
+		structured_logging.bind(pidm=None)
+		self.assertEqual(Contact.objects.using('default').count(), 2)
+
+		# A read after the shard map grew, before the rebalance, built an empty profile on the new shard
+		moving = self.pidms[1]
+		EmergencyProfile.objects.using(sharding.shard_for(moving)).create(pidm=moving, contacts='[]', notifications='[]',
+																		evacuation_assistance='[]')
+
+		call_command('rebalance_shards', stderr=io.StringIO())
+		self.assertEqual(sharding.misplaced_pidms(), {})
+		for pidm in self.pidms:
+			self.assertTrue(Contact.objects.using(sharding.shard_for(pidm)).filter(pidm=pidm).exists())
+			self.assertTrue(Emergency.objects.using(sharding.shard_for(pidm)).filter(pidm=pidm).exists())
+			self.assertTrue(EmergencyProfile.objects.using(sharding.shard_for(pidm)).filter(pidm=pidm).exists())
+			self.assertTrue(EvacuationRoster.objects.using(sharding.shard_for(pidm)).filter(pidm=pidm).exists())
+		self.assertEqual(Contact.objects.using('default').count(), 1)
+		self.assertNotEqual(EmergencyProfile.objects.using(sharding.shard_for(moving)).get(pidm=moving).contacts, '[]')
+
+	def test_surrogate_ids(self):
+		""" Contacts get ids from the sequence the shards share, never one another shard already used """
+		third = sharding.group_by_shard(range(1, 200))[sharding.shard_aliases()[2]][0]
+		Identity.objects.create(pidm=third, username='user%d' % third, first_name='Foo', last_name='Bar',
+			email='user%d@pdx.edu' % third)
+		for pidm in self.pidms + [third]:
+			self.write(pidm)
+		Contact.objects.using(sharding.shard_for(third)).create(pidm=third, priority='2', first_name='Jan', last_name='Bar')
+		ids = [pk for alias in sharding.shard_aliases() for pk in Contact.objects.using(alias).values_list('surrogate_id', flat=True)]
+		self.assertEqual(len(ids), 4)
+		self.assertEqual(len(set(ids)), 4)
+
+		""" Rows loaded without drawing from the sequence are skipped by the next ids once it is advanced """
+		Contact.objects.using('default').create(surrogate_id=max(ids) + 10, pidm=self.pidms[0], priority='2',
+			first_name='Jan', last_name='Bar')
+		self.assertEqual(sharding.advance_surrogate_sequences(), {'SPREMRG': max(ids) + 10})
+		self.assertEqual(list(sharding.allocate_surrogate_ids(Contact, 2)), [max(ids) + 11, max(ids) + 12])
+
+	def test_misplaced_pidms(self):
+		with self.settings(EMP_SHARDS=['default']):
+			for pidm in self.pidms:
+				self.write(pidm)
+			self.assertEqual(sharding.misplaced_pidms(), {})
+		structured_logging.bind(pidm=None)
+		moving = self.pidms[1]
+		target = sharding.shard_for(moving)
+		self.assertEqual(sharding.misplaced_pidms(), {('default', target): [moving]})
+
+		""" A dry run only counts them """
+		out = io.StringIO()
+		call_command('rebalance_shards', dry_run=True, stderr=out)
+		self.assertIn("1 people to move from default to %s" % target, out.getvalue())
+		self.assertEqual(sharding.misplaced_pidms(), {('default', target): [moving]})
+
+		sharding.move([moving], 'default', target)
+		self.assertEqual(sharding.misplaced_pidms(), {})
+		self.assertEqual(Contact.objects.using(target).get(pidm=moving).relation.description, 'Spouse/Significant Other')
+
+	def test_rebalance_collision(self):
+		""" A person whose surrogate id is taken on their shard stops the rebalance before anyone is moved """
+		with self.settings(EMP_SHARDS=['default']):
+			for pidm in self.pidms:
+				self.write(pidm)
+		structured_logging.bind(pidm=None)
+		moving = self.pidms[1]
+		target = sharding.shard_for(moving)
+		misplaced = sharding.misplaced_pidms()
+		self.assertEqual(misplaced, {('default', target): [moving]})
+		# Numbered by the target's own sequence before the shards shared one
+		other = sharding.group_by_shard(range(200, 400))[target][0]
+		taken = Contact.objects.using('default').get(pidm=moving).surrogate_id
+		Contact.objects.using(target).create(surrogate_id=taken, pidm=other, priority='1', first_name='Jan', last_name='Bar')
+
+		with self.assertRaisesMessage(CommandError, '%d (default to %s)' % (moving, target)):
+			call_command('rebalance_shards', stderr=io.StringIO())
+		self.assertEqual(sharding.misplaced_pidms(), misplaced)
+		self.assertEqual(Contact.objects.using('default').filter(pidm=moving).count(), 1)
+		with self.assertRaises(sharding.SurrogateIdCollision):
+			sharding.move([moving], 'default', target)
+		self.assertTrue(Emergency.objects.using('default').filter(pidm=moving).exists())
+
+	def test_interrupted_move(self):
+		with self.settings(EMP_SHARDS=['default']):
+			for pidm in self.pidms:
+				self.write(pidm)
+		structured_logging.bind(pidm=None)
+		moving = self.pidms[1]
+		target = sharding.shard_for(moving)
+
+		""" The target failing to take the rows leaves them on the source """
+		with mock.patch('django.db.models.query.QuerySet.bulk_create', side_effect=DatabaseError('disk full')):
+			with self.assertRaises(DatabaseError):
+				sharding.move([moving], 'default', target)
+		self.assertTrue(Contact.objects.using('default').filter(pidm=moving).exists())
+		self.assertTrue(Emergency.objects.using('default').filter(pidm=moving).exists())
+		self.assertFalse(Contact.objects.using(target).filter(pidm=moving).exists())
+
+		""" A failure after the target committed leaves copies on both, moving again removes the source's """
+		for model in (Contact, Emergency):
+			model.objects.using(target).bulk_create(list(model.objects.using('default').filter(pidm=moving)))
+		self.assertEqual(sharding.misplaced_pidms(), {('default', target): [moving]})
+		sharding.move([moving], 'default', target)
+		self.assertEqual(sharding.misplaced_pidms(), {})
+		self.assertEqual(Contact.objects.using(target).filter(pidm=moving).count(), 1)
+		self.assertEqual(Emergency.objects.using(target).filter(pidm=moving).count(), 1)
+		self.assertFalse(Contact.objects.using('default').filter(pidm=moving).exists())
+
+	def test_tasks(self):
+		""" A durable task is written in the transaction of its shard, and the worker polls every shard """
+		del calls[:]
+		shard = sharding.shard_aliases()[1]
+		try:
+			with transaction.atomic(using=shard):
+				tasks.enqueue_durable(record_call, 'rolled back', using=shard)
+				raise ValueError
+		except ValueError:
+			pass
+		self.assertFalse(Task.objects.using(shard).exists())
+
+		with transaction.atomic(using=shard):
+			tasks.enqueue_durable(record_call, 'committed', using=shard)
+		call_command('run_task_worker', once=True, stderr=io.StringIO())
+		self.assertEqual(calls, ['committed'])
+		self.assertEqual(Task.objects.using(shard).get().status, Task.DONE)
+		self.assertFalse(Task.objects.using('default').exists())
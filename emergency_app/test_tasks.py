@@ -0,0 +1,156 @@
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.core.management import call_command
+from django.db import transaction
+from django.utils import timezone
+from emergency_app.models.task import Task
+from common.util import tasks
+
+from datetime import timedelta
+import io
+
+# Side effects of the test tasks
+calls = []
+
+@tasks.task
+def record_call(value):
+	calls.append(value)
+
+@tasks.task
+def always_fails(value):
+	raise RuntimeError("vendor unavailable")
+
+
+@override_settings(EMP_TASKS_ALWAYS_EAGER=True)
+class OnCommitTests(TransactionTestCase):
+	"""
+	Testing that in-process tasks only run once their transaction commits
+	"""
+
+	def setUp(self):
+		del calls[:]
+
+	def test_enqueue_waits_for_commit(self):
+		with transaction.atomic():
+			tasks.enqueue(record_call, 'committed')
+			""" Nothing runs while the transaction is open """
+			self.assertEqual(calls, [])
+		self.assertEqual(calls, ['committed'])
+
+	def test_enqueue_skipped_on_rollback(self):
+		try:
+			with transaction.atomic():
+				tasks.enqueue(record_call, 'rolled back')
+				raise ValueError
+		except ValueError:
+			pass
+		self.assertEqual(calls, [])
+
+	def test_eager_failure_goes_to_durable_queue(self):
+		with self.assertLogs('common.util.tasks', 'ERROR'):
+			with transaction.atomic():
+				tasks.enqueue(always_fails, 'eager')
+		queued = Task.objects.get()
+		self.assertEqual((queued.name, queued.status, queued.attempts), (tasks.task_name(always_fails), Task.PENDING, 1))
+		self.assertIn("vendor unavailable", queued.last_error)
+
+
+class TaskRunnerTests(TestCase):
+	"""
+	Testing the in-process runner and the durable queue worker
+	"""
+	databases = '__all__'
+
+	def setUp(self):
+		del calls[:]
+
+	def test_in_process_runner(self):
+		"""
+		Tasks run on the pool, and spill over to the durable queue when the pool is full
+		"""
+		runner = tasks.InProcessRunner(max_workers=1, max_queue=1)
+		runner.submit(tasks.task_name(record_call), ('pooled',), {})
+		runner.executor.shutdown(wait=True)
+		self.assertEqual(calls, ['pooled'])
+
+		full_runner = tasks.InProcessRunner(max_workers=1, max_queue=1)
+		full_runner.slots.acquire()
+		full_runner.submit(tasks.task_name(record_call), ('spilled',), {})
+		self.assertEqual(Task.objects.get().name, tasks.task_name(record_call))
+
+	def test_durable_worker(self):
+		"""
+		The worker runs due tasks once and marks them done
+		"""
+		tasks.enqueue_durable(record_call, 'durable')
+		call_command('run_task_worker', once=True, stderr=io.StringIO())
+		self.assertEqual(calls, ['durable'])
+		self.assertEqual(Task.objects.get().status, Task.DONE)
+
+		""" A second run has nothing left to do """
+		call_command('run_task_worker', once=True, stderr=io.StringIO())
+		self.assertEqual(calls, ['durable'])
+
+	@override_settings(EMP_TASKS_BACKOFF_SECONDS=10)
+	def test_durable_retry_and_backoff(self):
+		"""
+		Failing tasks are rescheduled with exponential backoff until they run out of attempts
+		"""
+		queued = tasks.enqueue_durable(always_fails, 'x')
+		call_command('run_task_worker', once=True, max_attempts=2, stderr=io.StringIO())
+		queued.refresh_from_db()
+		self.assertEqual((queued.status, queued.attempts), (Task.PENDING, 1))
+		self.assertGreater(queued.run_after, timezone.now())
+		self.assertIn("vendor unavailable", queued.last_error)
+
+		""" Not due yet, so the worker leaves it alone """
+		call_command('run_task_worker', once=True, max_attempts=2, stderr=io.StringIO())
+		queued.refresh_from_db()
+		self.assertEqual(queued.attempts, 1)
+
+		Task.objects.filter(id=queued.id).update(run_after=timezone.now())
+		call_command('run_task_worker', once=True, max_attempts=2, stderr=io.StringIO())
+		queued.refresh_from_db()
+		self.assertEqual((queued.status, queued.attempts), (Task.FAILED, 2))
+
+	@override_settings(EMP_TASKS_LEASE_SECONDS=60)
+	def test_expired_lease(self):
+		"""
+		A task left running by a dead worker is run again once its lease expires
+		"""
+		queued = tasks.enqueue_durable(record_call, 'orphaned')
+		first = tasks.claim_due(10, 5)
+		self.assertEqual([claimed.id for claimed in first], [queued.id])
+		""" Still leased to the first worker """
+		self.assertEqual(tasks.claim_due(10, 5), [])
+
+		Task.objects.filter(id=queued.id).update(activity_date=timezone.now() - timedelta(seconds=61))
+		with self.assertLogs('common.util.tasks', 'WARNING'):
+			call_command('run_task_worker', once=True, stderr=io.StringIO())
+		queued.refresh_from_db()
+		self.assertEqual(calls, ['orphaned'])
+		self.assertEqual((queued.status, queued.attempts), (Task.DONE, 2))
+
+		""" The first worker finishing late doesn't overwrite the new claimer's state """
+		with self.assertLogs('common.util.tasks', 'WARNING'):
+			tasks.run_durable(first[0], 5)
+		queued.refresh_from_db()
+		self.assertEqual((queued.status, queued.attempts), (Task.DONE, 2))
+
+	@override_settings(EMP_TASKS_LEASE_SECONDS=60)
+	def test_expired_lease_attempts(self):
+		"""
+		A task whose worker keeps dying is marked failed once its lease expires on its last attempt
+		"""
+		queued = tasks.enqueue_durable(record_call, 'crashes its worker')
+		for attempts in (0, 1):
+			self.assertEqual([claimed.attempts for claimed in tasks.claim_due(10, 2)], [attempts])
+			Task.objects.filter(id=queued.id).update(activity_date=timezone.now() - timedelta(seconds=61))
+		with self.assertLogs('common.util.tasks', 'ERROR'):
+			self.assertEqual(tasks.claim_due(10, 2), [])
+		queued.refresh_from_db()
+		self.assertEqual((queued.status, queued.attempts), (Task.FAILED, 2))
+		self.assertIn("Lease expired", queued.last_error)
+
+	def test_backoff(self):
+		with self.settings(EMP_TASKS_BACKOFF_SECONDS=10, EMP_TASKS_MAX_BACKOFF_SECONDS=35):
+			self.assertEqual([tasks.backoff(attempt).seconds for attempt in (1, 2, 3, 4)], [10, 20, 35, 35])
@@ -1,6 +1,9 @@
 from django.test import TestCase
 from common.util import jwt_placeholder # JWT generating/authenticating
 from common.util import sanitization #The file that contains the code for sanitization logic
+from common.util import reference_data
+from emergency_app.models.nation import Nation
+from emergency_app.test_views import populate_static_tables
 import base64 # For checking JWT data
 import jwt as jwt_lib # For creating our own JWTs to tamper with
 
@@ -132,11 +135,39 @@ class JWTTests(TestCase):
         with self.assertRaises(jwt_lib.exceptions.ExpiredSignatureError):
             ret_val = jwt_placeholder.validate_token(jwt)
 
+    def test_refresh_token(self):
+        """
+        Testing the renewal of JWTs
+
+        The refreshed token should keep the claims and login time, and expire at the end of the session at the latest
+        A token whose session is over, or without a login time, should raise
+        """
+        data = dict(self.good_data_list[0])
+        jwt = jwt_placeholder.generate_token(data)
+        orig_iat = data['orig_iat']
+
+        refreshed = jwt_placeholder.grab_token_payload(jwt_placeholder.refresh_token(jwt, 60 * 60))
+        self.assertEqual(refreshed['orig_iat'], orig_iat)
+        self.assertEqual(refreshed['username'], data['username'])
+
+        """ The session ends before the token would have expired """
+        refreshed = jwt_placeholder.grab_token_payload(jwt_placeholder.refresh_token(jwt, 60))
+        self.assertEqual(refreshed['exp'], orig_iat + 60)
+
+        with self.assertRaises(jwt_lib.exceptions.ExpiredSignatureError):
+            jwt_placeholder.refresh_token(jwt, 0)
+
+        data.pop('orig_iat')
+        without_login_time = jwt_lib.encode(data, jwt_placeholder.base_secret, algorithm=jwt_placeholder.hash_algorithm)
+        with self.assertRaises(jwt_lib.exceptions.InvalidTokenError):
+            jwt_placeholder.refresh_token(without_login_time, 60 * 60)
+
 
 class SanitizationTests(TestCase):
     """
     Testing for sanitization API calls.
     """
+    databases = '__all__'
 
     # data stored within lists split among inputs we know to be valid, and invalid.
     # I believe that these examples cover all edge cases of testing.
@@ -202,6 +233,74 @@ class SanitizationTests(TestCase):
             result = sanitization.validate_username(data)
             self.assertFalse(result)
 
+    def test_country_phone_code_validation(self):
+        """
+        Testing that country phone codes are checked against the cached NATION table
+        """
+        reference_data.clear()
+        Nation.objects.create(id='LUS', value='USA', phone_code='+1', svgimg='')
+        self.assertTrue(sanitization.validate_country_phone_code('+1'))
+        self.assertFalse(sanitization.validate_country_phone_code('+999'))
+        reference_data.clear()
+
+    def test_zip_validation(self):
+        """
+        Testing the zip code validation. Malformed and non-ASCII codes are rejected
+        instead of raising.
+        """
+        for data in ["97201", "97201-1234"]:
+            self.assertTrue(sanitization.validate_zip_usa(data))
+        for data in ["00000", "", None, "9720", "9720a", "97201-", "9" * 10000, "\uff19\uff17\uff12\uff10\uff11"]:
+            self.assertFalse(sanitization.validate_zip_usa(data))
+
+    def test_batch_validation(self):
+        """
+        Testing that validating a column at a time gives exactly the single-value validators' results,
+        including on unicode, whitespace and empty values.
+        """
+        reference_data.clear()
+        populate_static_tables()
+        corpus = (self.good_emails_list + self.bad_emails_list + self.good_phone_list + self.bad_phone_list +
+                  self.good_usernames_list + self.bad_usernames_list +
+                  ["", " ", "Y", "N", "y", "S", "G", "LUS", "OR", "97201", "97201-1234", "00000", "9720a",
+                   "ünïcødé@exämple.рф", "a@b", "@.", "a@b.c\n", "５０３５５５２３４５", "50355523４5", "5035552345\n",
+                   "Zoë_1", "王小明", "ab", "a" * 31, "a" * 30, "x²", "９７２０１", "97201\n"])
+        for kind, (check, validator, message) in sanitization.batch_validators.items():
+            result = sanitization.validate_columns({'column': corpus}, {'column': kind})
+            self.assertEqual([bool(bitmap) for bitmap in result.bitmaps], [not validator(value) for value in corpus], kind)
+
+        """Testing the bitmap, messages and optional columns"""
+        result = sanitization.validate_columns(
+            {'email': ["a@b.c", "x", None], 'phone': ["5035552345", "", "123"], 'zip': ["97201", "", "00000"]},
+            {'email': 'email', 'phone': 'phone_usa', 'zip': 'zip_usa'}, optional=['phone'])
+        self.assertEqual(result.bitmaps, [0b000, 0b101, 0b111])
+        self.assertEqual(result.as_dict(), {
+            1: {'email': "Invalid email", 'zip': "Invalid zip code"},
+            2: {'email': "Invalid email", 'phone': "Invalid phone number", 'zip': "Invalid zip code"},
+        })
+        with self.assertRaises(ValueError):
+            sanitization.validate_columns({'a': ["x"], 'b': []}, {'a': 'email', 'b': 'email'})
+
+    def test_address_normalization(self):
+        """
+        Testing the phone/email normalization used by the reverse-lookup keys.
+        Every formatting of the same address should produce the same key.
+        """
+
+        """Testing USA numbers in different formats"""
+        for data in ["5035552345", "503-555-2345", "(503) 555 2345", "+1 503 555 2345", "15035552345"]:
+            self.assertEqual(sanitization.normalize_phone(data), "15035552345")
+
+        """Testing numbers with a separate country code"""
+        self.assertEqual(sanitization.normalize_phone("5551234567", "+52"), "525551234567")
+        self.assertEqual(sanitization.normalize_phone("2572522", "01"), "12572522")
+
+        """Testing emails and empty values"""
+        self.assertEqual(sanitization.normalize_email("  Foo.Bar@PDX.edu "), "foo.bar@pdx.edu")
+        for data in [None, "", "N/A"]:
+            self.assertEqual(sanitization.normalize_phone(data), None)
+        self.assertEqual(sanitization.normalize_email(" "), None)
+
 def base64_to_json_compare(payload, expected):
     """
     Compares a payload received from the JWT generation process
@@ -0,0 +1,132 @@
+from django.test import TestCase
+from django.http import QueryDict
+from emergency_app.models.contact import Contact
+from emergency_app.models.emergency import Emergency
+from emergency_app.forms import (UpdateEmergencyContactForm, ReplaceEmergencyContactForm,
+								SetEvacuationAssistanceForm, SetEmergencyNotificationsForm)
+from emergency_app.test_views import populate_static_tables
+from emergency_app import validation
+from common.util import reference_data
+from common.util import sharding
+
+from urllib.parse import urlencode
+
+address = {'street_line1': '1825 SW Broadway', 'city': 'Portland', 'stat_code': 'OR', 'zip': '97201'}
+contact = dict(address, pidm=123, priority='1', first_name='Debby', last_name='Bar', relt_code='S',
+			ctry_code_phone='1', phone_area='503', phone_number='5552345')
+
+# Submissions covering every path of the forms: valid, field errors, clean_<field>() and clean() errors,
+# whitespace, 'null'/'N/A' placeholders, unicode and null characters
+contact_submissions = [
+	contact,
+	dict(contact, priority='2', mi='  Q  ', street_line2='', natn_code='LUS'),
+	dict(contact, surrogate_id='1', priority='1'),
+	dict(contact, surrogate_id='1.000', priority='2'),
+	dict(contact, surrogate_id='4'),
+	dict(contact, surrogate_id='abc'),
+	dict(contact, priority='0'),
+	dict(contact, priority='9'),
+	dict(contact, priority=''),
+	dict(contact, priority='12345'),
+	dict(contact, first_name='', last_name=None),
+	dict(contact, first_name='null', last_name='N/A'),
+	dict(contact, first_name='x' * 241, last_name='nul\x00l'),
+	dict(contact, first_name='Zoë', last_name='王', mi='null'),
+	dict(contact, relt_code='Z'),
+	dict(contact, relt_code='null', stat_code='N/A', natn_code=''),
+	dict(contact, stat_code='ZZ'),
+	dict(contact, natn_code='XXX', stat_code='', zip=''),
+	dict(contact, street_line1=''),
+	dict(contact, city='  '),
+	dict(contact, stat_code='', zip=''),
+	{'pidm': 123, 'priority': '1', 'first_name': 'No', 'last_name': 'Address'},
+	{'pidm': 123, 'priority': '1', 'first_name': 'Only', 'last_name': 'City', 'city': 'Portland'},
+	{},
+]
+
+notification_submissions = [
+	{'external_email': 'foo@gmail.com', 'primary_phone': '5035552345', 'alternate_phone': '',
+	'sms_status_ind': 'N', 'sms_device': '5035552346'},
+	{'external_email': ' foo@gmail.com ', 'sms_status_ind': 'Y', 'sms_device': 'not a number'},
+	{'external_email': 'foo', 'primary_phone': '1035552345', 'alternate_phone': 'null', 'sms_status_ind': 'X'},
+	{'external_email': 'N/A', 'sms_status_ind': 'null', 'sms_device': '5' * 73},
+	{'sms_status_ind': 'N', 'sms_device': '５０３５５５２３４５'},
+	{'external_email': 'a@b.c\x00', 'sms_status_ind': ''},
+	{},
+]
+
+evacuation_submissions = [
+	{'evacuation_assistance': 'Y'},
+	{'evacuation_assistance': ' N '},
+	{'evacuation_assistance': 'yes'},
+	{'evacuation_assistance': 'YYYYY'},
+	{'evacuation_assistance': ''},
+	{},
+]
+
+
+def as_query_dict(data):
+	return QueryDict(urlencode({name: value for name, value in data.items() if value is not None}))
+
+
+class CompiledValidatorParityTests(TestCase):
+	"""
+	Testing that the compiled validators accept, clean and reject exactly like the forms they replace
+	"""
+	databases = '__all__'
+
+	def setUp(self):
+		reference_data.clear()
+		populate_static_tables()
+		Contact.objects.using(sharding.shard_for(123)).create(surrogate_id=1, pidm=123, priority='1', first_name='Debby', last_name='Bar')
+		Contact.objects.using(sharding.shard_for(987)).create(surrogate_id=4, pidm=987, priority='1', first_name='Billy', last_name='Kid')
+
+	def assert_parity(self, form, schema, data, instance=None, overrides=None):
+		valid = form.is_valid()
+		cleaned, errors = schema.validate(data, overrides)
+		message = "submitted %r" % (data,)
+		self.assertEqual(validation.as_text(errors), str(form.errors), message)
+		self.assertEqual(not errors, valid, message)
+		if valid:
+			self.assertEqual(cleaned, form.cleaned_data, message)
+			constructed = schema.construct(cleaned, instance)
+			for name in schema.editable:
+				self.assertEqual(getattr(constructed, name), getattr(form.instance, name), message)
+
+	def test_update_contact_parity(self):
+		for data in contact_submissions:
+			for submitted in (as_query_dict(data), data):
+				entry = Contact.objects.using(sharding.shard_for(123)).get(surrogate_id=1) if data.get('surrogate_id') == '1' else None
+				form = UpdateEmergencyContactForm(submitted, instance=entry)
+				self.assert_parity(form, validation.update_emergency_contact, submitted,
+								instance=Contact.objects.using(sharding.shard_for(123)).get(surrogate_id=1) if entry else None)
+
+	def test_replace_contact_parity(self):
+		for data in contact_submissions:
+			self.assert_parity(ReplaceEmergencyContactForm(data), validation.replace_emergency_contact, data)
+
+	def test_emergency_parity(self):
+		for data in notification_submissions:
+			submitted = as_query_dict(data)
+			self.assert_parity(SetEmergencyNotificationsForm(submitted), validation.set_emergency_notifications, submitted)
+		for data in evacuation_submissions:
+			submitted = as_query_dict(data)
+			self.assert_parity(SetEvacuationAssistanceForm(submitted), validation.set_evacuation_assistance, submitted)
+
+	def test_overrides(self):
+		"""
+		Overrides replace submitted values without copying the submission
+		"""
+		submitted = as_query_dict(dict(contact, pidm='987', priority='7'))
+		cleaned, errors = validation.update_emergency_contact.validate(submitted, {'pidm': 123, 'priority': '1'})
+		self.assertEqual(errors, {})
+		self.assertEqual((cleaned['pidm'], cleaned['priority']), (123, '1'))
+
+	def test_non_numeric_priority(self):
+		"""
+		The form raises a server error for priorities that aren't numbers, the compiled validator rejects them
+		"""
+		with self.assertRaises(ValueError):
+			UpdateEmergencyContactForm(dict(contact, priority='one')).is_valid()
+		cleaned, errors = validation.update_emergency_contact.validate(dict(contact, priority='one'))
+		self.assertEqual(errors, {validation.NON_FIELD_ERRORS: ["Invalid priority number"]})
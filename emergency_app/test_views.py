@@ -1,5 +1,6 @@
 from django.test import TestCase, Client
 from django.utils import timezone	# For timestamp verification
+from django.db.models import ProtectedError
 from emergency_app import views
 from emergency_app.models.identity import Identity
 from emergency_app.models.contact import Contact
@@ -7,6 +8,11 @@ from emergency_app.models.emergency import Emergency
 from emergency_app.models.relation import Relation
 from emergency_app.models.nation import Nation
 from emergency_app.models.state import State
+from common.util import jwt_placeholder
+from common.util import revocation
+from common.util import sharding
+
+import jwt as jwt_lib # For signing modified JWTs
 
 import base64 # For checking JWT data
 import json # For checking JWT return data
@@ -14,8 +20,9 @@ import json # For checking JWT return data
 # During testing, localhost:8000 is the base to any URL
 base_url = 'http://localhost:8000/'
 # Backend API URLs
-# Authentication Url
+# Authentication Urls
 auth_url = '/login/'
+refresh_url = '/refreshToken/'
 # Emergency Notification Urls
 get_emergency_notifications_url = '/getEmergencyNotifications/'
 set_emergency_notifications_url = '/setEmergencyNotifications/'
@@ -114,10 +121,43 @@ class AuthorizationTests(TestCase):
 
 		self.assertEqual(response.status_code, disallowed_method_code)
 
+	def test_refresh_token(self):
+		"""
+		Testing the renewal of a still valid JWT
+
+		Given a valid JWT, the backend should return a new JWT with the same claims and a later expiration, without a query
+		Given an invalid JWT or one whose session is over, the backend should return a 401
+		"""
+		c = Client()
+		token = c.post(auth_url, {'username': 'fooBar'}).content
+		payload = jwt_placeholder.grab_token_payload(token)
+
+		payload['exp'] -= 60
+		older = jwt_lib.encode(payload, jwt_placeholder.base_secret, algorithm=jwt_placeholder.hash_algorithm)
+		# A worker loads the revocation list once, before its first refresh
+		revocation.get_list().refresh()
+		with self.assertNumQueries(0):
+			response = c.post(refresh_url, HTTP_AUTHORIZATION=older.decode('utf-8'))
+		self.assertEqual(response.status_code, success_code)
+		refreshed = jwt_placeholder.grab_token_payload(response.content)
+		self.assertGreater(refreshed['exp'], payload['exp'])
+		self.assertEqual(dict(refreshed, exp=None), dict(payload, exp=None))
+
+		"""Testing a session logged into longer ago than its lifetime"""
+		with self.settings(EMP_SESSION_LIFETIME=0):
+			response = c.post(refresh_url, HTTP_AUTHORIZATION=token.decode('utf-8'))
+			self.assertEqual(response.status_code, unauthorized_code)
+
+		"""Testing invalid tokens"""
+		self.assertEqual(c.post(refresh_url, HTTP_AUTHORIZATION='Not a token').status_code, unauthorized_code)
+		self.assertEqual(c.post(refresh_url).status_code, unauthorized_code)
+		self.assertEqual(c.get(refresh_url).status_code, disallowed_method_code)
+
 class EmergencyNotificationTests(TestCase):
 	"""
 	Testing out the setting and getting of Alert Info
 	"""
+	databases = '__all__'
 
 	def setUp(self):
 		""" Our user entry with emergency notifications info set up """
@@ -148,7 +188,7 @@ class EmergencyNotificationTests(TestCase):
 		self.good_sms_device = '5030102929'
 		self.timestamp= timezone.now()
 		# Add data for 'fooBar'/pidm 123 user into the emergency notifications info (emergency) database
-		Emergency.objects.create(pidm=self.pidm_with_data, external_email=self.good_external_email,
+		Emergency.objects.using(sharding.shard_for(self.pidm_with_data)).create(pidm=self.pidm_with_data, external_email=self.good_external_email,
 											campus_email=self.campus_email, primary_phone=self.good_primary_phone,
 											alternate_phone=self.good_alternate_phone, sms_status_ind = self.good_sms_status_ind,
 											sms_device=self.good_sms_device)
@@ -257,7 +297,7 @@ class EmergencyNotificationTests(TestCase):
 		self.assertEqual(response.status_code, success_code)
 
 		# Grab the valid user's Emergency emergency notifications info
-		user_entry = Emergency.objects.get(pidm=self.pidm_with_data)
+		user_entry = Emergency.objects.using(sharding.shard_for(self.pidm_with_data)).get(pidm=self.pidm_with_data)
 
 		"""Testing that the data is uploaded to the registry correctly"""
 		# Now compare each value, asserting their equivalence
@@ -287,7 +327,7 @@ class EmergencyNotificationTests(TestCase):
 		self.assertEqual(response.status_code, success_code)
 
 		# Grab the valid user's Emergency emergency notifications info
-		user_entry = Emergency.objects.get(pidm=self.pidm_with_data)
+		user_entry = Emergency.objects.using(sharding.shard_for(self.pidm_with_data)).get(pidm=self.pidm_with_data)
 
 		"""Testing that the data is updated correctly"""
 		# self.assertEqual(user_entry.evacuation_assistance, self.good_evacuation_assistance)
@@ -317,7 +357,7 @@ class EmergencyNotificationTests(TestCase):
 		self.assertEqual(response.status_code, unprocessable_entity)
 
 		# Attempt to grab data for the invalid entry - should return an empty list
-		user_entry = Emergency.objects.filter(pidm=self.user_pidm_with_invalid_data)
+		user_entry = Emergency.objects.using(sharding.shard_for(self.user_pidm_with_invalid_data)).filter(pidm=self.user_pidm_with_invalid_data)
 
 		"""Testing that the database did NOT update with this invalid data, returning nothing"""
 		self.assertEqual(len(user_entry), 0)
@@ -341,7 +381,7 @@ class EmergencyNotificationTests(TestCase):
 		self.assertEqual(response.status_code, unprocessable_entity)
 
 		# Grab the valid user's Emergency emergency notifications info
-		user_entry = Emergency.objects.get(pidm=self.pidm_with_data)
+		user_entry = Emergency.objects.using(sharding.shard_for(self.pidm_with_data)).get(pidm=self.pidm_with_data)
 
 		"""Testing that the database did NOT update our old entry with the new invalid data."""
 		# self.assertEqual(user_entry.evacuation_assistance, self.good_evacuation_assistance)
@@ -355,6 +395,7 @@ class EvacuationAssistanceTests(TestCase):
 	"""
 	Testing out the setting and getting of Evacuation Assistance Info
 	"""
+	databases = '__all__'
 
 	def setUp(self):
 		""" Our user entry with valid info set up """
@@ -378,9 +419,9 @@ class EvacuationAssistanceTests(TestCase):
 		self.invalid_status = 'invalid!'
 
 		# The user entry with evacuation_assistance set to 'Y'
-		Emergency.objects.create(pidm=self.pidm_with_data, evacuation_assistance=self.valid_status)
+		Emergency.objects.using(sharding.shard_for(self.pidm_with_data)).create(pidm=self.pidm_with_data, evacuation_assistance=self.valid_status)
 		# The user entry with no evacuation_assistance data set
-		Emergency.objects.create(pidm=self.pidm_without_data)
+		Emergency.objects.using(sharding.shard_for(self.pidm_without_data)).create(pidm=self.pidm_without_data)
 
 	def test_get_evacuation_assistance(self):
 		"""
@@ -460,7 +501,7 @@ class EvacuationAssistanceTests(TestCase):
 		self.assertEqual(response.status_code, unprocessable_entity)
 
 		"""Testing that the Emergency database did not add the user in with incorrect data"""
-		user_entry = Emergency.objects.filter(pidm=self.pidm_without_emergency_entry)
+		user_entry = Emergency.objects.using(sharding.shard_for(self.pidm_without_emergency_entry)).filter(pidm=self.pidm_without_emergency_entry)
 		# Should be 0 returned values
 		self.assertEqual(len(user_entry), 0)
 
@@ -478,7 +519,7 @@ class EvacuationAssistanceTests(TestCase):
 		self.assertEqual(response.status_code, success_code)
 
 		"""Testing that the user was added to the Emergency registry with the correct value"""
-		user_entry = Emergency.objects.get(pidm=self.pidm_without_emergency_entry)
+		user_entry = Emergency.objects.using(sharding.shard_for(self.pidm_without_emergency_entry)).get(pidm=self.pidm_without_emergency_entry)
 		self.assertEqual(user_entry.evacuation_assistance, self.valid_status)
 
 		# We'll now update the database status with 'N' - No
@@ -494,7 +535,7 @@ class EvacuationAssistanceTests(TestCase):
 		self.assertEqual(response.status_code, success_code)
 
 		"""Testing that the user's data has updated to None"""
-		user_entry = Emergency.objects.get(pidm=self.pidm_without_emergency_entry)
+		user_entry = Emergency.objects.using(sharding.shard_for(self.pidm_without_emergency_entry)).get(pidm=self.pidm_without_emergency_entry)
 		self.assertEqual(user_entry.evacuation_assistance, 'N')
 
 		# Now we'll attempt to update the database with an invalid status
@@ -511,7 +552,7 @@ class EvacuationAssistanceTests(TestCase):
 		self.assertEqual(response.status_code, unprocessable_entity)
 
 		"""Testing that the user's data remains unchanged and is still None"""
-		user_entry = Emergency.objects.get(pidm=self.pidm_without_emergency_entry)
+		user_entry = Emergency.objects.using(sharding.shard_for(self.pidm_without_emergency_entry)).get(pidm=self.pidm_without_emergency_entry)
 		self.assertEqual(user_entry.evacuation_assistance, 'N')
 
 
@@ -519,6 +560,7 @@ class EmergencyContactsTests(TestCase):
 	"""
 	Testing out the setting and getting of Emergency Contacts Info
 	"""
+	databases = '__all__'
 
 	def setUp(self):
 		""" populate our static databases """
@@ -540,12 +582,14 @@ class EmergencyContactsTests(TestCase):
 
 		""" Contact information entries for data retrieval """
 		# Add two contacts for 'user_with_data' - no need to populate every field
-		Contact.objects.create(surrogate_id=1, pidm=123, first_name="Debby", last_name='Bar')
-		Contact.objects.create(surrogate_id=2, pidm=123, first_name="Jim", last_name='Bar')
+		Contact.objects.using(sharding.shard_for(123)).create(surrogate_id=1, pidm=123, first_name="Debby", last_name='Bar', relt_code='S', stat_code='OR', natn_code='LUS')
+		Contact.objects.using(sharding.shard_for(123)).create(surrogate_id=2, pidm=123, first_name="Jim", last_name='Bar')
 		# We'll check against how many values are returned on a get-contacts request
 		self.user_with_data_contact_count = 2
-		# Create a Contact entry that isn't linked to either user
-		Contact.objects.create(surrogate_id=3, pidm=987654321, first_name="Billy", last_name='Kid')
+		# Create a Contact entry that isn't linked to either user, on the fresh user's shard where their requests look for it
+		self.pidm_of_stranger = next(pidm for pidm in range(987654321, 987654421)
+			if sharding.shard_for(pidm) == sharding.shard_for(self.pidm_for_fresh_user))
+		Contact.objects.using(sharding.shard_for(self.pidm_of_stranger)).create(surrogate_id=3, pidm=self.pidm_of_stranger, first_name="Billy", last_name='Kid')
 
 		""" Valid emergency contact information to enter into database """
 		self.good_emergency_priority = "1"
@@ -607,6 +651,19 @@ class EmergencyContactsTests(TestCase):
 		for contact in contacts:
 			self.assertEqual(contact['pidm'], self.pidm_with_data)
 
+		"""Testing that the codes come with what they stand for, joined from the reference tables"""
+		contacts = {contact['surrogate_id']: contact for contact in contacts}
+		self.assertEqual((contacts[1]['relt_code'], contacts[1]['relation_description']), ('S', 'Spouse/Significant Other'))
+		self.assertEqual((contacts[1]['stat_code'], contacts[1]['state_name']), ('OR', 'Oregon'))
+		self.assertEqual((contacts[1]['natn_code'], contacts[1]['nation_name']), ('LUS', 'USA'))
+		self.assertEqual((contacts[2]['relation_description'], contacts[2]['state_name'], contacts[2]['nation_name']), (None, None, None))
+
+		"""Testing that the codes are foreign keys to the reference tables, the copies on the contact's shard"""
+		shard = sharding.shard_for(self.pidm_with_data)
+		self.assertEqual(Contact.objects.using(shard).get(surrogate_id=1).relation, Relation.objects.get(code='S'))
+		with self.assertRaises(ProtectedError):
+			Relation.objects.using(shard).filter(code='S').delete()
+
 		# Now to test that users without data receive a No Content (204) response
 		response = c.post(get_contacts_url, HTTP_AUTHORIZATION=user_without_data_jwt)
 		"""Testing that we received a 204 No Content response"""
@@ -671,7 +728,7 @@ class EmergencyContactsTests(TestCase):
 		self.assertEqual(response.status_code, success_code)
 
 		# Grab the valid user's Contact info
-		user_entry = Contact.objects.get(pidm=self.pidm_for_fresh_user)
+		user_entry = Contact.objects.using(sharding.shard_for(self.pidm_for_fresh_user)).get(pidm=self.pidm_for_fresh_user)
 
 		""" Testing that the data that was uploaded matches the local data """
 		# Compare each value using asserts
@@ -728,7 +785,7 @@ class EmergencyContactsTests(TestCase):
 		self.assertEqual(response.status_code, success_code)
 
 		# Grab the valid user's Contact info
-		user_entry = Contact.objects.get(pidm=self.pidm_for_fresh_user)
+		user_entry = Contact.objects.using(sharding.shard_for(self.pidm_for_fresh_user)).get(pidm=self.pidm_for_fresh_user)
 
 		""" Testing that the data that was uploaded matches the local data """
 		# Compare each value using asserts
@@ -770,7 +827,7 @@ class EmergencyContactsTests(TestCase):
 		self.assertEqual(response.status_code, unprocessable_entity)
 
 		# Try to grab db data for this entry, should be empty
-		user_entry = Contact.objects.filter(surrogate_id=self.surrogate_id_of_bad_contact)
+		user_entry = Contact.objects.using(sharding.shard_for(self.pidm_without_data)).filter(surrogate_id=self.surrogate_id_of_bad_contact)
 
 		"""Testing that the database did NOT update with this invalid data, returning nothing"""
 		self.assertEqual(len(user_entry), 0)
@@ -794,7 +851,7 @@ class EmergencyContactsTests(TestCase):
 		self.assertEqual(response.status_code, unprocessable_entity)
 
 		# Try to grab db data for this entry, should have stayed the same and not been updated
-		user_entry = Contact.objects.get(pidm=self.pidm_for_fresh_user)
+		user_entry = Contact.objects.using(sharding.shard_for(self.pidm_for_fresh_user)).get(pidm=self.pidm_for_fresh_user)
 		self.assertEqual(user_entry.priority, self.good_emergency_priority)
 		self.assertEqual(user_entry.relt_code, self.good_emergency_relt_code)
 		self.assertEqual(user_entry.last_name, self.good_emergency_last_name)
@@ -844,7 +901,7 @@ class EmergencyContactsTests(TestCase):
 		self.assertEqual(response.status_code, success_code)
 
 		# Now check if the priority of the surrogate was moved correctly.
-		user_entry_last = Contact.objects.get(surrogate_id=surrogate_id_of_contact)
+		user_entry_last = Contact.objects.using(sharding.shard_for(self.pidm_for_fresh_user)).get(surrogate_id=surrogate_id_of_contact)
 		self.assertEqual(user_entry_last.priority, '2')
 
 		# Insert at the front of the list.
@@ -875,10 +932,10 @@ class EmergencyContactsTests(TestCase):
 
 		self.assertEqual(response.status_code, success_code)
 		# check bumping down
-		should_be_first = Contact.objects.get(first_name="should_be_at_start")
+		should_be_first = Contact.objects.using(sharding.shard_for(self.pidm_for_fresh_user)).get(first_name="should_be_at_start")
 		self.assertEqual(should_be_first.priority, '1')
 		to_bump_down = should_be_first.surrogate_id
-		should_be_third = Contact.objects.get(surrogate_id=surrogate_id_of_contact)
+		should_be_third = Contact.objects.using(sharding.shard_for(self.pidm_for_fresh_user)).get(surrogate_id=surrogate_id_of_contact)
 		self.assertEqual(should_be_third.priority, '3')
 
 		# Now, test bumping up
@@ -909,15 +966,15 @@ class EmergencyContactsTests(TestCase):
 		)
 
 		# make sure that the new priority is three, and the old three was moved up to two
-		should_be_third = Contact.objects.get(surrogate_id=to_bump_down)
+		should_be_third = Contact.objects.using(sharding.shard_for(self.pidm_for_fresh_user)).get(surrogate_id=to_bump_down)
 		self.assertEqual(should_be_third.priority, "3")
 
-		should_now_be_second = Contact.objects.get(surrogate_id=surrogate_id_of_contact)
+		should_now_be_second = Contact.objects.using(sharding.shard_for(self.pidm_for_fresh_user)).get(surrogate_id=surrogate_id_of_contact)
 		self.assertEqual(should_now_be_second.priority, "2")
 
 		""" Testing the delete functionality in the emergency contact interface """
 		# Make sure that the valid entry exists.
-		user_entry = Contact.objects.filter(surrogate_id=surrogate_id_of_contact)
+		user_entry = Contact.objects.using(sharding.shard_for(self.pidm_for_fresh_user)).filter(surrogate_id=surrogate_id_of_contact)
 		self.assertEqual(len(user_entry), 1)
 
 		# now, delete it
@@ -930,16 +987,16 @@ class EmergencyContactsTests(TestCase):
 		HTTP_AUTHORIZATION=user_with_valid_data_jwt
 		)
 
-		user_entry = Contact.objects.filter(surrogate_id=surrogate_id_of_contact)
+		user_entry = Contact.objects.using(sharding.shard_for(self.pidm_for_fresh_user)).filter(surrogate_id=surrogate_id_of_contact)
 		self.assertEqual(len(user_entry), 0)
 
 		# Check if the priority adjustments happen as needed
-		bump_for_deletion = Contact.objects.get(surrogate_id=to_bump_down)
+		bump_for_deletion = Contact.objects.using(sharding.shard_for(self.pidm_for_fresh_user)).get(surrogate_id=to_bump_down)
 		self.assertEqual(bump_for_deletion.priority, "2")
 		# Now, we try to delete a user that does not belong to us. We should receive a 422.
 
 		# make sure that there is an existing entry for surrogate id of 3
-		user_entry = Contact.objects.filter(surrogate_id=3)
+		user_entry = Contact.objects.using(sharding.shard_for(self.pidm_of_stranger)).filter(surrogate_id=3)
 		self.assertEqual(len(user_entry), 1)
 
 		# now, try to delete it.
@@ -953,7 +1010,7 @@ class EmergencyContactsTests(TestCase):
 		# then, process the results.
 		self.assertEqual(response.status_code, unprocessable_entity)
 
-		user_entry = Contact.objects.filter(surrogate_id=3)
+		user_entry = Contact.objects.using(sharding.shard_for(self.pidm_of_stranger)).filter(surrogate_id=3)
 		self.assertEqual(len(user_entry), 1)
 
 class RelationshipCodeTests(TestCase):
@@ -961,6 +1018,7 @@ class RelationshipCodeTests(TestCase):
 	Testing out the relationship code + description API call
 	Just confirms that we are returning the code -> description JSON that we expect
 	"""
+	databases = '__all__'
 	def setUp(self):
 		populate_static_tables()
 		# # Hardcoding our relationship Code->description dicts/JSONs
@@ -0,0 +1,74 @@
+from django.test import TestCase, Client
+from emergency_app import warmup
+from emergency_app.test_views import populate_static_tables
+
+import os
+
+readiness_url = '/readiness/'
+
+success_code = 200
+service_unavailable_code = 503
+
+
+class WarmupTests(TestCase):
+	"""
+	Testing the warm-up routine and the readiness endpoint reporting it
+	"""
+	databases = '__all__'
+
+	def setUp(self):
+		populate_static_tables()
+
+	def tearDown(self):
+		warmup._state.update(pid=None, status=warmup.NOT_STARTED, steps=[])
+
+	def test_run(self):
+		state = warmup.run()
+		self.assertEqual(state['status'], warmup.READY)
+		self.assertEqual([step['name'] for step in state['steps']], [name for name, step in warmup.steps])
+		self.assertTrue(all(step['error'] is None for step in state['steps']))
+
+		response = Client().get(readiness_url)
+		self.assertEqual(response.status_code, success_code)
+		self.assertEqual(response.json()['status'], warmup.READY)
+
+	def test_allowed_hosts(self):
+		"""
+		The synthetic requests use a host the deployment accepts, and a refused one fails the warm-up
+		"""
+		with self.settings(ALLOWED_HOSTS=['.emergency.pdx.edu', 'localhost']):
+			self.assertEqual(warmup.warm_host(), 'emergency.pdx.edu')
+			self.assertEqual(warmup.run()['status'], warmup.READY)
+		with self.settings(ALLOWED_HOSTS=['*']):
+			self.assertEqual(warmup.warm_host(), 'localhost')
+
+		host = warmup.warm_host
+		warmup.warm_host = lambda: 'example.com'
+		try:
+			with self.settings(ALLOWED_HOSTS=['emergency.pdx.edu']):
+				state = warmup.run()
+		finally:
+			warmup.warm_host = host
+		self.assertEqual(state['status'], warmup.FAILED)
+		self.assertEqual(state['steps'][-1]['name'], 'views')
+		self.assertIn('answered 400', state['steps'][-1]['error'])
+
+	def test_not_ready_while_running(self):
+		"""
+		Readiness reports 503 until the warm-up is done, and doesn't start a second one
+		"""
+		warmup._state.update(pid=os.getpid(), status=warmup.RUNNING, steps=[])
+		response = Client().get(readiness_url)
+		self.assertEqual(response.status_code, service_unavailable_code)
+		self.assertEqual(response.json(), {'status': warmup.RUNNING, 'steps': []})
+
+	def test_failed_step(self):
+		steps = warmup.steps
+		warmup.steps = steps[:1] + [('broken', lambda: 1 / 0)] + steps[1:]
+		try:
+			state = warmup.run()
+		finally:
+			warmup.steps = steps
+		self.assertEqual(state['status'], warmup.FAILED)
+		self.assertEqual(state['steps'][-1]['name'], 'broken')
+		self.assertIn('ZeroDivisionError', state['steps'][-1]['error'])
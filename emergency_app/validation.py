@@ -0,0 +1,336 @@
+"""
+    Compiled validators for the write endpoints.
+    The ModelForms in forms.py cost a lot per request: every form deep-copies its fields, runs
+    Django's generic full_clean() and model validation, and the views copy request.POST to feed it.
+    The schemas here are declared once as a list of field specs and compiled at import into one
+    function per field, so a request is validated in a single pass over the submitted dict or
+    QueryDict without instantiating anything. They return the same cleaned values and the same
+    error messages as the forms, which stay the reference definition (see test_validation.py).
+"""
+import logging
+from django import forms
+from django.core import validators
+from django.db import models
+from django.db.models import AutoField
+from django.forms.utils import ErrorDict, ErrorList
+from emergency_app.models.contact import Contact
+from emergency_app.models.emergency import Emergency
+from common.util import sanitization
+from common.util import sharding
+
+# Same logger (and sampling) as the forms' invalid submission messages
+logger = logging.getLogger('emergency_app.forms')
+
+# Errors that aren't about one field are listed under this key, as in Django forms
+NON_FIELD_ERRORS = '__all__'
+
+# Field kinds
+TEXT = 'text'        # forms.CharField: stripped string, '' when empty
+INTEGER = 'integer'  # forms.IntegerField: int, None when empty
+
+# Messages of the Django fields and validators the forms are built from
+required_message = forms.Field.default_error_messages['required']
+integer_message = forms.IntegerField.default_error_messages['invalid']
+max_length_message = validators.MaxLengthValidator.message
+null_characters_message = validators.ProhibitNullCharactersValidator.message
+null_message = models.Field.default_error_messages['null']
+
+# Values forms.empty_string_handler turns into None
+blank_values = frozenset(("", "null", "N/A"))
+
+
+class Invalid(Exception):
+    """
+    Raised by the compiled cleaners with the error messages of a field (or of the whole submission)
+    """
+
+    def __init__(self, *messages):
+        super(Invalid, self).__init__(*messages)
+        self.messages = list(messages)
+
+
+class Field:
+    """
+    Declares one field of a schema
+    Args:
+            name (str): key in the submitted data and name of the model field it is written to
+            kind (str): TEXT or INTEGER
+            max_length (int): longest accepted TEXT value, after stripping
+            required (bool): whether an empty value is an error
+            empty_to_none (bool): whether '', 'null' and 'N/A' become None before the check
+            check (function): sanitization validator, the value is invalid when it returns False.
+                None values of optional fields aren't checked.
+            message (str): error when check rejects the value
+            clear_when (tuple): (other field, value), this field is None when the other field was
+                cleaned to that value
+    """
+
+    def __init__(self, name, kind=TEXT, max_length=None, required=True, empty_to_none=False,
+                 check=None, message=None, clear_when=None):
+        self.name = name
+        self.kind = kind
+        self.max_length = max_length
+        self.required = required
+        self.empty_to_none = empty_to_none
+        self.check = check
+        self.message = message
+        self.clear_when = clear_when
+
+
+def compile_field(field):
+    """
+    Builds the cleaner of one field, with every option of the spec bound as a constant
+    Returns:
+            function: clean(value, cleaned) -> cleaned value, raises Invalid.
+                      cleaned holds the fields cleaned so far.
+    """
+    name, kind, max_length, required = field.name, field.kind, field.max_length, field.required
+    empty_to_none, check, message = field.empty_to_none, field.check, field.message
+    clear_field, clear_value = field.clear_when or (None, None)
+    empty_values = validators.EMPTY_VALUES
+    trailing_decimal = forms.IntegerField.re_decimal
+
+    def clean(value, cleaned):
+        # forms.CharField / forms.IntegerField: to_python(), validate() and run_validators()
+        if kind == INTEGER:
+            if value in empty_values:
+                value = None
+            else:
+                try:
+                    value = int(trailing_decimal.sub('', str(value)))
+                except (ValueError, TypeError):
+                    raise Invalid(integer_message)
+        else:
+            if value not in empty_values:
+                value = str(value).strip()
+            if value in empty_values:
+                value = ''
+        if value in empty_values:
+            if required:
+                raise Invalid(required_message)
+        elif kind == TEXT:
+            errors = []
+            if max_length is not None and len(value) > max_length:
+                errors.append(max_length_message % {'limit_value': max_length, 'show_value': len(value)})
+            if '\x00' in value:
+                errors.append(null_characters_message)
+            if errors:
+                raise Invalid(*errors)
+
+        # The form's clean_<field>()
+        if clear_field is not None and cleaned.get(clear_field) == clear_value:
+            return None
+        if empty_to_none and value.__class__ is str and value in blank_values:
+            value = None
+        if check is not None and not (value is None and not required) and not check(value):
+            logger.info("Invalid %s", name, extra={'field': name})
+            raise Invalid(message)
+        return value
+
+    return clean
+
+
+class Schema:
+    """
+    A compiled validator
+    Args:
+            model (Model class): model the cleaned values are written to. Its NOT NULL columns are
+                checked like ModelForm's model validation does.
+            fields (list): Field specs, cleaned in this order
+            clean (function): called with the cleaned values once every field is cleaned, for checks
+                across fields. May modify the values and raises Invalid for non-field errors.
+    """
+
+    def __init__(self, model, fields, clean=None):
+        self.model = model
+        self.cleaners = [(field.name, compile_field(field)) for field in fields]
+        self.clean = clean
+        model_fields = {name: model._meta.get_field(name) for name, cleaner in self.cleaners}
+        self.not_null = [
+            field.name for field in fields
+            if field.required and not model_fields[field.name].null and not model_fields[field.name].blank
+        ]
+        self.editable = [
+            name for name, model_field in model_fields.items()
+            if model_field.editable and not isinstance(model_field, AutoField)
+        ]
+
+    def validate(self, data, overrides=None):
+        """
+        Validates submitted values
+        Args:
+                data (dict): request.POST or a json object, for a QueryDict the last value of a key counts
+                overrides (dict): values used instead of the submitted ones, e.g. the pidm from the JWT
+        Returns:
+                tuple: (cleaned values, errors), errors maps field names (NON_FIELD_ERRORS for the
+                       others) to lists of messages and is empty when the data is valid
+        """
+        overrides = overrides or {}
+        cleaned = {}
+        errors = {}
+        for name, clean in self.cleaners:
+            try:
+                cleaned[name] = clean(overrides[name] if name in overrides else data.get(name), cleaned)
+            except Invalid as e:
+                errors[name] = e.messages
+        if self.clean is not None:
+            try:
+                self.clean(cleaned)
+            except Invalid as e:
+                errors[NON_FIELD_ERRORS] = e.messages
+        for name in self.not_null:
+            if name in cleaned and cleaned[name] is None:
+                errors[name] = [null_message]
+                del cleaned[name]
+        return cleaned, errors
+
+    def construct(self, cleaned, instance=None):
+        """
+        Writes cleaned values into a model instance, like ModelForm.save(commit=False)
+        Args:
+                cleaned (dict): values returned by validate()
+                instance (Model): the row to update, a new one is created when None
+        Returns:
+                Model: the instance, not saved
+        """
+        if instance is None:
+            instance = self.model()
+        for name in self.editable:
+            if name in cleaned:
+                setattr(instance, name, cleaned[name])
+        return instance
+
+
+def as_text(errors):
+    """
+    Renders errors like str(form.errors), which the endpoints answer with
+    Args:
+            errors (dict): errors returned by Schema.validate()
+    Returns:
+            str: the errors as an html list
+    """
+    return str(ErrorDict(
+        (name, ErrorList(messages, error_class='nonfield' if name == NON_FIELD_ERRORS else None))
+        for name, messages in errors.items()
+    ))
+
+
+def blank_to_none(cleaned):
+    # forms.empty_string_handler on every value without a check of its own
+    for name, value in cleaned.items():
+        if value.__class__ is str and value in blank_values and name not in ("relt_code", "natn_code", "stat_code"):
+            cleaned[name] = None
+
+
+def check_surrogate_id_and_priority(cleaned):
+    """
+    The surrogate id must be one of the user's contacts, and the priority within 1 to n for
+    an existing contact, or 1 to n + 1 for a new one
+    """
+    surrogate_id = cleaned.get("surrogate_id")
+    pidm = cleaned.get("pidm")
+    # the user's contacts are on their shard, nobody has contacts without a pidm
+    contacts = Contact.objects.using('default' if pidm is None else sharding.shard_for(pidm))
+    if surrogate_id and not contacts.filter(surrogate_id=surrogate_id, pidm=pidm).exists():
+        logger.info("Invalid Surrogate ID", extra={'field': 'surrogate_id'})
+        raise Invalid("Invalid Surrogate ID")
+
+    priority = cleaned.get("priority")
+    if not priority:
+        logger.info("Missing priority number", extra={'field': 'priority'})
+        raise Invalid("Missing priority number")
+    # The form raises a ValueError (a server error) for priorities that aren't numbers
+    try:
+        priority = int(priority)
+    except ValueError:
+        priority = 0
+    if priority < 1 or priority > contacts.filter(pidm=pidm).count() + (0 if surrogate_id else 1):
+        logger.info("Invalid priority number", extra={'field': 'priority'})
+        raise Invalid("Invalid priority number")
+
+
+def check_address(cleaned):
+    """
+    The address is either complete (street line1, city, and either state + zip or nation) or empty
+    """
+    street_line1 = cleaned.get("street_line1")
+    city = cleaned.get("city")
+    stat_code = cleaned.get("stat_code")
+    zip = cleaned.get("zip")
+    natn_code = cleaned.get("natn_code")
+    if (street_line1 or city or stat_code or zip or natn_code):
+        # The form's messages for these two are the field names
+        if not street_line1:
+            logger.info("Invalid street line1", extra={'field': 'street_line1'})
+            raise Invalid("street_line1")
+        if not city:
+            logger.info("Invalid city", extra={'field': 'city'})
+            raise Invalid("city")
+        if not natn_code and not(stat_code and zip):
+            logger.info("Invalid natn_code or stat_code + zip", extra={'field': 'natn_code'})
+            raise Invalid("Nation field, or State + Zip fields is/are required")
+
+
+def clean_contact(cleaned):
+    check_surrogate_id_and_priority(cleaned)
+    blank_to_none(cleaned)
+    check_address(cleaned)
+
+
+def clean_replaced_contact(cleaned):
+    # The whole list decides the surrogate ids and priorities, replace_emergency_contacts checks them
+    blank_to_none(cleaned)
+    check_address(cleaned)
+
+
+contact_fields = [
+    Field('pidm', INTEGER),
+    Field('surrogate_id', INTEGER, required=False),
+    Field('priority', max_length=4),
+    Field('relt_code', max_length=4, required=False, empty_to_none=True,
+          check=sanitization.validate_relation, message="Invalid relation code"),
+    Field('last_name', max_length=240),
+    Field('first_name', max_length=240),
+    Field('mi', max_length=240, required=False),
+    Field('street_line1', max_length=75, required=False),
+    Field('street_line2', max_length=75, required=False),
+    Field('street_line3', max_length=75, required=False),
+    Field('city', max_length=50, required=False),
+    Field('stat_code', max_length=3, required=False, empty_to_none=True,
+          check=sanitization.validate_state_usa, message="Invalid state code"),
+    Field('natn_code', max_length=5, required=False, empty_to_none=True,
+          check=sanitization.validate_nation_code, message="Invalid nation code"),
+    Field('zip', max_length=30, required=False),
+    Field('ctry_code_phone', max_length=16, required=False),
+    Field('phone_area', max_length=6, required=False),
+    Field('phone_number', max_length=12, required=False),
+    Field('phone_ext', max_length=10, required=False),
+]
+
+# forms.UpdateEmergencyContactForm
+update_emergency_contact = Schema(Contact, contact_fields, clean_contact)
+
+# forms.ReplaceEmergencyContactForm
+replace_emergency_contact = Schema(Contact, contact_fields, clean_replaced_contact)
+
+# forms.SetEvacuationAssistanceForm
+set_evacuation_assistance = Schema(Emergency, [
+    Field('evacuation_assistance', max_length=4,
+          check=sanitization.validate_checkbox, message="Invalid checkbox value"),
+])
+
+# forms.SetEmergencyNotificationsForm
+set_emergency_notifications = Schema(Emergency, [
+    Field('external_email', max_length=128, required=False, empty_to_none=True,
+          check=sanitization.validate_email, message="Invalid email"),
+    Field('primary_phone', max_length=72, required=False, empty_to_none=True,
+          check=sanitization.validate_phone_num_usa, message="Invalid phone number"),
+    Field('alternate_phone', max_length=72, required=False, empty_to_none=True,
+          check=sanitization.validate_phone_num_usa, message="Invalid phone number"),
+    Field('sms_status_ind', max_length=4, empty_to_none=True,
+          check=sanitization.validate_checkbox, message="Invalid checkbox value"),
+    # Opting out of text messages empties the device number
+    Field('sms_device', max_length=72, required=False, empty_to_none=True,
+          check=sanitization.validate_phone_num_usa, message="Invalid phone number",
+          clear_when=('sms_status_ind', 'Y')),
+])
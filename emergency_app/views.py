@@ -1,36 +1,104 @@
 from django.shortcuts import render
-from django.http import HttpResponse, JsonResponse
-from django.db.models import F
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max
 # alternatively, from emergency_app.models.identity import Identity
 from .models.identity import Identity
 from .models.contact import Contact
 from .models.emergency import Emergency
-from .models.relation import Relation
-from .models.nation import Nation
-from .models.state import State
-#TODO - crsf_exempt is only needed when testing on http - REMOVE WHEN DONE TESTING
-from django.views.decorators.csrf import csrf_exempt
 #require_http_methods allows us to force POST rather then GET
 from django.views.decorators.http import require_http_methods
 
 from django.utils import timezone
-from .forms import UpdateEmergencyContactForm, SetEvacuationAssistanceForm, SetEmergencyNotificationsForm
+from django.conf import settings
+from . import validation
+from .models.change_log import ChangeLog
+import json
 
 # jwt_placeholder is a temporary JWT generator and validator
 # Will be replaced by Single-Sign-On calls
 from common.util import jwt_placeholder as j
-from common.util import sanitization
+from common.util import change_log
+from common.util import export
+from common.util import batch_lookup
+from common.util import reverse_lookup
+from common.util import evacuation_roster
+from common.util import emergency_profile
+from common.util import reference_data
+from common.util import structured_logging
+from common.util import idempotency
+from common.util import concurrency
+from common.util import revocation
+from common.util import sharding
+from . import warmup
+from . import admission
+
+# Views in this module authenticate with the JWT in the Authorization header, so they are exempt
+# from CSRF checks by the scoped policy in emergency_app/middleware.py
 
 # Common http return codes
+http_success_response = 200 # Request was valid and authorized
 http_no_content_response = 204 # Request was valid and authorized, but no content found
 http_unauthorized_response = 401 # Request is either missing JWT or provided invalid JWT
+http_forbidden_response = 403 # Request had a valid JWT, but the user is not allowed to make this call
+http_conflict_response = 409 # Request would overwrite a change made since the client (or this request) read the row
 http_unprocessable_entity_response = 422 # Request was formatted properly, but had invalid data (e.g. invalid email)
+http_service_unavailable_response = 503 # This worker is still warming up
 
 # The key name for our JWT in HTTP request headers
 JWT_Headers_Key = "HTTP_AUTHORIZATION"
 
-#TODO csrf_exempt is temporary, need this exemption over http
-@csrf_exempt
+# Every SPREMRG column of a contact, plus what its codes stand for, joined from the reference tables
+contact_columns = emergency_profile.contact_columns()
+contact_references = emergency_profile.contact_references
+
+# ZGBNNN columns the frontend reads and writes
+emergency_columns = ['external_email', 'campus_email', 'primary_phone', 'alternate_phone', 'sms_status_ind',
+	'sms_device', 'evacuation_assistance', 'version']
+
+def _authorize_administrator(request):
+	"""
+	Validates the JWT and checks that its user is listed in settings.EMP_ADMINISTRATORS
+	Args:
+		request (HttpRequest): The request carrying the JWT
+	Returns:
+		HttpResponse: Unauthorized(401) or Forbidden(403) response to return, None if the user is an administrator
+	"""
+	jwt = request.META.get(JWT_Headers_Key)
+	try:
+		j.validate_token(jwt)
+	except Exception as e:
+		return HttpResponse(str(e), status=http_unauthorized_response)
+
+	payload = j.grab_token_payload(jwt)
+	if payload.get('username') not in settings.EMP_ADMINISTRATORS:
+		return HttpResponse("Forbidden", status=http_forbidden_response)
+	return None
+
+def _conflict(message, current):
+	"""
+	Conflict(409) answer to a write that found the row changed since it was read
+	Args:
+		message (str): what was changed
+		current (QuerySet): .values() of the row as it is now
+	Returns:
+		JsonResponse: {"error": message, "current": the row, or null if it was deleted}
+	"""
+	return JsonResponse({'error': message, 'current': current.first()}, status=http_conflict_response)
+
+def _shift_priorities(contacts, offset):
+	"""
+	Moves a set of contacts up or down the priority list, recording every move in the change log
+	Args:
+		contacts (QuerySet): The Contact rows to move
+		offset (int): 1 to demote the contacts, -1 to promote them
+	"""
+	shifted = list(contacts.values_list('surrogate_id', 'pidm', 'priority'))
+	# update() skips auto_now, stamp the activity date so the export sees the moves
+	contacts.update(priority=F('priority') + offset, version=F('version') + 1, activity_date=timezone.now())
+	for surrogate_id, pidm, priority in shifted:
+		change_log.record(Contact, pidm, change_log.UPDATE, {'priority': str(int(priority) + offset)}, row_key=surrogate_id)
+
 @require_http_methods(["POST"])
 def login(request):
 	"""
@@ -52,6 +120,8 @@ def login(request):
 					last_name (str)
 					username (str)
 					email (str)
+					exp (int): expiration time, renew the JWT before it with refreshToken
+					orig_iat (int): login time, kept by refreshToken
 				}
 			Return Unauthorized Error(401) otherwise
 	Raises:
@@ -72,7 +142,47 @@ def login(request):
 	token = j.generate_token(user_data[0])
 	return HttpResponse(token)
 
-@csrf_exempt
+@require_http_methods(["POST"])
+def refresh_token(request):
+	"""
+	Only available as a POST request, with a still valid JWT in the Authorization header
+	Return:
+		Return a new JWT (plain-string) with the same payload and a renewed expiration on success,
+		built from the claims of the old one without reading the database.
+		Sessions end settings.EMP_SESSION_LIFETIME seconds after logging in, the last token expires then.
+		Return Unauthorized Error(401) if the JWT is invalid, expired, or its session is over
+	"""
+	jwt = request.META.get(JWT_Headers_Key)
+	try:
+		token = j.refresh_token(jwt, settings.EMP_SESSION_LIFETIME)
+	except Exception as e:
+		return HttpResponse(str(e), status=http_unauthorized_response)
+	return HttpResponse(token)
+
+@require_http_methods(["POST"])
+def revoke_token(request):
+	"""
+	Only available as a POST request, with a valid JWT in the Authorization header
+	Revokes the JWT and every token refreshed from it or it was refreshed from (logging out),
+	they are refused by every endpoint from then on
+	Return:
+		Return Success(200) on success, Unauthorized Error(401) if the JWT is invalid or already revoked
+	"""
+	jwt = request.META.get(JWT_Headers_Key)
+	try:
+		j.validate_token(jwt)
+	except Exception as e:
+		return HttpResponse(str(e), status=http_unauthorized_response)
+
+	payload = j.grab_token_payload(jwt)
+	if 'jti' not in payload:
+		return HttpResponse("Token can't be revoked, it expires at %d" % payload['exp'], status=http_unprocessable_entity_response)
+	# No token of the session is valid after its end (or its expiration, for tokens issued before sessions)
+	orig_iat = payload.get('orig_iat')
+	expires = orig_iat + settings.EMP_SESSION_LIFETIME if isinstance(orig_iat, int) else payload['exp']
+	revocation.revoke(payload['jti'], max(expires, payload['exp']))
+	return HttpResponse("Token revoked.")
+
 @require_http_methods(["POST", "GET"])
 def get_emergency_contacts(request):
 	"""
@@ -91,6 +201,7 @@ def get_emergency_contacts(request):
 		{
 			surrogate_id: xxxx
 			contact info...
+			relation_description, state_name, nation_name: what relt_code, stat_code and natn_code stand for
 		},
 		{
 			surrogate_id: xxxx
@@ -111,26 +222,62 @@ def get_emergency_contacts(request):
 	payload = j.grab_token_payload(jwt)
 
 	user_pidm = Identity.objects.get(username=payload['username']).pidm
+	structured_logging.bind(pidm=user_pidm)
 
-	# Now we can query the contact table for any contacts that this user has listed
-	contacts = Contact.objects.filter(pidm=user_pidm)
+	# The user's contacts by priority, with the reference tables joined in, were serialized by the last write
+	profile = emergency_profile.get(user_pidm)
 
 	# No contacts for this user's valid request results in a 204, No Content
-	if len(contacts) < 1:
+	if profile.contacts == emergency_profile.EMPTY:
 		return HttpResponse("No contacts found", status=http_no_content_response)
 
 	# Otherwise return all contacts in their json form
-	contact_list = list(contacts.values())
-	return JsonResponse(contact_list, safe=False)
+	return HttpResponse(profile.contacts, content_type='application/json')
+
+@require_http_methods(["POST"])
+def get_emergency_contacts_batch(request):
+	"""
+	Returns the emergency contacts and notification settings of many people in one request
+	Only available to administrators
+	Body (json):
+		{
+			"pidms": [123, 456, ...] <- at most settings.EMP_BATCH_LOOKUP_MAX_PIDMS
+		}
+	returns newline delimited json (one person per line, in the requested order) on success
+		{"pidm": 123, "contacts": [{surrogate_id: xxxx, contact info...}, ...by priority], "notifications": {...} or null}
+	"""
+	error = _authorize_administrator(request)
+	if error:
+		return error
+
+	try:
+		pidms = json.loads(request.body.decode('utf-8')).get('pidms')
+	except (ValueError, AttributeError):
+		pidms = None
+	if (not isinstance(pidms, list) or
+		not all(isinstance(pidm, int) and not isinstance(pidm, bool) for pidm in pidms)):
+		return HttpResponse("Body must be json of the form {\"pidms\": [123, ...]}", status=http_unprocessable_entity_response)
+	if len(pidms) > settings.EMP_BATCH_LOOKUP_MAX_PIDMS:
+		return HttpResponse("At most %d pidms per request" % settings.EMP_BATCH_LOOKUP_MAX_PIDMS, status=http_unprocessable_entity_response)
+
+	lines = batch_lookup.iter_lookup_lines(pidms, settings.EMP_BATCH_LOOKUP_CHUNK_SIZE)
+	return StreamingHttpResponse(lines, content_type='application/x-ndjson')
 
 # Update (mutate) emergency contact information
-@csrf_exempt
 @require_http_methods(["POST", "DELETE"])
+@idempotency.idempotent
 def update_emergency_contact(request, surrogate_id=None):
 	"""
 	Update the database information regarding the emergency contact information.
 	This could imply either submitting a new emergency contact, or deleting the
 	existing emergency contact.
+	An existing contact is only written if it still has the version the client read ('version' field,
+	or query parameter for DELETE), which defaults to the version read by this request.
+	returns Conflict(409) with the current contact otherwise:
+	{
+		"error": "Contact was changed by another request",
+		"current": {contact info...} <- or null if it was deleted
+	}
 	"""
 	# extract JWT from post request in uniform fashion to above JWT code
 	jwt = request.META.get(JWT_Headers_Key)
@@ -149,77 +296,253 @@ def update_emergency_contact(request, surrogate_id=None):
 		# checking whether surrogate id is given, and exists in database
 		if surrogate_id == None:
 			return HttpResponse("No Surrogate ID given for deleting contact!", status=422)
+		# the user's pidm first, it picks the shard the contact is on
+		user_pidm = Identity.objects.get(username=payload['username']).pidm
+		structured_logging.bind(pidm=user_pidm)
+		shard = sharding.shard_for(user_pidm)
 		try:
-			entry = Contact.objects.get(surrogate_id=surrogate_id)
+			entry = Contact.objects.using(shard).get(surrogate_id=surrogate_id)
 		except Contact.DoesNotExist:
 			return HttpResponse("No contact found.")
 
 		# checking whether user request has matching pidm with contact that has the surrogate id
-		user_pidm = Identity.objects.get(username=payload['username']).pidm
 		if entry.pidm != user_pidm:
 			return HttpResponse("No contact found", status=http_unprocessable_entity_response)
-		else:
-			# any contacts that is belong to the same user and have lower priority got promoted, before deleting the entry
-			Contact.objects.filter(pidm=entry.pidm, priority__gt=entry.priority).update(priority=F('priority') - 1)
-			entry.delete()
-			return HttpResponse("Successfully deleted emergency contact.", status=200)
+		version = concurrency.expected_version(request.GET, entry)
+		if version is None:
+			return HttpResponse("Invalid version", status=http_unprocessable_entity_response)
+		with transaction.atomic(using=shard):
+			# delete the entry only if nobody changed it since, then promote the contacts that had lower priority
+			deleted = concurrency.delete_if_current(entry, version)
+			if deleted:
+				_shift_priorities(Contact.objects.using(shard).filter(pidm=entry.pidm, priority__gt=entry.priority), -1)
+				change_log.record(entry, entry.pidm, change_log.DELETE, {})
+				emergency_profile.sync(entry.pidm)
+		if not deleted:
+			return _conflict("Contact was changed by another request",
+				Contact.objects.using(shard).filter(surrogate_id=entry.surrogate_id).values(*contact_columns, **contact_references))
+		return HttpResponse("Successfully deleted emergency contact.", status=200)
 	# End of deletion branch ==============================================================
 	else:
+		# Grab the pidm from the JWT, it picks the shard the contacts are on
+		jwt_pidm = Identity.objects.get(username=payload['username']).pidm
+		structured_logging.bind(pidm=jwt_pidm)
+		shard = sharding.shard_for(jwt_pidm)
+
 		# first, decide if we are updating or creating
 		# based upon if the surrogate_id already exists
 		surrogate_id = request.POST.get('surrogate_id')
 		if surrogate_id:
 			# if given surrogate id does not match in table, throws error
 			try:
-				entry = Contact.objects.get(surrogate_id=surrogate_id)
+				entry = Contact.objects.using(shard).get(surrogate_id=surrogate_id)
 			except Contact.DoesNotExist:
 				return HttpResponse("Invalid surrogate id", status=http_unprocessable_entity_response)
 			contact_exists = True
+			# the validated values are written into the instance, so capture it for the change log first
+			before = change_log.snapshot(entry)
 			# also record the priority before proceeding, to decide whether other contacts belong to the same user need demotion or promotion
 			old_priority = int(entry.priority)
+			# the version the row must still have when it's written
+			version = concurrency.expected_version(request.POST, entry)
+			if version is None:
+				return HttpResponse("Invalid version", status=http_unprocessable_entity_response)
 		else:
 			entry = None
 			contact_exists = False
+			before = None
 
-		# Grab the pidm from the JWT
-		jwt_pidm = Identity.objects.get(username=payload['username']).pidm
-
-		# Create a copy of the POST request to modify the Pidm
-		temp_body = request.POST.copy()
-		temp_body['pidm'] = jwt_pidm
-
-		# temporary fix for null value on state
-		try:
-			if temp_body['stat_code'] == "null":
-				temp_body['stat_code'] = None
-		except:
-			pass
-
-		# use form to validate and then save the request if the inputs are valid
-		form = UpdateEmergencyContactForm(temp_body, instance=entry) # If instance=None, it creates table. else, updates
-		if form.is_valid():
+		# validate the request with the pidm from the JWT ("null" states become None like every other blank value)
+		cleaned, errors = validation.update_emergency_contact.validate(request.POST, {'pidm': jwt_pidm})
+		if not errors:
 			# do not save immediately, since priority check on other contacts are needed
-			entry = form.save(commit=False)
+			entry = validation.update_emergency_contact.construct(cleaned, entry) # If entry is None, it creates one. else, updates
 			new_priority = int(entry.priority)
+			with transaction.atomic(using=shard):
+				if contact_exists == True:
+					# write the contact first, only if nobody changed it since it was read
+					saved = concurrency.save_if_current(entry, version)
+					if saved:
+						others = Contact.objects.using(shard).filter(pidm=entry.pidm).exclude(surrogate_id=entry.surrogate_id)
+						# if the old contact wants to be promoted, demote the contacts between new and (old - 1) priority
+						if old_priority > new_priority:
+							_shift_priorities(others.filter(priority__range=(new_priority, old_priority - 1)), 1)
+						# if the old contact wants to be demoted, promote the contacts between (old + 1) and new priority
+						if old_priority < new_priority:
+							_shift_priorities(others.filter(priority__range=(old_priority + 1, new_priority)), -1)
+						# and do not change anything if the old and new priority are same
+						change_log.record(entry, entry.pidm, change_log.UPDATE, change_log.diff(before, change_log.snapshot(entry)))
+						emergency_profile.sync(entry.pidm)
+				else:
+					# if the contact is new, demote this user's contacts that have lower priority
+					_shift_priorities(Contact.objects.using(shard).filter(pidm=entry.pidm, priority__gte=new_priority), 1)
+					entry.save(using=shard)
+					change_log.record(entry, entry.pidm, change_log.INSERT, change_log.snapshot(entry))
+					emergency_profile.sync(entry.pidm)
 			if contact_exists == True:
-				# if the old contact wants to be promoted, demote the contacts between new and (old - 1) priority
-				if old_priority > new_priority:
-					Contact.objects.filter(pidm=entry.pidm, priority__range=(new_priority, old_priority - 1)).update(priority=F('priority') + 1)
-				# if the old contact wants to be demoted, promote the contacts between (old + 1) and new priority
-				if old_priority < new_priority:
-					Contact.objects.filter(pidm=entry.pidm, priority__range=(old_priority + 1, new_priority)).update(priority=F('priority') - 1)
-				# and do not change anything if the old and new priority are same
-				entry.save()
+				if not saved:
+					return _conflict("Contact was changed by another request",
+						Contact.objects.using(shard).filter(surrogate_id=entry.surrogate_id).values(*contact_columns, **contact_references))
 				return HttpResponse("Updated successfully.")
 			else:
-				# if the contact is new, demote any contacts that have lower priority
-				Contact.objects.filter(priority__gte=new_priority).update(priority=F('priority') + 1)
-				entry.save()
 				return HttpResponse("Created successfully.")
 		else:
-			return HttpResponse("errors:" + str(form.errors), status=http_unprocessable_entity_response)
+			return HttpResponse("errors:" + validation.as_text(errors), status=http_unprocessable_entity_response)
+
+@require_http_methods(["POST"])
+@idempotency.idempotent
+def replace_emergency_contacts(request):
+	"""
+	Replaces the user's emergency contacts with a complete, ordered list in one request.
+	Only the difference to the stored contacts is written: new contacts are inserted, missing ones deleted,
+	and changed ones (including their priority, which is their position in the list) updated.
+	Body (json):
+		[
+			{
+				surrogate_id: xxxx <- leave out for a new contact
+				version: x <- optional, the version of the contact the client read
+				contact info... <- same fields as updateEmergencyContact, priority is ignored
+			},
+			...
+		]
+	returns a json on success with the following data
+	{
+		"created": 1,
+		"updated": 2,
+		"deleted": 0,
+		"unchanged": 1
+	}
+	returns Unprocessable Entity(422) with the errors of every invalid contact by list position otherwise,
+	or for a list of more than settings.EMP_REPLACE_CONTACTS_MAX_CONTACTS contacts
+	returns Conflict(409) with the current contacts if one that would change or be deleted was changed,
+	or a contact was added or deleted, by another request since they were read
+	{
+		"error": "Contacts were changed by another request",
+		"current": [{contact info...}, ...]
+	}
+	"""
+	jwt = request.META.get(JWT_Headers_Key)
+	try:
+		j.validate_token(jwt)
+	except Exception as e:
+		return HttpResponse(str(e), status=http_unauthorized_response)
+
+	payload = j.grab_token_payload(jwt)
+	user_pidm = Identity.objects.get(username=payload['username']).pidm
+	structured_logging.bind(pidm=user_pidm)
+	shard = sharding.shard_for(user_pidm)
+
+	try:
+		submitted = json.loads(request.body.decode('utf-8'))
+	except ValueError:
+		submitted = None
+	if not isinstance(submitted, list) or not all(isinstance(contact, dict) for contact in submitted):
+		return HttpResponse("Body must be a json list of contacts", status=http_unprocessable_entity_response)
+	if len(submitted) > settings.EMP_REPLACE_CONTACTS_MAX_CONTACTS:
+		return HttpResponse("At most %d contacts per request" % settings.EMP_REPLACE_CONTACTS_MAX_CONTACTS, status=http_unprocessable_entity_response)
+
+	# One query for everything the user currently has
+	current = {contact.surrogate_id: contact for contact in Contact.objects.using(shard).filter(pidm=user_pidm)}
+
+	# Validate every entry before writing anything
+	errors = {}
+	validated = []
+	seen_surrogate_ids = set()
+	# surrogate id -> the version the contact must still have if it's written
+	versions = {}
+	for position, contact in enumerate(submitted):
+		surrogate_id = contact.get('surrogate_id')
+		if surrogate_id not in (None, ''):
+			try:
+				surrogate_id = int(surrogate_id)
+			except (TypeError, ValueError):
+				surrogate_id = -1
+			if surrogate_id not in current or surrogate_id in seen_surrogate_ids:
+				errors[position] = {'surrogate_id': ["Invalid surrogate id"]}
+				continue
+			seen_surrogate_ids.add(surrogate_id)
+			versions[surrogate_id] = concurrency.expected_version(contact, current[surrogate_id])
+			if versions[surrogate_id] is None:
+				errors[position] = {'version': ["Invalid version"]}
+				continue
+		else:
+			surrogate_id = None
+
+		cleaned, contact_errors = validation.replace_emergency_contact.validate(contact, {'pidm': user_pidm, 'priority': str(position + 1)})
+		if contact_errors:
+			errors[position] = contact_errors
+		else:
+			validated.append((surrogate_id, validation.replace_emergency_contact.construct(cleaned)))
+	if errors:
+		return JsonResponse(errors, status=http_unprocessable_entity_response)
+
+	# Work out the minimal set of writes
+	now = timezone.now()
+	to_create, to_update, changes = [], [], []
+	updated_fields = set()
+	for surrogate_id, contact in validated:
+		if surrogate_id is None:
+			to_create.append(contact)
+			continue
+		stored = current[surrogate_id]
+		before = change_log.snapshot(stored)
+		for field, value in change_log.snapshot(contact).items():
+			if field != 'surrogate_id':
+				setattr(stored, field, value)
+		changed = change_log.diff(before, change_log.snapshot(stored))
+		if changed:
+			# bulk_update doesn't run auto_now or save(), so stamp the activity date and lookup keys ourselves
+			stored.activity_date = now
+			stored.update_lookup_keys()
+			to_update.append(stored)
+			updated_fields.update(changed)
+			changes.append(change_log.entry(stored, user_pidm, change_log.UPDATE, changed))
+	to_delete = [surrogate_id for surrogate_id in current if surrogate_id not in seen_surrogate_ids]
+	# The rows written must still be at the version read, the untouched ones may have changed since
+	claimed = {stored.surrogate_id: versions[stored.surrogate_id] for stored in to_update}
+	claimed.update((surrogate_id, current[surrogate_id].version) for surrogate_id in to_delete)
+
+	try:
+		with transaction.atomic(using=shard):
+			concurrency.claim_versions(Contact, claimed, shard)
+			if to_delete:
+				Contact.objects.using(shard).filter(pidm=user_pidm, surrogate_id__in=to_delete).delete()
+				changes.extend(change_log.entry(Contact, user_pidm, change_log.DELETE, {}, row_key=surrogate_id) for surrogate_id in to_delete)
+			if to_update:
+				Contact.objects.using(shard).bulk_update(to_update, sorted(updated_fields) + ['activity_date'] + Contact.lookup_key_fields)
+			for contact in to_create:
+				contact.update_lookup_keys()
+			numbered = sharding.assign_surrogate_ids(to_create)
+			if to_create and not numbered:
+				# sqlite doesn't hand back the ids of a bulk insert, the column's sequence numbers the rows above this one
+				highest = Contact.objects.using(shard).aggregate(highest=Max('surrogate_id'))['highest'] or 0
+			# A contact another request added (or deleted) since they were read would be kept without being seen
+			if set(Contact.objects.using(shard).filter(pidm=user_pidm).values_list('surrogate_id', flat=True)) != set(current) - set(to_delete):
+				raise concurrency.Conflict()
+			if to_create:
+				Contact.objects.using(shard).bulk_create(to_create)
+				created = to_create
+				if not numbered:
+					created = list(Contact.objects.using(shard).filter(pidm=user_pidm, surrogate_id__gt=highest))
+					# Another request inserted one in between
+					if len(created) != len(to_create):
+						raise concurrency.Conflict()
+				changes.extend(change_log.entry(contact, user_pidm, change_log.INSERT, change_log.snapshot(contact)) for contact in created)
+			ChangeLog.objects.using(shard).bulk_create(changes)
+			emergency_profile.sync(user_pidm)
+	except concurrency.Conflict:
+		return JsonResponse({
+			'error': "Contacts were changed by another request",
+			'current': list(Contact.objects.using(shard).filter(pidm=user_pidm).order_by('priority').values(*contact_columns, **contact_references)),
+		}, status=http_conflict_response)
+
+	return JsonResponse({
+		'created': len(to_create),
+		'updated': len(to_update),
+		'deleted': len(to_delete),
+		'unchanged': len(validated) - len(to_create) - len(to_update),
+	})
 
-@csrf_exempt
 @require_http_methods(["POST", "GET"])
 def get_emergency_notifications(request):
 	"""
@@ -240,7 +563,8 @@ def get_emergency_notifications(request):
       "external_email":  "aaa.bbb@email.com",
       "campus_email":  "ccc.ddd@pdx.edu",
       "activity_date": "YYYY-MM-DDTHH:MM:SS", <- YearMonthDayTHour:MinuteSecond
-      "sms_status_ind": "Y" <- Or null
+      "sms_status_ind": "Y", <- Or null
+      "version": 3 <- send it back with setEmergencyNotifications
 	}
 	NOTE: Any of these values can be null, make sure to check in front-end
 	"""
@@ -255,29 +579,32 @@ def get_emergency_notifications(request):
 	payload = j.grab_token_payload(jwt)
 
 	user_pidm = Identity.objects.get(username=payload['username']).pidm
+	structured_logging.bind(pidm=user_pidm)
 
-	# Now we query the emergency table for any info the user has listed
-	# SELECT * FROM Emergency WHERE Emergency.pidm = user_pidm
-	user_entry = Emergency.objects.filter(pidm=user_pidm)
+	# The user's emergency info was serialized by the last write
+	# We want every field except for the pidm, as there is no need to expose front-end to database specifics
+	profile = emergency_profile.get(user_pidm)
 
 	# No info found for this user's valid request results in a 204, No Content
-	if len(user_entry) < 1:
+	if profile.notifications == emergency_profile.EMPTY:
 		return HttpResponse("No emergency info found", status=http_no_content_response)
 
-	# Otherwise return all emergency info in their json format
-	# We want every field except for the pidm, as there is no need to expose front-end to database specifics
-	emergency_info = list(user_entry.values('external_email', 'campus_email', 'primary_phone',
-											'alternate_phone', 'sms_status_ind', 'sms_device'))
-
-	# Return the list of user's emergency info, safe=false means we can return non-dictionary items
-	return JsonResponse(emergency_info, safe=False)
+	# Return the list of user's emergency info
+	return HttpResponse(profile.notifications, content_type='application/json')
 
 
-@csrf_exempt
 @require_http_methods(["POST", "DELETE"])
+@idempotency.idempotent
 def set_emergency_notifications(request):
 	"""
 	Updates the user's status on the Emergency assistance table
+	Existing info is only written if it still has the version the client read ('version' field),
+	which defaults to the version read by this request.
+	returns Conflict(409) with the current info otherwise:
+	{
+		"error": "Emergency info was changed by another request",
+		"current": {emergency info...}
+	}
 	"""
 
 	jwt = request.META.get(JWT_Headers_Key)
@@ -289,42 +616,70 @@ def set_emergency_notifications(request):
 
 	payload = j.grab_token_payload(jwt)
 
-	user_pidm = Identity.objects.get(username=payload['username']).pidm
+	user = Identity.objects.get(username=payload['username'])
+	user_pidm = user.pidm
+	structured_logging.bind(pidm=user_pidm)
+	shard = sharding.shard_for(user_pidm)
 	user_email = payload['email']
 
 	# Determine if the user is already in the emergency registry
-	query = Emergency.objects.filter(pidm=user_pidm)
+	query = Emergency.objects.using(shard).filter(pidm=user_pidm)
 	if len(query) < 1:
 		entry = None
 		user_exists = False
+		before = None
 	else:
 		# Might as well grab the Emergency entry here
 		entry = query[0]
 		user_exists = True
-
-	form = SetEmergencyNotificationsForm(request.POST, instance=entry)
-	if form.is_valid():
+		# the validated values are written into the instance, so capture it for the change log first
+		before = change_log.snapshot(entry)
+		# the version the row must still have when it's written
+		version = concurrency.expected_version(request.POST, entry)
+		if version is None:
+			return HttpResponse("Invalid version", status=http_unprocessable_entity_response)
+
+	cleaned, errors = validation.set_emergency_notifications.validate(request.POST)
+	if not errors:
 		if user_exists == True:
-			form.save()
+			with transaction.atomic(using=shard):
+				entry = validation.set_emergency_notifications.construct(cleaned, entry)
+				saved = concurrency.save_if_current(entry, version)
+				if saved:
+					change_log.record(entry, user_pidm, change_log.UPDATE, change_log.diff(before, change_log.snapshot(entry)))
+					evacuation_roster.sync(entry, user)
+					emergency_profile.sync(user_pidm)
+			if not saved:
+				return _conflict("Emergency info was changed by another request",
+					Emergency.objects.using(shard).filter(pidm=user_pidm).values(*emergency_columns))
 			return HttpResponse("Updated successfully.")
 		else:
-			new_entry = form.save(commit=False)
+			new_entry = validation.set_emergency_notifications.construct(cleaned)
 			new_entry.pidm = user_pidm
 			new_entry.campus_email = user_email
-			new_entry.save()
+			try:
+				with transaction.atomic(using=shard):
+					# an insert, so a row created by another request since isn't overwritten
+					new_entry.save(using=shard, force_insert=True)
+					change_log.record(new_entry, user_pidm, change_log.INSERT, change_log.snapshot(new_entry))
+					evacuation_roster.sync(new_entry, user)
+					emergency_profile.sync(user_pidm)
+			except IntegrityError:
+				return _conflict("Emergency info was changed by another request",
+					Emergency.objects.using(shard).filter(pidm=user_pidm).values(*emergency_columns))
 			return HttpResponse("Created successfully.")
 	else:
-		return HttpResponse("errors:" + str(form.errors), status=http_unprocessable_entity_response)
+		return HttpResponse("errors:" + validation.as_text(errors), status=http_unprocessable_entity_response)
 
 
 
-@csrf_exempt
 @require_http_methods(["POST", "GET"])
 def get_evacuation_assistance(request):
 	"""
 	returns a json on success with the following data
 	{
-      "evacuation_assistance": "Y" <- Or null
+      "evacuation_assistance": "Y", <- Or null
+      "version": 3 <- send it back with setEvacuationAssistance
 	}
 	"""
 	# Pull the jwt from the POST request
@@ -338,26 +693,51 @@ def get_evacuation_assistance(request):
 	payload = j.grab_token_payload(jwt)
 
 	user_pidm = Identity.objects.get(username=payload['username']).pidm
+	structured_logging.bind(pidm=user_pidm)
 
-	# Now we query the emergency table for any info the user has listed
-	# SELECT * FROM Emergency WHERE Emergency.pidm = user_pidm
-	user_entry = Emergency.objects.filter(pidm=user_pidm)
+	# The user's evacuation assistance status was serialized by the last write
+	profile = emergency_profile.get(user_pidm)
 
 	# No info found for this user's valid request results in a 204, No Content
-	if len(user_entry) < 1:
+	if profile.evacuation_assistance == emergency_profile.EMPTY:
 		return HttpResponse("No emergency info found", status=http_no_content_response)
 
-	# Otherwise return evacuation assistance status in their json format
-	emergency_info = list(user_entry.values('evacuation_assistance'))
+	return HttpResponse(profile.evacuation_assistance, content_type='application/json')
 
-	return JsonResponse(emergency_info, safe=False)
+
+@require_http_methods(["POST", "GET"])
+def get_emergency_profile(request):
+	"""
+	Returns everything the three reads above return, in one request
+	returns a json on success with the following data
+	{
+		"contacts": [{surrogate_id: xxxx, contact info...}, ...by priority], <- as getEmergencyContacts, or []
+		"notifications": [{emergency info...}], <- as getEmergencyNotifications, or []
+		"evacuation_assistance": [{"evacuation_assistance": "Y", "version": 3}] <- as getEvacuationAssistance, or []
+	}
+	if JWT fails to validate return Unauthorized Error(401)
+	"""
+	jwt = request.META.get(JWT_Headers_Key)
+	try:
+		j.validate_token(jwt)
+	except Exception as e:
+		return HttpResponse(str(e), status=http_unauthorized_response)
+
+	payload = j.grab_token_payload(jwt)
+
+	user_pidm = Identity.objects.get(username=payload['username']).pidm
+	structured_logging.bind(pidm=user_pidm)
+
+	# One primary key read, the fragments are joined as they were serialized
+	return HttpResponse(emergency_profile.document(emergency_profile.get(user_pidm)), content_type='application/json')
 
 
-@csrf_exempt
 @require_http_methods(["POST"])
+@idempotency.idempotent
 def set_evacuation_assistance(request):
 	"""
 	Updates the user's evacuation assitance status on the Emergency table
+	Checks the version like set_emergency_notifications, returns Conflict(409) with the current info if it changed
 	"""
 	# Pull the jwt from the POST request
 	jwt = request.META.get(JWT_Headers_Key)
@@ -368,57 +748,272 @@ def set_evacuation_assistance(request):
 	# Grab username from the token
 	payload = j.grab_token_payload(jwt)
 
-	user_pidm = Identity.objects.get(username=payload['username']).pidm
+	user = Identity.objects.get(username=payload['username'])
+	user_pidm = user.pidm
+	structured_logging.bind(pidm=user_pidm)
+	shard = sharding.shard_for(user_pidm)
 	user_email = payload['email']
 
 	# Determine if the user is already in the emergency registry
-	query = Emergency.objects.filter(pidm=user_pidm)
+	query = Emergency.objects.using(shard).filter(pidm=user_pidm)
 	if len(query) < 1:
 		entry = None
 		user_exists = False
+		before = None
 	else:
 		# Might as well grab the Emergency entry here
 		entry = query[0]
 		user_exists = True
-
-	form = SetEvacuationAssistanceForm(request.POST, instance=entry)
-	if form.is_valid():
+		# the validated values are written into the instance, so capture it for the change log first
+		before = change_log.snapshot(entry)
+		# the version the row must still have when it's written
+		version = concurrency.expected_version(request.POST, entry)
+		if version is None:
+			return HttpResponse("Invalid version", status=http_unprocessable_entity_response)
+
+	cleaned, errors = validation.set_evacuation_assistance.validate(request.POST)
+	if not errors:
 		if user_exists == True:
-			form.save()
+			with transaction.atomic(using=shard):
+				entry = validation.set_evacuation_assistance.construct(cleaned, entry)
+				saved = concurrency.save_if_current(entry, version)
+				if saved:
+					change_log.record(entry, user_pidm, change_log.UPDATE, change_log.diff(before, change_log.snapshot(entry)))
+					evacuation_roster.sync(entry, user)
+					emergency_profile.sync(user_pidm)
+			if not saved:
+				return _conflict("Emergency info was changed by another request",
+					Emergency.objects.using(shard).filter(pidm=user_pidm).values(*emergency_columns))
 			return HttpResponse("Updated successfully.")
 		else:
-			new_entry = form.save(commit=False)
+			new_entry = validation.set_evacuation_assistance.construct(cleaned)
 			new_entry.pidm = user_pidm
 			new_entry.campus_email = user_email
-			new_entry.save()
+			try:
+				with transaction.atomic(using=shard):
+					# an insert, so a row created by another request since isn't overwritten
+					new_entry.save(using=shard, force_insert=True)
+					change_log.record(new_entry, user_pidm, change_log.INSERT, change_log.snapshot(new_entry))
+					evacuation_roster.sync(new_entry, user)
+					emergency_profile.sync(user_pidm)
+			except IntegrityError:
+				return _conflict("Emergency info was changed by another request",
+					Emergency.objects.using(shard).filter(pidm=user_pidm).values(*emergency_columns))
 			return HttpResponse("Created successfully.")
 	else:
-		return HttpResponse("errors:" + str(form.errors), status=http_unprocessable_entity_response)
+		return HttpResponse("errors:" + validation.as_text(errors), status=http_unprocessable_entity_response)
 
-@csrf_exempt
 @require_http_methods(["GET"])
 def get_relations(request):
 	"""
 	Returns the backend's relationship Values
 	No need for JWT validation as this is generic data
 	"""
-	return JsonResponse(list(Relation.objects.values()), safe=False)
+	return JsonResponse(reference_data.values(reference_data.RELATIONS), safe=False)
 
-@csrf_exempt
 @require_http_methods(["GET"])
 def get_nation_codes(request):
 	"""
 	Returns the backend's nation Values
 	No need for JWT validation as this is generic data
 	"""
-	return JsonResponse(list(Nation.objects.values()), safe=False)
+	return JsonResponse(reference_data.values(reference_data.NATIONS), safe=False)
 
 
-@csrf_exempt
 @require_http_methods(["GET", "POST"])
 def get_state_codes(request):
 	"""
 	Returns the backend's state Values
 	No need for JWT validation as this is generic data
 	"""
-	return JsonResponse(list(State.objects.values()), safe=False)
+	return JsonResponse(reference_data.values(reference_data.STATES), safe=False)
+
+@require_http_methods(["GET"])
+def get_changes(request):
+	"""
+	Returns the change log entries written after a cursor, for incremental sync to Banner and the alert vendor
+	Only available to administrators
+	Query string:
+		since (int): the last sequence number already processed, defaults to 0
+		limit (int): maximum amount of entries, capped at settings.EMP_CHANGE_LOG_PAGE_SIZE
+	returns a json on success with the following data
+	{
+		"changes": [
+			{
+				"sequence": 12,
+				"pidm": 123,
+				"table": "SPREMRG", <- or "ZGBNNN"
+				"row_key": "104557", <- surrogate_id for SPREMRG, pidm for ZGBNNN
+				"operation": "U", <- 'I'nsert, 'U'pdate or 'D'elete
+				"changed_fields": {"priority": "2", ...},
+				"activity_date": "YYYY-MM-DDTHH:MM:SS"
+			},
+			...
+		],
+		"next": 12 <- pass as 'since' on the following call
+	}
+	"""
+	error = _authorize_administrator(request)
+	if error:
+		return error
+
+	try:
+		since = int(request.GET.get('since', 0))
+		limit = min(int(request.GET.get('limit', settings.EMP_CHANGE_LOG_PAGE_SIZE)), settings.EMP_CHANGE_LOG_PAGE_SIZE)
+	except ValueError:
+		return HttpResponse("since and limit must be whole numbers", status=http_unprocessable_entity_response)
+
+	changes = change_log.changes_since(since, limit)
+	next_since = changes[-1]['sequence'] if changes else since
+	return JsonResponse({'changes': changes, 'next': next_since})
+
+@require_http_methods(["GET"])
+def export_modified_since(request):
+	"""
+	Streams every Contact and Emergency row modified after a timestamp, for consumers that can't read the change log
+	Only available to administrators
+	Query string:
+		since (str): ISO 8601 timestamp, e.g. 2019-08-01T13:32:00
+		tables (str): optional comma separated Banner tables, defaults to "SPREMRG,ZGBNNN"
+	returns newline delimited json (one row per line) on success
+		{"table": "SPREMRG", "row": {surrogate_id: xxxx, contact info...}}
+		{"table": "ZGBNNN", "row": {pidm: xxxx, emergency info...}}
+	Deleted rows are gone from the tables, so they aren't exported: consumers that must see deletions read /getChanges/
+	"""
+	error = _authorize_administrator(request)
+	if error:
+		return error
+
+	since = export.parse_since(request.GET.get('since'))
+	if since is None:
+		return HttpResponse("since must be an ISO 8601 timestamp", status=http_unprocessable_entity_response)
+
+	tables = request.GET.get('tables', ','.join(export.exportable_models)).split(',')
+	if any(table not in export.exportable_models for table in tables):
+		return HttpResponse("tables must be any of " + ', '.join(export.exportable_models), status=http_unprocessable_entity_response)
+
+	lines = export.iter_export_lines(tables, since, settings.EMP_EXPORT_CHUNK_SIZE)
+	return StreamingHttpResponse(lines, content_type='application/x-ndjson')
+
+@require_http_methods(["GET"])
+def lookup_address(request):
+	"""
+	Finds everyone using a phone number or email address, e.g. one reported by the SMS or email provider
+	Only available to administrators
+	Query string:
+		address (str): an email address or phone number (E.164 like +15035552345, or a USA number)
+	returns a json on success with the following data
+	[
+		{
+			"table": "ZGBNNN", <- or "SPREMRG"
+			"pidm": 123,
+			"row_key": 123, <- pidm for ZGBNNN, surrogate_id for SPREMRG
+			"field": "sms_device" <- column using the address
+		},
+		...
+	]
+	"""
+	error = _authorize_administrator(request)
+	if error:
+		return error
+
+	address = request.GET.get('address')
+	if not address:
+		return HttpResponse("address is required", status=http_unprocessable_entity_response)
+	return JsonResponse(reverse_lookup.lookup(address), safe=False)
+
+
+@require_http_methods(["GET"])
+def get_evacuation_roster(request):
+	"""
+	Returns everyone who needs evacuation assistance and how to reach them, for building safety staff
+	Only available to administrators
+	returns a json on success with the following data
+	{
+		"counts": {
+			"total": 2,
+			"sms": 1, <- people with an sms device
+			"phone": 2, <- people with a primary or alternate phone
+			"email": 2 <- people with a campus or external email
+		},
+		"roster": [
+			{
+				"pidm": 123,
+				"username": "fooBar",
+				"first_name": "Foo",
+				"last_name": "Bar",
+				"campus_email": "fooBar@pdx.edu",
+				"external_email": "foo@gmail.com",
+				"primary_phone": "5035552345",
+				"alternate_phone": null,
+				"sms_device": "5035552345",
+				"activity_date": "2019-05-01T12:00:00Z"
+			},
+			...
+		]
+	}
+	"""
+	error = _authorize_administrator(request)
+	if error:
+		return error
+
+	roster = evacuation_roster.all_rows()
+	return JsonResponse({'counts': evacuation_roster.counts(roster), 'roster': roster})
+
+
+@require_http_methods(["GET"])
+def readiness(request):
+	"""
+	Readiness probe for the load balancer, starts this worker's warm-up if it hasn't run yet
+	No need for JWT validation as this is generic data
+	returns a json with the following data, with a 200 once warm and a 503 until then
+	{
+		"status": "ready", <- or "not started", "running", "failed"
+		"steps": [
+			{
+				"name": "database",
+				"seconds": 0.0012,
+				"error": null <- or why the step failed
+			},
+			...
+		]
+	}
+	"""
+	warmup.start()
+	state = warmup.state()
+	status = http_success_response if state['status'] == warmup.READY else http_service_unavailable_response
+	return JsonResponse(state, status=status)
+
+@require_http_methods(["GET"])
+def get_admission_counters(request):
+	"""
+	Returns the admission control counters of the worker process answering the request
+	Only available to administrators
+	returns a json with the following data
+	{
+		"max_in_flight": 64,
+		"in_flight": 3, <- requests of every class running in this process
+		"classes": {
+			"write": {
+				"limit": 32,
+				"in_flight": 1,
+				"waiting": 0, <- requests waiting for a slot
+				"admitted": 1200,
+				"queued": 40, <- admitted or shed after waiting for a slot
+				"shed": 12, <- answered with a 503
+				"timed_out": 2, <- shed after waiting the class's timeout
+				"stale": 0, <- shed for waiting too long in the load balancer's queue
+				"wait_seconds": 3.52, <- total time admitted requests waited for a slot
+				"max_wait_seconds": 0.41
+			},
+			"read": {...},
+			"auth": {...},
+			"reference": {...}
+		}
+	}
+	"""
+	error = _authorize_administrator(request)
+	if error:
+		return error
+
+	return JsonResponse(admission.get_controller().counters())
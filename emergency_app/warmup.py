@@ -0,0 +1,206 @@
+"""
+    Warm-up routine run by each worker before it takes traffic, and the state the
+    readiness endpoint reports. Pays the cold-start costs up front: reference data,
+    the ZIP index, database connections, the JWT path, request validation, and one
+    synthetic request through each view.
+    The synthetic requests carry no token, so they never read or write user data.
+"""
+import io
+import os
+import re
+import sys
+import threading
+import time
+import zipcodes
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler, WSGIRequest
+from django.db import connections
+from django.urls import get_resolver
+from common.util import jwt_placeholder
+from common.util import reference_data
+from emergency_app import validation
+
+# Warm-up states
+NOT_STARTED = 'not started'
+RUNNING = 'running'
+READY = 'ready'
+FAILED = 'failed'
+
+# Path of the readiness endpoint, never sent a synthetic request
+readiness_path = 'readiness/'
+
+_lock = threading.Lock()
+_state = {'pid': None, 'status': NOT_STARTED, 'steps': []}
+
+
+def warm_database():
+    for connection in connections.all():
+        connection.ensure_connection()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+
+
+def warm_reference_data():
+    reference_data.load()
+
+
+def warm_zipcodes():
+    zipcodes.is_real('97201')
+
+
+def warm_jwt():
+    token = jwt_placeholder.generate_token({'username': 'warmup'})
+    jwt_placeholder.validate_token(token)
+    jwt_placeholder.grab_token_payload(token)
+
+
+def warm_validation():
+    def first(name):
+        return next(iter(reference_data.codes(name)), '')
+    validation.replace_emergency_contact.validate({
+        'pidm': 0, 'priority': '1', 'first_name': 'Warm', 'last_name': 'Up',
+        'street_line1': '1825 SW Broadway', 'city': 'Portland',
+        'relt_code': first(reference_data.RELATIONS), 'stat_code': first(reference_data.STATES),
+        'natn_code': first(reference_data.NATIONS), 'zip': '97201',
+        'ctry_code_phone': '1', 'phone_area': '503', 'phone_number': '5552345',
+    })
+    validation.set_emergency_notifications.validate({
+        'external_email': 'warmup@pdx.edu', 'primary_phone': '5035552345',
+        'sms_status_ind': 'N', 'sms_device': '5035552345',
+    })
+
+
+def warm_host():
+    """
+    Returns:
+            str: a Host header the deployment accepts, the first of settings.ALLOWED_HOSTS
+    """
+    for host in settings.ALLOWED_HOSTS:
+        if host != '*':
+            # '.pdx.edu' also matches pdx.edu itself
+            return host.lstrip('.')
+    # With no hosts listed Django accepts localhost (only while DEBUG), '*' accepts any
+    return 'localhost'
+
+
+def synthetic_request(method, path):
+    """
+    Returns:
+            WSGIRequest: a request without a token or body, as the server would build it
+    """
+    host = warm_host()
+    return WSGIRequest({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'SCRIPT_NAME': '',
+        'QUERY_STRING': '',
+        'CONTENT_LENGTH': '0',
+        'HTTP_HOST': host,
+        'SERVER_NAME': host,
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': '127.0.0.1',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    })
+
+
+def warm_views():
+    """
+    Sends one request without a token to every url, a GET or a POST for POST-only views, through
+    the middleware like the server's requests. Token-protected views answer 401 after going through
+    the middleware, routing and JWT check. A 400 (e.g. a Host the deployment refuses) or a server
+    error fails the step, the views weren't warmed.
+    """
+    handler = WSGIHandler()
+    for pattern in get_resolver().url_patterns:
+        route = str(pattern.pattern)
+        if route == readiness_path:
+            continue
+        path = '/' + re.sub('<int:[^>]+>', '0', route)
+        response = handler.get_response(synthetic_request('GET', path))
+        if response.status_code == 405:
+            response = handler.get_response(synthetic_request('POST', path))
+        if response.status_code == 400 or response.status_code >= 500:
+            raise RuntimeError("%s answered %d" % (path, response.status_code))
+
+
+# Warm-up steps, in order
+steps = [
+    ('database', warm_database),
+    ('reference_data', warm_reference_data),
+    ('zipcodes', warm_zipcodes),
+    ('jwt', warm_jwt),
+    ('validation', warm_validation),
+    ('views', warm_views),
+]
+
+
+def run():
+    """
+    Runs every warm-up step in this thread, stopping at the first failure
+    Returns:
+            dict: the warm-up state, see state()
+    """
+    with _lock:
+        _state.update(pid=os.getpid(), status=RUNNING, steps=[])
+    for name, step in steps:
+        started = time.monotonic()
+        try:
+            step()
+        except Exception as e:
+            _record(name, started, repr(e))
+            with _lock:
+                _state['status'] = FAILED
+            return state()
+        _record(name, started, None)
+    with _lock:
+        _state['status'] = READY
+    return state()
+
+
+def _record(name, started, error):
+    with _lock:
+        _state['steps'].append({'name': name, 'seconds': round(time.monotonic() - started, 6), 'error': error})
+
+
+def start():
+    """
+    Starts the warm-up on a background thread, unless this process is already warm or warming up.
+    A forked worker doesn't inherit its master's warm-up, and a failed warm-up is retried.
+    """
+    with _lock:
+        if _state['pid'] == os.getpid() and _state['status'] in (RUNNING, READY):
+            return
+        _state.update(pid=os.getpid(), status=RUNNING, steps=[])
+    threading.Thread(target=_run_in_thread, name='emp-warmup', daemon=True).start()
+
+
+def _run_in_thread():
+    try:
+        run()
+    finally:
+        # Connections are per thread, don't leave the warm-up thread's open
+        connections.close_all()
+
+
+def state():
+    """
+    Returns:
+            dict: "status" (NOT_STARTED, RUNNING, READY or FAILED) and the "steps" run so far,
+                each with its "name", "seconds" taken and "error" (None if it succeeded)
+    """
+    with _lock:
+        if _state['pid'] != os.getpid():
+            return {'status': NOT_STARTED, 'steps': []}
+        return {'status': _state['status'], 'steps': list(_state['steps'])}
+
+
+def is_ready():
+    return state()['status'] == READY
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+from corsheaders.defaults import default_headers
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -44,22 +45,33 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+	# corsheaders for cross origin access
+	# First, so CORS preflights are answered before CommonMiddleware (or anything else) can respond
+	'corsheaders.middleware.CorsMiddleware',
+
+    'emergency_app.middleware.RequestContextMiddleware',
+    # Early, so shed requests cost next to nothing
+    'emergency_app.admission.AdmissionControlMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'emergency_app.middleware.TokenAuthenticatedCsrfMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-	
-	# corsheaders for cross origin access
-	'corsheaders.middleware.CorsMiddleware',
+    # Last, it calls the view itself when profiling
+    'emergency_app.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'emp_backend.urls'
 
 # TODO - this whitelists everything, great for testing, probably not for production.
 CORS_ORIGIN_ALLOW_ALL = True
+# Idempotency-Key lets the write endpoints replay responses to retries (common/util/idempotency.py)
+CORS_ALLOW_HEADERS = list(default_headers) + ['idempotency-key']
+# Headers the frontend reads: when to retry a shed request, and whether a response is a replay
+CORS_EXPOSE_HEADERS = ['Retry-After', 'Idempotent-Replayed']
 
 TEMPLATES = [
     {
@@ -90,6 +102,17 @@ DATABASES = {
     }
 }
 
+# Shards of SPREMRG and ZGBNNN by pidm (common/util/sharding.py), one more SQLite file per shard locally.
+# EMP_SHARDS is the shard map: only ever append to it, then run the rebalance_shards command.
+EMP_SHARD_COUNT = int(os.environ.get('EMP_SHARD_COUNT', 1))
+for shard in range(1, EMP_SHARD_COUNT):
+    DATABASES['shard_%d' % shard] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db_shard_%d.sqlite3' % shard),
+    }
+EMP_SHARDS = ['default'] + ['shard_%d' % shard for shard in range(1, EMP_SHARD_COUNT)]
+DATABASE_ROUTERS = ['common.util.sharding.ShardRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -128,3 +151,181 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/2.2/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Logging
+# https://docs.djangoproject.com/en/2.2/topics/logging/
+# The application's records are written as json lines by a background thread, see common/util/structured_logging.py
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'context': {'()': 'common.util.structured_logging.ContextFilter'},
+        # Invalid submissions are logged by the forms on every request, keep a sample of them
+        'sample': {'()': 'common.util.structured_logging.SamplingFilter', 'default': 0.1},
+        # At most 10 records a second (bursts of 50) per message type
+        'rate_limit': {'()': 'common.util.structured_logging.RateLimitFilter', 'rate': 10, 'burst': 50},
+    },
+    'formatters': {
+        'json': {'()': 'common.util.structured_logging.JsonFormatter'},
+    },
+    'handlers': {
+        'background': {
+            'class': 'common.util.structured_logging.BackgroundHandler',
+            'formatter': 'json',
+            'filters': ['context', 'rate_limit'],
+        },
+        'background_sampled': {
+            'class': 'common.util.structured_logging.BackgroundHandler',
+            'formatter': 'json',
+            'filters': ['context', 'sample', 'rate_limit'],
+        },
+    },
+    'loggers': {
+        'emergency_app.forms': {
+            'handlers': ['background_sampled'],
+            'level': os.environ.get('EMP_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+        'emergency_app': {
+            'handlers': ['background'],
+            'level': os.environ.get('EMP_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+        'common': {
+            'handlers': ['background'],
+            'level': os.environ.get('EMP_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+
+# Emergency Management settings
+
+# Usernames allowed to call the administrative (cross-user) API calls
+EMP_ADMINISTRATORS = []
+
+# Maximum amount of change log entries returned by one getChanges call or drained per batch
+EMP_CHANGE_LOG_PAGE_SIZE = 500
+
+# Amount of rows read per keyset-paginated query of the "modified since" export
+EMP_EXPORT_CHUNK_SIZE = 1000
+
+# Background tasks (common/util/tasks.py)
+# Threads and waiting tasks of the in-process runner, extra tasks spill over to the durable queue
+EMP_TASKS_MAX_WORKERS = 4
+EMP_TASKS_MAX_QUEUE = 100
+# Durable queue retries: attempts before giving up, and the exponential backoff base and cap in seconds
+EMP_TASKS_MAX_ATTEMPTS = 5
+EMP_TASKS_BACKOFF_SECONDS = 30
+EMP_TASKS_MAX_BACKOFF_SECONDS = 60 * 60
+# Seconds a worker has to finish a task it claimed before another worker runs it again (longer than any task takes)
+EMP_TASKS_LEASE_SECONDS = 15 * 60
+# Run in-process tasks synchronously at commit instead of on the thread pool (local testing)
+EMP_TASKS_ALWAYS_EAGER = False
+
+# Batch contact lookup (getEmergencyContactsBatch): pidms per request, and pidms per IN query
+EMP_BATCH_LOOKUP_MAX_PIDMS = 5000
+EMP_BATCH_LOOKUP_CHUNK_SIZE = 500
+
+# Contacts accepted by one replaceEmergencyContacts call
+EMP_REPLACE_CONTACTS_MAX_CONTACTS = 20
+
+# Alert dispatch (common/util/dispatch.py): transport per channel, its class, parallel sends and options
+# Use 'common.util.dispatch.StubTransport' as BACKEND to test locally without sending anything
+EMP_DISPATCH_TRANSPORTS = {
+    'email': {
+        'BACKEND': 'common.util.dispatch.SMTPTransport',
+        'CONCURRENCY': 20,
+        'OPTIONS': {'from_email': 'psualert@pdx.edu'},
+    },
+    'sms': {
+        'BACKEND': 'common.util.dispatch.SMSGatewayTransport',
+        'CONCURRENCY': 50,
+        'OPTIONS': {'url': os.environ.get('EMP_SMS_GATEWAY_URL'), 'token': os.environ.get('EMP_SMS_GATEWAY_TOKEN')},
+    },
+}
+# Attempts per address, and the seconds before the first retry (doubled on each retry)
+EMP_DISPATCH_MAX_ATTEMPTS = 3
+EMP_DISPATCH_BACKOFF_SECONDS = 0.5
+
+# Seconds the reference tables (STVRELT, NATION, STATE) are cached per process, see common/util/reference_data.py
+EMP_REFERENCE_DATA_TTL = 300
+# Import and build the shared read-only modules when the app loads, for pre-fork servers (see emp_backend/wsgi_preload.py)
+EMP_PRELOAD = os.environ.get('EMP_PRELOAD') == '1'
+
+# Modules whose views authenticate with the JWT in the Authorization header and so skip the CSRF check
+# (see emergency_app/middleware.py). emp_backend/settings_api.py drops the CSRF middleware altogether.
+EMP_TOKEN_AUTHENTICATED_VIEW_MODULES = ['emergency_app.views']
+
+# Opt-in request profiling (emergency_app/profiling.py), by a signed X-EMP-Profile header
+# (`manage.py sign_profile_header`) or for a random fraction of requests
+EMP_PROFILE_SAMPLE_RATE = float(os.environ.get('EMP_PROFILE_SAMPLE_RATE', 0))
+# Profiler used for sampled requests: 'cprofile' (pstats) or 'sample' (collapsed stacks)
+EMP_PROFILE_MODE = 'sample'
+# Seconds between two stack samples of the 'sample' profiler
+EMP_PROFILE_SAMPLE_INTERVAL = 0.005
+# Seconds a signed header stays valid
+EMP_PROFILE_HEADER_MAX_AGE = 60 * 60
+# Where profiles are written, and the size above which the oldest are deleted
+EMP_PROFILE_DIR = os.environ.get('EMP_PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+EMP_PROFILE_MAX_BYTES = 100 * 1024 * 1024
+
+# Admission control (emergency_app/admission.py), requests that can't be admitted get a 503 with Retry-After.
+# The limits are per process and need threaded workers with more threads than EMP_ADMISSION_MAX_IN_FLIGHT,
+# e.g. gunicorn --threads 128: the threads over the limit are the ones waiting for a slot or being shed.
+# Requests in flight in one process, over every class
+EMP_ADMISSION_ENABLED = True
+EMP_ADMISSION_MAX_IN_FLIGHT = int(os.environ.get('EMP_ADMISSION_MAX_IN_FLIGHT', 64))
+# Classes in priority order: requests in flight, requests waiting for a slot, seconds they may wait,
+# and the Retry-After of shed requests. Reference data is cached by clients, so it doesn't wait.
+EMP_ADMISSION_CLASSES = {
+    'write': {'limit': 32, 'queue': 128, 'timeout': 5, 'retry_after': 2},
+    'read': {'limit': 32, 'queue': 128, 'timeout': 2, 'retry_after': 2},
+    'auth': {'limit': 16, 'queue': 64, 'timeout': 2, 'retry_after': 5},
+    'reference': {'limit': 8, 'queue': 0, 'timeout': 0, 'retry_after': 30},
+}
+# Class of each endpoint (first segment of the path), others are always admitted
+EMP_ADMISSION_ENDPOINTS = {
+    'login': 'auth',
+    'refreshToken': 'auth',
+    'revokeToken': 'auth',
+    'getEmergencyContacts': 'read',
+    'getEmergencyContactsBatch': 'read',
+    'getEmergencyNotifications': 'read',
+    'getEvacuationAssistance': 'read',
+    'getEmergencyProfile': 'read',
+    'getChanges': 'read',
+    'exportModifiedSince': 'read',
+    'lookupAddress': 'read',
+    'getEvacuationRoster': 'read',
+    'updateEmergencyContact': 'write',
+    'replaceEmergencyContacts': 'write',
+    'setEmergencyNotifications': 'write',
+    'setEvacuationAssistance': 'write',
+    'getRelations': 'reference',
+    'getNationCodes': 'reference',
+    'getStateCodes': 'reference',
+}
+# Seconds a request may have waited in the load balancer's queue (X-Request-Start header) before it is shed
+EMP_ADMISSION_MAX_UPSTREAM_WAIT = 10
+
+# Idempotency-Key header of the write endpoints (common/util/idempotency.py): seconds responses are kept
+# in IDEMPOTENCY_KEY for replaying to retries, seconds after which a key whose first request never completed
+# (its worker died) may be claimed again, and seconds between each worker's purges of the expired keys
+EMP_IDEMPOTENCY_TTL = 24 * 60 * 60
+EMP_IDEMPOTENCY_LOCK_SECONDS = 5 * 60
+EMP_IDEMPOTENCY_PURGE_INTERVAL = 5 * 60
+
+# Seconds after logging in that refreshToken stops renewing the JWT and the user has to log in again
+EMP_SESSION_LIFETIME = 12 * 60 * 60
+
+# Revoked JWTs (common/util/revocation.py), mirrored in every process by a Bloom filter sized for the capacity
+# (about 1.8MB for a million at 0.1%), the error rate is the share of valid tokens looked up in the database.
+# Seconds between reads of new revocations, and between rebuilds of the whole filter
+EMP_REVOCATION_CAPACITY = 1000000
+EMP_REVOCATION_ERROR_RATE = 0.001
+EMP_REVOCATION_REFRESH_INTERVAL = 5
+EMP_REVOCATION_RELOAD_INTERVAL = 10 * 60
@@ -0,0 +1,36 @@
+"""
+API-only settings profile for emp_backend.
+
+Every view authenticates with the JWT in the Authorization header, so the session, CSRF,
+authentication, messages and clickjacking middleware, and the admin, auth, sessions,
+messages and staticfiles apps they need, are pure overhead on each request and at startup.
+This profile runs the same application without them. Select it with
+
+    DJANGO_SETTINGS_MODULE=emp_backend.settings_api
+
+benchmarks/request_stack.py measures what it saves against emp_backend.settings.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = [
+    'emergency_app',
+    # corsheaders for cross origin access
+    'corsheaders',
+]
+
+MIDDLEWARE = [
+    # First, so CORS preflights are answered before any other middleware runs
+    'corsheaders.middleware.CorsMiddleware',
+    'emergency_app.middleware.RequestContextMiddleware',
+    'emergency_app.admission.AdmissionControlMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    # Last, it calls the view itself when profiling
+    'emergency_app.profiling.ProfilingMiddleware',
+]
+
+# No view renders templates
+TEMPLATES = []
+
+AUTH_PASSWORD_VALIDATORS = []
@@ -0,0 +1,21 @@
+"""
+Test settings profile for emp_backend.
+
+The test suite runs against three shard databases, so the code that places, moves and gathers
+people's rows across shards is exercised on every run. Select it with
+
+    python manage.py test --settings=emp_backend.settings_test
+
+or DJANGO_SETTINGS_MODULE=emp_backend.settings_test for other runners. EMP_SHARD_COUNT still
+overrides the amount of shards.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+EMP_SHARD_COUNT = int(os.environ.get('EMP_SHARD_COUNT', 3))  # noqa: F405
+for shard in range(1, EMP_SHARD_COUNT):
+    DATABASES['shard_%d' % shard] = {  # noqa: F405
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db_shard_%d.sqlite3' % shard),  # noqa: F405
+    }
+EMP_SHARDS = ['default'] + ['shard_%d' % shard for shard in range(1, EMP_SHARD_COUNT)]
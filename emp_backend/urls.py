@@ -13,21 +13,31 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """#
-from django.contrib import admin
 from django.urls import path
 from emergency_app import views
+from emergency_app import warmup
 
 urlpatterns = [
-    # path('admin/', admin.site.urls),
 	path('login/', views.login),
+	path('refreshToken/', views.refresh_token),
+	path('revokeToken/', views.revoke_token),
 	path('getEmergencyContacts/', views.get_emergency_contacts),
+	path('getEmergencyContactsBatch/', views.get_emergency_contacts_batch),
 	path('updateEmergencyContact/', views.update_emergency_contact),
 	path('updateEmergencyContact/<int:surrogate_id>/', views.update_emergency_contact),
+	path('replaceEmergencyContacts/', views.replace_emergency_contacts),
 	path('getEmergencyNotifications/', views.get_emergency_notifications),
 	path('setEmergencyNotifications/', views.set_emergency_notifications),
     path('getEvacuationAssistance/', views.get_evacuation_assistance),
     path('setEvacuationAssistance/', views.set_evacuation_assistance),
+    path('getEmergencyProfile/', views.get_emergency_profile),
     path('getRelations/', views.get_relations),
     path('getNationCodes/', views.get_nation_codes),
     path('getStateCodes/', views.get_state_codes),
+    path('getChanges/', views.get_changes),
+    path('exportModifiedSince/', views.export_modified_since),
+    path('lookupAddress/', views.lookup_address),
+    path('getEvacuationRoster/', views.get_evacuation_roster),
+    path('getAdmissionCounters/', views.get_admission_counters),
+    path(warmup.readiness_path, views.readiness),
 ]
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'emp_backend.settings')
 
 application = get_wsgi_application()
+
+# Warm up on a background thread, the readiness endpoint reports 503 until it is done
+from emergency_app import warmup  # noqa: E402 (needs the apps loaded by get_wsgi_application)
+
+warmup.start()
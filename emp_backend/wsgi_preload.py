@@ -0,0 +1,25 @@
+"""
+WSGI config for pre-fork servers that load the application once in the master process.
+
+Loads all shared read-only data before the workers are forked and freezes the garbage
+collector, so the workers share those pages copy-on-write. Run it with e.g.
+
+    gunicorn --preload --workers 8 --threads 128 emp_backend.wsgi_preload:application
+
+Admission control needs the threads, see emergency_app/admission.py.
+"""
+
+import os
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'emp_backend.settings')
+
+application = get_wsgi_application()
+
+from emergency_app import preload, warmup  # noqa: E402 (needs the apps loaded by get_wsgi_application)
+
+preload.preload(freeze=True)
+
+# Database connections and threads don't survive the fork, so each worker warms itself up
+os.register_at_fork(after_in_child=warmup.start)
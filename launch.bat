@@ -15,14 +15,16 @@ echo Populating Identity table
 python manage.py loaddata identity.json
 echo Populating Emergency table
 python manage.py loaddata emergency.json
-echo Populating Contact table
-python manage.py loaddata contact.json
 echo Populating Relation table
 python manage.py loaddata relation.yaml
 echo Populating Nation table
 python manage.py loaddata nation.yaml
 echo Populating State table
 python manage.py loaddata state.yaml
+echo Populating Contact table
+python manage.py loaddata contact.json
+echo Computing the phone and email lookup keys
+python manage.py backfill_lookup_keys
 
 
 :nopopulate